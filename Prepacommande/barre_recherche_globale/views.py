@@ -8,9 +8,11 @@ from datetime import datetime, timedelta
 import json
 
 from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.etats import ids_etats
 from parametre.models import Region, Ville, Operateur
 from article.models import Article
 from commande.models import Panier
+from commande.recherche import ETATS_ROLE, rechercher_commandes, statut
 
 
 @login_required
@@ -81,78 +83,8 @@ def search_commandes_preparation(query, request=None):
     commandes = []
     
     try:
-        # Recherche par ID numérique
-        if query.isdigit():
-            try:
-                cmd = Commande.objects.get(id=int(query))
-                commandes.append({
-                    'id': cmd.id,
-                    'type': 'commande',
-                    'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-                    'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                    'status': get_commande_status(cmd),
-                    'url': reverse('Prepacommande:detail_prepa', kwargs={'pk': cmd.id}),
-                    'icon': 'fas fa-shopping-cart',
-                    'priority': 1
-                })
-            except Commande.DoesNotExist:
-                pass
-            except Exception as e:
-                print(f"Erreur lors de la recherche par ID: {e}")
-                pass
-    
-        # Recherche par numéro externe
-        try:
-            cmd_externe = Commande.objects.get(num_cmd__icontains=query)
-            commandes.append({
-                'id': cmd_externe.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd_externe.id} ({cmd_externe.num_cmd})',
-                'subtitle': f'Client: {cmd_externe.client.nom if cmd_externe.client else "N/A"} - {cmd_externe.total_cmd} DH',
-                'status': get_commande_status(cmd_externe),
-                'url': reverse('Prepacommande:detail_prepa', kwargs={'pk': cmd_externe.id}),
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-        except Exception as e:
-            print(f"Erreur lors de la recherche par numéro externe: {e}")
-            pass
-        
-        # Recherche par client
-        commandes_client = Commande.objects.filter(
-            Q(client__nom__icontains=query) |
-            Q(client__prenom__icontains=query) |
-            Q(client__email__icontains=query)
-        ).exclude(
-            num_cmd__icontains=query
-        )[:10]
-        
-        for cmd in commandes_client:
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': reverse('Prepacommande:detail_prepa', kwargs={'pk': cmd.id}),
-                'icon': 'fas fa-shopping-cart',
-                'priority': 2
-            })
-        
-        # Recherche par région/ville
-        commandes_geo = Commande.objects.filter(
-            Q(ville__nom__icontains=query) |
-            Q(ville__region__nom_region__icontains=query) |
-            Q(ville_init__icontains=query)
-        ).exclude(
-            Q(num_cmd__icontains=query) |
-            Q(client__nom__icontains=query) |
-            Q(client__prenom__icontains=query)
-        )[:10]
-        
-        for cmd in commandes_geo:
+        # Une requête classée : numéro / ID, puis client, puis géographie (commande/recherche.py)
+        for cmd in rechercher_commandes(query, limite=10):
             commandes.append({
                 'id': cmd.id,
                 'type': 'commande',
@@ -161,18 +93,10 @@ def search_commandes_preparation(query, request=None):
                 'status': get_commande_status(cmd),
                 'url': reverse('Prepacommande:detail_prepa', kwargs={'pk': cmd.id}),
                 'icon': 'fas fa-shopping-cart',
-                'priority': 3
+                'priority': cmd.rang
             })
-    
-        # Éliminer les doublons
-        commandes_uniques = []
-        seen_ids = set()
-        for cmd in commandes:
-            if cmd['id'] not in seen_ids:
-                commandes_uniques.append(cmd)
-                seen_ids.add(cmd['id'])
         
-        return commandes_uniques[:10]
+        return commandes
     
     except Exception as e:
         print(f"Erreur générale dans search_commandes_preparation: {e}")
@@ -276,9 +200,8 @@ def search_articles_panier_preparation(query):
     try:
         # Rechercher dans les commandes avec états : En préparation, Collectée, Emballée
         commandes_preparation = Commande.objects.filter(
-            etats__enum_etat__libelle__in=["En préparation", "Collectée", "Emballée"],
-            etats__date_fin__isnull=True
-        ).distinct()
+            etat_courant_id__in=ids_etats(*ETATS_ROLE['PREPARATION'])
+        )
         
         # Rechercher les articles du panier qui correspondent à la requête
         paniers_match = Panier.objects.filter(
@@ -433,10 +356,7 @@ def is_commande_for_preparation(commande, request=None):
 
 def get_commande_status(commande):
     """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
+    return statut(commande)
 
 
 @login_required
@@ -474,8 +394,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes récentes à préparer
     recent_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle="Confirmée",
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats("Confirmée")
     ).order_by('-id')[:3]
     
     for cmd in recent_commandes:
@@ -502,8 +421,7 @@ def search_suggestions_api(request):
     # Suggestions d'articles populaires dans les paniers
     if len(query) >= 3:
         articles_populaires = Panier.objects.filter(
-            commande__etats__enum_etat__libelle__in=["En préparation", "Collectée", "Emballée"],
-            commande__etats__date_fin__isnull=True,
+            commande__etat_courant_id__in=ids_etats(*ETATS_ROLE['PREPARATION']),
             article__nom__icontains=query
         ).values('article__nom').annotate(
             count=Count('id')
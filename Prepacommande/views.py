@@ -12,7 +12,9 @@ from django.core.paginator import Paginator
 
 import json
 from parametre.models import Operateur
+from parametre.operateurs import operateur_courant
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Panier
+from commande.etats import ids_etats, obtenir_etat, obtenir_ou_creer_etat
 from django.urls import reverse
 
 import barcode
@@ -20,6 +22,8 @@ from barcode.writer import ImageWriter
 from io import BytesIO
 import base64
 import csv
+from commande import compteurs as compteurs_files
+from commande.codes_barres import url_code
 
 from article.models import Article, MouvementStock
 from commande.models import Envoi
@@ -68,28 +72,20 @@ def home_view(request):
 
     # Récupérer les états nécessaires
     try:
-        etat_confirmee = EnumEtatCmd.objects.get(libelle__iexact="Confirmée")
-        etat_en_preparation = EnumEtatCmd.objects.get(libelle__iexact="En préparation")
-        etat_preparee = EnumEtatCmd.objects.get(libelle__iexact="Préparée")
+        etat_confirmee = obtenir_etat("Confirmée")
+        etat_en_preparation = obtenir_etat("En préparation")
+        etat_preparee = obtenir_etat("Préparée")
     except EnumEtatCmd.DoesNotExist as e:
         messages.error(request, f"État manquant dans le système: {str(e)}")
         return redirect("login")
 
-    # 1. Commandes à préparer (à imprimer et affectées à cet opérateur)
-    commandes_a_preparer = (
-        Commande.objects.filter(
-            etats__enum_etat__libelle="En préparation",
-        etats__operateur=operateur_profile,
-            etats__date_fin__isnull=True,
-        )
-        .distinct()
-        .count()
-    )
+    # 1. Commandes à préparer (à imprimer et affectées à cet opérateur) : compteur de file
+    commandes_a_preparer = compteurs_files.total(["En préparation"], operateur_profile)
     
     # 2. Commandes préparées aujourd'hui par cet opérateur
     commandes_preparees = (
         EtatCommande.objects.filter(
-            enum_etat__libelle="Préparée",
+            enum_etat=etat_preparee,
         date_debut__date=today,
             operateur=operateur_profile,
         )
@@ -97,16 +93,8 @@ def home_view(request):
         .count()
     )
 
-    # 3. Commandes en cours de préparation
-    commandes_en_cours = (
-        Commande.objects.filter(
-        etats__enum_etat=etat_en_preparation,
-        etats__date_fin__isnull=True,
-            etats__operateur=operateur_profile,
-        )
-        .distinct()
-        .count()
-    )
+    # 3. Commandes en cours de préparation (même file que les commandes à préparer)
+    commandes_en_cours = commandes_a_preparer
 
     # 4. Performance de l'opérateur aujourd'hui
     ma_performance = (
@@ -131,9 +119,7 @@ def home_view(request):
     ).count()
 
     # Commandes actuellement en préparation (toutes)
-    commandes_en_preparation = Commande.objects.filter(
-        etats__enum_etat=etat_en_preparation, etats__date_fin__isnull=True
-    ).count()
+    commandes_en_preparation = compteurs_files.total([etat_en_preparation.libelle])
 
     # Performance de l'opérateur aujourd'hui (commandes préparées par lui)
     ma_performance_today = EtatCommande.objects.filter(
@@ -237,16 +223,12 @@ def liste_prepa(request):
         commandes_affectees = []
         commandes_base = (
             Commande.objects.filter(
-                Q(etats__enum_etat__libelle="À imprimer")
-                | Q(etats__enum_etat__libelle="En préparation")
-                | Q(etats__enum_etat__libelle="Collectée")
-                | Q(etats__enum_etat__libelle="Emballée"),
-            etats__operateur=operateur_profile,
-                etats__date_fin__isnull=True,
+                Q(etat_courant_id__in=ids_etats("À imprimer", "En préparation", "Collectée", "Emballée")),
+                operateur_etat_courant=operateur_profile,
             )
             .select_related("client", "ville", "ville__region")
             .prefetch_related("paniers__article", "etats")
-            .distinct()
+            
         )
         
         for commande in commandes_base:
@@ -282,16 +264,12 @@ def liste_prepa(request):
         # car on veut inclure les commandes avec opération de renvoi même si elles ont des états ultérieurs
         commandes_affectees = (
             Commande.objects.filter(
-                Q(etats__enum_etat__libelle="À imprimer")
-                | Q(etats__enum_etat__libelle="En préparation")
-                | Q(etats__enum_etat__libelle="Collectée")
-                | Q(etats__enum_etat__libelle="Emballée"),
-            etats__operateur=operateur_profile,
-                etats__date_fin__isnull=True,  # État actif (en cours)
+                Q(etat_courant_id__in=ids_etats("À imprimer", "En préparation", "Collectée", "Emballée")),
+                operateur_etat_courant=operateur_profile,
             )
             .select_related("client", "ville", "ville__region")
             .prefetch_related("paniers__article", "etats")
-            .distinct()
+            
         )
     elif filter_type == "retournees":
         # Obsolète: rediriger vers la page dédiée
@@ -302,16 +280,12 @@ def liste_prepa(request):
         commandes_affectees = []
         commandes_base = (
             Commande.objects.filter(
-                Q(etats__enum_etat__libelle="À imprimer")
-                | Q(etats__enum_etat__libelle="En préparation")
-                | Q(etats__enum_etat__libelle="Collectée")
-                | Q(etats__enum_etat__libelle="Emballée"),
-                etats__operateur=operateur_profile,
-                etats__date_fin__isnull=True,
+                Q(etat_courant_id__in=ids_etats("À imprimer", "En préparation", "Collectée", "Emballée")),
+                operateur_etat_courant=operateur_profile,
             )
             .select_related("client", "ville", "ville__region")
             .prefetch_related("paniers__article", "etats")
-            .distinct()
+            
         )
 
         for commande in commandes_base:
@@ -351,7 +325,7 @@ def liste_prepa(request):
                     num_cmd_original = commande.num_cmd.replace("RENVOI-", "")
                     commande_originale = Commande.objects.filter(
                         num_cmd=num_cmd_original,
-                        etats__enum_etat__libelle="Livrée Partiellement",
+                        etats__enum_etat_id__in=ids_etats("Livrée Partiellement"),
                     ).first()
 
                     if commande_originale:
@@ -380,16 +354,12 @@ def liste_prepa(request):
         commandes_affectees = []
         commandes_base = (
             Commande.objects.filter(
-                Q(etats__enum_etat__libelle="À imprimer")
-                | Q(etats__enum_etat__libelle="En préparation")
-                | Q(etats__enum_etat__libelle="Collectée")
-                | Q(etats__enum_etat__libelle="Emballée"),
-            etats__operateur=operateur_profile,
-                etats__date_fin__isnull=True,
+                Q(etat_courant_id__in=ids_etats("À imprimer", "En préparation", "Collectée", "Emballée")),
+                operateur_etat_courant=operateur_profile,
             )
             .select_related("client", "ville", "ville__region")
             .prefetch_related("paniers__article", "etats")
-            .distinct()
+            
         )
         
         for commande in commandes_base:
@@ -462,7 +432,7 @@ def liste_prepa(request):
                     num_cmd_original = commande.num_cmd.replace("RENVOI-", "")
                     commande_originale = Commande.objects.filter(
                         num_cmd=num_cmd_original,
-                        etats__enum_etat__libelle="Livrée Partiellement",
+                        etats__enum_etat_id__in=ids_etats("Livrée Partiellement"),
                     ).first()
 
                     if commande_originale:
@@ -558,22 +528,18 @@ def liste_prepa(request):
         # et qui n'ont pas encore d'état "Préparée" ou "En cours de livraison"
         commandes_affectees = (
             Commande.objects.filter(
-                Q(etats__enum_etat__libelle="À imprimer")
-                | Q(etats__enum_etat__libelle="En préparation")
-                | Q(etats__enum_etat__libelle="Collectée")
-                | Q(etats__enum_etat__libelle="Emballée"),
+                Q(etats__enum_etat_id__in=ids_etats("À imprimer", "En préparation", "Collectée", "Emballée")),
                 etats__operateur=operateur_profile,
             )
             .exclude(
             # Exclure les commandes qui ont déjà un état ultérieur actif
                 Q(
-                    etats__enum_etat__libelle__in=[
+                    etat_courant_id__in=ids_etats(
                         "Préparée",
                         "En cours de livraison",
                         "Livrée",
                         "Annulée",
-                    ],
-                    etats__date_fin__isnull=True,
+                    ),
                 )
             )
             .select_related("client", "ville", "ville__region")
@@ -658,21 +624,11 @@ def liste_prepa(request):
             reverse=True,
         )
     else:
-        commandes_affectees = commandes_affectees.order_by("-etats__date_debut")
+        commandes_affectees = commandes_affectees.order_by("-date_etat_courant")
 
-    # Générer les codes-barres pour chaque commande
-    code128 = barcode.get_barcode_class("code128")
+    # URLs des codes-barres (images calculées une seule fois, voir commande/codes_barres.py)
     for commande in commandes_affectees:
-        if commande.id_yz:
-            barcode_instance = code128(str(commande.id_yz), writer=ImageWriter())
-            buffer = BytesIO()
-            barcode_instance.write(
-                buffer, options={"write_text": False, "module_height": 10.0}
-            )
-            barcode_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            commande.barcode_base64 = barcode_base64
-        else:
-            commande.barcode_base64 = None
+        commande.barcode_url = url_code("commande", commande.id_yz) if commande.id_yz else None
     
     # Statistiques
     if isinstance(commandes_affectees, list):
@@ -695,7 +651,7 @@ def liste_prepa(request):
         # Commandes urgentes (affectées depuis plus de 1 jour)
         date_limite_urgence = timezone.now() - timedelta(days=1)
         commandes_urgentes = commandes_affectees.filter(
-            etats__date_debut__lt=date_limite_urgence
+            date_etat_courant__lt=date_limite_urgence
         ).count()
     
     # Statistiques par type pour les onglets
@@ -710,16 +666,12 @@ def liste_prepa(request):
     # D'abord, récupérer toutes les commandes affectées à cet opérateur (sans filtre)
     toutes_commandes = (
         Commande.objects.filter(
-            Q(etats__enum_etat__libelle="À imprimer")
-            | Q(etats__enum_etat__libelle="En préparation")
-            | Q(etats__enum_etat__libelle="Collectée")
-            | Q(etats__enum_etat__libelle="Emballée"),
-        etats__operateur=operateur_profile,
-            etats__date_fin__isnull=True,  # État actif (en cours)
+            Q(etat_courant_id__in=ids_etats("À imprimer", "En préparation", "Collectée", "Emballée")),
+            operateur_etat_courant=operateur_profile,
         )
         .select_related("client", "ville", "ville__region")
         .prefetch_related("paniers__article", "etats")
-        .distinct()
+        
     )
     
     for cmd in toutes_commandes:
@@ -734,7 +686,7 @@ def liste_prepa(request):
             num_cmd_original = cmd.num_cmd.replace("RENVOI-", "")
             commande_originale = Commande.objects.filter(
                 num_cmd=num_cmd_original,
-                etats__enum_etat__libelle="Livrée Partiellement",
+                etats__enum_etat_id__in=ids_etats("Livrée Partiellement"),
             ).first()
             
             if commande_originale:
@@ -790,10 +742,9 @@ def liste_prepa(request):
     # Chercher les commandes de renvoi créées lors de livraisons partielles
     commandes_renvoi_livraison_partielle = Commande.objects.filter(
         num_cmd__startswith="RENVOI-",
-        etats__enum_etat__libelle="En préparation",
-        etats__operateur=operateur_profile,
-        etats__date_fin__isnull=True,
-    ).distinct()
+        etat_courant_id__in=ids_etats("En préparation"),
+        operateur_etat_courant=operateur_profile,
+    )
     
     livrees_partiellement_count = 0
     for commande_renvoi in commandes_renvoi_livraison_partielle:
@@ -802,7 +753,7 @@ def liste_prepa(request):
         
         # Vérifier que la commande originale a été livrée partiellement
         commande_originale = Commande.objects.filter(
-            num_cmd=num_cmd_original, etats__enum_etat__libelle="Livrée Partiellement"
+            num_cmd=num_cmd_original, etats__enum_etat_id__in=ids_etats("Livrée Partiellement")
         ).first()
         
         if commande_originale:
@@ -827,7 +778,7 @@ def liste_prepa(request):
             num_cmd_original = cmd.num_cmd.replace("RENVOI-", "")
             commande_originale = Commande.objects.filter(
                 num_cmd=num_cmd_original,
-                etats__enum_etat__libelle="Livrée Partiellement",
+                etats__enum_etat_id__in=ids_etats("Livrée Partiellement"),
             ).first()
 
             if commande_originale:
@@ -969,13 +920,12 @@ def commandes_en_preparation(request):
     # Récupérer les commandes dont l'état ACTUEL est "En préparation" et qui sont affectées à cet opérateur
     commandes_en_preparation = (
         Commande.objects.filter(
-            etats__enum_etat__libelle="En préparation",
-        etats__operateur=operateur_profile,
-            etats__date_fin__isnull=True,  # État actif (en cours)
+            etat_courant_id__in=ids_etats("En préparation"),
+            operateur_etat_courant=operateur_profile,
         )
         .select_related("client", "ville", "ville__region")
         .prefetch_related("paniers__article", "etats")
-        .distinct()
+        
     )
 
     # Pagination côté serveur
@@ -1036,9 +986,9 @@ def commandes_livrees_partiellement(request):
     # qui ont été préparées (envoyées à la logistique) par cet opérateur
     # L'opérateur de préparation crée l'état 'En préparation', pas 'Préparée'
     commandes_livrees_partiellement_qs = (
-        Commande.objects.filter(etats__enum_etat__libelle="Livrée Partiellement")
+        Commande.objects.filter(etats__enum_etat_id__in=ids_etats("Livrée Partiellement"))
         .filter(
-            etats__enum_etat__libelle="En préparation",
+            etats__enum_etat_id__in=ids_etats("En préparation"),
             etats__operateur=operateur_profile,
         )
         .select_related("client", "ville", "ville__region")
@@ -1064,7 +1014,7 @@ def commandes_livrees_partiellement(request):
     for commande in commandes_livrees_partiellement:
         # Trouver l'état "Livrée Partiellement" le plus récent
         etat_livraison_partielle = (
-            commande.etats.filter(enum_etat__libelle="Livrée Partiellement")
+            commande.etats.filter(enum_etat_id__in=ids_etats("Livrée Partiellement"))
             .order_by("-date_debut")
             .first()
         )
@@ -1144,10 +1094,10 @@ def commandes_retournees(request):
     # L'opérateur de préparation crée l'état 'En préparation', pas 'Préparée'
     commandes_qs = (
         Commande.objects.filter(
-            etats__enum_etat__libelle="Retournée", etats__date_fin__isnull=True
+            etat_courant_id__in=ids_etats("Retournée")
         )  # État actuel
         .filter(
-            etats__enum_etat__libelle="En préparation",
+            etats__enum_etat_id__in=ids_etats("En préparation"),
             etats__operateur=operateur_profile,
         )
         .select_related("client", "ville", "ville__region")
@@ -1160,7 +1110,7 @@ def commandes_retournees(request):
     # Enrichir avec méta d'état 'Retournée'
     for commande in commandes:
         etat_retour = (
-            commande.etats.filter(enum_etat__libelle="Retournée")
+            commande.etats.filter(enum_etat_id__in=ids_etats("Retournée"))
             .order_by("-date_debut")
             .first()
         )
@@ -1220,12 +1170,12 @@ def traiter_commande_retournee_api(request, commande_id):
         
         # Vérifier que la commande est bien retournée et préparée par cet opérateur
         if not commande.etats.filter(
-            enum_etat__libelle="Retournée", date_fin__isnull=True
+            enum_etat_id__in=ids_etats("Retournée"), date_fin__isnull=True
         ).exists():
             return JsonResponse({"success": False, "message": "Commande non retournée"})
         
         if not commande.etats.filter(
-            enum_etat__libelle="En préparation", operateur=operateur_profile
+            enum_etat_id__in=ids_etats("En préparation"), operateur=operateur_profile
         ).exists():
             return JsonResponse(
                 {"success": False, "message": "Commande non préparée par vous"}
@@ -1246,25 +1196,15 @@ def traiter_commande_retournee_api(request, commande_id):
                 # Ne pas changer l'état de la commande, elle reste "Retournée"
                 # Seulement réincrémenter le stock si les produits sont en bon état
                 if etat_stock == "bon":
-                    for panier in commande.paniers.all():
-                        article = panier.article
-                        quantite = panier.quantite
-                        
-                        # Réincrémenter le stock disponible
-                        article.qte_disponible += quantite
-                        article.save()
-                        
-                        # Créer un mouvement de stock pour tracer
-                        from article.models import MouvementStock
+                    from article import stock
 
-                        MouvementStock.objects.create(
-                            article=article,
-                            quantite=quantite,
-                            type_mouvement="entree",
-                            commentaire=f"Réincrémentation - Commande retournée {commande.id_yz} - Produits en bon état - {commentaire}",
-                            operateur=operateur_profile,
-                            qte_apres_mouvement=article.qte_disponible,
-                        )
+                    # Réincrémenter le stock disponible des variantes, en un lot tracé
+                    stock.liberer(
+                        stock.lignes_paniers(commande.paniers.all()),
+                        commande=commande,
+                        operateur=operateur_profile,
+                        commentaire=f"Réincrémentation - Commande retournée {commande.id_yz} - Produits en bon état - {commentaire}",
+                    )
                 
                 message = f"Stock réincrémenté: {'Oui' if etat_stock == 'bon' else 'Non'}. Commande reste en état 'Retournée'."
                 
@@ -1394,10 +1334,7 @@ def detail_prepa(request, pk):
 
     # Vérifier que la commande est bien affectée à cet opérateur pour la préparation
     etat_preparation = commande.etats.filter(
-        Q(enum_etat__libelle="À imprimer")
-        | Q(enum_etat__libelle="En préparation")
-        | Q(enum_etat__libelle="Collectée")
-        | Q(enum_etat__libelle="Emballée"),
+        Q(enum_etat_id__in=ids_etats("À imprimer", "En préparation", "Collectée", "Emballée")),
         operateur=operateur_profile,
     ).first()
     
@@ -1598,13 +1535,8 @@ def detail_prepa(request, pk):
         "-date_operation"
     )
     
-    # Générer le code-barres pour la commande
-    code128 = barcode.get_barcode_class("code128")
-    barcode_instance = code128(str(commande.id_yz), writer=ImageWriter())
-    buffer = BytesIO()
-    barcode_instance.write(buffer, options={"write_text": False, "module_height": 10.0})
-    barcode_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    commande_barcode = f"data:image/png;base64,{barcode_base64}"
+    # URL du code-barres de la commande
+    commande_barcode = url_code("commande", commande.id_yz)
 
     # Gestion des actions POST (marquer comme préparée, etc.)
     if request.method == "POST":
@@ -1616,8 +1548,8 @@ def detail_prepa(request, pk):
         if action == "marquer_collectee":
             with transaction.atomic():
                 # Marquer l'état 'En préparation' comme terminé
-                etat_en_preparation, created = EnumEtatCmd.objects.get_or_create(
-                    libelle="En préparation"
+                etat_en_preparation, created = obtenir_ou_creer_etat(
+                    "En préparation"
                 )
                 
                 etat_actuel = EtatCommande.objects.filter(
@@ -1632,8 +1564,8 @@ def detail_prepa(request, pk):
                     etat_actuel.save()
                 
                 # Créer le nouvel état 'Collectée'
-                etat_collectee, created = EnumEtatCmd.objects.get_or_create(
-                    libelle="Collectée"
+                etat_collectee, created = obtenir_ou_creer_etat(
+                    "Collectée"
                 )
                 EtatCommande.objects.create(
                     commande=commande,
@@ -1653,8 +1585,8 @@ def detail_prepa(request, pk):
         elif action == "marquer_emballee":
             with transaction.atomic():
                 # Marquer l'état 'Collectée' comme terminé
-                etat_collectee, created = EnumEtatCmd.objects.get_or_create(
-                    libelle="Collectée"
+                etat_collectee, created = obtenir_ou_creer_etat(
+                    "Collectée"
                 )
 
                 etat_actuel = EtatCommande.objects.filter(
@@ -1667,8 +1599,8 @@ def detail_prepa(request, pk):
                     etat_actuel.save()
 
                 # Créer le nouvel état 'Emballée'
-                etat_emballee, created = EnumEtatCmd.objects.get_or_create(
-                    libelle="Emballée"
+                etat_emballee, created = obtenir_ou_creer_etat(
+                    "Emballée"
                 )
                 EtatCommande.objects.create(
                     commande=commande,
@@ -1716,8 +1648,8 @@ def detail_prepa(request, pk):
                         break
                 
                 # 3. Créer l'état "Retour Confirmation" et l'affecter
-                etat_retour_enum, _ = EnumEtatCmd.objects.get_or_create(
-                    libelle="Retour Confirmation",
+                etat_retour_enum, _ = obtenir_ou_creer_etat(
+                    "Retour Confirmation",
                     defaults={"ordre": 25, "couleur": "#D97706"},
                 )
                 
@@ -1858,7 +1790,7 @@ def modifier_commande_prepa(request, commande_id):
     print(f"🔍 Vérification de l'état de préparation")
     # Vérifier que la commande est affectée à cet opérateur pour la préparation
     etat_preparation = commande.etats.filter(
-        Q(enum_etat__libelle="À imprimer") | Q(enum_etat__libelle="En préparation"),
+        Q(enum_etat_id__in=ids_etats("À imprimer", "En préparation")),
         operateur=operateur,
         date_fin__isnull=True,
     ).first()
@@ -2718,7 +2650,7 @@ def modifier_commande_prepa(request, commande_id):
         if commande_originale_obj:
             # Vérifier si la commande originale a bien été livrée partiellement
             if commande_originale_obj.etats.filter(
-                enum_etat__libelle="Livrée Partiellement"
+                enum_etat_id__in=ids_etats("Livrée Partiellement")
             ).exists():
                 is_commande_livree_partiellement = True
                 operation_livraison_partielle_source = (
@@ -2897,7 +2829,7 @@ def ajouter_article_commande_prepa(request, commande_id):
     
     try:
         # Récupérer l'opérateur de préparation
-        operateur = Operateur.objects.get(user=request.user, type_operateur="PREPARATION")
+        operateur = operateur_courant(request, 'PREPARATION')
         print(f"✅ Opérateur trouvé: {operateur.id} - Type: {operateur.type_operateur}")
     except Operateur.DoesNotExist:
         print("❌ Profil d'opérateur de préparation non trouvé")
@@ -2911,7 +2843,7 @@ def ajouter_article_commande_prepa(request, commande_id):
             
             # Vérifier que la commande est affectée à cet opérateur pour la préparation
             etat_preparation = commande.etats.filter(
-                Q(enum_etat__libelle="À imprimer") | Q(enum_etat__libelle="En préparation"),
+                Q(enum_etat_id__in=ids_etats("À imprimer", "En préparation")),
                 operateur=operateur,
                 date_fin__isnull=True,
             ).first()
@@ -3268,7 +3200,7 @@ def api_panier_commande_prepa(request, commande_id):
     
     # Vérifier que la commande est affectée à cet opérateur
     etat_preparation = commande.etats.filter(
-        Q(enum_etat__libelle="À imprimer") | Q(enum_etat__libelle="En préparation"),
+        Q(enum_etat_id__in=ids_etats("À imprimer", "En préparation")),
         operateur=operateur,
         date_fin__isnull=True,
     ).first()
@@ -4230,19 +4162,18 @@ def details_region_view(request):
     # Base queryset pour toutes les commandes en traitement
     commandes_reparties = (
         Commande.objects.filter(
-            etats__enum_etat__libelle__in=[
+            etat_courant_id__in=ids_etats(
                 "Confirmée",
                 "À imprimer",
                 "Préparée",
                 "En cours de livraison",
-            ],
-        etats__date_fin__isnull=True,
+            ),
         ville__isnull=False,  # Exclure les commandes sans ville
             ville__region__isnull=False,  # Exclure les commandes sans région
         )
         .select_related("client", "ville", "ville__region")
         .prefetch_related("etats__operateur", "etats__enum_etat", "paniers__article")
-        .distinct()
+        
     )
     
     # Appliquer les filtres
@@ -4264,8 +4195,7 @@ def details_region_view(request):
     
     # Statistiques des commandes PRÉPARÉES par ville dans la région/ville filtrée
     commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle="Préparée",
-        etats__date_fin__isnull=True,
+        etat_courant_id__in=ids_etats("Préparée"),
         ville__isnull=False,
         ville__region__isnull=False,
     ).select_related("ville", "ville__region")
@@ -4388,7 +4318,7 @@ def rafraichir_articles_commande_prepa(request, commande_id):
         # Vérifier que la commande est affectée à cet opérateur
         etat_preparation = commande.etats.filter(
             operateur=operateur,
-            enum_etat__libelle__in=["En préparation", "À imprimer"],
+            enum_etat_id__in=ids_etats("En préparation", "À imprimer"),
             date_fin__isnull=True,
         ).first()
         
@@ -4548,7 +4478,7 @@ def ajouter_article_commande_prepa(request, commande_id):
             # Vérifier que la commande est bien en préparation pour cet opérateur
             etat_preparation = commande.etats.filter(
                 operateur=operateur,
-                enum_etat__libelle__in=["En préparation", "À imprimer"],
+                enum_etat_id__in=ids_etats("En préparation", "À imprimer"),
                 date_fin__isnull=True,
             ).first()
             
@@ -4985,7 +4915,7 @@ def api_prix_upsell_articles(request, commande_id):
         # Vérifier que la commande est affectée à cet opérateur
         etat_preparation = commande.etats.filter(
             operateur=operateur,
-            enum_etat__libelle__in=["En préparation", "À imprimer"],
+            enum_etat_id__in=ids_etats("En préparation", "À imprimer"),
             date_fin__isnull=True,
         ).first()
         
@@ -5116,7 +5046,7 @@ def api_changer_etat_commande(request, commande_id):
         # Vérifier que la commande est affectée à cet opérateur
         etat_actuel = commande.etats.filter(
             operateur=operateur,
-            enum_etat__libelle__in=["En préparation", "À imprimer", "Collectée", "Emballée"],
+            enum_etat_id__in=ids_etats("En préparation", "À imprimer", "Collectée", "Emballée"),
             date_fin__isnull=True,
         ).first()
         
@@ -5135,7 +5065,7 @@ def api_changer_etat_commande(request, commande_id):
         
         # Récupérer l'état correspondant
         try:
-            nouvel_etat_enum = EnumEtatCmd.objects.get(libelle=nouvel_etat)
+            nouvel_etat_enum = obtenir_etat(nouvel_etat)
         except EnumEtatCmd.DoesNotExist:
             return JsonResponse({"success": False, "error": f"État '{nouvel_etat}' non trouvé dans le système"}, status=400)
         
@@ -8,8 +8,12 @@ from datetime import datetime, timedelta
 import json
 
 from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.etats import ids_etats
 from parametre.models import Region, Ville, Operateur
 from article.models import Article
+from commande.recherche import (
+    ETATS_ROLE, rechercher_articles, rechercher_commandes, rechercher_regions, rechercher_villes, statut,
+)
 
 @login_required
 def global_search_view(request):
@@ -88,98 +92,28 @@ def search_commandes_supervision(query, request=None):
     """Recherche dans les commandes pour supervision"""
     commandes = []
     
-    # Recherche par ID numérique
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd.id}),
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par numéro externe
-    try:
-        cmd_externe = Commande.objects.get(num_cmd__icontains=query)
-        commandes.append({
-            'id': cmd_externe.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd_externe.id} ({cmd_externe.num_cmd})',
-            'subtitle': f'Client: {cmd_externe.client.nom if cmd_externe.client else "N/A"} - {cmd_externe.total_cmd} DH',
-            'status': get_commande_status(cmd_externe),
-            'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd_externe.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 1
-        })
-    except Commande.DoesNotExist:
-        pass
-    
-    # Recherche par client
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    ).exclude(
-        num_cmd__icontains=query
-    )[:10]
-    
-    for cmd in commandes_client:
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query) |
-        Q(ville_init__icontains=query)
-    ).exclude(
-        Q(num_cmd__icontains=query) |
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:10]
-    
-    for cmd in commandes_geo:
-        ville_display = cmd.ville.nom if cmd.ville else "N/A"
-        if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
-            ville_display = f"{cmd.ville_init} → {ville_display}"
+    # Une requête classée : numéro / ID, puis client, puis géographie (commande/recherche.py)
+    for cmd in rechercher_commandes(query, limite=10):
+        if cmd.rang == 3:
+            ville_display = cmd.ville.nom if cmd.ville else "N/A"
+            if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
+                ville_display = f"{cmd.ville_init} → {ville_display}"
+            subtitle = f'{ville_display} - {cmd.total_cmd} DH'
+        else:
+            subtitle = f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH'
         
         commandes.append({
             'id': cmd.id,
             'type': 'commande',
             'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'{ville_display} - {cmd.total_cmd} DH',
+            'subtitle': subtitle,
             'status': get_commande_status(cmd),
             'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd.id}),
             'icon': 'fas fa-shopping-cart',
-            'priority': 3
+            'priority': cmd.rang
         })
     
-    # Dédupliquer les résultats par ID de commande
-    commandes_uniques = []
-    ids_vus = set()
-    
-    for cmd in commandes:
-        if cmd['id'] not in ids_vus:
-            commandes_uniques.append(cmd)
-            ids_vus.add(cmd['id'])
-    
-    return commandes_uniques[:10]
+    return commandes
 
 
 def search_operateurs_supervision(query):
@@ -197,10 +131,9 @@ def search_operateurs_supervision(query):
     for operateur in operateurs_match:
         # Compter les commandes où cet opérateur est intervenu récemment
         commandes_assignees = Commande.objects.filter(
-            etats__operateur=operateur,
-            etats__enum_etat__libelle__in=["Confirmée", "En préparation"],
-            etats__date_fin__isnull=True
-        ).distinct().count()
+            operateur_etat_courant=operateur,
+            etat_courant_id__in=ids_etats("Confirmée", "En préparation")
+        ).count()
         
         operateurs.append({
             'id': operateur.id,
@@ -220,19 +153,13 @@ def search_articles_supervision(query):
     """Recherche dans les articles pour supervision"""
     articles = []
     
-    articles_match = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query) |
-        Q(description__icontains=query)
-    )[:8]
-    
-    for article in articles_match:
+    for article in rechercher_articles(query, limite=8):
         articles.append({
             'id': article.id,
             'type': 'article',
             'title': article.nom,
-            'subtitle': f'Réf: {article.reference} - Stock: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
+            'subtitle': f'Réf: {article.reference} - Stock: {article.stock}',
+            'status': 'En stock' if article.stock > 0 else 'Rupture',
             'url': reverse('Superpreparation:detail_article', kwargs={'article_id': article.id}),
             'icon': 'fas fa-box',
             'priority': 1
@@ -246,18 +173,13 @@ def search_stock_supervision(query):
     stock_items = []
     
     # Recherche par nom d'article
-    articles_stock = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query)
-    )[:5]
-    
-    for article in articles_stock:
+    for article in rechercher_articles(query, limite=5, description=False):
         stock_items.append({
             'id': article.id,
             'type': 'stock',
             'title': f'Stock {article.nom}',
-            'subtitle': f'Réf: {article.reference} - Quantité: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
+            'subtitle': f'Réf: {article.reference} - Quantité: {article.stock}',
+            'status': 'En stock' if article.stock > 0 else 'Rupture',
             'url': reverse('Superpreparation:detail_article', kwargs={'article_id': article.id}),
             'icon': 'fas fa-warehouse',
             'priority': 1
@@ -283,23 +205,12 @@ def search_regions_supervision(query, request=None):
     """Recherche dans les régions pour supervision"""
     regions = []
     
-    regions_match = Region.objects.filter(
-        Q(nom_region__icontains=query)
-    )[:5]
-    
-    for region in regions_match:
-        # Compter les commandes de cette région
-        nb_commandes = Commande.objects.filter(
-            ville__region=region,
-            etats__enum_etat__libelle__in=["Confirmée", "En préparation", "Préparée"],
-            etats__date_fin__isnull=True
-        ).count()
-        
+    for region in rechercher_regions(query, ETATS_ROLE['SUPERVISION']):
         regions.append({
             'id': region.id,
             'type': 'region',
             'title': region.nom_region,
-            'subtitle': f'{nb_commandes} commandes en supervision',
+            'subtitle': f'{region.nb_commandes} commandes en supervision',
             'status': 'Active',
             'url': f'/supervision/region/{region.nom_region}/',
             'icon': 'fas fa-map',
@@ -313,24 +224,12 @@ def search_villes_supervision(query, request=None):
     """Recherche dans les villes pour supervision"""
     villes = []
     
-    villes_match = Ville.objects.filter(
-        Q(nom__icontains=query) |
-        Q(region__nom_region__icontains=query)
-    )[:5]
-    
-    for ville in villes_match:
-        # Compter les commandes de cette ville
-        nb_commandes = Commande.objects.filter(
-            ville=ville,
-            etats__enum_etat__libelle__in=["Confirmée", "En préparation", "Préparée"],
-            etats__date_fin__isnull=True
-        ).count()
-        
+    for ville in rechercher_villes(query, ETATS_ROLE['SUPERVISION']):
         villes.append({
             'id': ville.id,
             'type': 'ville',
             'title': ville.nom,
-            'subtitle': f'{ville.region.nom_region} - {nb_commandes} commandes en supervision',
+            'subtitle': f'{ville.region.nom_region} - {ville.nb_commandes} commandes en supervision',
             'status': 'Active',
             'url': f'/supervision/ville/{ville.nom}/',
             'icon': 'fas fa-map-marker-alt',
@@ -373,10 +272,7 @@ def search_statistiques_supervision(query):
 
 def get_commande_status(commande):
     """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
+    return statut(commande)
 
 
 @login_required
@@ -408,8 +304,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes récentes
     recent_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle="Confirmée",
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats("Confirmée")
     ).order_by('-id')[:3]
     
     for cmd in recent_commandes:
@@ -4,6 +4,7 @@ from django.urls import reverse
 from django.contrib import messages
 from functools import wraps
 from parametre.models import Operateur
+from parametre.operateurs import operateur_courant
 
 def superviseur_preparation_required(view_func):
     """
@@ -20,7 +21,7 @@ def superviseur_preparation_required(view_func):
             return redirect('login')
         
         try:
-            operateur = Operateur.objects.get(user=request.user, actif=True)
+            operateur = operateur_courant(request, actif=True)
             
             # Autoriser les superviseurs, les opérateurs de préparation et ADMIN
             if operateur.type_operateur in ['SUPERVISEUR_PREPARATION', 'PREPARATION', 'ADMIN']:
@@ -57,7 +58,7 @@ def superviseur_only_required(view_func):
             return redirect('login')
         
         try:
-            operateur = Operateur.objects.get(user=request.user, actif=True)
+            operateur = operateur_courant(request, actif=True)
             
             # Autoriser uniquement les superviseurs
             if operateur.type_operateur == 'SUPERVISEUR_PREPARATION':
@@ -86,7 +87,7 @@ def preparation_team_required(view_func):
             return redirect('login')
         
         try:
-            operateur = Operateur.objects.get(user=request.user, actif=True)
+            operateur = operateur_courant(request, actif=True)
             
             # Autoriser les superviseurs, les opérateurs de préparation et ADMIN
             if operateur.type_operateur in ['SUPERVISEUR_PREPARATION', 'PREPARATION', 'ADMIN']:
@@ -4,15 +4,18 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash
-from django.db.models import Count, Q, Sum, F, Avg
+from django.db.models import Count, Exists, OuterRef, Q, Sum, F, Avg
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.http import JsonResponse, HttpResponse
 from django.db import transaction
 from django.core.paginator import Paginator
+from config.pagination import PaginationCurseur, compter
 import json
 from parametre.models import Operateur, Ville
+from parametre.operateurs import operateur_courant
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Operation, Panier, Envoi
+from commande.etats import ids_etats, obtenir_etat, obtenir_ou_creer_etat
 from django.urls import reverse
 import barcode
 from barcode.writer import ImageWriter
@@ -20,6 +23,8 @@ from io import BytesIO
 import base64
 import qrcode
 import csv
+from commande import compteurs as compteurs_files
+from commande.codes_barres import obtenir_base64, pre_generer, url_code
 from article.models import Article, MouvementStock, VarianteArticle
 from commande.models import Envoi
 from .forms import ArticleForm, AjusterStockForm
@@ -48,29 +53,20 @@ def home_view(request):
 
     # Récupérer les états nécessaires
     try:
-        etat_confirmee = EnumEtatCmd.objects.get(libelle__iexact='Confirmée')
-        etat_en_preparation = EnumEtatCmd.objects.get(libelle__iexact='En préparation')
-        etat_preparee = EnumEtatCmd.objects.get(libelle__iexact='Préparée')
+        etat_confirmee = obtenir_etat('Confirmée')
+        etat_en_preparation = obtenir_etat('En préparation')
+        etat_preparee = obtenir_etat('Préparée')
     except EnumEtatCmd.DoesNotExist as e:
         messages.error(request, f"État manquant dans le système: {str(e)}")
         return redirect('login')
 
 
-    # 3. Commandes livrées partiellement (supervision)
-    commandes_livrees_partiellement = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée Partiellement',
-        etats__date_fin__isnull=True
+    # 3. Files de la supervision (compteurs de files, tous opérateurs confondus)
+    files = compteurs_files.par_etat(['Livrée Partiellement', 'Retournée', etat_en_preparation.libelle])
+    commandes_livrees_partiellement = files['Livrée Partiellement']
+    commandes_retournees = files['Retournée']
 
-    ).distinct().count()
-    commandes_retournees = Commande.objects.filter(
-        etats__enum_etat__libelle='Retournée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
-
-    commandes_en_cours = Commande.objects.filter(
-        etats__enum_etat=etat_en_preparation,
-        etats__date_fin__isnull=True
-    ).distinct().count()
+    commandes_en_cours = files[etat_en_preparation.libelle]
 
     ma_performance = EtatCommande.objects.filter(
         enum_etat=etat_preparee,
@@ -97,10 +93,7 @@ def home_view(request):
 
     # Commandes actuellement en préparation (toutes)
 
-    commandes_en_preparation = Commande.objects.filter(
-        etats__enum_etat=etat_en_preparation,
-        etats__date_fin__isnull=True
-    ).count()
+    commandes_en_preparation = files[etat_en_preparation.libelle]
 
     # Performance de l'opérateur aujourd'hui (commandes préparées par lui)
     ma_performance_today = EtatCommande.objects.filter(
@@ -150,7 +143,7 @@ def home_view(request):
     # Commandes confirmées aujourd'hui
 
     commandes_confirmees_today = Commande.objects.filter(
-        etats__enum_etat__libelle='Confirmée',
+        etats__enum_etat_id__in=ids_etats('Confirmée'),
         etats__date_debut__date=today
     ).distinct().count()
 
@@ -261,26 +254,17 @@ def _get_commandes_en_preparation():
             .order_by('date_debut')
     )
 
-    # Récupérer les commandes en une seule requête avec annotations pour trier côté DB
-    # current_etat_date = date_debut max des états actifs de préparation
+    # Récupérer les commandes en une seule requête, triées côté DB sur la date de l'état actuel
     qs = (
         Commande.objects.filter(
-            Q(etats__enum_etat__libelle__in=etats_preparation),
-            etats__date_fin__isnull=True
+            etat_courant_id__in=ids_etats(*etats_preparation)
         )
         .select_related('client', 'ville', 'ville__region')
         .prefetch_related(
             Prefetch('etats', queryset=etats_qs),
             'paniers__article'
         )
-        .annotate(
-            current_etat_date=Max(
-                'etats__date_debut',
-                filter=Q(etats__enum_etat__libelle__in=etats_preparation, etats__date_fin__isnull=True)
-            )
-        )
-        .order_by('-current_etat_date', '-id')
-        .distinct()
+        .order_by('-date_etat_courant', '-id')
     )
 
     # Limiter les colonnes ramenées par Commande (évite de gros transferts)
@@ -324,24 +308,17 @@ def _enrichir_commande(commande):
     
     # Ajouter l'état de confirmation
     etat_conf = commande.etats.filter(
-        enum_etat__libelle='Confirmée',
+        enum_etat_id__in=ids_etats('Confirmée'),
         operateur__type_operateur='CONFIRMATION'
     ).order_by('-date_debut').first()
     
     if not etat_conf:
-        etat_conf = commande.etats.filter(enum_etat__libelle='Confirmée').order_by('date_debut').first()
+        etat_conf = commande.etats.filter(enum_etat_id__in=ids_etats('Confirmée')).order_by('date_debut').first()
     
     commande.etat_confirmation = etat_conf
     
-    # Générer le code-barres
-    if commande.id_yz:
-        code128 = barcode.get_barcode_class('code128')
-        barcode_instance = code128(str(commande.id_yz), writer=ImageWriter())
-        buffer = BytesIO()
-        barcode_instance.write(buffer, options={'write_text': False, 'module_height': 10.0})
-        commande.barcode_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    else:
-        commande.barcode_base64 = None
+    # URL du code-barres (image calculée une seule fois et mise en cache, voir commande/codes_barres.py)
+    commande.barcode_url = url_code('commande', commande.id_yz) if commande.id_yz else None
     
     return commande
 
@@ -410,7 +387,7 @@ def _filtrer_commandes_par_type(commandes, filter_type):
                 num_cmd_original = commande.num_cmd.replace('RENVOI-', '')
                 commande_originale = Commande.objects.filter(
                     num_cmd=num_cmd_original,
-                    etats__enum_etat__libelle='Livrée Partiellement'
+                    etats__enum_etat_id__in=ids_etats('Livrée Partiellement')
                 ).first()
                 if commande_originale:
                     commandes_filtrees.append(commande)
@@ -457,7 +434,7 @@ def _calculer_statistiques(operateur_profile):
             commande.num_cmd.startswith('RENVOI-') and
             Commande.objects.filter(
                 num_cmd=commande.num_cmd.replace('RENVOI-', ''),
-                etats__enum_etat__libelle='Livrée Partiellement'
+                etats__enum_etat_id__in=ids_etats('Livrée Partiellement')
             ).exists()):
             stats['renvoyees_logistique'] += 1
             continue
@@ -479,7 +456,7 @@ def _calculer_statistiques(operateur_profile):
         superviseur_nom = operateur_profile.nom_complet
         if superviseur_nom:
             stats['affectees_moi'] = Commande.objects.filter(
-                etats__enum_etat__libelle='En préparation',
+                etats__enum_etat_id__in=ids_etats('En préparation'),
                 etats__commentaire__icontains=f"Affectée à la préparation par {superviseur_nom}"
             ).distinct().count()
     except Exception:
@@ -603,10 +580,10 @@ def commandes_preparees(request):
     except Operateur.DoesNotExist:
         messages.error(request, "Votre profil opérateur n'existe pas.")
         return redirect('login')
+    # État courant dénormalisé : ni jointure sur les états ni distinct
     commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__date_fin__isnull=True  # État actif
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats').distinct()
+        etat_courant_id__in=ids_etats('Préparée')
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats')
     search_query = request.GET.get('search', '')
     if search_query:
         commandes_preparees = commandes_preparees.filter(
@@ -615,18 +592,18 @@ def commandes_preparees(request):
             Q(client__nom__icontains=search_query) |
             Q(client__prenom__icontains=search_query) |
             Q(client__numero_tel__icontains=search_query)
-        ).distinct()
+        )
 
-    # Statistiques
-    total_preparees = commandes_preparees.count()
+    # Statistiques (total lu dans les compteurs de files hors recherche)
+    if search_query:
+        total_preparees = compter(commandes_preparees)[0]
+    else:
+        total_preparees = compteurs_files.total(['Préparée'])
     valeur_totale = commandes_preparees.aggregate(total=Sum('total_cmd'))['total'] or 0
     
     # Commandes préparées aujourd'hui
     today = timezone.now().date()
-    preparees_today = commandes_preparees.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__date_debut__date=today
-    ).count()
+    preparees_today = commandes_preparees.filter(date_etat_courant__date=today).count()
 
     # Pagination
     items_per_page = request.GET.get('items_per_page', 10)
@@ -637,9 +614,9 @@ def commandes_preparees(request):
     except (ValueError, TypeError):
         items_per_page = 10
 
-    paginator = Paginator(commandes_preparees, items_per_page)
-    page_number = request.GET.get('page', 1)
-    commandes_page = paginator.get_page(page_number)
+    commandes_page = PaginationCurseur(
+        commandes_preparees, items_per_page, ('-date_etat_courant',), total=total_preparees, requete=request
+    ).get_page(request.GET.get('page'))
 
     context = {
         'page_title': 'Commandes Préparées',
@@ -668,9 +645,8 @@ def commandes_en_preparation(request):
         messages.error(request, "Votre profil opérateur n'existe pas.")
         return redirect('Superpreparation:home')
     commandes_en_preparation = Commande.objects.filter(
-        etats__enum_etat__libelle='En préparation',
-        etats__date_fin__isnull=True  # État actif (en cours)
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__operateur').distinct()
+        etat_courant_id__in=ids_etats('En préparation')
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__operateur')
     search_query = request.GET.get('search', '')
     if search_query:
         commandes_en_preparation = commandes_en_preparation.filter(
@@ -683,7 +659,7 @@ def commandes_en_preparation(request):
     stats = {
         'total_commandes': commandes_en_preparation.count(),
         'commandes_urgentes': commandes_en_preparation.filter(
-            etats__date_debut__lt=timezone.now() - timedelta(days=1)
+            date_etat_courant__lt=timezone.now() - timedelta(days=1)
         ).count(),
         'valeur_totale': commandes_en_preparation.aggregate(total=Sum('total_cmd'))['total'] or 0
     }
@@ -717,9 +693,8 @@ def commandes_emballees(request):
 
     # Récupérer TOUTES les commandes emballées qui attendent la finalisation
     commandes_emballees = Commande.objects.filter(
-        etats__enum_etat__libelle='Emballée',
-        etats__date_fin__isnull=True  # État actif (en cours)
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__operateur').distinct()
+        etat_courant_id__in=ids_etats('Emballée')
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__operateur')
 
     # Recherche
     search_query = request.GET.get('search', '')
@@ -736,7 +711,7 @@ def commandes_emballees(request):
     stats = {
         'total_commandes': commandes_emballees.count(),
         'commandes_urgentes': commandes_emballees.filter(
-            etats__date_debut__lt=timezone.now() - timedelta(hours=2)  # Urgent si emballée depuis plus de 2h
+            date_etat_courant__lt=timezone.now() - timedelta(hours=2)  # Urgent si emballée depuis plus de 2h
         ).count(),
         'valeur_totale': commandes_emballees.aggregate(total=Sum('total_cmd'))['total'] or 0
     }
@@ -774,7 +749,7 @@ def traiter_commande_retournee_api(request, commande_id):
         
         # Vérifier que la commande est bien en état "Retournée"
         etat_retournee = commande.etats.filter(
-            enum_etat__libelle='Retournée',
+            enum_etat_id__in=ids_etats('Retournée'),
             date_fin__isnull=True
         ).first()
         
@@ -792,8 +767,10 @@ def traiter_commande_retournee_api(request, commande_id):
         # Traitement selon le type
         with transaction.atomic(): 
             if type_traitement == 'repreparer':
-                # Traiter tous les paniers de la commande
-                for panier in commande.paniers.all():
+                # Traiter tous les paniers de la commande : les mouvements sont appliqués en un lot
+                from article import stock
+                mouvements = []
+                for panier in commande.paniers.select_related('article', 'variante__couleur', 'variante__pointure'):
                     quantite = panier.quantite
                     
                     if panier.variante:
@@ -808,33 +785,19 @@ def traiter_commande_retournee_api(request, commande_id):
                             })
                         
                         # Créer un mouvement de stock pour tracer (dans tous les cas)
-                        from article.models import MouvementStock
-                        
+                        description = f"{variante.couleur.nom if variante.couleur else 'N/A'} - {variante.pointure.pointure if variante.pointure else 'N/A'}"
                         if etat_stock == 'bon':
                             # Réincrémenter le stock de la variante
-                            variante.qte_disponible += quantite
-                            variante.save()
-                            
-                            MouvementStock.objects.create(
-                                article=panier.article,
-                                variante=variante,
-                                quantite=quantite,
-                                type_mouvement='entree',
-                                commentaire=f"Réincrémentation - Commande retournée {commande.id_yz} - {variante.couleur.nom if variante.couleur else 'N/A'} - {variante.pointure.pointure if variante.pointure else 'N/A'} - Produits en bon état - {commentaire}",
-                                operateur=operateur_profile,
-                                qte_apres_mouvement=variante.qte_disponible
-                            )
+                            mouvements.append(stock.Mouvement(
+                                variante, quantite, 'entree',
+                                f"Réincrémentation - Commande retournée {commande.id_yz} - {description} - Produits en bon état - {commentaire}",
+                            ))
                         else:
-                            # Produits défectueux : juste tracer sans réincrémenter
-                            MouvementStock.objects.create(
-                                article=panier.article,
-                                variante=variante,
-                                quantite=0,  # Quantité 0 car pas de réincrémentation
-                                type_mouvement='perte',
-                                commentaire=f"Produits défectueux - Commande retournée {commande.id_yz} - {variante.couleur.nom if variante.couleur else 'N/A'} - {variante.pointure.pointure if variante.pointure else 'N/A'} - Produits défectueux (non réintégrés) - {commentaire}",
-                                operateur=operateur_profile,
-                                qte_apres_mouvement=variante.qte_disponible
-                            )
+                            # Produits défectueux : juste tracer sans réincrémenter (quantité 0)
+                            mouvements.append(stock.Mouvement(
+                                variante, 0, 'perte',
+                                f"Produits défectueux - Commande retournée {commande.id_yz} - {description} - Produits défectueux (non réintégrés) - {commentaire}",
+                            ))
                     else:
                         # Cas sans variante : gérer les articles simples (si ce cas existe dans votre logique métier)
                         # Note: Dans ce système, les articles devraient normalement avoir des variantes
@@ -843,6 +806,8 @@ def traiter_commande_retournee_api(request, commande_id):
                             'message': f'Article {panier.article.nom} sans variante définie. Impossible de gérer le stock.'
                         })
                 
+                stock.appliquer(mouvements, commande=commande, operateur=operateur_profile)
+                
                 # GESTION DES ÉTATS DE COMMANDE
                 # Terminer l'état "Retournée" avec la date de fin (la commande reste à l'état "Retournée")
                 etat_retournee.terminer_etat(operateur_profile)
@@ -1051,7 +1016,7 @@ def detail_prepa(request, pk):
     # Récupérer l'état de préparation actuel (peut être affecté à n'importe quel opérateur)
 
     etat_preparation = commande.etats.filter(
-        Q(enum_etat__libelle='À imprimer') | Q(enum_etat__libelle='En préparation'),
+        Q(enum_etat_id__in=ids_etats('À imprimer', 'En préparation')),
         date_fin__isnull=True
     ).first()
 
@@ -1229,13 +1194,8 @@ def detail_prepa(request, pk):
     total_articles = sum(panier.total_ligne for panier in paniers)
     # Récupérer les opérations associées à la commande
     operations = commande.operations.select_related('operateur').order_by('-date_operation')
-    # Générer le code-barres pour la commande
-    code128 = barcode.get_barcode_class('code128')
-    barcode_instance = code128(str(commande.id_yz), writer=ImageWriter())
-    buffer = BytesIO()
-    barcode_instance.write(buffer, options={'write_text': False, 'module_height': 10.0})
-    barcode_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    commande_barcode = f"data:image/png;base64,{barcode_base64}"
+    # URL du code-barres de la commande
+    commande_barcode = url_code('commande', commande.id_yz)
     # Gestion des actions POST (marquer comme préparée, etc.)
     if request.method == 'POST':
         action = request.POST.get('action')
@@ -1244,7 +1204,7 @@ def detail_prepa(request, pk):
         if action == 'marquer_preparee':
             with transaction.atomic():
                 # Marquer l'état 'En préparation' comme terminé
-                etat_en_preparation, created = EnumEtatCmd.objects.get_or_create(libelle='En préparation')
+                etat_en_preparation, created = obtenir_ou_creer_etat('En préparation')
                 etat_actuel = EtatCommande.objects.filter(
                     commande=commande,
                     enum_etat=etat_en_preparation,
@@ -1255,7 +1215,7 @@ def detail_prepa(request, pk):
                     etat_actuel.operateur = operateur_profile
                     etat_actuel.save()
                 # Créer le nouvel état 'Préparée'
-                etat_preparee, created = EnumEtatCmd.objects.get_or_create(libelle='Préparée')
+                etat_preparee, created = obtenir_ou_creer_etat('Préparée')
                 EtatCommande.objects.create(
                     commande=commande,
                     enum_etat=etat_preparee,
@@ -1286,8 +1246,8 @@ def detail_prepa(request, pk):
                         operateur_confirmation_origine = etat.operateur
                         break
                 # 3. Créer l'état "Retour Confirmation" et l'affecter
-                etat_retour_enum, _ = EnumEtatCmd.objects.get_or_create(
-                    libelle='Retour Confirmation',
+                etat_retour_enum, _ = obtenir_ou_creer_etat(
+                    'Retour Confirmation',
                     defaults={'ordre': 25, 'couleur': '#D97706'}
                 )
                 EtatCommande.objects.create(
@@ -1340,11 +1300,18 @@ def detail_prepa(request, pk):
 def api_commandes_confirmees(request):
     """API pour récupérer toutes les commandes confirmées"""
     try:
-        commandes_confirmees = Commande.objects.filter(
-            etats__enum_etat__libelle='Confirmée'
-        ).select_related('client').distinct()
+        try:
+            par_page = min(max(int(request.GET.get('par_page', 100)), 1), 500)
+        except (TypeError, ValueError):
+            par_page = 100
+        commandes_confirmees = Commande.objects.filter(Exists(
+            EtatCommande.objects.filter(commande=OuterRef('pk'), enum_etat_id__in=ids_etats('Confirmée'))
+        )).select_related('client')
+        page = PaginationCurseur(commandes_confirmees, par_page, ('-date_creation',), requete=request).get_page(
+            request.GET.get('page')
+        )
         commandes_data = []
-        for commande in commandes_confirmees:
+        for commande in page:
             commandes_data.append({
                 'id': commande.id_yz,
                 'client_nom': f"{commande.client.prenom} {commande.client.nom}",
@@ -1353,7 +1320,8 @@ def api_commandes_confirmees(request):
             })
         return JsonResponse({
             'success': True,
-            'commandes': commandes_data
+            'commandes': commandes_data,
+            'pagination': page.meta(),
         })
     except Exception as e:
         return JsonResponse({
@@ -1476,7 +1444,7 @@ def modifier_commande_prepa(request, commande_id):
     
     try:
         # Récupérer l'opérateur
-        operateur = Operateur.objects.get(user=request.user, type_operateur='PREPARATION')
+        operateur = operateur_courant(request, 'PREPARATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur de préparation non trouvé.")
         return redirect('login')
@@ -1486,7 +1454,7 @@ def modifier_commande_prepa(request, commande_id):
     
     # Vérifier que la commande est affectée à cet opérateur pour la préparation
     etat_preparation = commande.etats.filter(
-        Q(enum_etat__enum_etat__libelle='À imprimer') | Q(enum_etat__enum_etat__libelle='En préparation'),
+        Q(enum_etat__enum_etat_id__in=ids_etats('À imprimer', 'En préparation')),
         operateur=operateur,
         date_fin__isnull=True
     ).first()
@@ -2093,7 +2061,7 @@ def modifier_commande_prepa(request, commande_id):
         commande_originale_obj = Commande.objects.filter(num_cmd=num_cmd_original, client=commande.client).first()
         if commande_originale_obj:
             # Vérifier si la commande originale a bien été livrée partiellement
-            if commande_originale_obj.etats.filter(enum_etat__libelle='Livrée Partiellement').exists():
+            if commande_originale_obj.etats.filter(enum_etat_id__in=ids_etats('Livrée Partiellement')).exists():
                 is_commande_livree_partiellement = True
                 operation_livraison_partielle_source = commande_originale_obj.operations.filter(
                     type_operation='LIVRAISON_PARTIELLE'
@@ -2194,7 +2162,7 @@ def modifier_commande_superviseur(request, commande_id):
     from parametre.models import Ville
     try:
         # Accepter PREPARATION et SUPERVISEUR_PREPARATION
-        operateur = Operateur.objects.get(user=request.user, actif=True)
+        operateur = operateur_courant(request, actif=True)
         if operateur.type_operateur not in ['PREPARATION', 'SUPERVISEUR_PREPARATION']:
             messages.error(request, "Accès non autorisé. Réservé à l'équipe préparation.")
             return redirect('Superpreparation:home')
@@ -2559,7 +2527,7 @@ def modifier_commande_superviseur(request, commande_id):
 
                 commande=commande_originale_obj,
 
-                enum_etat__libelle='Livrée partiellement'
+                enum_etat_id__in=ids_etats('Livrée partiellement')
 
             ).first()
 
@@ -2624,7 +2592,7 @@ def api_articles_disponibles_prepa(request):
     from article.models import Article
     try:
         # Accepter PREPARATION, SUPERVISEUR_PREPARATION et ADMIN
-        operateur = Operateur.objects.get(user=request.user, actif=True)
+        operateur = operateur_courant(request, actif=True)
         if operateur.type_operateur not in ['PREPARATION', 'SUPERVISEUR_PREPARATION', 'ADMIN']:
             return JsonResponse({'success': False, 'message': 'Accès non autorisé'}, status=403)
     except Operateur.DoesNotExist:
@@ -2996,7 +2964,7 @@ def api_panier_commande_prepa(request, commande_id):
     """API pour récupérer le panier d'une commande pour les opérateurs de préparation"""
     try:
         # Accepter PREPARATION et SUPERVISEUR_PREPARATION
-        operateur = Operateur.objects.get(user=request.user, actif=True)
+        operateur = operateur_courant(request, actif=True)
         if operateur.type_operateur not in ['PREPARATION', 'SUPERVISEUR_PREPARATION']:
             return JsonResponse({'success': False, 'message': 'Accès non autorisé'})
     except Operateur.DoesNotExist:
@@ -3012,13 +2980,13 @@ def api_panier_commande_prepa(request, commande_id):
     if operateur and operateur.type_operateur == 'SUPERVISEUR_PREPARATION':
         # Vérifier seulement que la commande est en préparation (incluant les états finaux)
         etat_preparation = commande.etats.filter(
-            Q(enum_etat__libelle='En préparation') | Q(enum_etat__libelle='Collectée') | Q(enum_etat__libelle='Emballée') | Q(enum_etat__libelle='Préparée'),
+            Q(enum_etat_id__in=ids_etats('En préparation', 'Collectée', 'Emballée', 'Préparée')),
             date_fin__isnull=True
         ).first()
     else:
         # Pour les opérateurs normaux, vérifier l'affectation spécifique
         etat_preparation = commande.etats.filter(
-            Q(enum_etat__libelle='En préparation') | Q(enum_etat__libelle='Collectée') | Q(enum_etat__libelle='Emballée') | Q(enum_etat__libelle='Préparée'),
+            Q(enum_etat_id__in=ids_etats('En préparation', 'Collectée', 'Emballée', 'Préparée')),
             operateur=operateur,
             date_fin__isnull=True
         ).first()
@@ -3102,7 +3070,7 @@ def api_finaliser_commande(request, commande_id):
             etat_actuel.operateur = operateur_profile
             etat_actuel.save()
             # Créer le nouvel état 'Préparée' (final)
-            etat_preparee, created = EnumEtatCmd.objects.get_or_create(libelle='Préparée')
+            etat_preparee, created = obtenir_ou_creer_etat('Préparée')
             EtatCommande.objects.create(
                 commande=commande,
                 enum_etat=etat_preparee,
@@ -3268,15 +3236,13 @@ def imprimer_tickets_preparation(request):
         return HttpResponse("IDs de commande invalides.", status=400)
     commandes = Commande.objects.filter(
         id__in=commande_ids,
-        etats__operateur=operateur_profile,
-        etats__enum_etat__libelle='En préparation',
-        etats__date_fin__isnull=True
-    ).distinct()
+        operateur_etat_courant=operateur_profile,
+        etat_courant_id__in=ids_etats('En préparation')
+    )
 
     if not commandes.exists():
         messages.info(request, "L'impression des tickets est désactivée. Utilisez les outils de gestion.")
         return redirect('Superpreparation:liste_prepa')
-    code128 = barcode.get_barcode_class('code128')
     messages.info(request, "L'impression des tickets a été retirée de l'interface superviseur.")
     return redirect('Superpreparation:liste_prepa')
 
@@ -3328,8 +3294,7 @@ def export_envois(request):
     
     # Commandes PRÉPARÉES à être envoyées
     commandes_pretes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Préparée')
     ).select_related('ville__region')
     
     if region_id and region_id.strip():
@@ -3372,13 +3337,12 @@ def details_region_view(request):
     
     # Base queryset pour toutes les commandes en traitement
     commandes_reparties = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée', 'En cours de livraison'],
-        etats__date_fin__isnull=True,
+        etat_courant_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée', 'En cours de livraison'),
         ville__isnull=False,  # Exclure les commandes sans ville
         ville__region__isnull=False  # Exclure les commandes sans région
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__operateur', 'etats__enum_etat', 'paniers__article'
-    ).distinct()
+    )
     
     # Appliquer les filtres
     if region_name:
@@ -3396,8 +3360,7 @@ def details_region_view(request):
     
     # Statistiques des commandes PRÉPARÉES par ville dans la région/ville filtrée
     commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__date_fin__isnull=True,
+        etat_courant_id__in=ids_etats('Préparée'),
         ville__isnull=False,
         ville__region__isnull=False
     ).select_related('ville', 'ville__region')
@@ -3478,8 +3441,7 @@ def envois_view(request):
     from parametre.models import Region
     regions = Region.objects.all()
     commandes_pretes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Préparée')
     ).select_related('ville__region')
     
     # Récupérer les envois actifs (non clôturés)
@@ -3491,8 +3453,7 @@ def envois_view(request):
     for envoi in envois_actifs:
         nb_commandes = Commande.objects.filter(
             ville__region=envoi.region,
-            etats__enum_etat__libelle='Préparée',
-            etats__date_fin__isnull=True
+            etat_courant_id__in=ids_etats('Préparée')
         ).count()
         
         # Mettre à jour seulement si le nombre a changé
@@ -3521,14 +3482,13 @@ def commandes_envoi(request, envoi_id):
         
         # Récupérer seulement les commandes préparées de cet envoi spécifique
         commandes = Commande.objects.filter(
-            etats__enum_etat__libelle='Préparée',
-            etats__date_fin__isnull=True  # État actuel (pas terminé)
+            etat_courant_id__in=ids_etats('Préparée')
         ).select_related('client', 'ville', 'ville__region').prefetch_related(
             'etats', 
             'paniers__article', 
             'paniers__variante__couleur', 
             'paniers__variante__pointure'
-        ).distinct()
+        )
         
         print(f"DEBUG: Envoi {envoi.id} - Commandes préparées trouvées: {commandes.count()}")
         
@@ -3823,7 +3783,7 @@ def creer_envoi_region(request):
     
     try:
         from parametre.models import Operateur
-        operateur = Operateur.objects.get(user=request.user, actif=True)
+        operateur = operateur_courant(request, actif=True)
         print(f"🔍 DEBUG - Profil opérateur: {operateur.type_operateur}")
     except Operateur.DoesNotExist:
         print(f"🔍 DEBUG - Aucun profil opérateur trouvé")
@@ -3854,7 +3814,7 @@ def creer_envoi_region(request):
         # Récupérer le profil opérateur
         try:
             from parametre.models import Operateur
-            operateur_creation = Operateur.objects.get(user=request.user, actif=True)
+            operateur_creation = operateur_courant(request, actif=True)
         except Operateur.DoesNotExist:
             operateur_creation = None
             
@@ -3890,7 +3850,7 @@ def creer_envois_multiples(request):
         
         # Récupérer le profil opérateur
         try:
-            operateur_creation = Operateur.objects.get(user=request.user, actif=True)
+            operateur_creation = operateur_courant(request, actif=True)
         except Operateur.DoesNotExist:
             operateur_creation = None
         
@@ -3974,7 +3934,7 @@ def cloturer_envois_multiples(request):
         
         # Récupérer le profil opérateur
         try:
-            operateur_cloture = Operateur.objects.get(user=request.user, actif=True)
+            operateur_cloture = operateur_courant(request, actif=True)
         except Operateur.DoesNotExist:
             operateur_cloture = None
         
@@ -4063,22 +4023,20 @@ def cloturer_envoi(request):
             # On cible explicitement les commandes dont l'état courant est "Préparée"
             commandes = Commande.objects.filter(
                 envoi=envoi,
-                etats__enum_etat__libelle='Préparée',
-                etats__date_fin__isnull=True,
-            ).distinct()
+                etat_courant_id__in=ids_etats('Préparée'),
+            )
             if not commandes.exists():
                 # Fallback: prendre les commandes 'Préparée' de la région de l'envoi
                 commandes = (
                     Commande.objects.filter(
                         ville__region=envoi.region,
-                        etats__enum_etat__libelle='Préparée',
-                        etats__date_fin__isnull=True,
+                        etat_courant_id__in=ids_etats('Préparée'),
                     )
                     .select_related('client', 'ville')
-                    .distinct()
+                    
                 )
-            etat_enum, _ = EnumEtatCmd.objects.get_or_create(
-                libelle='Mise en distribution',
+            etat_enum, _ = obtenir_ou_creer_etat(
+                'Mise en distribution',
                 defaults={'ordre': 17, 'couleur': '#8B5CF6'}
             )
 
@@ -4123,7 +4081,7 @@ def rafraichir_articles_commande_prepa(request, commande_id):
     print(f"🔄 Rafraîchissement des articles pour la commande {commande_id}")
     
     try:
-        operateur = Operateur.objects.get(user=request.user, actif=True)
+        operateur = operateur_courant(request, actif=True)
         
         # Vérifier le type d'opérateur
         if operateur.type_operateur not in ['SUPERVISEUR_PREPARATION', 'PREPARATION', 'ADMIN']:
@@ -4143,14 +4101,14 @@ def rafraichir_articles_commande_prepa(request, commande_id):
         if operateur and operateur.type_operateur == 'SUPERVISEUR_PREPARATION':
             # Vérifier seulement que la commande est en préparation
             etat_preparation = commande.etats.filter(
-                enum_etat__libelle__in=['En préparation', 'À imprimer'],
+                enum_etat_id__in=ids_etats('En préparation', 'À imprimer'),
                 date_fin__isnull=True
             ).first()
         else:
             # Pour les opérateurs normaux, vérifier l'affectation spécifique
             etat_preparation = commande.etats.filter(
                 operateur=operateur,
-                enum_etat__libelle__in=['En préparation', 'À imprimer'],
+                enum_etat_id__in=ids_etats('En préparation', 'À imprimer'),
                 date_fin__isnull=True
             ).first()
         
@@ -4301,7 +4259,7 @@ def ajouter_article_commande_prepa(request, commande_id):
     
     try:
         # Autoriser PREPARATION et SUPERVISEUR_PREPARATION
-        operateur = Operateur.objects.get(user=request.user, actif=True)
+        operateur = operateur_courant(request, actif=True)
         print(f"✅ Opérateur trouvé: {operateur.id} - Type: {operateur.type_operateur}")
         if operateur.type_operateur not in ['PREPARATION', 'SUPERVISEUR_PREPARATION']:
             print(f"❌ Type d'opérateur non autorisé: {operateur.type_operateur}")
@@ -4320,14 +4278,14 @@ def ajouter_article_commande_prepa(request, commande_id):
             if operateur.type_operateur == 'SUPERVISEUR_PREPARATION':
                 # Le superviseur peut agir sur toute commande en cours (sans contrainte d'affectation)
                 etat_preparation = commande.etats.filter(
-                    enum_etat__libelle__in=['En préparation', 'À imprimer'],
+                    enum_etat_id__in=ids_etats('En préparation', 'À imprimer'),
                     date_fin__isnull=True
                 ).first()
             else:
                 # Opérateur préparation: seulement sur les commandes qui lui sont affectées
                 etat_preparation = commande.etats.filter(
                     operateur=operateur,
-                    enum_etat__libelle__in=['En préparation', 'À imprimer'],
+                    enum_etat_id__in=ids_etats('En préparation', 'À imprimer'),
                     date_fin__isnull=True
                 ).first()
             
@@ -4517,7 +4475,7 @@ def modifier_quantite_article_prepa(request, commande_id):
         return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
 
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='PREPARATION')
+        operateur = operateur_courant(request, 'PREPARATION')
     except Operateur.DoesNotExist:
         return JsonResponse({'error': 'Profil d\'opérateur non trouvé.'}, status=403)
 
@@ -4526,7 +4484,7 @@ def modifier_quantite_article_prepa(request, commande_id):
             commande = Commande.objects.select_for_update().get(id=commande_id)
             
             # Vérifier l'affectation
-            if not commande.etats.filter(operateur=operateur, enum_etat__libelle__in=['En préparation', 'À imprimer'], date_fin__isnull=True).exists():
+            if not commande.etats.filter(operateur=operateur, enum_etat_id__in=ids_etats('En préparation', 'À imprimer'), date_fin__isnull=True).exists():
                 return JsonResponse({'error': 'Commande non affectée.'}, status=403)
             
             panier_id = request.POST.get('panier_id')
@@ -4538,9 +4496,9 @@ def modifier_quantite_article_prepa(request, commande_id):
             difference = nouvelle_quantite - ancienne_quantite
 
             if difference > 0:
-                creer_mouvement_stock(article, difference, 'sortie', commande, operateur, f'Ajustement qté cmd {commande.id_yz}')
+                creer_mouvement_stock(article, difference, 'sortie', operateur, commande, f'Ajustement qté cmd {commande.id_yz}', variante=panier.variante)
             elif difference < 0:
-                creer_mouvement_stock(article, abs(difference), 'entree', commande, operateur, f'Ajustement qté cmd {commande.id_yz}')
+                creer_mouvement_stock(article, abs(difference), 'entree', operateur, commande, f'Ajustement qté cmd {commande.id_yz}', variante=panier.variante)
 
             panier.quantite = nouvelle_quantite
             
@@ -4599,7 +4557,7 @@ def supprimer_article_commande_prepa(request, commande_id):
         return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
 
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='PREPARATION')
+        operateur = operateur_courant(request, 'PREPARATION')
     except Operateur.DoesNotExist:
         return JsonResponse({'error': 'Profil d\'opérateur non trouvé.'}, status=403)
 
@@ -4608,7 +4566,7 @@ def supprimer_article_commande_prepa(request, commande_id):
             commande = Commande.objects.select_for_update().get(id=commande_id)
             
             # Vérifier l'affectation
-            if not commande.etats.filter(operateur=operateur, enum_etat__libelle__in=['En préparation', 'À imprimer'], date_fin__isnull=True).exists():
+            if not commande.etats.filter(operateur=operateur, enum_etat_id__in=ids_etats('En préparation', 'À imprimer'), date_fin__isnull=True).exists():
                 return JsonResponse({'error': 'Commande non affectée.'}, status=403)
 
             panier_id = request.POST.get('panier_id')
@@ -4616,7 +4574,7 @@ def supprimer_article_commande_prepa(request, commande_id):
             quantite_supprimee = panier.quantite
             article = panier.article
             
-            creer_mouvement_stock(article, quantite_supprimee, 'entree', commande, operateur, f'Suppression article cmd {commande.id_yz}')
+            creer_mouvement_stock(article, quantite_supprimee, 'entree', operateur, commande, f'Suppression article cmd {commande.id_yz}', variante=panier.variante)
             
             # Sauvegarder l'info avant suppression
             etait_upsell = panier.article.isUpsell
@@ -4671,7 +4629,7 @@ def api_panier_commande_livraison(request, commande_id):
     """API pour récupérer le panier d'une commande pour les opérateurs de livraison"""
     try:
         # Vérifier que l'utilisateur est un opérateur de livraison
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Accès non autorisé'})
     
@@ -4715,7 +4673,7 @@ def api_articles_commande_livree_partiellement(request, commande_id):
 
     try:
         # Vérifier que l'utilisateur est un opérateur de préparation
-        operateur = Operateur.objects.get(user=request.user, type_operateur='PREPARATION')
+        operateur = operateur_courant(request, 'PREPARATION')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Accès non autorisé'})
     
@@ -4874,7 +4832,7 @@ def api_prix_upsell_articles(request, commande_id):
     print(f"🔄 Récupération des prix upsell pour la commande {commande_id}")
 
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='PREPARATION')
+        operateur = operateur_courant(request, 'PREPARATION')
     except Operateur.DoesNotExist:
         return JsonResponse({'error': 'Profil d\'opérateur de préparation non trouvé.'}, status=403)
 
@@ -4884,7 +4842,7 @@ def api_prix_upsell_articles(request, commande_id):
         # Vérifier que la commande est affectée à cet opérateur
         etat_preparation = commande.etats.filter(
             operateur=operateur,
-            enum_etat__libelle__in=['En préparation', 'À imprimer'],
+            enum_etat_id__in=ids_etats('En préparation', 'À imprimer'),
             date_fin__isnull=True
         ).first()
         
@@ -4975,9 +4933,8 @@ def commandes_confirmees(request):
 
     # Récupérer toutes les commandes confirmées (état actif sans date_fin)
     commandes_confirmees = Commande.objects.filter(
-        etats__enum_etat__libelle='Confirmée',
-        etats__date_fin__isnull=True  # État actif (en cours)
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations').distinct()
+        etat_courant_id__in=ids_etats('Confirmée')
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations')
 
     # Recherche
     search_query = request.GET.get('search', '')
@@ -4993,7 +4950,7 @@ def commandes_confirmees(request):
         ).distinct()
 
     # Tri par date de confirmation (plus récentes en premier)
-    commandes_confirmees = commandes_confirmees.order_by('-etats__date_debut')
+    commandes_confirmees = commandes_confirmees.order_by('-date_etat_courant')
 
     # Créer une copie des données non paginées pour les statistiques AVANT la pagination
     commandes_non_paginees = commandes_confirmees
@@ -5050,24 +5007,21 @@ def commandes_confirmees(request):
 
     # Confirmées aujourd'hui
     confirmees_aujourd_hui = Commande.objects.filter(
-        etats__enum_etat__libelle='Confirmée',
-        etats__date_fin__isnull=True,  # État actif
-        etats__date_debut__date=today
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Confirmée'),
+        date_etat_courant__date=today
+    ).count()
 
     # Confirmées cette semaine
     confirmees_semaine = Commande.objects.filter(
-        etats__enum_etat__libelle='Confirmée',
-        etats__date_fin__isnull=True,  # État actif
-        etats__date_debut__date__gte=week_start
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Confirmée'),
+        date_etat_courant__date__gte=week_start
+    ).count()
 
     # Confirmées ce mois
     confirmees_mois = Commande.objects.filter(
-        etats__enum_etat__libelle='Confirmée',
-        etats__date_fin__isnull=True,  # État actif
-        etats__date_debut__date__gte=month_start
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Confirmée'),
+        date_etat_courant__date__gte=month_start
+    ).count()
 
     # Total des commandes confirmées (utiliser les données non paginées)
     total_confirmees = commandes_non_paginees.count()
@@ -5220,68 +5174,12 @@ def get_article_variants(request, article_id):
 
 
 def generate_barcode_for_commande(commande_id_yz):
-    """Fonction utilitaire pour générer le code-barres d'une commande"""
-    try:
-        barcode_data = str(commande_id_yz)
-        print(f"📊 Génération du code-barres: {barcode_data}")
-        
-        # Créer un code-barres avec les mêmes options que Prepacommande
-        code128 = barcode.get_barcode_class("code128")
-        barcode_instance = code128(barcode_data, writer=ImageWriter())
-        buffer = BytesIO()
-        barcode_instance.write(
-            buffer,
-            options={
-                "write_text": False,
-                "module_height": 4.0,  # Hauteur augmentée pour meilleure lisibilité
-                "module_width": 0.15,  # Largeur augmentée pour impression claire
-                "quiet_zone": 2.0,     # Zone de silence autour du code-barres
-            },
-        )
-        barcode_base64 = base64.b64encode(buffer.getvalue()).decode()
-        print(f"✅ Code-barres généré avec succès (dimensions optimisées)")
-        return barcode_base64
-    except Exception as barcode_error:
-            print(f"❌ Erreur lors de la génération du code-barres: {str(barcode_error)}")
-    return ""
+    """Fonction utilitaire pour générer le code-barres d'une commande (base64, depuis le cache des codes-barres)"""
+    return obtenir_base64('ticket', commande_id_yz)
 
 def generate_qr_code_for_commande(commande_id_yz):
-    """Fonction utilitaire pour générer le code QR d'une commande"""
-    try:
-        import qrcode
-        qr_data = str(commande_id_yz)
-        print(f"📊 Génération du code QR: {qr_data}")
-        
-        # Créer un code QR avec des paramètres optimisés pour l'impression
-        qr = qrcode.QRCode(
-            version=1,  # Version 1 (21x21 modules)
-            error_correction=qrcode.constants.ERROR_CORRECT_L,  # Niveau de correction d'erreur bas
-            box_size=10,  # Taille de chaque module (pixel)
-            border=4,  # Bordure autour du QR code
-        )
-        
-        # Ajouter les données
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        
-        # Créer l'image
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        
-        # Créer un buffer pour l'image
-        buffer = BytesIO()
-        qr_image.save(buffer, format='PNG')
-        
-        # Convertir en base64
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-        print(f"✅ Code QR généré avec succès")
-        return qr_base64
-        
-    except ImportError:
-        print("❌ Erreur: La bibliothèque qrcode n'est pas installée")
-        return ""
-    except Exception as qr_error:
-        print(f"❌ Erreur lors de la génération du code QR: {str(qr_error)}")
-        return ""
+    """Fonction utilitaire pour générer le code QR d'une commande (base64, depuis le cache des codes-barres)"""
+    return obtenir_base64('qr', commande_id_yz)
 
 @superviseur_preparation_required
 def api_ticket_commande_new(request):
@@ -5297,7 +5195,7 @@ def api_ticket_commande_new(request):
         try:
             commande = Commande.objects.filter(
                 id_yz=commande_id,
-                etats__enum_etat__libelle='Confirmée'
+                etats__enum_etat_id__in=ids_etats('Confirmée')
             ).distinct().first()
             
             if not commande:
@@ -5309,8 +5207,8 @@ def api_ticket_commande_new(request):
             print(f"❌ Erreur lors de la recherche de la commande {commande_id}: {str(e)}")
             return JsonResponse({'error': f'Erreur lors de la recherche de la commande {commande_id}'}, status=500)
         
-        # Générer le code QR
-        qr_base64 = generate_qr_code_for_commande(commande.id_yz)
+        # URL du code QR (image mise en cache, absolue pour la fenêtre d'impression)
+        qr_code_url = request.build_absolute_uri(url_code('qr', commande.id_yz))
         
         # Préparer les articles
         articles_data = []
@@ -5342,7 +5240,7 @@ def api_ticket_commande_new(request):
             'total': f"{commande.total_cmd:.2f}",
             'frais_livraison': commande.frais_livraison,
             'date_commande': commande.date_creation,
-            'qr_code': qr_base64,
+            'qr_code': qr_code_url,
             'articles': articles_data
         }
         
@@ -5380,7 +5278,7 @@ def api_qr_codes_articles(request):
         try:
             commande = Commande.objects.filter(
                 id_yz=commande_id,
-                etats__enum_etat__libelle='Confirmée'
+                etats__enum_etat_id__in=ids_etats('Confirmée')
             ).distinct().first()
             
             if not commande:
@@ -5401,35 +5299,20 @@ def api_qr_codes_articles(request):
         # Générer les QR codes pour chaque article
         qr_codes_html = []
         
-        for panier in paniers:
+        # Texte du QR code : référence_article|CMD-numéro_commande
+        paniers = list(paniers)
+        qr_texts = [f"{panier.article.reference}|CMD-{commande.id_yz}" for panier in paniers]
+        # Images absentes du cache calculées en une fois (en parallèle pour les grosses commandes)
+        pre_generer('qr', qr_texts)
+        
+        for panier, qr_text in zip(paniers, qr_texts):
             article = panier.article
-            variante = panier.variante
-            
-            # Créer le texte du QR code : référence_article|CMD-numéro_commande
-            qr_text = f"{article.reference}|CMD-{commande.id_yz}"
-            
-            # Générer le QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_text)
-            qr.make(fit=True)
-            
-            # Créer l'image du QR code
-            qr_image = qr.make_image(fill_color="black", back_color="white")
-                
-                # Convertir en base64
-            buffer = BytesIO()
-            qr_image.save(buffer, format='PNG')
-            qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+            qr_url = request.build_absolute_uri(url_code('qr', qr_text))
             
             # Créer le HTML pour ce QR code
             qr_html = f'''
             <div class="qr-code-container">
-                <img src="data:image/png;base64,{qr_base64}" alt="QR Code" class="qr-code">
+                <img src="{qr_url}" alt="QR Code" class="qr-code">
                 <div class="article-info">
                     <div class="article-ref">{article.reference}</div>
                     <div class="commande-ref">CMD-{commande.id_yz}</div>
@@ -5489,7 +5372,7 @@ def api_finaliser_preparation(request, commande_id):
         
         # Récupérer l'état "Préparée"
         try:
-            etat_preparee = EnumEtatCmd.objects.get(libelle='Préparée')
+            etat_preparee = obtenir_etat('Préparée')
         except EnumEtatCmd.DoesNotExist:
             return JsonResponse({
                 'success': False, 
@@ -13,6 +13,7 @@ from django.core.paginator import Paginator
 import json
 from parametre.models import Operateur, Ville
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Operation, Panier, Envoi
+from commande.etats import ids_etats
 from django.urls import reverse
 import barcode
 from barcode.writer import ImageWriter
@@ -20,6 +21,7 @@ from io import BytesIO
 import base64
 import qrcode
 import csv
+from commande.codes_barres import pre_generer, url_code
 from article.models import Article, MouvementStock, VarianteArticle
 from commande.models import Envoi
 from .forms import ArticleForm, AjusterStockForm
@@ -242,7 +244,7 @@ def api_qr_codes_articles(request):
         try:
             commande = Commande.objects.filter(
                 id_yz=commande_id,
-                etats__enum_etat__libelle='Confirmée'
+                etats__enum_etat_id__in=ids_etats('Confirmée')
             ).distinct().first()
             
             if not commande:
@@ -263,35 +265,20 @@ def api_qr_codes_articles(request):
         # Générer les QR codes pour chaque article
         qr_codes_html = []
         
-        for panier in paniers:
+        # Texte du QR code : référence_article|CMD-numéro_commande
+        paniers = list(paniers)
+        qr_texts = [f"{panier.article.reference}|CMD-{commande.id_yz}" for panier in paniers]
+        # Images absentes du cache calculées en une fois (en parallèle pour les grosses commandes)
+        pre_generer('qr', qr_texts)
+        
+        for panier, qr_text in zip(paniers, qr_texts):
             article = panier.article
-            variante = panier.variante
-            
-            # Créer le texte du QR code : référence_article|CMD-numéro_commande
-            qr_text = f"{article.reference}|CMD-{commande.id_yz}"
-            
-            # Générer le QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_text)
-            qr.make(fit=True)
-            
-            # Créer l'image du QR code
-            qr_image = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convertir en base64
-            buffer = BytesIO()
-            qr_image.save(buffer, format='PNG')
-            qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+            qr_url = request.build_absolute_uri(url_code('qr', qr_text))
             
             # Créer le HTML pour ce QR code
             qr_html = f'''
             <div class="qr-code-container">
-                <img src="data:image/png;base64,{qr_base64}" alt="QR Code" class="qr-code">
+                <img src="{qr_url}" alt="QR Code" class="qr-code">
                 <div class="article-info">
                     <div class="article-ref">{article.reference}</div>
                     <div class="commande-ref">CMD-{commande.id_yz}</div>
@@ -1419,53 +1406,23 @@ def modifier_promotion(request, id):
     
     if request.method == 'POST':
         # Conserver les anciens articles pour comparaison
-        anciens_articles = list(promotion.articles.all())
+        anciens_articles = set(promotion.articles.values_list('pk', flat=True))
         
         form = PromotionForm(request.POST, instance=promotion)
         if form.is_valid():
             promotion_modifiee = form.save()
             
-            # Récupérer les nouveaux articles
-            nouveaux_articles = list(promotion_modifiee.articles.all())
+            # Recalculer en lot le prix des anciens et des nouveaux articles
+            # (les autres promotions actives de chaque article restent appliquées)
+            from article.promotions import rafraichir_articles
+            rafraichir_articles(anciens_articles | set(promotion_modifiee.articles.values_list('pk', flat=True)))
             
             # Vérifier si la promotion doit être active
             now = timezone.now()
             if promotion_modifiee.active and promotion_modifiee.date_debut <= now <= promotion_modifiee.date_fin:
-                # Retirer la promotion des anciens articles qui ne sont plus dans la promotion
-                for article in anciens_articles:
-                    if article not in nouveaux_articles:
-                        # Vérifier si l'article n'a pas d'autres promotions actives
-                        autres_promotions_actives = article.promotions.filter(
-                            active=True,
-                            date_debut__lte=now,
-                            date_fin__gte=now
-                        ).exclude(id=promotion_modifiee.id).exists()
-                        
-                        if not autres_promotions_actives:
-                            article.retirer_promotion()
-                        else:
-                            article.update_prix_actuel()
-                
-                # Appliquer la promotion aux nouveaux articles
-                for article in nouveaux_articles:
-                    article.appliquer_promotion(promotion_modifiee)
-                
                 messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès. Les prix ont été mis à jour.")
             else:
-                # Si la promotion n'est pas active, retirer la promotion de tous les anciens articles
-                for article in anciens_articles:
-                    autres_promotions_actives = article.promotions.filter(
-                        active=True,
-                        date_debut__lte=now,
-                        date_fin__gte=now
-                    ).exclude(id=promotion_modifiee.id).exists()
-                    
-                    if not autres_promotions_actives:
-                        article.retirer_promotion()
-                    else:
-                        article.update_prix_actuel()
-                
-            messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès.")
+                messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès.")
             
             return redirect('Superpreparation:detail_promotion', id=promotion.id)
         else:
@@ -2623,7 +2580,7 @@ def api_qr_codes_articles(request):
         try:
             commande = Commande.objects.filter(
                 id_yz=commande_id,
-                etats__enum_etat__libelle='Confirmée'
+                etats__enum_etat_id__in=ids_etats('Confirmée')
             ).distinct().first()
             
             if not commande:
@@ -2644,35 +2601,20 @@ def api_qr_codes_articles(request):
         # Générer les QR codes pour chaque article
         qr_codes_html = []
         
-        for panier in paniers:
+        # Texte du QR code : référence_article|CMD-numéro_commande
+        paniers = list(paniers)
+        qr_texts = [f"{panier.article.reference}|CMD-{commande.id_yz}" for panier in paniers]
+        # Images absentes du cache calculées en une fois (en parallèle pour les grosses commandes)
+        pre_generer('qr', qr_texts)
+        
+        for panier, qr_text in zip(paniers, qr_texts):
             article = panier.article
-            variante = panier.variante
-            
-            # Créer le texte du QR code : référence_article|CMD-numéro_commande
-            qr_text = f"{article.reference}|CMD-{commande.id_yz}"
-            
-            # Générer le QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_text)
-            qr.make(fit=True)
-            
-            # Créer l'image du QR code
-            qr_image = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convertir en base64
-            buffer = BytesIO()
-            qr_image.save(buffer, format='PNG')
-            qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+            qr_url = request.build_absolute_uri(url_code('qr', qr_text))
             
             # Créer le HTML pour ce QR code
             qr_html = f'''
             <div class="qr-code-container">
-                <img src="data:image/png;base64,{qr_base64}" alt="QR Code" class="qr-code">
+                <img src="{qr_url}" alt="QR Code" class="qr-code">
                 <div class="article-info">
                     <div class="article-ref">{article.reference}</div>
                     <div class="commande-ref">CMD-{commande.id_yz}</div>
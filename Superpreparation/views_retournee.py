@@ -13,6 +13,7 @@ from django.core.paginator import Paginator
 from django.utils import timezone
 
 from parametre.models import Operateur
+from parametre.operateurs import operateur_courant
 from commande.models import Commande, ArticleRetourne
 from .decorators import superviseur_preparation_required
 
@@ -151,7 +152,7 @@ def traiter_article_retourne_service(request, retour_id):
         except AttributeError:
             # Fallback si pas de profil opérateur
             try:
-                operateur = Operateur.objects.get(user=request.user, actif=True)
+                operateur = operateur_courant(request, actif=True)
             except Operateur.DoesNotExist:
                 operateur = None
 
@@ -229,7 +230,7 @@ def reintegrer_automatique_service(request):
         except AttributeError:
             # Fallback si pas de profil opérateur
             try:
-                operateur = Operateur.objects.get(user=request.user, actif=True)
+                operateur = operateur_courant(request, actif=True)
             except Operateur.DoesNotExist:
                 operateur = None
 
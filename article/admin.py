@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Article, Promotion, Categorie, Genre, Pointure, Couleur, VarianteArticle, MouvementStock
+from .models import Article, Promotion, Categorie, Genre, Pointure, Couleur, VarianteArticle, MouvementStock, ReservationStock
 from django.db.models import Sum, Q
 from django.contrib import messages
 from django.http import HttpResponseRedirect
@@ -99,19 +99,19 @@ class CouleurAdmin(admin.ModelAdmin):
 
 @admin.register(VarianteArticle)
 class VarianteArticleAdmin(admin.ModelAdmin):
-    list_display = ('article', 'reference_variante', 'couleur', 'pointure', 'qte_disponible', 'prix_unitaire_display', 'prix_achat_display', 'prix_actuel_display', 'actif')
+    list_display = ('article', 'reference_variante', 'couleur', 'pointure', 'qte_disponible', 'qte_reservee', 'qte_vendable', 'prix_unitaire_display', 'prix_achat_display', 'prix_actuel_display', 'actif')
     list_filter = ('actif', 'article__categorie', 'couleur', 'pointure', 'date_creation')
     search_fields = ('article__nom', 'couleur__nom', 'pointure__pointure')
     ordering = ('article__nom', 'couleur__nom', 'pointure__pointure')
     list_editable = ('qte_disponible', 'actif')
-    readonly_fields = ('date_creation', 'date_modification')
+    readonly_fields = ('date_creation', 'date_modification', 'qte_reservee', 'qte_vendable')
     
     fieldsets = (
         ('Article et variante', {
             'fields': ('article', 'couleur', 'pointure')
         }),
         ('Stock', {
-            'fields': ('qte_disponible', 'actif')
+            'fields': ('qte_disponible', 'qte_reservee', 'qte_vendable', 'actif')
         }),
         ('Dates', {
             'fields': ('date_creation', 'date_modification'),
@@ -142,14 +142,15 @@ class ArticleAdmin(admin.ModelAdmin):
     search_fields = ('nom', 'reference', 'categorie__nom')
     ordering = ('nom', 'categorie__nom')
     list_editable = ('prix_unitaire', 'prix_achat', 'actif', 'phase', 'isUpsell')
-    readonly_fields = ('date_creation', 'date_modification')
+    readonly_fields = ('date_creation', 'date_modification', 'prix_actuel', 'promotion_active', 'prix_valide_jusqu_au')
     
     fieldsets = (
         ('Informations produit', {
             'fields': ('nom', 'reference', 'categorie', 'genre', 'phase', 'description')
         }),
         ('Prix', {
-            'fields': ('prix_unitaire', 'prix_achat', 'prix_upsell_1', 'prix_upsell_2', 'prix_upsell_3', 'prix_upsell_4'),
+            'fields': ('prix_unitaire', 'prix_achat', 'prix_upsell_1', 'prix_upsell_2', 'prix_upsell_3', 'prix_upsell_4',
+                       'prix_actuel', 'promotion_active', 'prix_valide_jusqu_au'),
             'description': 'Prix unitaire, prix d\'achat et prix de substitution (upsell)'
         }),
         ('Configuration Upsell', {
@@ -219,6 +220,20 @@ class MouvementStockAdmin(admin.ModelAdmin):
     variante_info.short_description = 'Variante'
 
 
+@admin.register(ReservationStock)
+class ReservationStockAdmin(admin.ModelAdmin):
+    list_display = ('variante', 'commande', 'quantite', 'statut', 'operateur', 'date_creation', 'date_expiration', 'date_fin')
+    list_filter = ('statut', 'date_creation')
+    search_fields = ('commande__id_yz', 'commande__num_cmd', 'variante__article__nom')
+    ordering = ('-date_creation',)
+    list_select_related = ('variante__article', 'commande', 'operateur')
+    # Les réservations sont tenues par article/reservations.py : consultation seule
+    readonly_fields = [champ.name for champ in ReservationStock._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(Promotion)
 class PromotionAdmin(admin.ModelAdmin):
     list_display = ('nom', 'pourcentage_reduction', 'date_debut', 'date_fin', 'active', 'est_active', 'nombre_articles')
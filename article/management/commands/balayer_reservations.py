@@ -0,0 +1,74 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from article.models import ReservationStock
+from article.reservations import balayer, reconcilier
+
+
+class Command(BaseCommand):
+    help = (
+        "Libère les réservations de stock expirées ou dont la commande n'est plus en confirmation, "
+        "puis recalcule les compteurs de stock réservé qui ont dérivé. En continu avec --boucle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help='Processus permanent : balaie les réservations toutes les --intervalle secondes',
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=60,
+            help='Secondes entre deux balayages en mode boucle (défaut: 60)',
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=1000,
+            help='Nombre maximum de réservations libérées par transaction (défaut: 1000)',
+        )
+        parser.add_argument(
+            '--purger-jours',
+            type=int,
+            default=30,
+            help='Supprime les réservations closes plus anciennes que ce nombre de jours (défaut: 30, 0 pour désactiver)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                self.balayer(options['limite'], options['purger_jours'])
+            except Exception as e:
+                if not options['boucle']:
+                    raise
+                # Ne pas arrêter le processus sur une erreur ponctuelle (base indisponible, ...)
+                self.stdout.write(self.style.ERROR(f'❌ Erreur lors du balayage des réservations: {str(e)}'))
+
+            if not options['boucle']:
+                return
+            time.sleep(max(1, options['intervalle']))
+
+    def balayer(self, limite, purger_jours):
+        liberees = 0
+        while True:
+            lot = balayer(limite=max(1, limite))
+            liberees += lot
+            if lot < limite:
+                break
+        corrigees = reconcilier()
+
+        if purger_jours:
+            seuil = timezone.now() - timedelta(days=purger_jours)
+            ReservationStock.objects.exclude(statut='active').filter(date_fin__lt=seuil).delete()
+
+        if liberees or corrigees:
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ {liberees} réservation(s) libérée(s), {corrigees} compteur(s) de stock réservé corrigé(s)'
+            ))
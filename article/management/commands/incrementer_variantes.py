@@ -3,6 +3,7 @@ import os
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.utils import timezone
+from article import stock
 from article.models import Article, VarianteArticle, Couleur, Pointure, Categorie, Genre
 from decimal import Decimal
 
@@ -272,8 +273,9 @@ class Command(BaseCommand):
                     if variante_existante:
                         if force:
                             if not dry_run:
-                                variante_existante.qte_disponible += quantite
-                                variante_existante.save()
+                                stock.appliquer([stock.Mouvement(
+                                    variante_existante, quantite, 'entree', 'Incrémentation par import de variantes'
+                                )])
                             stats['variantes_incrementees'] += 1
                             self.stdout.write(
                                 f'    VARIANTE INCRÉMENTÉE: {couleur_nom} - {pointure_nom} (+{quantite})'
@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from article.promotions import rafraichir_articles, rafraichir_echus
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule le prix actuel des articles dont une promotion commence ou se termine "
+        "(prix_valide_jusqu_au atteinte). En continu avec --boucle, ou pour tout le catalogue avec --tout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help='Processus permanent : vérifie les bornes de promotion toutes les --intervalle secondes',
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=60,
+            help='Secondes entre deux vérifications en mode boucle (défaut: 60)',
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=1000,
+            help="Nombre maximum d'articles recalculés par lot (défaut: 1000)",
+        )
+        parser.add_argument(
+            '--tout',
+            action='store_true',
+            help='Recalcule tous les articles (reprise après une modification hors application)',
+        )
+
+    def handle(self, *args, **options):
+        if options['tout']:
+            modifies = rafraichir_articles(taille_lot=max(1, options['limite']))
+            self.stdout.write(self.style.SUCCESS(f'✅ {modifies} article(s) mis à jour'))
+            return
+
+        while True:
+            close_old_connections()
+            try:
+                self.rafraichir(max(1, options['limite']))
+            except Exception as e:
+                if not options['boucle']:
+                    raise
+                # Ne pas arrêter le processus sur une erreur ponctuelle (base indisponible, ...)
+                self.stdout.write(self.style.ERROR(f'❌ Erreur lors du recalcul des prix: {str(e)}'))
+
+            if not options['boucle']:
+                return
+            time.sleep(max(1, options['intervalle']))
+
+    def rafraichir(self, limite):
+        examines = modifies = 0
+        while True:
+            lot, lot_modifies = rafraichir_echus(limite=limite)
+            examines += lot
+            modifies += lot_modifies
+            # Un lot sans modification ne ferait que se répéter (borne atteinte à l'instant même)
+            if lot < limite or not lot_modifies:
+                break
+
+        if examines:
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ {examines} article(s) à une borne de promotion, {modifies} prix mis à jour'
+            ))
@@ -6,6 +6,7 @@ from article.models import Article, Categorie, Genre, Pointure, Couleur, Variant
 from commande.models import Commande, Panier, EtatCommande, Operation, EnumEtatCmd
 from client.models import Client
 from parametre.models import Operateur, Ville, Region
+from parametre.operateurs import invalider as invalider_profils_operateurs
 from kpis.models import KPIConfiguration
 
 
@@ -273,6 +274,8 @@ class Command(BaseCommand):
             
             # Désactiver les opérateurs
             count = Operateur.objects.filter(actif=True).update(actif=False)
+            # UPDATE sans signaux : oublier les profils en cache
+            invalider_profils_operateurs(*Operateur.objects.values_list('user_id', flat=True))
             self.stdout.write(f'   - {count} opérateurs désactivés')
             
             # Désactiver les clients
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0005_article_prix_remise_1_article_prix_remise_2_and_more'),
+        ('commande', '0026_etiquette_job'),
+        ('parametre', '0005_export_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variantearticle',
+            name='qte_reservee',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='variantearticle',
+            name='qte_vendable',
+            field=models.GeneratedField(db_persist=True, expression=models.F('qte_disponible') - models.F('qte_reservee'), output_field=models.IntegerField()),
+        ),
+        migrations.CreateModel(
+            name='ReservationStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantite', models.PositiveIntegerField()),
+                ('statut', models.CharField(choices=[('active', 'Active'), ('consommee', 'Consommée'), ('liberee', 'Libérée'), ('expiree', 'Expirée')], default='active', max_length=10)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_expiration', models.DateTimeField()),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+                ('commande', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations_stock', to='commande.commande')),
+                ('operateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='parametre.operateur')),
+                ('panier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations_stock', to='commande.panier')),
+                ('variante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='article.variantearticle')),
+            ],
+            options={
+                'verbose_name': 'Réservation de stock',
+                'verbose_name_plural': 'Réservations de stock',
+                'ordering': ['-date_creation'],
+                'indexes': [models.Index(fields=['commande', 'statut'], name='resa_commande_statut_idx'), models.Index(condition=models.Q(('statut', 'active')), fields=['date_expiration'], name='resa_active_expiration_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:20
+
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def initialiser_prix_promotions(apps, schema_editor):
+    """Renseigne promotion_active et prix_valide_jusqu_au pour les articles ayant des promotions"""
+    Article = apps.get_model('article', 'Article')
+    Promotion = apps.get_model('article', 'Promotion')
+    maintenant = timezone.now()
+
+    promotions = defaultdict(list)
+    for article_id, *promotion in Promotion.articles.through.objects.filter(
+        promotion__active=True, promotion__date_fin__gte=maintenant
+    ).values_list('article_id', 'promotion_id', 'promotion__pourcentage_reduction',
+                  'promotion__date_debut', 'promotion__date_fin'):
+        promotions[article_id].append(tuple(promotion))
+
+    a_ecrire = []
+    for article in Article.objects.filter(pk__in=list(promotions)):
+        en_cours = sorted(p for p in promotions[article.pk] if p[2] <= maintenant <= p[3])
+        meilleure = max(en_cours, key=lambda p: p[1], default=None)
+        bornes = [p[3] for p in en_cours] + [p[2] for p in promotions[article.pk] if p[2] > maintenant]
+        article.prix_valide_jusqu_au = min(bornes, default=None)
+        if meilleure:
+            article.promotion_active_id = meilleure[0]
+            prix = article.prix_unitaire - article.prix_unitaire * (meilleure[1] / 100)
+            article.prix_actuel = Decimal(str(prix)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        a_ecrire.append(article)
+    Article.objects.bulk_update(a_ecrire, ['prix_actuel', 'promotion_active', 'prix_valide_jusqu_au'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0006_reservation_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='promotion_active',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='article.promotion', verbose_name='Promotion appliquée'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='prix_valide_jusqu_au',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Prochaine borne de promotion à laquelle le prix actuel doit être recalculé', null=True, verbose_name="Prix valide jusqu'au"),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('prix_valide_jusqu_au__isnull', False)), fields=['prix_valide_jusqu_au'], name='article_prix_echeance_idx'),
+        ),
+        migrations.RunPython(initialiser_prix_promotions, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 from decimal import Decimal, ROUND_HALF_UP
@@ -131,6 +131,14 @@ class VarianteArticle(models.Model):
     couleur = models.ForeignKey(Couleur, on_delete=models.CASCADE,null=True, blank=True)
     pointure = models.ForeignKey(Pointure, on_delete=models.CASCADE,null=True, blank=True)
     qte_disponible = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Quantité retenue par les commandes en cours de confirmation (voir article/reservations.py)
+    qte_reservee = models.IntegerField(default=0, editable=False)
+    # Disponible à la vente : stock physique moins les réservations, calculé par la base
+    qte_vendable = models.GeneratedField(
+        expression=models.F('qte_disponible') - models.F('qte_reservee'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
     actif = models.BooleanField(default=True)
     date_creation = models.DateTimeField(default=timezone.now, editable=False)
     date_modification = models.DateTimeField(auto_now=True)
@@ -149,6 +157,13 @@ class VarianteArticle(models.Model):
         super().clean()
     
     def save(self, *args, **kwargs):
+        # qte_reservee n'est écrite que par article/reservations.py (UPDATE incrémental) :
+        # une instance lue avant une réservation ne doit pas écraser le compteur
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                champ.name for champ in self._meta.concrete_fields
+                if not champ.primary_key and not champ.generated and champ.name != 'qte_reservee'
+            ]
         super().save(*args, **kwargs)
 
     def generer_reference_variante_automatique(self):
@@ -227,6 +242,51 @@ class MouvementStock(models.Model):
         return f"{self.article.nom} - {self.get_type_mouvement_display()} - {self.quantite}"
 
 
+class ReservationStock(models.Model):
+    """
+    Réservation de stock d'une ligne de panier pendant la confirmation de sa commande.
+    Les réservations actives sont cumulées dans VarianteArticle.qte_reservee.
+    """
+    STATUT_CHOICES = [
+        ('active', 'Active'),
+        ('consommee', 'Consommée'),
+        ('liberee', 'Libérée'),
+        ('expiree', 'Expirée'),
+    ]
+
+    variante = models.ForeignKey(VarianteArticle, on_delete=models.CASCADE, related_name='reservations')
+    commande = models.ForeignKey('commande.Commande', on_delete=models.CASCADE, related_name='reservations_stock')
+    panier = models.ForeignKey(
+        'commande.Panier',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reservations_stock'
+    )
+    operateur = models.ForeignKey('parametre.Operateur', on_delete=models.SET_NULL, null=True, blank=True)
+    quantite = models.PositiveIntegerField()
+    statut = models.CharField(max_length=10, choices=STATUT_CHOICES, default='active')
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_expiration = models.DateTimeField()
+    date_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Réservation de stock"
+        verbose_name_plural = "Réservations de stock"
+        ordering = ['-date_creation']
+        indexes = [
+            models.Index(fields=['commande', 'statut'], name='resa_commande_statut_idx'),
+            models.Index(
+                fields=['date_expiration'],
+                name='resa_active_expiration_idx',
+                condition=models.Q(statut='active'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Réservation {self.variante_id} x{self.quantite} - Commande {self.commande_id} ({self.statut})"
+
+
 # Garder le modèle Article existant tel quel pour l'instant
 # Nous le modifierons plus tard avec une migration séparée
 class Article(models.Model):
@@ -276,6 +336,16 @@ class Article(models.Model):
     prix_remise_2 = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Prix remise 2")
     prix_remise_3 = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Prix remise 3")
     prix_remise_4 = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Prix remise 4")
+
+    # Promotion appliquée à prix_actuel, tenue à jour par article/promotions.py
+    promotion_active = models.ForeignKey(
+        'Promotion', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name='+', verbose_name="Promotion appliquée"
+    )
+    prix_valide_jusqu_au = models.DateTimeField(
+        null=True, blank=True, editable=False, verbose_name="Prix valide jusqu'au",
+        help_text="Prochaine borne de promotion à laquelle le prix actuel doit être recalculé"
+    )
     class Meta:
         verbose_name = "Article"
         verbose_name_plural = "Articles"
@@ -283,6 +353,12 @@ class Article(models.Model):
         constraints = [
             models.CheckConstraint(check=models.Q(prix_unitaire__gt=0), name='prix_unitaire_positif'),
         ]
+        indexes = [
+            models.Index(
+                fields=['prix_valide_jusqu_au'], name='article_prix_echeance_idx',
+                condition=models.Q(prix_valide_jusqu_au__isnull=False),
+            ),
+        ]
     
 
     def modele_complet(self):
@@ -345,62 +421,43 @@ class Article(models.Model):
         if self.isUpsell and self.should_disable_upsell():
             self.isUpsell = False
         
+        # promotion_active et prix_valide_jusqu_au ne sont écrits que par article/promotions.py :
+        # une instance lue avant un changement de promotion ne doit pas les écraser
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                champ.name for champ in self._meta.concrete_fields
+                if not champ.primary_key and champ.name not in ('promotion_active', 'prix_valide_jusqu_au')
+            ]
         super().save(*args, **kwargs)
     
     @property
     def est_disponible(self):
         return self.qte_disponible > 0 and self.actif
     
+    def _rafraichir_prix(self):
+        """Recalcule le prix promotionnel de l'article et recharge les champs dénormalisés"""
+        from .promotions import CHAMPS_PRIX, rafraichir_articles
+
+        rafraichir_articles([self.pk])
+        self.refresh_from_db(fields=CHAMPS_PRIX)
+
     def update_prix_actuel(self):
         """Met à jour le prix actuel en tenant compte des promotions actives"""
-        now = timezone.now()
-        promotion_active = self.promotions.filter(
-            date_debut__lte=now,
-            date_fin__gte=now,
-            active=True
-        ).order_by('-pourcentage_reduction').first()
-        
-        # Prix actuel = prix unitaire par défaut
-        if self.prix_actuel is None:
-            self.prix_actuel = self.prix_unitaire
-        
-        # Appliquer la réduction si une promotion est active
-        if promotion_active:
-            reduction = self.prix_unitaire * (promotion_active.pourcentage_reduction / 100)
-            nouveau_prix = self.prix_unitaire - reduction
-            # Arrondir à 2 décimales
-            self.prix_actuel = Decimal(str(nouveau_prix)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        else:
-            # Si pas de promotion, le prix actuel revient au prix unitaire
-            self.prix_actuel = self.prix_unitaire
-            
-        self.save(update_fields=['prix_actuel'])
+        self._rafraichir_prix()
     
     def appliquer_promotion(self, promotion):
-        """Applique une promotion spécifique à cet article"""
-        if promotion.est_active and self in promotion.articles.all():
-            reduction = self.prix_unitaire * (promotion.pourcentage_reduction / 100)
-            nouveau_prix = self.prix_unitaire - reduction
-            self.prix_actuel = Decimal(str(nouveau_prix)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            
-            # Désactiver l'upsell automatiquement lors de l'application d'une promotion
-            fields_to_update = ['prix_actuel']
-            if self.isUpsell:
-                self.isUpsell = False
-                fields_to_update.append('isUpsell')
-            
-            self.save(update_fields=fields_to_update)
+        """Applique une promotion spécifique à cet article (la meilleure promotion active l'emporte)"""
+        if promotion.est_active and promotion.articles.filter(pk=self.pk).exists():
+            # Désactive aussi l'upsell, un article en promotion ne peut pas être upsell
+            self._rafraichir_prix()
             return True
         return False
     
     def retirer_promotion(self):
-        """Retire toutes les promotions et remet le prix actuel au prix unitaire"""
-        self.prix_actuel = self.prix_unitaire
-        
+        """Retire les promotions qui ne s'appliquent plus et recalcule le prix actuel"""
         # Note: Ne pas réactiver automatiquement l'upsell car cela doit être fait manuellement
         # L'upsell reste désactivé après une promotion pour éviter les activations non désirées
-        
-        self.save(update_fields=['prix_actuel'])
+        self._rafraichir_prix()
         return True
     
     def get_all_prices(self):
@@ -420,6 +477,10 @@ class Article(models.Model):
     def has_promo_active(self):
         """Retourne True si l'article a au moins une promotion active (non expirée et active=True)"""
         now = timezone.now()
+        if self.prix_valide_jusqu_au is None or now < self.prix_valide_jusqu_au:
+            # Champs dénormalisés à jour : aucune requête
+            return self.promotion_active_id is not None
+        # Borne de promotion dépassée, pas encore traitée par rafraichir_prix_promotions
         return self.promotions.filter(active=True, date_debut__lte=now, date_fin__gte=now).exists()
 
     @property
@@ -566,8 +627,8 @@ class Promotion(models.Model):
         Promotion.objects.filter(id=self.id).update(active=True)
         
         # Appliquer la promotion à tous les articles associés
-        for article in self.articles.all():
-            article.appliquer_promotion(self)
+        from .promotions import rafraichir_promotion
+        rafraichir_promotion(self)
         
         return True
     
@@ -577,20 +638,9 @@ class Promotion(models.Model):
         # Utiliser update() pour éviter de déclencher le signal post_save
         Promotion.objects.filter(id=self.id).update(active=False)
         
-        # Retirer la promotion de tous les articles associés
-        for article in self.articles.all():
-            # Vérifier si l'article n'a pas d'autres promotions actives
-            autres_promotions_actives = article.promotions.filter(
-                active=True,
-                date_debut__lte=timezone.now(),
-                date_fin__gte=timezone.now()
-            ).exclude(id=self.id).exists()
-            
-            if not autres_promotions_actives:
-                article.retirer_promotion()
-            else:
-                # Recalculer le prix avec les autres promotions actives
-                article.update_prix_actuel()
+        # Retirer la promotion de tous les articles associés (les autres promotions actives restent appliquées)
+        from .promotions import rafraichir_promotion
+        rafraichir_promotion(self)
         
         return True
     
@@ -681,12 +731,40 @@ def update_article_prices(sender, instance, created, **kwargs):
     if created:
         now = timezone.now()
         if instance.date_debut <= now <= instance.date_fin:
+            # activer_promotion() met aussi à jour les prix des articles
             instance.activer_promotion()
+            return
     
-    # Pour tous les articles associés à cette promotion
-    for article in instance.articles.all():
-        # Mettre à jour le prix actuel basé sur toutes les promotions actives
-        article.update_prix_actuel()
+    # Mettre à jour en lot le prix actuel des articles associés, basé sur toutes les promotions actives
+    from .promotions import rafraichir_promotion
+    rafraichir_promotion(instance)
+
+
+@receiver(m2m_changed, sender=Promotion.articles.through)
+def update_article_prices_on_articles_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Met à jour les prix des articles ajoutés à une promotion ou retirés"""
+    from .promotions import rafraichir_articles
+
+    if action == 'pre_clear':
+        instance._articles_avant_vidage = (
+            [instance.pk] if reverse else list(instance.articles.values_list('pk', flat=True))
+        )
+    elif action == 'post_clear':
+        rafraichir_articles(getattr(instance, '_articles_avant_vidage', []))
+    elif action in ('post_add', 'post_remove'):
+        rafraichir_articles([instance.pk] if reverse else pk_set or [])
+
+
+@receiver(pre_delete, sender=Promotion)
+def memoriser_articles_promotion(sender, instance, **kwargs):
+    instance._articles_avant_suppression = list(instance.articles.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Promotion)
+def update_article_prices_on_delete(sender, instance, **kwargs):
+    """Recalcule le prix des articles d'une promotion supprimée"""
+    from .promotions import rafraichir_articles
+    rafraichir_articles(getattr(instance, '_articles_avant_suppression', []))
 
 # Signal pour mettre à jour la quantité totale de l'article quand une variante est modifiée
 @receiver(post_save, sender=VarianteArticle)
@@ -0,0 +1,112 @@
+"""
+Prix effectif des articles selon leurs promotions.
+
+Le prix promotionnel est dénormalisé sur l'article :
+  - prix_actuel : prix effectif (prix unitaire moins la meilleure réduction active) ;
+  - promotion_active : la promotion appliquée, ou NULL ;
+  - prix_valide_jusqu_au : prochaine borne de promotion (fin d'une promotion active ou début
+    d'une promotion programmée) à laquelle le prix doit être recalculé, ou NULL si aucune.
+
+Tant que prix_valide_jusqu_au n'est pas atteinte, Article.has_promo_active et prix_actuel se
+lisent sans requête. rafraichir_articles() recalcule un lot d'articles en deux requêtes de
+lecture et un bulk_update ; elle est appelée quand une promotion change (signaux de
+article/models.py) et, aux bornes, par la commande `rafraichir_prix_promotions`.
+"""
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+CHAMPS_PRIX = ['prix_actuel', 'promotion_active', 'prix_valide_jusqu_au', 'isUpsell']
+
+
+def calculer_prix(prix_unitaire, promotions, maintenant):
+    """
+    Prix effectif d'un article à partir de ses promotions actives non expirées,
+    données comme tuples (id, pourcentage_reduction, date_debut, date_fin).
+    Retourne (promotion_id ou None, prix_actuel, prix_valide_jusqu_au).
+    """
+    en_cours = [p for p in promotions if p[2] <= maintenant <= p[3]]
+    # Meilleure réduction, la plus ancienne promotion en cas d'égalité
+    meilleure = max(sorted(en_cours), key=lambda p: p[1], default=None)
+    bornes = [p[3] for p in en_cours] + [p[2] for p in promotions if p[2] > maintenant]
+    echeance = min(bornes, default=None)
+
+    if meilleure is None:
+        return None, prix_unitaire, echeance
+    reduction = prix_unitaire * (meilleure[1] / 100)
+    prix = Decimal(str(prix_unitaire - reduction)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return meilleure[0], prix, echeance
+
+
+def _promotions_par_article(article_ids, maintenant):
+    from .models import Promotion
+
+    lignes = Promotion.articles.through.objects.filter(promotion__active=True, promotion__date_fin__gte=maintenant)
+    if article_ids is not None:
+        lignes = lignes.filter(article_id__in=article_ids)
+    promotions = defaultdict(list)
+    for article_id, *promotion in lignes.values_list(
+        'article_id', 'promotion_id', 'promotion__pourcentage_reduction', 'promotion__date_debut', 'promotion__date_fin'
+    ):
+        promotions[article_id].append(tuple(promotion))
+    return promotions
+
+
+def rafraichir_articles(article_ids=None, maintenant=None, taille_lot=1000):
+    """
+    Recalcule le prix effectif des articles donnés (tous si None) et n'écrit que ceux qui changent.
+    Un article passé en promotion perd son statut upsell, comme Article.appliquer_promotion le faisait.
+    Retourne le nombre d'articles modifiés.
+    """
+    from .models import Article
+
+    maintenant = maintenant or timezone.now()
+    if article_ids is not None:
+        article_ids = set(article_ids)
+        if not article_ids:
+            return 0
+
+    promotions = _promotions_par_article(article_ids, maintenant)
+    articles = Article.objects.only('pk', 'prix_unitaire', *CHAMPS_PRIX).order_by('pk')
+    if article_ids is not None:
+        articles = articles.filter(pk__in=article_ids)
+
+    modifies = 0
+    a_ecrire = []
+    with transaction.atomic():
+        for article in articles.iterator(chunk_size=taille_lot):
+            promotion_id, prix, echeance = calculer_prix(article.prix_unitaire, promotions.get(article.pk, []), maintenant)
+            nouvelles_valeurs = (prix, promotion_id, echeance, article.isUpsell and promotion_id is None)
+            if (article.prix_actuel, article.promotion_active_id, article.prix_valide_jusqu_au, article.isUpsell) == nouvelles_valeurs:
+                continue
+            article.prix_actuel, article.promotion_active_id, article.prix_valide_jusqu_au, article.isUpsell = nouvelles_valeurs
+            a_ecrire.append(article)
+            if len(a_ecrire) >= taille_lot:
+                Article.objects.bulk_update(a_ecrire, CHAMPS_PRIX)
+                modifies += len(a_ecrire)
+                a_ecrire = []
+        if a_ecrire:
+            Article.objects.bulk_update(a_ecrire, CHAMPS_PRIX)
+            modifies += len(a_ecrire)
+    return modifies
+
+
+def rafraichir_promotion(promotion):
+    """Recalcule les articles d'une promotion (après création, modification ou (dés)activation)"""
+    return rafraichir_articles(promotion.articles.values_list('pk', flat=True))
+
+
+def articles_echus(maintenant=None):
+    """Articles dont le prix a atteint une borne de promotion"""
+    from .models import Article
+
+    return Article.objects.filter(prix_valide_jusqu_au__lte=maintenant or timezone.now())
+
+
+def rafraichir_echus(maintenant=None, limite=1000):
+    """Recalcule un lot d'articles échus. Retourne (articles examinés, articles modifiés)"""
+    maintenant = maintenant or timezone.now()
+    lot = list(articles_echus(maintenant).order_by('prix_valide_jusqu_au').values_list('pk', flat=True)[:limite])
+    return len(lot), rafraichir_articles(lot, maintenant)
@@ -0,0 +1,186 @@
+"""
+Réservations de stock des commandes en cours de confirmation.
+
+Tant qu'un opérateur confirme une commande, chaque ligne de panier retient sa quantité
+par une ReservationStock active. Le total des réservations actives d'une variante est
+tenu à jour de façon incrémentale dans VarianteArticle.qte_reservee (UPDATE ... F() + delta),
+et la base calcule qte_vendable = qte_disponible - qte_reservee : les sélecteurs d'articles
+lisent ce seul chiffre, sans agrégat sur les commandes en cours.
+
+Cycle de vie :
+  - synchroniser_commande() aligne les réservations sur le panier (lancement de la
+    confirmation, modification du panier) ; hors confirmation, elle les libère ;
+  - consommer_commande() les clôt à la confirmation, dans la même transaction que la
+    sortie de stock (article/stock.py) : qte_vendable ne varie pas ;
+  - liberer_commande() les rend à l'annulation ;
+  - balayer() (commande `balayer_reservations`) libère les réservations expirées ou dont
+    la commande a quitté la confirmation, et reconcilier() recalcule les compteurs.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# États de commande pendant lesquels le panier retient son stock
+ETATS_RESERVATION = ('En cours de confirmation',)
+
+
+def duree_reservation():
+    return timedelta(minutes=getattr(settings, 'RESERVATIONS_STOCK_TTL_MINUTES', 120))
+
+
+def _ajuster_compteurs(deltas):
+    """Applique {variante_id: delta} à qte_reservee en un UPDATE (variantes verrouillées dans l'ordre des id)"""
+    from .models import VarianteArticle
+
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    list(VarianteArticle.objects.select_for_update().filter(pk__in=deltas).order_by('pk').values_list('pk', flat=True))
+    VarianteArticle.objects.filter(pk__in=deltas).update(qte_reservee=F('qte_reservee') + Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    ))
+
+
+def _clore(reservations, statut, maintenant=None):
+    """Clôt des réservations actives (statut final) et retire leurs quantités des compteurs"""
+    from .models import ReservationStock
+
+    if not reservations:
+        return 0
+    deltas = {}
+    for reservation in reservations:
+        deltas[reservation.variante_id] = deltas.get(reservation.variante_id, 0) - reservation.quantite
+    closes = ReservationStock.objects.filter(
+        pk__in=[reservation.pk for reservation in reservations], statut='active'
+    ).update(statut=statut, date_fin=maintenant or timezone.now())
+    _ajuster_compteurs(deltas)
+    return closes
+
+
+def _en_confirmation(commande):
+    return bool(commande.etat_courant_id) and commande.etat_courant.libelle in ETATS_RESERVATION
+
+
+def synchroniser_commande(commande, operateur=None, forcer=False):
+    """
+    Aligne les réservations actives de la commande sur ses paniers et repousse leur expiration.
+    Hors des états de confirmation (sauf `forcer`), toutes les réservations sont libérées.
+    """
+    from commande.models import Panier
+    from .models import ReservationStock
+
+    maintenant = timezone.now()
+    expiration = maintenant + duree_reservation()
+    with transaction.atomic():
+        actives = list(ReservationStock.objects.select_for_update().filter(commande=commande, statut='active'))
+        voulues = {}
+        if forcer or _en_confirmation(commande):
+            voulues = {
+                panier_id: (variante_id, quantite)
+                for panier_id, variante_id, quantite in Panier.objects.filter(
+                    commande=commande, variante__isnull=False, quantite__gt=0
+                ).values_list('pk', 'variante_id', 'quantite')
+            }
+
+        deltas = {}
+        a_liberer = []
+        a_prolonger = []
+        for reservation in actives:
+            voulue = voulues.pop(reservation.panier_id, None)
+            if voulue is None or voulue[0] != reservation.variante_id:
+                a_liberer.append(reservation)
+                if voulue is not None:
+                    voulues[reservation.panier_id] = voulue
+                continue
+            if voulue[1] != reservation.quantite:
+                deltas[reservation.variante_id] = deltas.get(reservation.variante_id, 0) + voulue[1] - reservation.quantite
+                reservation.quantite = voulue[1]
+            reservation.date_expiration = expiration
+            a_prolonger.append(reservation)
+
+        nouvelles = [
+            ReservationStock(
+                variante_id=variante_id,
+                commande=commande,
+                panier_id=panier_id,
+                operateur=operateur,
+                quantite=quantite,
+                date_expiration=expiration,
+            )
+            for panier_id, (variante_id, quantite) in voulues.items()
+        ]
+        for reservation in nouvelles:
+            deltas[reservation.variante_id] = deltas.get(reservation.variante_id, 0) + reservation.quantite
+
+        _clore(a_liberer, 'liberee', maintenant)
+        if a_prolonger:
+            ReservationStock.objects.bulk_update(a_prolonger, ['quantite', 'date_expiration'])
+        if nouvelles:
+            ReservationStock.objects.bulk_create(nouvelles)
+        _ajuster_compteurs(deltas)
+    return len(a_prolonger) + len(nouvelles)
+
+
+def consommer_commande(commande):
+    """Clôt les réservations de la commande confirmée (le stock physique est sorti par ailleurs)"""
+    from .models import ReservationStock
+
+    with transaction.atomic():
+        return _clore(list(ReservationStock.objects.select_for_update().filter(commande=commande, statut='active')), 'consommee')
+
+
+def liberer_commande(commande):
+    """Rend au stock vendable toutes les réservations actives de la commande"""
+    from .models import ReservationStock
+
+    with transaction.atomic():
+        return _clore(list(ReservationStock.objects.select_for_update().filter(commande=commande, statut='active')), 'liberee')
+
+
+def reservations_echues(maintenant=None):
+    """Réservations actives expirées, ou dont la commande n'est plus en confirmation"""
+    from commande.etats import ids_etats
+    from .models import ReservationStock
+
+    maintenant = maintenant or timezone.now()
+    return ReservationStock.objects.filter(statut='active').filter(
+        Q(date_expiration__lte=maintenant)
+        | Q(panier__isnull=True)
+        | Q(commande__etat_courant__isnull=True)
+        | ~Q(commande__etat_courant_id__in=ids_etats(*ETATS_RESERVATION))
+    )
+
+
+def balayer(maintenant=None, limite=1000):
+    """Libère un lot de réservations échues. Retourne le nombre de réservations libérées"""
+    maintenant = maintenant or timezone.now()
+    with transaction.atomic():
+        lot = list(reservations_echues(maintenant).select_for_update(skip_locked=True, of=('self',)).order_by('pk')[:limite])
+        return _clore(lot, 'expiree', maintenant)
+
+
+def reconcilier():
+    """
+    Recalcule qte_reservee à partir des réservations actives, pour les variantes où le compteur
+    a dérivé (suppression de commande en cascade, écriture hors service). Retourne le nombre corrigé.
+    """
+    from .models import ReservationStock, VarianteArticle
+
+    total_actif = Coalesce(Subquery(
+        ReservationStock.objects.filter(variante=OuterRef('pk'), statut='active')
+        .values('variante').annotate(total=Sum('quantite')).values('total')[:1]
+    ), 0)
+    with transaction.atomic():
+        derives = list(
+            VarianteArticle.objects.annotate(total_actif=total_actif)
+            .exclude(qte_reservee=F('total_actif')).values_list('pk', flat=True)
+        )
+        if derives:
+            VarianteArticle.objects.filter(pk__in=derives).update(qte_reservee=total_actif)
+    return len(derives)
@@ -0,0 +1,223 @@
+"""
+Grand livre du stock des variantes (VarianteArticle.qte_disponible).
+
+Toutes les écritures de stock passent par appliquer() : réservations (sorties à la
+confirmation ou à l'ajout d'un article), libérations (annulation, modification du panier),
+retours et ajustements. Pour un lot de mouvements (en pratique : ceux d'une commande) :
+
+  1. les variantes concernées sont verrouillées en une requête, toujours dans l'ordre des
+     identifiants, ce qui évite les interblocages entre deux lots concurrents ;
+  2. le stock est contrôlé avant toute écriture : StockInsuffisant liste toutes les lignes
+     en défaut, rien n'est écrit ;
+  3. les quantités sont modifiées par un seul UPDATE (F('qte_disponible') + delta), jamais
+     par lecture-modification-écriture d'une instance ;
+  4. les MouvementStock sont créés en un seul bulk_create.
+
+Les instances VarianteArticle passées en paramètre ne sont pas rafraîchies : relire
+qte_disponible depuis la base (ou utiliser qte_apres_mouvement des mouvements retournés).
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
+# Types de mouvement qui augmentent le stock (les autres le diminuent)
+TYPES_ENTREE = ('entree', 'ajustement_pos', 'retour_client')
+TYPES_SORTIE = ('sortie', 'ajustement_neg')
+
+
+class StockInsuffisant(ValidationError):
+    """Levée quand au moins une variante n'a pas le stock demandé. `manques` détaille chaque ligne"""
+
+    def __init__(self, manques):
+        self.manques = manques
+        super().__init__("Stock insuffisant : " + ", ".join(
+            f"{m['variante']} (disponible {m['disponible']}, demandé {m['demande']})" for m in manques
+        ))
+
+
+@dataclass
+class Mouvement:
+    """Une ligne du lot : `quantite` est signée (positive = entrée, négative = sortie)"""
+    variante: object
+    quantite: int
+    type_mouvement: str
+    commentaire: Optional[str] = None
+
+
+def signer(quantite, type_mouvement):
+    """Quantité signée selon le type de mouvement"""
+    quantite = abs(int(quantite))
+    if type_mouvement in TYPES_ENTREE:
+        return quantite
+    if type_mouvement in TYPES_SORTIE:
+        return -quantite
+    raise ValidationError(f"Type de mouvement inconnu : {type_mouvement}")
+
+
+def appliquer(mouvements, commande=None, operateur=None, controle=True, reservations=False):
+    """
+    Applique un lot de mouvements de façon atomique et retourne les MouvementStock créés.
+
+    controle=True : lève StockInsuffisant si une sortie rendrait une variante négative.
+    controle=False : le stock est borné à 0 (comportement historique de la confirmation).
+    reservations=True : le contrôle porte sur le stock vendable (hors réservations des autres
+    commandes, voir article/reservations.py) plutôt que sur le stock physique.
+    Les mouvements de quantité nulle sont seulement tracés.
+    """
+    from .models import MouvementStock, VarianteArticle
+
+    mouvements = [m for m in mouvements if m.variante is not None]
+    if not mouvements:
+        return []
+
+    deltas = {}
+    for mouvement in mouvements:
+        deltas[mouvement.variante.pk] = deltas.get(mouvement.variante.pk, 0) + int(mouvement.quantite)
+
+    with transaction.atomic():
+        etats = {}
+        reservees = {}
+        for pk, article_id, qte, qte_reservee in VarianteArticle.objects.select_for_update().filter(
+            pk__in=deltas
+        ).order_by('pk').values_list('pk', 'article_id', 'qte_disponible', 'qte_reservee'):
+            etats[pk] = (article_id, qte)
+            reservees[pk] = qte_reservee if reservations else 0
+        manquantes = set(deltas) - set(etats)
+        if manquantes:
+            raise VarianteArticle.DoesNotExist(f"Variantes introuvables : {sorted(manquantes)}")
+
+        if controle:
+            manques = [
+                {
+                    'variante': next(m.variante for m in mouvements if m.variante.pk == pk),
+                    'variante_id': pk,
+                    'disponible': max(0, etats[pk][1] - reservees[pk]),
+                    'demande': -delta,
+                }
+                for pk, delta in deltas.items() if delta < 0 and etats[pk][1] - reservees[pk] + delta < 0
+            ]
+            if manques:
+                raise StockInsuffisant(manques)
+
+        a_modifier = {pk: delta for pk, delta in deltas.items() if delta}
+        if a_modifier:
+            increment = Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in a_modifier.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            nouvelle_valeur = F('qte_disponible') + increment
+            if not controle:
+                nouvelle_valeur = Greatest(nouvelle_valeur, Value(0))
+            VarianteArticle.objects.filter(pk__in=a_modifier).update(qte_disponible=nouvelle_valeur)
+
+        # Quantité après chaque mouvement, dans l'ordre du lot
+        courantes = {pk: qte for pk, (_, qte) in etats.items()}
+        lignes = []
+        for mouvement in mouvements:
+            pk = mouvement.variante.pk
+            courantes[pk] += int(mouvement.quantite)
+            if not controle:
+                courantes[pk] = max(0, courantes[pk])
+            lignes.append(MouvementStock(
+                article_id=etats[pk][0],
+                variante_id=pk,
+                type_mouvement=mouvement.type_mouvement,
+                quantite=int(mouvement.quantite),
+                qte_apres_mouvement=courantes[pk],
+                commentaire=mouvement.commentaire,
+                commande_associee=commande,
+                operateur=operateur,
+            ))
+        return MouvementStock.objects.bulk_create(lignes)
+
+
+def _lot(lignes, type_mouvement, commentaire):
+    return [
+        Mouvement(variante, signer(quantite, type_mouvement), type_mouvement, commentaire)
+        for variante, quantite in lignes
+    ]
+
+
+def reserver(lignes, commande=None, operateur=None, commentaire=None, controle=True, reservations=False):
+    """Sortie de stock de lignes (variante, quantité), par exemple les paniers d'une commande"""
+    return appliquer(_lot(lignes, 'sortie', commentaire), commande, operateur, controle, reservations)
+
+
+def liberer(lignes, commande=None, operateur=None, commentaire=None):
+    """Remise en stock de lignes (variante, quantité) précédemment réservées"""
+    return appliquer(_lot(lignes, 'entree', commentaire), commande, operateur)
+
+
+def retourner(lignes, commande=None, operateur=None, commentaire=None):
+    """Réintégration de produits retournés par le client"""
+    return appliquer(_lot(lignes, 'retour_client', commentaire), commande, operateur)
+
+
+def ajuster(variante, difference, commande=None, operateur=None, commentaire=None, controle=True):
+    """Ajustement d'une variante : difference > 0 sort du stock (quantité commandée augmentée), < 0 y remet"""
+    if not difference:
+        return []
+    type_mouvement = 'sortie' if difference > 0 else 'entree'
+    return appliquer(
+        [Mouvement(variante, -int(difference), type_mouvement, commentaire)], commande, operateur, controle
+    )
+
+
+def lignes_paniers(paniers):
+    """Lignes (variante, quantité) des paniers qui ont une variante"""
+    return [(panier.variante, panier.quantite) for panier in paniers if panier.variante_id]
+
+
+def variante_par_defaut(article):
+    """Variante « Standard / Unique » créée pour un article qui n'en a aucune"""
+    from .models import Couleur, Pointure, VarianteArticle
+
+    couleur_defaut, _ = Couleur.objects.get_or_create(nom="Standard", defaults={'actif': True})
+    pointure_defaut, _ = Pointure.objects.get_or_create(pointure="Unique", defaults={'actif': True})
+    return VarianteArticle.objects.create(
+        article=article,
+        couleur=couleur_defaut,
+        pointure=pointure_defaut,
+        qte_disponible=0,
+        actif=True,
+    )
+
+
+def mouvement_article(article, quantite, type_mouvement, operateur=None, commande=None, commentaire=None, variante=None):
+    """
+    Mouvement sur une variante donnée, ou sur l'article entier : une entrée va à la variante
+    active la plus stockée, une sortie est répartie sur les variantes actives en commençant
+    par les plus stockées. Retourne le dernier MouvementStock créé.
+    """
+    from .models import VarianteArticle
+
+    quantite_signee = signer(quantite, type_mouvement)
+    with transaction.atomic():
+        if variante:
+            mouvements = [Mouvement(variante, quantite_signee, type_mouvement, commentaire)]
+        else:
+            variantes = list(
+                VarianteArticle.objects.filter(article=article, actif=True).order_by('-qte_disponible', 'pk')
+            ) or [variante_par_defaut(article)]
+            if quantite_signee >= 0:
+                mouvements = [Mouvement(variantes[0], quantite_signee, type_mouvement, commentaire)]
+            else:
+                mouvements = []
+                reste = -quantite_signee
+                for candidate in variantes:
+                    retrait = min(candidate.qte_disponible, reste)
+                    if retrait:
+                        mouvements.append(Mouvement(candidate, -retrait, type_mouvement, commentaire))
+                        reste -= retrait
+                    if not reste:
+                        break
+                if reste:
+                    # Répartition impossible : laisser le contrôle lever StockInsuffisant
+                    mouvements = [Mouvement(variantes[0], quantite_signee, type_mouvement, commentaire)]
+        crees = appliquer(mouvements, commande, operateur)
+    return crees[-1] if crees else None
@@ -1,3 +1,257 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from article import promotions, reservations, stock
+from article.models import (
+    Article, Categorie, Couleur, MouvementStock, Pointure, Promotion, ReservationStock, VarianteArticle,
+)
+from client.models import Client
+from commande.models import Commande, EnumEtatCmd, EtatCommande, Panier
+from parametre.models import Operateur, Region, Ville
+
+
+class StockTestCase(TestCase):
+    """Articles à deux variantes (10 et 4 en stock) et une commande"""
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom_region='Centre')
+        cls.ville = Ville.objects.create(nom='Casablanca', frais_livraison=30, region=region)
+        cls.client_test = Client.objects.create(nom='Alami', prenom='Sara', numero_tel='0612345678')
+        cls.operateur = Operateur.objects.create(
+            user=User.objects.create(username='confirmation'), nom='Op', prenom='Test', mail='op@test.ma',
+            type_operateur='CONFIRMATION',
+        )
+        categorie = Categorie.objects.create(nom='SANDALES')
+        cls.article = Article.objects.create(nom='Sandale', reference='SAN-1', prix_unitaire=200, categorie=categorie)
+        cls.v1 = VarianteArticle.objects.create(
+            article=cls.article, couleur=Couleur.objects.create(nom='Noir'),
+            pointure=Pointure.objects.create(pointure='38'), qte_disponible=10,
+        )
+        cls.v2 = VarianteArticle.objects.create(
+            article=cls.article, couleur=Couleur.objects.create(nom='Blanc'),
+            pointure=Pointure.objects.create(pointure='39'), qte_disponible=4,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def stock(self, variante):
+        return VarianteArticle.objects.values_list('qte_disponible', flat=True).get(pk=variante.pk)
+
+    def commande(self, *lignes):
+        commande = Commande.objects.create(client=self.client_test, ville=self.ville, adresse='Rue 1', total_cmd=0)
+        for variante, quantite in lignes:
+            Panier.objects.create(
+                commande=commande, article=variante.article, variante=variante, quantite=quantite,
+                sous_total=200 * quantite,
+            )
+        return commande
+
+
+class StockTests(StockTestCase):
+
+    def test_reserver_sort_le_stock_et_trace_les_mouvements(self):
+        commande = self.commande((self.v1, 3), (self.v2, 1))
+        mouvements = stock.reserver(stock.lignes_paniers(commande.paniers.all()), commande=commande, operateur=self.operateur)
+
+        self.assertEqual((self.stock(self.v1), self.stock(self.v2)), (7, 3))
+        self.assertEqual([m.qte_apres_mouvement for m in mouvements], [7, 3])
+        self.assertEqual([m.quantite for m in mouvements], [-3, -1])
+        self.assertEqual(MouvementStock.objects.filter(commande_associee=commande, type_mouvement='sortie').count(), 2)
+
+    def test_stock_insuffisant_n_ecrit_rien(self):
+        with self.assertRaises(stock.StockInsuffisant) as erreur:
+            stock.reserver([(self.v1, 2), (self.v2, 5)])
+
+        self.assertEqual([(m['variante_id'], m['disponible'], m['demande']) for m in erreur.exception.manques], [(self.v2.pk, 4, 5)])
+        self.assertEqual((self.stock(self.v1), self.stock(self.v2)), (10, 4))
+        self.assertFalse(MouvementStock.objects.exists())
+
+    def test_mouvements_cumules_par_variante(self):
+        # Deux lignes de la même variante : contrôlées ensemble, quantité après chaque mouvement
+        with self.assertRaises(stock.StockInsuffisant):
+            stock.reserver([(self.v2, 3), (self.v2, 2)])
+
+        mouvements = stock.reserver([(self.v1, 3), (self.v1, 2)])
+        self.assertEqual([m.qte_apres_mouvement for m in mouvements], [7, 5])
+        self.assertEqual(self.stock(self.v1), 5)
+
+    def test_sans_controle_le_stock_est_borne_a_zero(self):
+        stock.appliquer([stock.Mouvement(self.v2, -6, 'sortie')], controle=False)
+
+        self.assertEqual(self.stock(self.v2), 0)
+
+    def test_liberer_et_ajuster(self):
+        stock.reserver([(self.v1, 5)])
+        stock.liberer([(self.v1, 2)])
+        self.assertEqual(self.stock(self.v1), 7)
+
+        # Quantité commandée augmentée de 3 puis diminuée de 1
+        stock.ajuster(self.v1, 3)
+        stock.ajuster(self.v1, -1)
+        self.assertEqual(self.stock(self.v1), 5)
+        self.assertEqual(stock.ajuster(self.v1, 0), [])
+
+    def test_type_de_mouvement_inconnu(self):
+        with self.assertRaises(stock.ValidationError):
+            stock.signer(1, 'transfert')
+
+    def test_sortie_article_repartie_sur_les_variantes(self):
+        dernier = stock.mouvement_article(self.article, 12, 'sortie', operateur=self.operateur)
+
+        # La variante la plus stockée d'abord, le reste sur la suivante
+        self.assertEqual((self.stock(self.v1), self.stock(self.v2)), (0, 2))
+        self.assertEqual(dernier.variante_id, self.v2.pk)
+        self.assertEqual(dernier.qte_apres_mouvement, 2)
+
+        with self.assertRaises(stock.StockInsuffisant):
+            stock.mouvement_article(self.article, 3, 'sortie')
+
+
+class ReservationsTests(StockTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.en_confirmation = EnumEtatCmd.objects.create(libelle='En cours de confirmation', ordre=3)
+        cls.confirmee = EnumEtatCmd.objects.create(libelle='Confirmée', ordre=4)
+
+    def en_cours(self, *lignes):
+        commande = self.commande(*lignes)
+        EtatCommande.objects.create(commande=commande, enum_etat=self.en_confirmation, operateur=self.operateur)
+        return Commande.objects.get(pk=commande.pk)
+
+    def compteurs(self, variante):
+        return VarianteArticle.objects.values_list('qte_disponible', 'qte_reservee', 'qte_vendable').get(pk=variante.pk)
+
+    def test_synchroniser_reserve_le_panier(self):
+        commande = self.en_cours((self.v1, 3), (self.v2, 1))
+        reservations.synchroniser_commande(commande, self.operateur)
+
+        self.assertEqual(self.compteurs(self.v1), (10, 3, 7))
+        self.assertEqual(self.compteurs(self.v2), (4, 1, 3))
+
+        # Quantité modifiée : la réservation suit, sans doublon
+        Panier.objects.filter(commande=commande, variante=self.v1).update(quantite=5)
+        reservations.synchroniser_commande(commande, self.operateur)
+        self.assertEqual(self.compteurs(self.v1), (10, 5, 5))
+        self.assertEqual(ReservationStock.objects.filter(commande=commande, statut='active').count(), 2)
+
+    def test_hors_confirmation_les_reservations_sont_liberees(self):
+        commande = self.en_cours((self.v1, 3))
+        reservations.synchroniser_commande(commande)
+        EtatCommande.objects.filter(commande=commande).update(date_fin=timezone.now())
+        EtatCommande.objects.create(commande=commande, enum_etat=self.confirmee, operateur=self.operateur)
+
+        reservations.synchroniser_commande(Commande.objects.get(pk=commande.pk))
+        self.assertEqual(self.compteurs(self.v1), (10, 0, 10))
+        self.assertEqual(ReservationStock.objects.get(commande=commande).statut, 'liberee')
+
+    def test_confirmation_consomme_sans_changer_le_vendable(self):
+        commande = self.en_cours((self.v2, 3))
+        autre = self.en_cours((self.v2, 1))
+        reservations.synchroniser_commande(commande)
+        reservations.synchroniser_commande(autre)
+        self.assertEqual(self.compteurs(self.v2), (4, 4, 0))
+
+        reservations.consommer_commande(commande)
+        stock.reserver([(self.v2, 3)], commande=commande, reservations=True)
+        self.assertEqual(self.compteurs(self.v2), (1, 1, 0))
+
+        # Le stock retenu par l'autre commande n'est pas vendable
+        with self.assertRaises(stock.StockInsuffisant):
+            stock.reserver([(self.v2, 1)], reservations=True)
+
+    def test_une_instance_perimee_n_ecrase_pas_le_compteur(self):
+        variante = VarianteArticle.objects.get(pk=self.v1.pk)
+        reservations.synchroniser_commande(self.en_cours((self.v1, 2)))
+        variante.qte_disponible = 12
+        variante.save()
+
+        self.assertEqual(self.compteurs(self.v1), (12, 2, 10))
+
+    def test_balayer_libere_les_reservations_expirees(self):
+        commande = self.en_cours((self.v1, 3))
+        reservations.synchroniser_commande(commande)
+        reservations.synchroniser_commande(self.en_cours((self.v1, 1)))
+        ReservationStock.objects.filter(commande=commande).update(date_expiration=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(reservations.balayer(), 1)
+        self.assertEqual(ReservationStock.objects.get(commande=commande).statut, 'expiree')
+        self.assertEqual(self.compteurs(self.v1), (10, 1, 9))
+
+    def test_reconcilier_corrige_un_compteur_derive(self):
+        reservations.synchroniser_commande(self.en_cours((self.v1, 2)))
+        VarianteArticle.objects.filter(pk=self.v1.pk).update(qte_reservee=9)
+        VarianteArticle.objects.filter(pk=self.v2.pk).update(qte_reservee=1)
+
+        self.assertEqual(reservations.reconcilier(), 2)
+        self.assertEqual(self.compteurs(self.v1)[1], 2)
+        self.assertEqual(self.compteurs(self.v2)[1], 0)
+        self.assertEqual(reservations.reconcilier(), 0)
+
+
+class CalculerPrixTests(SimpleTestCase):
+
+    def setUp(self):
+        self.maintenant = timezone.now()
+
+    def promotion(self, id, pourcentage, debut, fin):
+        return (id, Decimal(pourcentage), self.maintenant + timedelta(days=debut), self.maintenant + timedelta(days=fin))
+
+    def test_meilleure_reduction_et_prochaine_borne(self):
+        promotions_article = [
+            self.promotion(1, 10, -5, 10), self.promotion(2, 25, -1, 3), self.promotion(3, 50, 2, 8),
+        ]
+        promotion_id, prix, echeance = promotions.calculer_prix(Decimal('199.99'), promotions_article, self.maintenant)
+
+        self.assertEqual((promotion_id, prix), (2, Decimal('149.99')))
+        # Le début de la promotion programmée arrive avant la fin des promotions en cours
+        self.assertEqual(echeance, self.maintenant + timedelta(days=2))
+
+    def test_egalite_et_absence_de_promotion(self):
+        egales = [self.promotion(4, 20, -1, 5), self.promotion(3, 20, -2, 5)]
+        self.assertEqual(promotions.calculer_prix(Decimal('100'), egales, self.maintenant)[0], 3)
+        self.assertEqual(promotions.calculer_prix(Decimal('100'), [], self.maintenant), (None, Decimal('100'), None))
+
+
+class PromotionsTests(StockTestCase):
+
+    def promotion(self, pourcentage, debut, fin, *articles):
+        maintenant = timezone.now()
+        promotion = Promotion.objects.create(
+            nom=f'Promo {pourcentage}', pourcentage_reduction=pourcentage,
+            date_debut=maintenant + timedelta(days=debut), date_fin=maintenant + timedelta(days=fin),
+        )
+        promotion.articles.add(*articles)
+        return promotion
+
+    def prix(self):
+        return Article.objects.values_list('prix_actuel', 'promotion_active', 'isUpsell').get(pk=self.article.pk)
+
+    def test_prix_denormalise_suit_les_promotions(self):
+        Article.objects.filter(pk=self.article.pk).update(isUpsell=True)
+        promotion = self.promotion(25, -1, 10, self.article)
+        self.assertEqual(self.prix(), (Decimal('150.00'), promotion.pk, False))
+
+        promotion.active = False
+        promotion.save()
+        self.assertEqual(self.prix(), (Decimal('200.00'), None, False))
+
+    def test_bornes_traitees_par_rafraichir_echus(self):
+        promotion = self.promotion(10, 1, 5, self.article)
+        self.assertEqual(self.prix()[:2], (Decimal('200.00'), None))
+        self.assertEqual(promotions.rafraichir_echus(), (0, 0))
+
+        # Début de la promotion atteint, puis sa fin
+        self.assertEqual(promotions.rafraichir_echus(timezone.now() + timedelta(days=2)), (1, 1))
+        self.assertEqual(self.prix()[:2], (Decimal('180.00'), promotion.pk))
+        self.assertEqual(promotions.rafraichir_echus(timezone.now() + timedelta(days=6)), (1, 1))
+        self.assertEqual(self.prix()[:2], (Decimal('200.00'), None))
+        self.assertFalse(promotions.articles_echus(timezone.now() + timedelta(days=30)).exists())
@@ -1283,53 +1283,23 @@ def modifier_promotion(request, id):
     
     if request.method == 'POST':
         # Conserver les anciens articles pour comparaison
-        anciens_articles = list(promotion.articles.all())
+        anciens_articles = set(promotion.articles.values_list('pk', flat=True))
         
         form = PromotionForm(request.POST, instance=promotion)
         if form.is_valid():
             promotion_modifiee = form.save()
             
-            # Récupérer les nouveaux articles
-            nouveaux_articles = list(promotion_modifiee.articles.all())
+            # Recalculer en lot le prix des anciens et des nouveaux articles
+            # (les autres promotions actives de chaque article restent appliquées)
+            from article.promotions import rafraichir_articles
+            rafraichir_articles(anciens_articles | set(promotion_modifiee.articles.values_list('pk', flat=True)))
             
             # Vérifier si la promotion doit être active
             now = timezone.now()
             if promotion_modifiee.active and promotion_modifiee.date_debut <= now <= promotion_modifiee.date_fin:
-                # Retirer la promotion des anciens articles qui ne sont plus dans la promotion
-                for article in anciens_articles:
-                    if article not in nouveaux_articles:
-                        # Vérifier si l'article n'a pas d'autres promotions actives
-                        autres_promotions_actives = article.promotions.filter(
-                            active=True,
-                            date_debut__lte=now,
-                            date_fin__gte=now
-                        ).exclude(id=promotion_modifiee.id).exists()
-                        
-                        if not autres_promotions_actives:
-                            article.retirer_promotion()
-                        else:
-                            article.update_prix_actuel()
-                
-                # Appliquer la promotion aux nouveaux articles
-                for article in nouveaux_articles:
-                    article.appliquer_promotion(promotion_modifiee)
-                
                 messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès. Les prix ont été mis à jour.")
             else:
-                # Si la promotion n'est pas active, retirer la promotion de tous les anciens articles
-                for article in anciens_articles:
-                    autres_promotions_actives = article.promotions.filter(
-                        active=True,
-                        date_debut__lte=now,
-                        date_fin__gte=now
-                    ).exclude(id=promotion_modifiee.id).exists()
-                    
-                    if not autres_promotions_actives:
-                        article.retirer_promotion()
-                    else:
-                        article.update_prix_actuel()
-                
-            messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès.")
+                messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès.")
             
             return redirect('article:detail_promotion', id=promotion.id)
         else:
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from client.models import Client
+from client.telephone import inverser, normaliser
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule la forme canonique E.164 des numéros de téléphone clients (telephone_e164, "
+        "telephone_inverse) et signale les numéros non reconnus et les clients en double."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=2000,
+            help='Nombre de clients mis à jour par lot (défaut: 2000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Affiche le bilan sans rien modifier',
+        )
+
+    def handle(self, *args, **options):
+        taille_lot = max(1, options['limite'])
+        examines = modifies = non_reconnus = 0
+        lot = []
+
+        for client in Client.objects.only('pk', 'numero_tel', 'telephone_e164', 'telephone_inverse').order_by('pk').iterator(chunk_size=taille_lot):
+            examines += 1
+            e164 = normaliser(client.numero_tel)
+            if e164 is None:
+                non_reconnus += 1
+            if (e164, inverser(e164)) != (client.telephone_e164, client.telephone_inverse):
+                client.telephone_e164, client.telephone_inverse = e164, inverser(e164)
+                lot.append(client)
+            if len(lot) >= taille_lot:
+                modifies += self._ecrire(lot, options['dry_run'])
+                lot = []
+        modifies += self._ecrire(lot, options['dry_run'])
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Mode simulation (dry-run) - Aucune modification effectuée'))
+        self.stdout.write(f'{examines} client(s) examinés, {non_reconnus} numéro(s) non reconnus')
+
+        doublons = Client.objects.filter(telephone_e164__isnull=False).values('telephone_e164').annotate(
+            nombre=Count('id')
+        ).filter(nombre__gt=1).order_by()
+        nb_doublons = doublons.count()
+        if nb_doublons:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ {nb_doublons} numéro(s) partagés par plusieurs clients (saisies différentes du même numéro)'
+            ))
+        self.stdout.write(self.style.SUCCESS(f'✅ {modifies} client(s) mis à jour'))
+
+    def _ecrire(self, lot, dry_run):
+        if not lot:
+            return 0
+        if not dry_run:
+            Client.objects.bulk_update(lot, ['telephone_e164', 'telephone_inverse'])
+        return len(lot)
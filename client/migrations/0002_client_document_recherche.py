@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+def initialiser_documents(apps, schema_editor):
+    """Construit le document de recherche des clients existants (même règle que client.models.document_recherche)"""
+    Client = apps.get_model('client', 'Client')
+    champs = ('nom', 'prenom', 'email', 'numero_tel', 'adresse')
+
+    lot = []
+    for client in Client.objects.only('pk', *champs).iterator(chunk_size=2000):
+        valeurs = (getattr(client, champ) for champ in champs)
+        client.document_recherche = ' '.join(str(v).strip() for v in valeurs if v and str(v).strip()).lower()
+        lot.append(client)
+        if len(lot) >= 2000:
+            Client.objects.bulk_update(lot, ['document_recherche'])
+            lot = []
+    if lot:
+        Client.objects.bulk_update(lot, ['document_recherche'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='document_recherche',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Document de recherche'),
+        ),
+        migrations.RunPython(initialiser_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:40
+
+import re
+
+from django.db import migrations, models
+
+# Copie figée de client.telephone.normaliser / inverser au moment de la migration :
+# les évolutions ultérieures du module ne doivent pas changer ce que la migration écrit.
+INDICATIF_PAYS = '212'
+LONGUEUR_NATIONALE = 9
+
+
+def normaliser(numero):
+    if not numero:
+        return None
+    brut = str(numero).strip()
+    valeur = re.sub(r'\D', '', brut)
+    nationale = len(INDICATIF_PAYS) + LONGUEUR_NATIONALE
+
+    if brut.startswith('+'):
+        international = valeur
+    elif valeur.startswith('00'):
+        international = valeur[2:]
+    elif valeur.startswith(INDICATIF_PAYS + '0') and len(valeur) == nationale + 1:
+        international = INDICATIF_PAYS + valeur[len(INDICATIF_PAYS) + 1:]
+    elif valeur.startswith(INDICATIF_PAYS) and len(valeur) == nationale:
+        international = valeur
+    elif valeur.startswith('0') and len(valeur) == LONGUEUR_NATIONALE + 1:
+        international = INDICATIF_PAYS + valeur[1:]
+    elif len(valeur) == LONGUEUR_NATIONALE:
+        international = INDICATIF_PAYS + valeur
+    elif len(valeur) > LONGUEUR_NATIONALE + 1 and not valeur.startswith('0'):
+        international = valeur
+    else:
+        return None
+
+    if not 8 <= len(international) <= 15:
+        return None
+    return '+' + international
+
+
+def inverser(e164):
+    return e164[1:][::-1] if e164 else None
+
+
+def initialiser_telephones(apps, schema_editor):
+    """Renseigne la forme canonique des numéros existants (voir aussi la commande normaliser_telephones)"""
+    Client = apps.get_model('client', 'Client')
+    lot = []
+    for client in Client.objects.only('pk', 'numero_tel').iterator(chunk_size=2000):
+        client.telephone_e164 = normaliser(client.numero_tel)
+        client.telephone_inverse = inverser(client.telephone_e164)
+        lot.append(client)
+        if len(lot) >= 2000:
+            Client.objects.bulk_update(lot, ['telephone_e164', 'telephone_inverse'])
+            lot = []
+    if lot:
+        Client.objects.bulk_update(lot, ['telephone_e164', 'telephone_inverse'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0002_client_document_recherche'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='telephone_e164',
+            field=models.CharField(blank=True, editable=False, max_length=16, null=True, verbose_name='Téléphone (E.164)'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='telephone_inverse',
+            field=models.CharField(blank=True, editable=False, max_length=15, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['telephone_e164'], name='client_tel_e164_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['telephone_inverse'], name='client_tel_inverse_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(initialiser_telephones, migrations.RunPython.noop),
+    ]
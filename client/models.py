@@ -7,6 +7,14 @@ from parametre.models import Operateur, Ville
 
 # Create your models here.
 
+CHAMPS_DOCUMENT = ('nom', 'prenom', 'email', 'numero_tel', 'adresse')
+
+
+def document_recherche(*valeurs):
+    """Texte indexé par la recherche globale : valeurs renseignées, en minuscules"""
+    return ' '.join(str(valeur).strip() for valeur in valeurs if valeur and str(valeur).strip()).lower()
+
+
 class Client(models.Model):
     """
     Modèle pour les clients
@@ -14,16 +22,45 @@ class Client(models.Model):
     nom = models.CharField(max_length=100, default='', verbose_name="Nom")
     prenom = models.CharField(max_length=100, default='', verbose_name="Prénom")
     numero_tel = models.CharField(max_length=30, unique=True, verbose_name="Numéro de téléphone")
+    # Forme canonique du téléphone et ses chiffres inversés (client/telephone.py), tenus à jour par save()
+    telephone_e164 = models.CharField(max_length=16, null=True, blank=True, editable=False, verbose_name="Téléphone (E.164)")
+    telephone_inverse = models.CharField(max_length=15, null=True, blank=True, editable=False)
     email = models.EmailField(blank=True, null=True, verbose_name="Email")
     adresse = models.TextField(blank=True, null=True, verbose_name="Adresse")
     date_creation = models.DateTimeField(auto_now_add=True, verbose_name="Date de création")
     date_modification = models.DateTimeField(auto_now=True, verbose_name="Dernière modification")
     note = models.TextField(blank=True, null=True, verbose_name="Note")
     is_active = models.BooleanField(default=True, verbose_name="Actif")
+    # Document de la recherche globale (commande/recherche.py), tenu à jour par save()
+    document_recherche = models.TextField(blank=True, default='', editable=False, verbose_name="Document de recherche")
     
     def __str__(self):
         return f"{self.prenom} {self.nom} ({self.numero_tel})"
 
+    def construire_document_recherche(self):
+        return document_recherche(*(getattr(self, champ) for champ in CHAMPS_DOCUMENT))
+
+    def normaliser_telephone(self):
+        from client.telephone import inverser, normaliser
+        self.telephone_e164 = normaliser(self.numero_tel)
+        self.telephone_inverse = inverser(self.telephone_e164)
+
+    def save(self, *args, **kwargs):
+        self.normaliser_telephone()
+        document = self.construire_document_recherche()
+        # Les commandes du client reprennent son document (signal post_save dans commande/models.py)
+        self._document_modifie = document != self.document_recherche
+        self.document_recherche = document
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if 'numero_tel' in update_fields:
+                update_fields |= {'telephone_e164', 'telephone_inverse'}
+            if self._document_modifie:
+                update_fields.add('document_recherche')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
     @property
     def get_full_name(self):
         return f"{self.prenom} {self.nom}".strip()
@@ -32,3 +69,8 @@ class Client(models.Model):
         verbose_name = "Client"
         verbose_name_plural = "Clients"
         ordering = ['-date_creation']
+        indexes = [
+            # varchar_pattern_ops : LIKE 'préfixe%' sous PostgreSQL (ignoré par les autres bases)
+            models.Index(fields=['telephone_e164'], name='client_tel_e164_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['telephone_inverse'], name='client_tel_inverse_idx', opclasses=['varchar_pattern_ops']),
+        ]
@@ -0,0 +1,166 @@
+"""
+Numéros de téléphone des clients : forme canonique et recherche indexée.
+
+numero_tel garde la saisie d'origine (unique). Client.save() en dérive :
+  - telephone_e164 : forme canonique E.164 (+212612345678), None si le numéro n'est pas reconnaissable ;
+  - telephone_inverse : chiffres de telephone_e164 à l'envers (876543216212).
+
+Les deux colonnes sont indexées en btree (varchar_pattern_ops sous PostgreSQL), ce qui sert :
+  - la correspondance exacte, quelle que soit la saisie (06 12 34 56 78, 212612345678, +212...) ;
+  - la recherche par début de numéro (telephone_e164 LIKE '+2126123%') ;
+  - la recherche par fin de numéro, les 8-9 derniers chiffres que les opérateurs tapent le plus
+    souvent (telephone_inverse LIKE '8765%').
+
+Toutes les recherches de client par téléphone (API de confirmation, création de commande,
+liste des clients, détection des doublons à la synchronisation) passent par ce module.
+"""
+import re
+
+from django.db.models import Case, IntegerField, Q, Value, When
+
+INDICATIF_PAYS = '212'
+LONGUEUR_NATIONALE = 9
+LONGUEUR_MIN_RECHERCHE = 3
+
+# Une requête de téléphone ne contient que des chiffres et des séparateurs
+_SAISIE_TELEPHONE = re.compile(r'^\+?[\d\s\-\.\(\)/]+$')
+
+
+def chiffres(numero):
+    return re.sub(r'\D', '', str(numero or ''))
+
+
+def normaliser(numero):
+    """Forme E.164 du numéro (+212612345678), ou None s'il n'est pas reconnaissable"""
+    if not numero:
+        return None
+    brut = str(numero).strip()
+    valeur = chiffres(brut)
+    nationale = len(INDICATIF_PAYS) + LONGUEUR_NATIONALE
+
+    if brut.startswith('+'):
+        international = valeur
+    elif valeur.startswith('00'):
+        international = valeur[2:]
+    elif valeur.startswith(INDICATIF_PAYS + '0') and len(valeur) == nationale + 1:
+        # 2120612345678 : zéro national conservé après l'indicatif
+        international = INDICATIF_PAYS + valeur[len(INDICATIF_PAYS) + 1:]
+    elif valeur.startswith(INDICATIF_PAYS) and len(valeur) == nationale:
+        international = valeur
+    elif valeur.startswith('0') and len(valeur) == LONGUEUR_NATIONALE + 1:
+        international = INDICATIF_PAYS + valeur[1:]
+    elif len(valeur) == LONGUEUR_NATIONALE:
+        international = INDICATIF_PAYS + valeur
+    elif len(valeur) > LONGUEUR_NATIONALE + 1 and not valeur.startswith('0'):
+        # Indicatif étranger saisi sans « + » (la synchronisation retire le +)
+        international = valeur
+    else:
+        return None
+
+    if not 8 <= len(international) <= 15:
+        return None
+    return '+' + international
+
+
+def inverser(e164):
+    """Chiffres du numéro canonique à l'envers (colonne telephone_inverse)"""
+    return e164[1:][::-1] if e164 else None
+
+
+def _prefixe_canonique(valeur, brut):
+    """Début de numéro saisi, ramené au début de la forme E.164"""
+    if brut.startswith('+'):
+        return '+' + valeur
+    if valeur.startswith('00'):
+        return '+' + valeur[2:]
+    if valeur.startswith(INDICATIF_PAYS):
+        return '+' + valeur
+    if valeur.startswith('0'):
+        return '+' + INDICATIF_PAYS + valeur[1:]
+    return '+' + INDICATIF_PAYS + valeur
+
+
+def filtre(query, prefixe=''):
+    """
+    Condition Q sur les colonnes indexées pour une saisie (partielle) de téléphone : numéro exact,
+    début ou fin de numéro. None si la saisie n'est pas un téléphone (lettres, moins de 3 chiffres).
+    prefixe : chemin vers le client (ex. 'client__' depuis Commande).
+    """
+    brut = str(query or '').strip()
+    valeur = chiffres(brut)
+    if len(valeur) < LONGUEUR_MIN_RECHERCHE or not _SAISIE_TELEPHONE.match(brut):
+        return None
+
+    conditions = (
+        Q(**{f'{prefixe}numero_tel': brut})
+        | Q(**{f'{prefixe}telephone_e164__startswith': _prefixe_canonique(valeur, brut)})
+        | Q(**{f'{prefixe}telephone_inverse__startswith': valeur[::-1]})
+    )
+    canonique = normaliser(brut)
+    if canonique:
+        conditions |= Q(**{f'{prefixe}telephone_e164': canonique})
+    return conditions
+
+
+def rechercher(query, limite=10, actifs_seulement=False):
+    """Clients dont le téléphone correspond à la saisie ; correspondance exacte en premier"""
+    from .models import Client
+
+    conditions = filtre(query)
+    if conditions is None:
+        return []
+    clients = Client.objects.filter(conditions)
+    if actifs_seulement:
+        clients = clients.filter(is_active=True)
+    canonique = normaliser(query)
+    if canonique:
+        clients = clients.annotate(rang=Case(
+            When(telephone_e164=canonique, then=Value(1)), default=Value(2), output_field=IntegerField()
+        )).order_by('rang', 'prenom', 'nom')
+    else:
+        clients = clients.order_by('prenom', 'nom')
+    return list(clients[:limite])
+
+
+def trouver(numero):
+    """Clients portant ce numéro (même saisie, ou même forme canonique)"""
+    from .models import Client
+
+    brut = str(numero or '').strip()
+    conditions = Q(numero_tel=brut)
+    canonique = normaliser(brut)
+    if canonique:
+        conditions |= Q(telephone_e164=canonique)
+    return Client.objects.filter(conditions).order_by('pk')
+
+
+def cle(numero):
+    """Clé de regroupement d'un numéro : forme canonique, à défaut la saisie"""
+    return normaliser(numero) or str(numero or '').strip()
+
+
+def clients_par_telephone(numeros):
+    """
+    {numéro: Client existant} pour une liste de numéros, en une requête : un numéro retrouve
+    le client de même saisie, sinon le plus ancien client de même forme canonique.
+    """
+    from .models import Client
+
+    numeros = [str(numero).strip() for numero in numeros if numero]
+    canoniques = {numero: normaliser(numero) for numero in numeros}
+    existants = list(Client.objects.filter(
+        Q(numero_tel__in=numeros) | Q(telephone_e164__in={c for c in canoniques.values() if c})
+    ).order_by('pk'))
+
+    par_saisie = {client.numero_tel: client for client in existants}
+    par_canonique = {}
+    for client in existants:
+        if client.telephone_e164:
+            par_canonique.setdefault(client.telephone_e164, client)
+
+    trouves = {}
+    for numero in numeros:
+        client = par_saisie.get(numero) or par_canonique.get(canoniques[numero])
+        if client is not None:
+            trouves[numero] = client
+    return trouves
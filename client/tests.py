@@ -1,3 +1,66 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+from client import telephone
+from client.models import Client
+
+
+class NormalisationTests(SimpleTestCase):
+
+    def test_saisies_marocaines(self):
+        for saisie in ('0612345678', '06 12 34 56 78', '06-12-34-56-78', '612345678', '212612345678',
+                       '2120612345678', '+212 6 12 34 56 78', '00212612345678'):
+            with self.subTest(saisie=saisie):
+                self.assertEqual(telephone.normaliser(saisie), '+212612345678')
+
+    def test_numeros_etrangers(self):
+        self.assertEqual(telephone.normaliser('+33 6 12 34 56 78'), '+33612345678')
+        # Indicatif étranger sans « + » (la synchronisation le retire)
+        self.assertEqual(telephone.normaliser('33612345678'), '+33612345678')
+
+    def test_numeros_non_reconnus(self):
+        for saisie in (None, '', '12', '0612', 'abc', '+1234567'):
+            with self.subTest(saisie=saisie):
+                self.assertIsNone(telephone.normaliser(saisie))
+
+    def test_inverse_et_cle(self):
+        self.assertEqual(telephone.inverser('+212612345678'), '876543216212')
+        self.assertIsNone(telephone.inverser(None))
+        self.assertEqual(telephone.cle('06 12 34 56 78'), '+212612345678')
+        self.assertEqual(telephone.cle(' 12 '), '12')
+
+    def test_filtre_refuse_ce_qui_n_est_pas_un_telephone(self):
+        self.assertIsNone(telephone.filtre('Alami'))
+        self.assertIsNone(telephone.filtre('06'))
+        self.assertIsNotNone(telephone.filtre('5678'))
+
+
+class RechercheTelephoneTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sara = Client.objects.create(nom='Alami', prenom='Sara', numero_tel='06 12 34 56 78')
+        cls.karim = Client.objects.create(nom='Bennani', prenom='Karim', numero_tel='0661223344')
+
+    def test_colonnes_derivees(self):
+        self.assertEqual(self.sara.telephone_e164, '+212612345678')
+        self.assertEqual(self.sara.telephone_inverse, '876543216212')
+
+        self.sara.numero_tel = '0700000001'
+        self.sara.save(update_fields=['numero_tel'])
+        self.sara.refresh_from_db()
+        self.assertEqual(self.sara.telephone_e164, '+212700000001')
+
+    def test_recherche_par_debut_fin_ou_numero_complet(self):
+        self.assertEqual(telephone.rechercher('0661'), [self.karim])
+        self.assertEqual(telephone.rechercher('2233 44'), [self.karim])
+        self.assertEqual(telephone.rechercher('+212 612 345 678'), [self.sara])
+        self.assertEqual(telephone.rechercher('Alami'), [])
+
+    def test_trouver_quelle_que_soit_la_saisie(self):
+        self.assertEqual(list(telephone.trouver('212612345678')), [self.sara])
+        self.assertEqual(list(telephone.trouver('06 61 22 33 44')), [self.karim])
+
+    def test_clients_par_telephone(self):
+        trouves = telephone.clients_par_telephone(['+212612345678', '0661223344', '0799999999', ''])
+
+        self.assertEqual(trouves, {'+212612345678': self.sara, '0661223344': self.karim})
@@ -1,30 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, OuterRef, Subquery
+from django.db.models import Q, Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_POST
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 from .models import Client
+from . import telephone
 from commande.models import Commande
+from commande.etats import ids_etats
+from config.pagination import PaginationCurseur
 
 # Create your views here.
 
-@login_required
-def liste_clients(request):
-    from synchronisation.models import SyncLog
 
-    # Sous-requête pour trouver la 'ville_init' de la dernière commande de chaque client
-    latest_commande_ville_init = Commande.objects.filter(
-        client=OuterRef('pk')
-    ).order_by('-date_creation').values('ville_init')[:1]
+def _condition_telephone(term):
+    """Téléphone : colonnes indexées (client/telephone.py) ; une saisie non numérique ne vise pas le téléphone"""
+    condition = telephone.filtre(term)
+    return condition if condition is not None else Q(pk__in=[])
 
-    # Annoter les clients avec la ville de leur dernière commande
-    clients = Client.objects.annotate(
-        nombre_commandes=Count('commandes', distinct=True),
-        derniere_ville_init=Subquery(latest_commande_ville_init)
-    ).all()
+
+def _clients_filtres(request):
+    """Clients de la liste, annotés et filtrés selon les paramètres de la requête"""
     search_query = request.GET.get('search', '')
 
     # Récupérer les filtres avancés
@@ -33,7 +32,25 @@ def liste_clients(request):
     orders_count_filter = request.GET.get('orders_count_filter', '')
     date_filter = request.GET.get('date_filter', '')
 
-    if search_query:
+    # Sous-requête pour trouver la 'ville_init' de la dernière commande de chaque client
+    latest_commande_ville_init = Commande.objects.filter(
+        client=OuterRef('pk')
+    ).order_by('-date_creation').values('ville_init')[:1]
+
+    # Annoter les clients avec la ville de leur dernière commande et leur nombre de commandes
+    # (sous-requêtes évaluées pour les seuls clients lus, sans GROUP BY sur toute la table)
+    nombre_commandes = Commande.objects.filter(client=OuterRef('pk')).order_by().values('client').annotate(
+        nombre=Count('id')
+    ).values('nombre')
+    clients = Client.objects.annotate(
+        nombre_commandes=Coalesce(Subquery(nombre_commandes), 0),
+        derniere_ville_init=Subquery(latest_commande_ville_init)
+    ).all()
+
+    if search_query and telephone.normaliser(search_query) and telephone.filtre(search_query) is not None:
+        # Numéro complet : l'index téléphone suffit, sans parcourir les commandes
+        clients = clients.filter(telephone.filtre(search_query))
+    elif search_query:
         # Recherche flexible et variée
         search_terms = search_query.strip().split()
 
@@ -56,7 +73,7 @@ def liste_clients(request):
                     # Recherche dans les données du client
                     Q(nom__icontains=term) |
                     Q(prenom__icontains=term) |
-                    Q(numero_tel__icontains=term) |
+                    _condition_telephone(term) |
                     Q(email__icontains=term) |
                     Q(adresse__icontains=term) |
                     Q(id__icontains=term) |  # Recherche par ID client
@@ -86,7 +103,7 @@ def liste_clients(request):
             search_conditions |= (
                 Q(nom__icontains=global_term) |
                 Q(prenom__icontains=global_term) |
-                Q(numero_tel__icontains=global_term) |
+                _condition_telephone(global_term) |
                 Q(email__icontains=global_term) |
                 Q(adresse__icontains=global_term) |
                 Q(commandes__id_yz__icontains=global_term) |
@@ -106,13 +123,11 @@ def liste_clients(request):
             clients = clients.filter(nombre_commandes=0)
         elif status_filter == 'with_errors':
             clients = clients.filter(
-                commandes__etats__enum_etat__libelle__iexact='Erronée',
-                commandes__etats__date_fin__isnull=True
+                commandes__etat_courant_id__in=ids_etats('Erronée')
             ).distinct()
         elif status_filter == 'with_duplicates':
             clients = clients.filter(
-                commandes__etats__enum_etat__libelle__iexact='Doublon',
-                commandes__etats__date_fin__isnull=True
+                commandes__etat_courant_id__in=ids_etats('Doublon')
             ).distinct()
 
     if city_filter:
@@ -150,68 +165,71 @@ def liste_clients(request):
             year_ago = today - timedelta(days=365)
             clients = clients.filter(date_creation__gte=year_ago)
 
-    # Triez par date de création par défaut
-    clients = clients.order_by('-date_creation')
+    return clients
 
-    # Gestion de la pagination flexible
+
+def _page_clients(request, clients):
+    """(page_obj, items_per_page, start_range, end_range) : plage personnalisée, tous les clients, ou page par curseur"""
     items_per_page = request.GET.get('items_per_page', 10)
     start_range = request.GET.get('start_range', '')
     end_range = request.GET.get('end_range', '')
-    
-    # Conserver une copie des clients non paginés pour les statistiques
-    clients_non_pagines = clients
-    
+    page_number = request.GET.get('page', 1)
+
+    # Triez par date de création par défaut
+    clients = clients.order_by('-date_creation', '-id')
+
     # Gestion de la plage personnalisée
     if start_range and end_range:
         try:
             start_idx = int(start_range) - 1  # Index commence à 0
             end_idx = int(end_range)
             if start_idx >= 0 and end_idx > start_idx:
-                clients = list(clients)[start_idx:end_idx]
+                clients_plage = list(clients[start_idx:end_idx])
                 # Créer un paginator factice pour la plage
-                paginator = Paginator(clients, len(clients))
-                page_obj = paginator.get_page(1)
+                return Paginator(clients_plage, len(clients_plage) or 1).get_page(1), items_per_page, start_range, end_range
         except (ValueError, TypeError):
-            # En cas d'erreur, utiliser la pagination normale
+            pass
+        # Plage invalide : pagination normale
+        items_per_page = 10
+
+    if items_per_page == 'all':
+        # Afficher tous les clients
+        return Paginator(clients, clients.count() or 1).get_page(1), items_per_page, start_range, end_range
+
+    try:
+        items_per_page = int(items_per_page)
+        if items_per_page <= 0:
             items_per_page = 10
-            paginator = Paginator(clients, items_per_page)
-            page_number = request.GET.get('page', 1)
-            page_obj = paginator.get_page(page_number)
-    else:
-        # Pagination normale
-        page_number = request.GET.get('page', 1)
-        if items_per_page == 'all':
-            # Afficher tous les clients
-            paginator = Paginator(clients, clients.count())
-            page_obj = paginator.get_page(1)
-        else:
-            try:
-                items_per_page = int(items_per_page)
-                if items_per_page <= 0:
-                    items_per_page = 10
-            except (ValueError, TypeError):
-                items_per_page = 10
-            
-            paginator = Paginator(clients, items_per_page)
-            page_obj = paginator.get_page(page_number)
+    except (ValueError, TypeError):
+        items_per_page = 10
+    # Pagination par curseur : une page profonde coûte autant que la première
+    page_obj = PaginationCurseur(clients, items_per_page, ('-date_creation',), requete=request).get_page(page_number)
+    return page_obj, items_per_page, start_range, end_range
+
+
+@login_required
+def liste_clients(request):
+    from synchronisation.models import SyncLog
+
+    search_query = request.GET.get('search', '')
+    clients = _clients_filtres(request)
+    page_obj, items_per_page, start_range, end_range = _page_clients(request, clients)
 
     # Statistiques vérifiées
     total_clients = Client.objects.count()
-    clients_avec_commandes = Client.objects.filter(commandes__isnull=False).distinct().count()
+    clients_avec_commandes = Client.objects.filter(Exists(Commande.objects.filter(client=OuterRef('pk')))).count()
     clients_sans_commandes = total_clients - clients_avec_commandes
     
     # NOUVELLES STATISTIQUES POUR LES COMMANDES
     # Compter les clients distincts avec des commandes erronées (état actuel)
-    clients_avec_cmd_erronees = Client.objects.filter(
-        commandes__etats__enum_etat__libelle__iexact='Erronée',
-        commandes__etats__date_fin__isnull=True
-    ).distinct().count()
+    clients_avec_cmd_erronees = Client.objects.filter(Exists(Commande.objects.filter(
+        client=OuterRef('pk'), etat_courant_id__in=ids_etats('Erronée')
+    ))).count()
 
     # Compter les clients distincts avec des commandes doublons (état actuel)
-    clients_avec_cmd_doublons = Client.objects.filter(
-        commandes__etats__enum_etat__libelle__iexact='Doublon',
-        commandes__etats__date_fin__isnull=True
-    ).distinct().count()
+    clients_avec_cmd_doublons = Client.objects.filter(Exists(Commande.objects.filter(
+        client=OuterRef('pk'), etat_courant_id__in=ids_etats('Doublon')
+    ))).count()
 
     # Vérifier les doublons potentiels de clients (basé sur le numéro de tel)
     doublons_detectes = Client.objects.values('numero_tel').annotate(
@@ -252,7 +270,7 @@ def liste_clients(request):
             'html_table_body': html_table_body,
             'html_pagination': html_pagination,
             'html_pagination_info': html_pagination_info,
-            'total_count': clients_non_pagines.count()
+            'total_count': page_obj.paginator.count
         })
 
     context = {
@@ -367,21 +385,19 @@ def detail_client(request, pk):
     montant_total = sum(commande.total_cmd for commande in toutes_commandes)
     
     # Statistiques par état (toutes les commandes, même sans état défini)
-    etats_stats = toutes_commandes.values(
-        'etats__enum_etat__libelle',
-        'etats__enum_etat__couleur'
+    etats_stats = toutes_commandes.filter(etat_courant__isnull=False).values(
+        'etat_courant__libelle',
+        'etat_courant__couleur'
     ).annotate(
-        count=Count('id', distinct=True)
-    ).filter(
-        etats__date_fin__isnull=True  # État actuel seulement
+        count=Count('id')
     ).order_by('-count')
     
     # Ajouter les commandes sans état défini aux statistiques
-    commandes_sans_etat = toutes_commandes.filter(etats__isnull=True).count()
+    commandes_sans_etat = toutes_commandes.filter(etat_courant__isnull=True).count()
     if commandes_sans_etat > 0:
         etats_stats = list(etats_stats) + [{
-            'etats__enum_etat__libelle': 'Non défini',
-            'etats__enum_etat__couleur': '#6B7280',
+            'etat_courant__libelle': 'Non défini',
+            'etat_courant__couleur': '#6B7280',
             'count': commandes_sans_etat
         }]
     
@@ -578,184 +594,8 @@ def supprimer_clients_masse(request):
 def recherche_clients_ajax(request):
     """Vue AJAX pour la recherche dynamique des clients"""
     search_query = request.GET.get('search', '')
-    page = request.GET.get('page', 1)
-
-    # Récupérer les filtres avancés
-    status_filter = request.GET.get('status_filter', '')
-    city_filter = request.GET.get('city_filter', '')
-    orders_count_filter = request.GET.get('orders_count_filter', '')
-    date_filter = request.GET.get('date_filter', '')
-
-    # Sous-requête pour trouver la 'ville_init' de la dernière commande de chaque client
-    latest_commande_ville_init = Commande.objects.filter(
-        client=OuterRef('pk')
-    ).order_by('-date_creation').values('ville_init')[:1]
-
-    # Annoter les clients avec la ville de leur dernière commande
-    clients = Client.objects.annotate(
-        nombre_commandes=Count('commandes', distinct=True),
-        derniere_ville_init=Subquery(latest_commande_ville_init)
-    ).all()
-
-    if search_query:
-        # Recherche flexible et variée
-        search_terms = search_query.strip().split()
-        
-        # Construction de la requête de recherche
-        search_conditions = Q()
-        
-        # Vérifier si la recherche correspond exactement à une ville_init
-        exact_ville_init_match = Commande.objects.filter(
-            ville_init__iexact=search_query
-        ).exists()
-        
-        if exact_ville_init_match:
-            # Si la recherche correspond exactement à une ville_init, on filtre directement
-            search_conditions = Q(derniere_ville_init__iexact=search_query)
-        else:
-            # Sinon, on utilise la recherche normale par termes
-            term_conditions = Q()
-            for term in search_terms:
-                term_conditions |= (
-                    # Recherche dans les données du client
-                    Q(nom__icontains=term) |
-                    Q(prenom__icontains=term) |
-                    Q(numero_tel__icontains=term) |
-                    Q(email__icontains=term) |
-                    Q(adresse__icontains=term) |
-                    Q(id__icontains=term) |  # Recherche par ID client
-                    Q(derniere_ville_init__icontains=term) |
-                    
-                    # Recherche dans les commandes associées
-                    Q(commandes__id_yz__icontains=term) |
-                    Q(commandes__num_cmd__icontains=term) |
-                    Q(commandes__total_cmd__icontains=term) |
-                    
-                    # Recherche dans les villes des commandes
-                    Q(commandes__ville__nom__icontains=term) |
-                    Q(commandes__ville_init__icontains=term) |
-                    Q(commandes__ville__region__nom_region__icontains=term) |
-                    
-                    # Recherche dans les états des commandes
-                    Q(commandes__etats__enum_etat__libelle__icontains=term) |
-                    
-                    # Recherche dans les produits des commandes
-                    Q(commandes__produit_init__icontains=term)
-                )
-            search_conditions &= term_conditions
-        
-        # Recherche globale si un seul terme (pour retrouver "Dupont Jean" avec "Jean Dupont")
-        if not exact_ville_init_match and len(search_terms) == 1:
-            global_term = search_query.strip()
-            search_conditions |= (
-                Q(nom__icontains=global_term) |
-                Q(prenom__icontains=global_term) |
-                Q(numero_tel__icontains=global_term) |
-                Q(email__icontains=global_term) |
-                Q(adresse__icontains=global_term) |
-                Q(commandes__id_yz__icontains=global_term) |
-                Q(commandes__num_cmd__icontains=global_term) |
-                Q(commandes__ville__nom__icontains=global_term) |
-                Q(commandes__ville_init__icontains=global_term) |
-                Q(commandes__etats__enum_etat__libelle__icontains=global_term)
-            )
-        
-        clients = clients.filter(search_conditions).distinct()
-
-    # Appliquer les filtres avancés
-    if status_filter:
-        if status_filter == 'with_orders':
-            clients = clients.filter(nombre_commandes__gt=0)
-        elif status_filter == 'without_orders':
-            clients = clients.filter(nombre_commandes=0)
-        elif status_filter == 'with_errors':
-            clients = clients.filter(
-                commandes__etats__enum_etat__libelle__iexact='Erronée',
-                commandes__etats__date_fin__isnull=True
-            ).distinct()
-        elif status_filter == 'with_duplicates':
-            clients = clients.filter(
-                commandes__etats__enum_etat__libelle__iexact='Doublon',
-                commandes__etats__date_fin__isnull=True
-            ).distinct()
-
-    if city_filter:
-        clients = clients.filter(derniere_ville_init__icontains=city_filter)
-
-    if orders_count_filter:
-        if orders_count_filter == '0':
-            clients = clients.filter(nombre_commandes=0)
-        elif orders_count_filter == '1':
-            clients = clients.filter(nombre_commandes=1)
-        elif orders_count_filter == '2-5':
-            clients = clients.filter(nombre_commandes__gte=2, nombre_commandes__lte=5)
-        elif orders_count_filter == '6-10':
-            clients = clients.filter(nombre_commandes__gte=6, nombre_commandes__lte=10)
-        elif orders_count_filter == '10+':
-            clients = clients.filter(nombre_commandes__gt=10)
-
-    if date_filter:
-        from datetime import datetime, timedelta
-        from django.utils import timezone
-        today = timezone.now()
-
-        if date_filter == 'today':
-            clients = clients.filter(date_creation__date=today.date())
-        elif date_filter == 'week':
-            week_ago = today - timedelta(days=7)
-            clients = clients.filter(date_creation__gte=week_ago)
-        elif date_filter == 'month':
-            month_ago = today - timedelta(days=30)
-            clients = clients.filter(date_creation__gte=month_ago)
-        elif date_filter == 'quarter':
-            quarter_ago = today - timedelta(days=90)
-            clients = clients.filter(date_creation__gte=quarter_ago)
-        elif date_filter == 'year':
-            year_ago = today - timedelta(days=365)
-            clients = clients.filter(date_creation__gte=year_ago)
-
-    # Triez par date de création par défaut
-    clients = clients.order_by('-date_creation')
-
-    # Gestion de la pagination flexible
-    items_per_page = request.GET.get('items_per_page', 10)
-    start_range = request.GET.get('start_range', '')
-    end_range = request.GET.get('end_range', '')
-    
-    # Conserver une copie des clients non paginés pour les statistiques
-    clients_non_pagines = clients
-    
-    # Gestion de la plage personnalisée
-    if start_range and end_range:
-        try:
-            start_idx = int(start_range) - 1  # Index commence à 0
-            end_idx = int(end_range)
-            if start_idx >= 0 and end_idx > start_idx:
-                clients = list(clients)[start_idx:end_idx]
-                # Créer un paginator factice pour la plage
-                paginator = Paginator(clients, len(clients))
-                page_obj = paginator.get_page(1)
-        except (ValueError, TypeError):
-            # En cas d'erreur, utiliser la pagination normale
-            items_per_page = 10
-            paginator = Paginator(clients, items_per_page)
-            page_obj = paginator.get_page(page)
-    else:
-        # Pagination normale
-        if items_per_page == 'all':
-            # Afficher tous les clients
-            paginator = Paginator(clients, clients.count())
-            page_obj = paginator.get_page(1)
-        else:
-            try:
-                items_per_page = int(items_per_page)
-                if items_per_page <= 0:
-                    items_per_page = 10
-            except (ValueError, TypeError):
-                items_per_page = 10
-            
-            paginator = Paginator(clients, items_per_page)
-            page_obj = paginator.get_page(page)
+    clients = _clients_filtres(request)
+    page_obj, items_per_page, start_range, end_range = _page_clients(request, clients)
 
     # Rendre les templates partiels pour AJAX
     html_table_body = render_to_string('client/partials/_clients_table_body.html', {
@@ -783,8 +623,8 @@ def recherche_clients_ajax(request):
         'has_previous': page_obj.has_previous(),
         'has_next': page_obj.has_next(),
         'current_page': page_obj.number,
-        'total_pages': paginator.num_pages,
-        'total_count': clients_non_pagines.count(),
+        'total_pages': page_obj.paginator.num_pages,
+        'total_count': page_obj.paginator.count,
     })
 
 @login_required
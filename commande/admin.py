@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import EnumEtatCmd, Commande, Panier, EtatCommande, Operation, Envoi, ArticleRetourne
+from .models import EnumEtatCmd, Commande, Panier, EtatCommande, CompteurFile, Operation, Envoi, ArticleRetourne
 
 @admin.register(EnumEtatCmd)
 class EnumEtatCmdAdmin(admin.ModelAdmin):
@@ -83,6 +83,14 @@ class EtatCommandeAdmin(admin.ModelAdmin):
     ordering = ('-date_debut',)
     readonly_fields = ('date_debut',)
 
+@admin.register(CompteurFile)
+class CompteurFileAdmin(admin.ModelAdmin):
+    # Tenus par commande/compteurs.py : consultation seulement, correction par reconcilier_compteurs
+    list_display = ('etat', 'operateur', 'nombre')
+    list_filter = ('etat',)
+    list_select_related = ('etat', 'operateur')
+    readonly_fields = ('operateur', 'etat', 'nombre')
+
 @admin.register(Operation)
 class OperationAdmin(admin.ModelAdmin):
     list_display = ('id', 'type_operation', 'date_operation', 'commande', 'operateur')
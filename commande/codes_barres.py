@@ -0,0 +1,227 @@
+"""
+Génération des codes-barres (Code 128) et QR codes des tickets, étiquettes et fiches de préparation.
+
+Chaque image est identifiée par son contenu : empreinte SHA-256 de (symbologie, données,
+options). Elle n'est calculée qu'une fois, puis servie depuis :
+  1. un cache LRU en mémoire du processus ;
+  2. un cache disque partagé (CODES_BARRES_CACHE_DIR/<2 premiers caractères>/<empreinte>.png).
+
+Les templates référencent les images par URL (vue `commande:code_barre_image`), servies avec
+des en-têtes de cache HTTP longs : le navigateur ne les redemande pas d'une impression à
+l'autre. Pour les impressions en série, pre_generer() calcule d'avance les images manquantes
+dans un pool de processus.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing import get_context
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+# Réglages nommés utilisés par les écrans : (symbologie, options)
+PRESETS = {
+    # Code-barres de commande des listes et fiches de préparation
+    'commande': ('code128', {'write_text': False, 'module_height': 10.0}),
+    # Code-barres des tickets de commande (dimensions optimisées pour l'impression)
+    'ticket': ('code128', {'write_text': False, 'module_height': 4.0, 'module_width': 0.15, 'quiet_zone': 2.0}),
+    # QR code des tickets et des articles
+    'qr': ('qr', {'box_size': 10, 'border': 4}),
+}
+
+LONGUEUR_MAX_DONNEES = 200
+
+# Un rendu prend ~1 ms : en dessous de ce nombre d'images, le démarrage du pool coûte plus qu'il ne rapporte
+SEUIL_POOL = 500
+
+TAILLE_LRU = 512
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+
+# --- Rendu (fonctions pures, exécutables dans un processus du pool) -------------------
+
+def _rendre_code128(donnees, options):
+    import barcode
+    from barcode.writer import ImageWriter
+
+    code128 = barcode.get_barcode_class('code128')
+    buffer = BytesIO()
+    code128(donnees, writer=ImageWriter()).write(buffer, options=options)
+    return buffer.getvalue()
+
+
+def _rendre_qr(donnees, options):
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,  # Version 1 (21x21 modules), agrandie si nécessaire (fit=True)
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=options.get('box_size', 10),
+        border=options.get('border', 4),
+    )
+    qr.add_data(donnees)
+    qr.make(fit=True)
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+RENDUS = {
+    'code128': _rendre_code128,
+    'qr': _rendre_qr,
+}
+
+
+def rendre_png(symbologie, donnees, options):
+    return RENDUS[symbologie](donnees, options)
+
+
+def _rendre_demande(demande):
+    cle, symbologie, donnees, options = demande
+    return cle, rendre_png(symbologie, donnees, options)
+
+
+# --- Cache --------------------------------------------------------------------------
+
+def empreinte(symbologie, donnees, options):
+    contenu = json.dumps([symbologie, donnees, options], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(contenu.encode('utf-8')).hexdigest()
+
+
+def _dossier_cache():
+    from django.conf import settings
+
+    return getattr(settings, 'CODES_BARRES_CACHE_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'codes_barres')
+
+
+def _chemin(cle):
+    return os.path.join(_dossier_cache(), cle[:2], f'{cle}.png')
+
+
+def _lire_lru(cle):
+    with _lru_lock:
+        png = _lru.get(cle)
+        if png is not None:
+            _lru.move_to_end(cle)
+        return png
+
+
+def _ecrire_lru(cle, png):
+    with _lru_lock:
+        _lru[cle] = png
+        _lru.move_to_end(cle)
+        while len(_lru) > TAILLE_LRU:
+            _lru.popitem(last=False)
+
+
+def _lire_disque(cle):
+    try:
+        with open(_chemin(cle), 'rb') as fichier:
+            return fichier.read()
+    except OSError:
+        return None
+
+
+def _ecrire_disque(cle, png):
+    chemin = _chemin(cle)
+    try:
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        # Écriture atomique : un lecteur concurrent ne voit jamais un fichier partiel
+        fd, chemin_tmp = tempfile.mkstemp(dir=os.path.dirname(chemin), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fichier:
+            fichier.write(png)
+        os.replace(chemin_tmp, chemin)
+    except OSError as e:
+        logger.warning(f"Cache disque des codes-barres indisponible ({chemin}): {e}")
+
+
+def _normaliser(preset, donnees):
+    symbologie, options = PRESETS[preset]
+    donnees = str(donnees)
+    if not donnees or len(donnees) > LONGUEUR_MAX_DONNEES:
+        raise ValueError("Données de code-barres vides ou trop longues")
+    return symbologie, donnees, options
+
+
+def obtenir_png(preset, donnees):
+    """Retourne (empreinte, PNG) du code, en le calculant au besoin"""
+    symbologie, donnees, options = _normaliser(preset, donnees)
+    cle = empreinte(symbologie, donnees, options)
+
+    png = _lire_lru(cle)
+    if png is None:
+        png = _lire_disque(cle)
+        if png is None:
+            png = rendre_png(symbologie, donnees, options)
+            _ecrire_disque(cle, png)
+        _ecrire_lru(cle, png)
+    return cle, png
+
+
+def obtenir_base64(preset, donnees):
+    """PNG encodé en base64 (pour les exports PDF et les usages qui ne peuvent pas référencer une URL)"""
+    try:
+        return base64.b64encode(obtenir_png(preset, donnees)[1]).decode('utf-8')
+    except Exception as e:
+        logger.error(f"Erreur lors de la génération du code {preset} pour {donnees}: {e}")
+        return ""
+
+
+def pre_generer(preset, liste_donnees, processus=None):
+    """
+    Calcule d'avance les images absentes du cache disque, en parallèle au-delà de SEUIL_POOL.
+    Retourne le nombre d'images calculées.
+    """
+    demandes = {}
+    for donnees in liste_donnees:
+        try:
+            symbologie, donnees, options = _normaliser(preset, donnees)
+        except ValueError:
+            continue
+        cle = empreinte(symbologie, donnees, options)
+        if cle not in demandes and not os.path.exists(_chemin(cle)):
+            demandes[cle] = (cle, symbologie, donnees, options)
+
+    if not demandes:
+        return 0
+
+    from django.conf import settings
+
+    processus = processus or getattr(settings, 'CODES_BARRES_PROCESSUS', None) or min(4, os.cpu_count() or 1)
+    restantes = dict(demandes)
+    if len(demandes) >= SEUIL_POOL and processus > 1:
+        try:
+            # 'spawn' : les processus du pool n'héritent ni des threads ni des connexions du serveur web
+            with ProcessPoolExecutor(max_workers=processus, mp_context=get_context('spawn')) as pool:
+                for cle, png in pool.map(_rendre_demande, demandes.values(), chunksize=8):
+                    _ecrire_disque(cle, png)
+                    del restantes[cle]
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f"Pool de rendu des codes-barres indisponible, rendu séquentiel: {e}")
+
+    for cle, png in map(_rendre_demande, restantes.values()):
+        _ecrire_disque(cle, png)
+    return len(demandes)
+
+
+def version_preset(preset):
+    """Change quand les options du preset changent : invalide les URLs déjà en cache chez les navigateurs"""
+    return hashlib.sha256(json.dumps(PRESETS[preset], sort_keys=True).encode('utf-8')).hexdigest()[:10]
+
+
+def url_code(preset, donnees):
+    """URL de l'image du code (à utiliser dans <img src>)"""
+    from django.urls import reverse
+
+    if donnees in (None, ''):
+        return ''
+    return f"{reverse('commande:code_barre_image', args=[preset])}?{urlencode({'d': str(donnees), 'v': version_preset(preset)})}"
@@ -0,0 +1,155 @@
+"""
+Compteurs de files : nombre de commandes par (opérateur, état courant).
+
+Chaque commande compte dans la file (operateur_etat_courant, etat_courant) de son état courant
+dénormalisé ; CompteurFile en garde le total par couple, l'opérateur étant NULL pour les
+commandes sans opérateur. Les badges des interfaces lisent ces quelques lignes au lieu de
+compter les commandes par jointure sur les états.
+
+Tenue à jour, dans la transaction qui déplace la commande :
+  - EtatCommande.synchroniser_etat_courant() (ouverture / fermeture d'un état) : la commande
+    est verrouillée, l'ancien couple est décrémenté et le nouveau incrémenté ;
+  - changer_etats() (commande/transitions.py) et la création en masse de la synchronisation
+    appliquent les deltas du lot en une fois ;
+  - la suppression d'une commande retire son couple (signal post_delete).
+
+Les écritures qui contournent ces chemins (suppression en cascade d'un opérateur, recalcul de
+rafraichir_etat_courant, UPDATE manuel) sont corrigées par reconcilier(), appelée après
+`backfill_etat_courant` et périodiquement par la commande `reconcilier_compteurs`.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+
+from .etats import ids_etats, libelle_etat
+
+
+def deplacer(deltas, ancien, nouveau):
+    """Ajoute au dict de deltas le passage d'une commande du couple `ancien` au couple `nouveau`"""
+    if ancien == nouveau:
+        return deltas
+    if ancien[1] is not None:
+        deltas[ancien] = deltas.get(ancien, 0) - 1
+    if nouveau[1] is not None:
+        deltas[nouveau] = deltas.get(nouveau, 0) + 1
+    return deltas
+
+
+def _condition(cles):
+    condition = Q()
+    for operateur_id, etat_id in cles:
+        condition |= Q(operateur_id=operateur_id, etat_id=etat_id)
+    return condition
+
+
+def _verrouiller(cles):
+    """{(operateur_id, etat_id): pk} des compteurs existants, verrouillés dans l'ordre des id"""
+    from .models import CompteurFile
+
+    return {
+        (operateur_id, etat_id): pk
+        for pk, operateur_id, etat_id in CompteurFile.objects.select_for_update().filter(
+            _condition(cles)
+        ).order_by('pk').values_list('pk', 'operateur_id', 'etat_id')
+    }
+
+
+def ajuster(deltas):
+    """
+    Applique {(operateur_id, etat_id): delta} aux compteurs : un UPDATE ... F() + delta pour les
+    compteurs existants, une création pour les couples nouveaux. Un delta négatif sur un compteur
+    absent (dérive) est laissé à reconcilier().
+    """
+    from .models import CompteurFile
+
+    deltas = {cle: delta for cle, delta in deltas.items() if delta and cle[1] is not None}
+    if not deltas:
+        return
+    with transaction.atomic():
+        existants = _verrouiller(deltas)
+        for cle in sorted((cle for cle in deltas if cle not in existants), key=lambda c: (c[0] or 0, c[1])):
+            if deltas[cle] < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    CompteurFile.objects.create(operateur_id=cle[0], etat_id=cle[1], nombre=deltas[cle])
+            except IntegrityError:
+                # Créé entre-temps par une transaction concurrente : l'incrémenter
+                existants.update(_verrouiller([cle]))
+        if existants:
+            CompteurFile.objects.filter(pk__in=existants.values()).update(nombre=F('nombre') + Case(
+                *[When(pk=pk, then=Value(deltas[cle])) for cle, pk in existants.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            ))
+
+
+def par_etat(libelles=None, operateur=None):
+    """
+    {libellé: nombre de commandes} dans les états `libelles` (0 pour une file vide ; None = tous
+    les états suivis) : tous opérateurs confondus, ou pour `operateur` (instance ou id) seulement.
+    """
+    from .models import CompteurFile
+
+    compteurs = CompteurFile.objects.all()
+    if libelles is not None:
+        compteurs = compteurs.filter(etat_id__in=ids_etats(*libelles))
+    if operateur is not None:
+        compteurs = compteurs.filter(operateur_id=getattr(operateur, 'pk', operateur))
+    totaux = dict.fromkeys(libelles or (), 0)
+    # Libellés lus dans le registre des états : ni jointure ni tri sur EnumEtatCmd
+    for etat_id, nombre in compteurs.values_list('etat_id').annotate(nombre=Sum('nombre')).order_by():
+        libelle = libelle_etat(etat_id)
+        if libelle is not None:
+            totaux[libelle] = max(nombre or 0, 0)
+    return totaux
+
+
+def total(libelles, operateur=None):
+    """Nombre de commandes dans l'ensemble des états `libelles`"""
+    return sum(par_etat(libelles, operateur).values())
+
+
+def reconcilier():
+    """
+    Recalcule les compteurs à partir de l'état courant des commandes (une requête d'agrégat) et
+    corrige ceux qui ont dérivé. Retourne le nombre de compteurs corrigés.
+    """
+    from .models import Commande, CompteurFile
+
+    with transaction.atomic():
+        # Verrouiller d'abord les compteurs : une transition en cours termine avant le recomptage
+        existants = {
+            (operateur_id, etat_id): (pk, nombre)
+            for pk, operateur_id, etat_id, nombre in CompteurFile.objects.select_for_update().order_by('pk').values_list(
+                'pk', 'operateur_id', 'etat_id', 'nombre'
+            )
+        }
+        reels = {
+            (operateur_id, etat_id): nombre
+            for operateur_id, etat_id, nombre in Commande.objects.filter(etat_courant__isnull=False).values_list(
+                'operateur_etat_courant_id', 'etat_courant_id'
+            ).annotate(nombre=Count('id')).order_by()
+        }
+
+        corrections = {
+            pk: reels.get(cle, 0) for cle, (pk, nombre) in existants.items() if nombre != reels.get(cle, 0)
+        }
+        if corrections:
+            CompteurFile.objects.filter(pk__in=corrections).update(nombre=Case(
+                *[When(pk=pk, then=Value(nombre)) for pk, nombre in corrections.items()],
+                default=F('nombre'),
+                output_field=IntegerField(),
+            ))
+
+        crees = 0
+        for cle, nombre in reels.items():
+            if cle in existants:
+                continue
+            try:
+                with transaction.atomic():
+                    CompteurFile.objects.create(operateur_id=cle[0], etat_id=cle[1], nombre=nombre)
+                crees += 1
+            except IntegrityError:
+                # Créé par une transition concurrente : corrigé au prochain passage
+                pass
+    return len(corrections) + crees
@@ -0,0 +1,100 @@
+"""
+Passage automatique des "Confirmation décalée" arrivées à échéance vers "Confirmée".
+
+Traitement exécuté hors des requêtes HTTP par `python manage.py process_delayed_confirmations`
+(en tâche planifiée, ou en continu avec --boucle). Les états échus sont trouvés via
+l'index partiel sur date_fin_delayed (états ouverts uniquement), puis traités par lots par
+le service de changement d'état en masse (commande/transitions.py).
+
+Sur PostgreSQL, un verrou consultatif (pg_try_advisory_xact_lock) garantit qu'un seul
+processus traite les échéances à un instant donné ; les autres passent leur tour.
+"""
+import logging
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from commande.etats import ids_etats, obtenir_etat
+from commande.models import EnumEtatCmd, EtatCommande
+from commande.transitions import changer_etats
+
+logger = logging.getLogger(__name__)
+
+LIBELLE_DECALEE = 'Confirmation décalée'
+LIBELLE_CONFIRMEE = 'Confirmée'
+
+# Clé du verrou consultatif PostgreSQL (constante arbitraire propre à ce traitement)
+CLE_VERROU = 727001
+
+
+def _obtenir_verrou():
+    """Verrou de transaction non bloquant ; toujours accordé hors PostgreSQL"""
+    if connection.vendor != 'postgresql':
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [CLE_VERROU])
+        return cursor.fetchone()[0]
+
+
+def etats_echus(maintenant):
+    return EtatCommande.objects.filter(
+        date_fin__isnull=True,  # État encore actif
+        date_fin_delayed__lte=maintenant,  # Date de fin atteinte
+        enum_etat_id__in=ids_etats(LIBELLE_DECALEE),
+    )
+
+
+def traiter_lot(maintenant=None, limite=500):
+    """
+    Traite au plus `limite` confirmations décalées échues dans une transaction.
+    Retourne la liste des id_yz traités, ou None si un autre processus détient le verrou.
+    """
+    maintenant = maintenant or timezone.now()
+    etat_confirmee = obtenir_etat(LIBELLE_CONFIRMEE)
+
+    with transaction.atomic():
+        if not _obtenir_verrou():
+            return None
+
+        echus = list(
+            etats_echus(maintenant)
+            .order_by('date_fin_delayed')
+            .values('commande_id', 'commande__id_yz', 'operateur_id', 'date_fin_delayed')[:limite]
+        )
+        if not echus:
+            return []
+
+        # Un seul passage à "Confirmée" par commande
+        par_commande = {}
+        for etat in echus:
+            par_commande.setdefault(etat['commande_id'], etat)
+
+        # Fermer TOUS les états actifs de ces commandes et créer les états "Confirmée"
+        changer_etats(
+            list(par_commande),
+            etat_confirmee,
+            operateurs={commande_id: etat['operateur_id'] for commande_id, etat in par_commande.items()},
+            commentaire=lambda courant, operateur_id: (
+                'Transition automatique depuis "Confirmation décalée" (fin prévue: '
+                f'{par_commande[courant.commande_id]["date_fin_delayed"].strftime("%d/%m/%Y %H:%M")})'
+            ),
+            ignorer_identiques=False,
+            maintenant=maintenant,
+        )
+
+    traites = [etat['commande__id_yz'] for etat in par_commande.values()]
+    logger.info(f'{len(traites)} confirmations décalées passées automatiquement à "Confirmée"')
+    return traites
+
+
+def traiter_confirmations_decalees(maintenant=None, limite=500):
+    """Traite toutes les échéances atteintes, lot par lot. Retourne la liste des id_yz traités"""
+    maintenant = maintenant or timezone.now()
+    traites = []
+    while True:
+        lot = traiter_lot(maintenant, limite)
+        if not lot:
+            return traites
+        traites.extend(lot)
+        if len(lot) < limite:
+            return traites
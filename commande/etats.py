@@ -0,0 +1,199 @@
+"""
+Registre des états de commande (EnumEtatCmd), chargé une fois par processus.
+
+La table EnumEtatCmd ne compte que quelques dizaines de lignes et ne change presque jamais :
+au lieu de joindre enum_etat pour filtrer sur le libellé (etats__enum_etat__libelle='Confirmée')
+ou de relire l'état à chaque requête (EnumEtatCmd.objects.get(libelle=...)), les vues filtrent
+sur la clé étrangère avec les identifiants du registre :
+
+    Commande.objects.filter(etat_courant_id__in=ids_etats('Confirmée', 'Préparée'))
+    EtatCommande.objects.filter(enum_etat_id__in=ids_etats(PREPAREE), date_fin__isnull=True)
+
+Un libellé inconnu ne donne aucun identifiant, donc aucune ligne, comme le filtre par jointure.
+La recherche d'un libellé ignore la casse (équivalent de libelle__iexact).
+
+Invalidation :
+  - toute écriture sur EnumEtatCmd (signaux post_save / post_delete, commande/models.py) vide le
+    registre du processus et incrémente une génération partagée dans le cache Django, après le
+    commit ;
+  - les autres processus comparent leur génération à celle du cache au plus toutes les
+    VERIFICATION_GENERATION secondes, et rechargent le registre si elle a changé ;
+  - jusqu'au commit, la transaction qui a modifié les états lit un registre rechargé depuis la
+    base, sans le partager : un état qu'elle vient de créer (synchronisation) y est déjà visible.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+
+GENERATION_KEY = 'commande:etats:generation'
+VERIFICATION_GENERATION = 30
+
+# Libellés des états suivis par les interfaces
+NON_AFFECTEE = 'Non affectée'
+AFFECTEE = 'Affectée'
+EN_COURS_CONFIRMATION = 'En cours de confirmation'
+REPORT_CONFIRMATION = 'Report de confirmation'
+CONFIRMEE = 'Confirmée'
+ANNULEE = 'Annulée'
+ERRONEE = 'Erronée'
+DOUBLON = 'Doublon'
+A_IMPRIMER = 'À imprimer'
+EN_PREPARATION = 'En préparation'
+COLLECTEE = 'Collectée'
+EMBALLEE = 'Emballée'
+PREPAREE = 'Préparée'
+EN_LIVRAISON = 'En livraison'
+LIVREE = 'Livrée'
+RETOURNEE = 'Retournée'
+
+
+@dataclass(frozen=True)
+class Etat:
+    id: int
+    libelle: str
+    ordre: int
+    couleur: str
+
+    def instance(self):
+        """EnumEtatCmd correspondant, construit sans requête (nouvelle instance à chaque appel)"""
+        from .models import EnumEtatCmd
+
+        return EnumEtatCmd.from_db(
+            DEFAULT_DB_ALIAS, ['id', 'libelle', 'ordre', 'couleur'], (self.id, self.libelle, self.ordre, self.couleur)
+        )
+
+
+class Registre:
+    """Instantané immuable des états : par libellé (sans casse) et par identifiant"""
+
+    def __init__(self, etats):
+        self.etats = tuple(sorted(etats, key=lambda etat: (etat.ordre, etat.libelle)))
+        self.par_libelle = MappingProxyType({etat.libelle.casefold(): etat for etat in self.etats})
+        self.par_id = MappingProxyType({etat.id: etat for etat in self.etats})
+
+    def __len__(self):
+        return len(self.etats)
+
+    def etat(self, libelle):
+        return self.par_libelle.get(str(libelle).casefold()) if libelle is not None else None
+
+
+_verrou = threading.Lock()
+_registre = None
+_generation = None
+_verifie_a = 0.0
+
+# États modifiés dans la transaction en cours du thread, pas encore validés
+_transaction = threading.local()
+
+
+def _generation_partagee():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def _charger():
+    from .models import EnumEtatCmd
+
+    return Registre(
+        Etat(*valeurs) for valeurs in EnumEtatCmd.objects.values_list('id', 'libelle', 'ordre', 'couleur')
+    )
+
+
+def registre():
+    """Registre courant du processus, rechargé si un autre processus a modifié les états"""
+    global _registre, _generation, _verifie_a
+    if getattr(_transaction, 'modifie', False):
+        if connection.in_atomic_block:
+            return _charger()
+        _transaction.modifie = False
+    actuel = _registre
+    if actuel is not None and time.monotonic() - _verifie_a < VERIFICATION_GENERATION:
+        return actuel
+    with _verrou:
+        generation = _generation_partagee()
+        if _registre is None or generation != _generation:
+            _registre = _charger()
+            _generation = generation
+        _verifie_a = time.monotonic()
+        return _registre
+
+
+def etat(libelle):
+    """Etat du libellé (casse ignorée), None s'il n'existe pas"""
+    return registre().etat(libelle)
+
+
+def etat_par_id(pk):
+    return registre().par_id.get(pk)
+
+
+def id_etat(libelle):
+    """Identifiant de l'état du libellé, None s'il n'existe pas"""
+    trouve = etat(libelle)
+    return trouve.id if trouve is not None else None
+
+
+def ids_etats(*libelles):
+    """Identifiants des états existants parmi `libelles`, pour un filtre enum_etat_id__in / etat_courant_id__in"""
+    courant = registre()
+    ids = []
+    for libelle in libelles:
+        trouve = courant.etat(libelle)
+        if trouve is not None and trouve.id not in ids:
+            ids.append(trouve.id)
+    return ids
+
+
+def libelle_etat(pk):
+    """Libellé de l'état d'identifiant `pk`, None s'il n'existe pas"""
+    trouve = etat_par_id(pk)
+    return trouve.libelle if trouve is not None else None
+
+
+def obtenir_etat(libelle):
+    """EnumEtatCmd du libellé sans requête ; lève EnumEtatCmd.DoesNotExist comme objects.get()"""
+    trouve = etat(libelle)
+    if trouve is None:
+        from .models import EnumEtatCmd
+        raise EnumEtatCmd.DoesNotExist(f"État de commande '{libelle}' introuvable")
+    return trouve.instance()
+
+
+def obtenir_ou_creer_etat(libelle, defaults=None):
+    """(EnumEtatCmd, créé) comme objects.get_or_create(), sans requête quand l'état existe déjà"""
+    trouve = etat(libelle)
+    if trouve is not None:
+        return trouve.instance(), False
+    from .models import EnumEtatCmd
+    instance, cree = EnumEtatCmd.objects.get_or_create(libelle=libelle, defaults=defaults or {})
+    if not cree:
+        # Présent en base mais absent du registre (chargé avant sa création) : recharger
+        invalider()
+    return instance, cree
+
+
+def invalider():
+    """Vide le registre du processus et fait recharger celui des autres processus"""
+    global _registre
+    _transaction.modifie = False
+    with _verrou:
+        _registre = None
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+def planifier_invalidation():
+    """Invalide le registre après le commit de la transaction en cours (immédiatement hors transaction)"""
+    if connection.in_atomic_block:
+        _transaction.modifie = True
+    transaction.on_commit(invalider)
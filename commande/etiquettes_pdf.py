@@ -0,0 +1,342 @@
+"""
+Génération des PDF d'étiquettes (EtiquetteGeneratorView) par lots.
+
+- Les données des étiquettes sont lues en une requête puis réduites à des dictionnaires
+  simples : le rendu ReportLab ne touche plus la base et peut tourner dans un autre processus.
+- Les styles sont construits une fois par jeu de paramètres de template et par processus.
+- Au-delà de TAILLE_LOT étiquettes, la liste est découpée en lots rendus en parallèle
+  (pool de processus) puis fusionnés avec pypdf. Sans pypdf, le rendu se fait en un seul
+  document dans le processus courant.
+- Les gros volumes passent par un EtiquetteJob exécuté en arrière-plan, dont la
+  progression (étiquettes rendues) est consultable pendant le rendu.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from multiprocessing import get_context
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT = 250
+
+# Champs du template utilisés par le rendu (copiés dans un dict transmissible aux processus)
+CHAMPS_TEMPLATE = (
+    'width', 'height', 'margin_top', 'margin_bottom', 'margin_left', 'margin_right',
+    'font_size_title', 'font_size_text', 'font_size_barcode',
+    'barcode_width', 'barcode_height', 'qr_size',
+    'show_header', 'show_footer', 'show_barcode', 'show_qr',
+)
+
+
+def parametres_template(template):
+    return {champ: getattr(template, champ) for champ in CHAMPS_TEMPLATE}
+
+
+def donnees_etiquettes(commande_ids):
+    """Une entrée par article de panier des commandes demandées, dans l'ordre des commandes"""
+    from .models import Panier
+
+    paniers = Panier.objects.filter(commande_id__in=commande_ids).select_related(
+        'commande', 'commande__client', 'article', 'variante__couleur', 'variante__pointure'
+    ).order_by('commande_id', 'id')
+
+    etiquettes = []
+    for panier in paniers:
+        commande = panier.commande
+        variante = panier.variante
+        if variante:
+            description_variante = ' '.join(filter(None, [
+                variante.couleur.nom if variante.couleur else '',
+                variante.pointure.pointure if variante.pointure else '',
+            ])) or 'Standard'
+        else:
+            description_variante = 'Standard'
+        etiquettes.append({
+            'entete': f"Commande {commande.id_yz or commande.num_cmd}",
+            'article': panier.article.nom,
+            'variante': description_variante,
+            'quantite': panier.quantite,
+            'client': commande.client.nom if commande.client else '',
+            'date': commande.date_cmd.strftime('%d/%m/%Y') if commande.date_cmd else '',
+            'code': panier.article.nom,
+        })
+    return etiquettes
+
+
+# --- Rendu (exécutable dans un processus du pool) ----------------------------------
+
+@lru_cache(maxsize=32)
+def _styles(font_size_title, font_size_text):
+    from reportlab.lib.colors import Color
+    from reportlab.lib.enums import TA_CENTER, TA_LEFT
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=font_size_title,
+        textColor=Color(0.17, 0.24, 0.31),  # #2c3e50
+        alignment=TA_CENTER,
+        spaceAfter=12,
+    )
+    text_style = ParagraphStyle(
+        'CustomText',
+        parent=styles['Normal'],
+        fontSize=font_size_text,
+        textColor=Color(0.2, 0.2, 0.2),  # #333333
+        alignment=TA_LEFT,
+        spaceAfter=6,
+    )
+    return title_style, text_style
+
+
+def _creer_code_barres(texte, parametres):
+    from reportlab.graphics.barcode import code128
+    from reportlab.lib.units import mm
+
+    try:
+        options = dict(
+            barHeight=parametres['barcode_height'] * mm,
+            fontSize=parametres['font_size_barcode'],
+            humanReadable=True,
+        )
+        barcode = code128.Code128(texte, barWidth=parametres['barcode_width'] * mm, **options)
+        # Code128 est un Flowable : l'affiner si nécessaire pour qu'il tienne dans la largeur utile
+        largeur_utile = (parametres['width'] - parametres['margin_left'] - parametres['margin_right']) * mm
+        if barcode.width > largeur_utile:
+            barcode = code128.Code128(
+                texte, barWidth=parametres['barcode_width'] * mm * largeur_utile / barcode.width, **options
+            )
+        return barcode
+    except Exception as e:
+        logger.warning(f"Erreur création code-barres: {e}")
+        return None
+
+
+def _creer_qr_code(texte, parametres):
+    from reportlab.graphics.barcode import qr
+    from reportlab.graphics.shapes import Drawing
+
+    try:
+        drawing = Drawing(parametres['qr_size'], parametres['qr_size'])
+        drawing.add(qr.QrCodeWidget(texte))
+        return drawing
+    except Exception as e:
+        logger.warning(f"Erreur création QR code: {e}")
+        return None
+
+
+def _marqueur(callback, numero):
+    """Flowable vide qui signale le rendu effectif d'une étiquette (progression)"""
+    from reportlab.platypus import Flowable
+
+    class Marqueur(Flowable):
+        def wrap(self, *args):
+            return 0, 0
+
+        def draw(self):
+            callback(numero)
+
+    return Marqueur()
+
+
+def rendre_pdf(parametres, format_type, etiquettes, progression=None):
+    """Rend les étiquettes données en un PDF (bytes)"""
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=(parametres['width'] * mm, parametres['height'] * mm),
+        rightMargin=parametres['margin_right'] * mm,
+        leftMargin=parametres['margin_left'] * mm,
+        topMargin=parametres['margin_top'] * mm,
+        bottomMargin=parametres['margin_bottom'] * mm
+    )
+    title_style, text_style = _styles(parametres['font_size_title'], parametres['font_size_text'])
+
+    creer_code = None
+    if format_type == 'barcode' and parametres['show_barcode']:
+        creer_code = _creer_code_barres
+    elif format_type == 'qr' and parametres['show_qr']:
+        creer_code = _creer_qr_code
+
+    story = []
+    for numero, etiquette in enumerate(etiquettes, 1):
+        # En-tête
+        if parametres['show_header']:
+            story.append(Paragraph(etiquette['entete'], title_style))
+            story.append(Spacer(1, 6))
+
+        # Informations de l'article
+        article_info = f"""
+        <b>Référence:</b> {etiquette['article']}<br/>
+        <b>Variante:</b> {etiquette['variante']}<br/>
+        <b>Quantité:</b> {etiquette['quantite']}<br/>
+        <b>Client:</b> {etiquette['client']}<br/>
+        <b>Date:</b> {etiquette['date']}
+        """
+        story.append(Paragraph(article_info, text_style))
+        story.append(Spacer(1, 12))
+
+        # Code-barres ou QR code
+        if creer_code:
+            code = creer_code(etiquette['code'], parametres)
+            if code:
+                story.append(code)
+                story.append(Spacer(1, 12))
+
+        # Pied de page
+        if parametres['show_footer']:
+            story.append(Paragraph("<b>Yoozak</b> - Système de gestion des commandes", text_style))
+
+        # Espace entre les étiquettes
+        story.append(Spacer(1, 20))
+        if progression:
+            story.append(_marqueur(progression, numero))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def _rendre_lot(args):
+    parametres, format_type, etiquettes = args
+    return rendre_pdf(parametres, format_type, etiquettes)
+
+
+# --- Orchestration ---------------------------------------------------------------
+
+def fusion_disponible():
+    try:
+        import pypdf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _fusionner(pdfs):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(io.BytesIO(pdf))
+    sortie = io.BytesIO()
+    writer.write(sortie)
+    return sortie.getvalue()
+
+
+def generer_pdf(parametres, format_type, etiquettes, progression=None, processus=None):
+    """
+    PDF de toutes les étiquettes. `progression(nb_rendues, total)` est appelée pendant le rendu.
+    """
+    total = len(etiquettes)
+
+    def signaler(nb):
+        if progression:
+            progression(nb, total)
+
+    if total <= TAILLE_LOT or not fusion_disponible():
+        return rendre_pdf(parametres, format_type, etiquettes, progression=signaler if progression else None)
+
+    from django.conf import settings
+
+    lots = [etiquettes[i:i + TAILLE_LOT] for i in range(0, total, TAILLE_LOT)]
+    processus = processus or getattr(settings, 'ETIQUETTES_PROCESSUS', None) or min(4, os.cpu_count() or 1)
+    pdfs = [None] * len(lots)
+    faits = 0
+
+    if processus > 1:
+        try:
+            # 'spawn' : les processus du pool n'héritent ni des threads ni des connexions du serveur web
+            with ProcessPoolExecutor(max_workers=processus, mp_context=get_context('spawn')) as pool:
+                futures = {
+                    pool.submit(_rendre_lot, (parametres, format_type, lot)): index
+                    for index, lot in enumerate(lots)
+                }
+                for future in futures:
+                    index = futures[future]
+                    pdfs[index] = future.result()
+                    faits += len(lots[index])
+                    signaler(faits)
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f"Pool de rendu des étiquettes indisponible, rendu séquentiel: {e}")
+
+    for index, lot in enumerate(lots):
+        if pdfs[index] is None:
+            pdfs[index] = rendre_pdf(parametres, format_type, lot)
+            faits += len(lot)
+            signaler(faits)
+
+    return _fusionner(pdfs)
+
+
+# --- Jobs en arrière-plan ------------------------------------------------------------
+
+INTERVALLE_PROGRESSION = 50
+
+
+def lancer_job(template, commande_ids, format_type, utilisateur=None):
+    from django.db import transaction
+    from .models import EtiquetteJob
+
+    job = EtiquetteJob.objects.create(
+        template=template,
+        commande_ids=list(commande_ids),
+        format_type=format_type,
+        cree_par=utilisateur if utilisateur and utilisateur.is_authenticated else None,
+    )
+    transaction.on_commit(lambda: threading.Thread(
+        target=_executer_job_thread, args=(job.pk,), daemon=True
+    ).start())
+    return job
+
+
+def _executer_job_thread(job_id):
+    from django.db import close_old_connections, connection
+    from .models import EtiquetteJob
+
+    close_old_connections()
+    try:
+        executer_job(EtiquetteJob.objects.get(pk=job_id))
+    finally:
+        connection.close()
+
+
+def executer_job(job):
+    """Rend le PDF d'un EtiquetteJob. Ne lève pas : l'erreur est enregistrée sur le job"""
+    from django.core.files.base import ContentFile
+    from django.utils import timezone
+    from .models import EtiquetteJob
+
+    if not EtiquetteJob.objects.filter(pk=job.pk, statut='en_attente').update(
+        statut='en_cours', date_debut=timezone.now()
+    ):
+        return job
+
+    try:
+        etiquettes = donnees_etiquettes(job.commande_ids)
+        EtiquetteJob.objects.filter(pk=job.pk).update(nb_total=len(etiquettes))
+
+        def progression(nb, total):
+            if nb == total or nb % INTERVALLE_PROGRESSION == 0:
+                EtiquetteJob.objects.filter(pk=job.pk).update(nb_rendues=nb)
+
+        pdf = generer_pdf(parametres_template(job.template), job.format_type, etiquettes, progression)
+        job.fichier.save(f"etiquettes_{job.pk}.pdf", ContentFile(pdf), save=False)
+        job.nb_total = job.nb_rendues = len(etiquettes)
+        job.statut = 'termine'
+        job.date_fin = timezone.now()
+        job.save(update_fields=['fichier', 'nb_total', 'nb_rendues', 'statut', 'date_fin'])
+    except Exception as e:
+        logger.error(f"Erreur lors de la génération des étiquettes #{job.pk}: {e}", exc_info=True)
+        job.statut = 'erreur'
+        job.erreur = str(e)
+        job.date_fin = timezone.now()
+        job.save(update_fields=['statut', 'erreur', 'date_fin'])
+    return job
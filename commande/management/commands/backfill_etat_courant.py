@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+from commande.compteurs import reconcilier
+from commande.models import Commande
+
+
+class Command(BaseCommand):
+    help = "Initialise/recalcule l'état courant dénormalisé des commandes (etat_courant, date_etat_courant, operateur_etat_courant)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Nombre de commandes (plage d\'identifiants) traitées par lot (défaut: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+
+        bornes = Commande.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if bornes['min_id'] is None:
+            self.stdout.write(self.style.SUCCESS('Aucune commande à traiter.'))
+            return
+
+        self.stdout.write(
+            f"Recalcul de l'état courant des commandes {bornes['min_id']} à {bornes['max_id']} "
+            f"par lots de {batch_size}..."
+        )
+
+        total = 0
+        debut = bornes['min_id']
+        while debut <= bornes['max_id']:
+            fin = debut + batch_size
+            with transaction.atomic():
+                total += Commande.rafraichir_etat_courant(
+                    Commande.objects.filter(id__gte=debut, id__lt=fin)
+                )
+            debut = fin
+
+        self.stdout.write(self.style.SUCCESS(f'✅ État courant recalculé pour {total} commandes'))
+
+        # rafraichir_etat_courant() contourne les compteurs de files
+        corriges = reconcilier()
+        self.stdout.write(self.style.SUCCESS(f'✅ {corriges} compteur(s) de files corrigé(s)'))
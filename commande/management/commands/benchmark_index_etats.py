@@ -0,0 +1,155 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from commande.models import EtatCommande
+
+TABLE = 'bench_etats_commande'
+
+# Requêtes dominantes sur les états (paramètres tirés du jeu synthétique)
+REQUETES = [
+    (
+        "État ouvert d'une commande",
+        "SELECT * FROM {table} WHERE commande_id = %(commande)s AND date_fin IS NULL AND enum_etat_id = %(etat)s",
+    ),
+    (
+        "File d'un opérateur",
+        "SELECT * FROM {table} WHERE operateur_id = %(operateur)s AND enum_etat_id = %(etat)s "
+        "AND date_fin IS NULL ORDER BY date_debut DESC LIMIT 25",
+    ),
+    (
+        "Historique d'une commande",
+        "SELECT * FROM {table} WHERE commande_id = %(commande)s ORDER BY date_debut DESC",
+    ),
+    (
+        'Entrées dans un état (24 h)',
+        "SELECT count(*) FROM {table} WHERE enum_etat_id = %(etat)s AND date_debut >= %(depuis)s",
+    ),
+    (
+        "Activité d'un opérateur (7 j)",
+        "SELECT * FROM {table} WHERE operateur_id = %(operateur)s AND date_debut >= %(semaine)s ORDER BY date_debut",
+    ),
+    (
+        'Confirmations décalées échues',
+        "SELECT * FROM {table} WHERE date_fin IS NULL AND date_fin_delayed IS NOT NULL AND date_fin_delayed <= now()",
+    ),
+]
+
+# Index existants avant la migration 0029 : clés étrangères seulement
+INDEX_CLES_ETRANGERES = ('commande_id', 'enum_etat_id', 'operateur_id')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare les plans (EXPLAIN ANALYZE) des requêtes sur les états de commande, avant et après les index "
+        "de EtatCommande, sur un jeu synthétique (1 000 000 d'états par défaut) créé dans une table temporaire. "
+        "PostgreSQL uniquement ; la transaction est annulée à la fin, aucune donnée n'est conservée."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--etats', type=int, default=1000000, help="Nombre d'états synthétiques (défaut: 1000000)")
+        parser.add_argument('--operateurs', type=int, default=50, help="Nombre d'opérateurs synthétiques (défaut: 50)")
+        parser.add_argument('--libelles', type=int, default=19, help="Nombre d'états distincts (défaut: 19)")
+        parser.add_argument('--graine', type=float, default=0.42, help='Graine de setseed() entre -1 et 1, pour des mesures reproductibles')
+        parser.add_argument('--plans', action='store_true', help='Affiche les plans complets (format texte)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Ce benchmark lit les plans de PostgreSQL (EXPLAIN ANALYZE) : base actuelle " + connection.vendor)
+
+        with transaction.atomic():
+            with connection.cursor() as curseur:
+                debut = time.perf_counter()
+                self._creer_jeu(curseur, options)
+                self.stdout.write(f"📦 {options['etats']} états synthétiques créés en {time.perf_counter() - debut:.1f} s")
+
+                parametres = self._parametres(curseur, options)
+                avant = self._mesurer(curseur, parametres, options['plans'])
+
+                debut = time.perf_counter()
+                for sql in self._index_modele():
+                    curseur.execute(sql)
+                curseur.execute(f'ANALYZE {TABLE}')
+                self.stdout.write(f"🔧 Index de EtatCommande créés en {time.perf_counter() - debut:.1f} s")
+                apres = self._mesurer(curseur, parametres, options['plans'])
+
+            self.stdout.write('')
+            for (nom, _), (plan_avant, duree_avant), (plan_apres, duree_apres) in zip(REQUETES, avant, apres):
+                self.stdout.write(f'{nom:<32} {duree_avant:9.2f} ms -> {duree_apres:9.2f} ms')
+                self.stdout.write(f'    avant : {plan_avant}')
+                self.stdout.write(f'    après : {plan_apres}')
+            transaction.set_rollback(True)
+
+    def _creer_jeu(self, curseur, options):
+        # Cinq états par commande : les quatre premiers fermés, le dernier ouvert ; 1 % des états
+        # ouverts portent une échéance de confirmation décalée, 10 % n'ont pas d'opérateur
+        curseur.execute(f'CREATE TEMP TABLE {TABLE} (LIKE {EtatCommande._meta.db_table} INCLUDING DEFAULTS) ON COMMIT DROP')
+        curseur.execute('SELECT setseed(%s)', [options['graine']])
+        curseur.execute(
+            f"""
+            INSERT INTO {TABLE} (id, commande_id, enum_etat_id, operateur_id, date_debut, date_fin, date_fin_delayed, commentaire)
+            SELECT g,
+                   (g - 1) / 5 + 1,
+                   CASE WHEN (g - 1) %% 5 = 4 THEN 1 + floor(random() * %(libelles)s)::int ELSE (g - 1) %% 5 + 1 END,
+                   CASE WHEN random() < 0.1 THEN NULL ELSE 1 + floor(random() * %(operateurs)s)::int END,
+                   now() - ((%(etats)s - g) * interval '30 seconds'),
+                   CASE WHEN (g - 1) %% 5 = 4 THEN NULL ELSE now() - ((%(etats)s - g - 1) * interval '30 seconds') END,
+                   CASE WHEN (g - 1) %% 5 = 4 AND random() < 0.01 THEN now() + ((random() - 0.5) * interval '2 days') END,
+                   NULL
+            FROM generate_series(1, %(etats)s) AS g
+            """,
+            {'etats': options['etats'], 'operateurs': options['operateurs'], 'libelles': max(options['libelles'], 5)},
+        )
+        for colonne in INDEX_CLES_ETRANGERES:
+            curseur.execute(f'CREATE INDEX ON {TABLE} ({colonne})')
+        curseur.execute(f'ANALYZE {TABLE}')
+
+    def _parametres(self, curseur, options):
+        aleatoire = random.Random(options['graine'])
+        commandes = max(options['etats'] // 5, 1)
+        curseur.execute("SELECT now() - interval '1 day', now() - interval '7 days'")
+        depuis, semaine = curseur.fetchone()
+        return {
+            'commande': aleatoire.randint(1, commandes),
+            'operateur': aleatoire.randint(1, options['operateurs']),
+            'etat': aleatoire.randint(1, max(options['libelles'], 5)),
+            'depuis': depuis,
+            'semaine': semaine,
+        }
+
+    def _index_modele(self):
+        """CREATE INDEX des index déclarés sur EtatCommande, portés sur la table synthétique"""
+        table = EtatCommande._meta.db_table
+        with connection.schema_editor(atomic=False) as editeur:
+            for index in EtatCommande._meta.indexes:
+                sql = str(index.create_sql(EtatCommande, editeur))
+                yield sql.replace(editeur.quote_name(table), editeur.quote_name(TABLE)).replace(
+                    editeur.quote_name(index.name), editeur.quote_name(f'bench_{index.name}')
+                )
+
+    def _mesurer(self, curseur, parametres, plans):
+        resultats = []
+        for nom, requete in REQUETES:
+            sql = requete.format(table=TABLE)
+            curseur.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', parametres)
+            plan = curseur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plan = plan[0]
+            resultats.append((self._resume(plan['Plan']), plan['Execution Time']))
+            if plans:
+                curseur.execute(f'EXPLAIN ANALYZE {sql}', parametres)
+                self.stdout.write(f'--- {nom}')
+                self.stdout.write('\n'.join(ligne for ligne, in curseur.fetchall()))
+        return resultats
+
+    def _resume(self, noeud):
+        """Nœuds du plan, avec l'index utilisé : « Limit > Index Scan (bench_etat_cmd_ouvert_op_idx) »"""
+        libelle = noeud['Node Type']
+        if noeud.get('Index Name'):
+            libelle += f" ({noeud['Index Name']})"
+        enfants = [self._resume(enfant) for enfant in noeud.get('Plans', [])]
+        return f"{libelle} > {', '.join(enfants)}" if enfants else libelle
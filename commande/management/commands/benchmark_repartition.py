@@ -0,0 +1,81 @@
+import random
+import time
+from statistics import pstdev
+
+from django.core.management.base import BaseCommand
+
+from commande.repartition import PROFILS, ChargeOperateur, charger_operateurs, commandes_a_repartir, planifier, ponderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le moteur de répartition sur un jeu synthétique (10 000 commandes, 50 opérateurs par défaut) "
+        "et le compare au round-robin. Aucune écriture en base ; --reel simule aussi sur les données actuelles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commandes', type=int, default=10000, help='Nombre de commandes synthétiques (défaut: 10000)')
+        parser.add_argument('--operateurs', type=int, default=50, help="Nombre d'opérateurs synthétiques (défaut: 50)")
+        parser.add_argument('--regions', type=int, default=12, help='Nombre de régions synthétiques (défaut: 12)')
+        parser.add_argument('--graine', type=int, default=42, help='Graine aléatoire, pour des mesures reproductibles')
+        parser.add_argument(
+            '--reel',
+            choices=sorted(PROFILS),
+            help='Simule aussi la répartition du profil donné sur la base actuelle (lecture seule)',
+        )
+
+    def handle(self, *args, **options):
+        aleatoire = random.Random(options['graine'])
+        nb_regions = max(1, options['regions'])
+        commandes = [(pk, aleatoire.randrange(nb_regions)) for pk in range(options['commandes'])]
+
+        def operateurs_synthetiques():
+            # Graine fixe : mêmes charges initiales et débits pour les deux stratégies
+            tirage = random.Random(options['graine'] + 1)
+            operateurs = []
+            for pk in range(options['operateurs']):
+                operateur = ChargeOperateur(pk=pk, nom=f'Opérateur {pk}', charge=tirage.randrange(0, 60))
+                for _ in range(operateur.charge):
+                    operateur.regions[tirage.randrange(nb_regions)] += 1
+                operateurs.append(operateur)
+            ponderer(operateurs, {op.pk: tirage.uniform(5, 40) for op in operateurs})
+            return operateurs
+
+        # Round-robin historique
+        operateurs = operateurs_synthetiques()
+        debut = time.perf_counter()
+        for index, (commande_id, region_id) in enumerate(commandes):
+            operateur = operateurs[index % len(operateurs)]
+            operateur.charge += 1
+            operateur.regions[region_id] += 1
+        self._rapport('Round-robin', operateurs, time.perf_counter() - debut, None)
+
+        # Moindre charge pondérée avec affinité régionale
+        operateurs = operateurs_synthetiques()
+        debut = time.perf_counter()
+        plan = planifier(commandes, operateurs)
+        self._rapport('Charge pondérée', operateurs, time.perf_counter() - debut, plan.affinite)
+
+        if options['reel']:
+            config = PROFILS[options['reel']]
+            debut = time.perf_counter()
+            reelles = commandes_a_repartir(config)
+            operateurs = charger_operateurs(config)
+            lecture = time.perf_counter() - debut
+            plan = planifier(reelles, operateurs)
+            self.stdout.write(
+                f"Base actuelle ({options['reel']}): {len(reelles)} commande(s), {len(operateurs)} opérateur(s), "
+                f"lecture {lecture * 1000:.0f} ms, plan {len(plan.affectations)} affectation(s)"
+            )
+
+    def _rapport(self, nom, operateurs, duree, affinite):
+        # Délai d'écoulement de chaque file : charge / débit
+        delais = [op.charge_ponderee for op in operateurs]
+        dispersion = sum(sum(1 for n in op.regions.values() if n) for op in operateurs) / len(operateurs)
+        ligne = (
+            f'{nom:<16} {duree * 1000:8.1f} ms | délai de file max {max(delais):6.2f} j, '
+            f'écart-type {pstdev(delais):5.2f} | régions par opérateur {dispersion:4.1f}'
+        )
+        if affinite is not None:
+            ligne += f' | affinité {affinite}'
+        self.stdout.write(ligne)
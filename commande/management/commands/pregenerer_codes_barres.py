@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from commande.codes_barres import pre_generer
+from commande.models import Commande, Panier
+
+
+class Command(BaseCommand):
+    help = (
+        "Pré-calcule (en parallèle) les codes-barres et QR codes des commandes à imprimer, "
+        "pour que les séries de tickets soient servies depuis le cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--etats',
+            nargs='+',
+            default=['Confirmée', 'En préparation'],
+            help='États courants des commandes concernées (défaut: Confirmée, En préparation)',
+        )
+        parser.add_argument(
+            '--processus',
+            type=int,
+            default=None,
+            help='Nombre de processus de rendu (défaut: CODES_BARRES_PROCESSUS ou min(4, CPU))',
+        )
+
+    def handle(self, *args, **options):
+        ids_yz = list(
+            Commande.objects.filter(
+                etat_courant__libelle__in=options['etats'],
+                id_yz__isnull=False
+            ).values_list('id_yz', flat=True)
+        )
+        textes_articles = [
+            f"{reference}|CMD-{id_yz}"
+            for reference, id_yz in Panier.objects.filter(
+                commande__id_yz__in=ids_yz
+            ).values_list('article__reference', 'commande__id_yz')
+        ]
+
+        total = 0
+        for preset, liste in (('ticket', ids_yz), ('commande', ids_yz), ('qr', ids_yz + textes_articles)):
+            nb = pre_generer(preset, liste, processus=options['processus'])
+            total += nb
+            self.stdout.write(f'   {preset}: {nb} image(s) calculée(s) sur {len(liste)}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {total} code(s) pré-calculé(s) pour {len(ids_yz)} commande(s)'
+        ))
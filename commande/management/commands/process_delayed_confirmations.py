@@ -1,101 +1,88 @@
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
 from django.utils import timezone
-from commande.models import EtatCommande, EnumEtatCmd
+
+from commande.confirmations_decalees import traiter_confirmations_decalees
+from commande.models import EnumEtatCmd
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Traite les confirmations décalées qui ont atteint leur date de fin'
+    help = (
+        'Traite les confirmations décalées qui ont atteint leur date de fin. '
+        'Avec --boucle, reste actif et vérifie les échéances à intervalle régulier.'
+    )
 
-    def handle(self, *args, **options):
-        self.stdout.write(
-            self.style.SUCCESS('Début du traitement des confirmations décalées...')
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help='Processus permanent : vérifie les échéances toutes les --intervalle secondes',
         )
-        
-        # Récupérer tous les états "Confirmation décalée" qui ont atteint leur date de fin
-        now = timezone.now()
-        
-        etats_delayed = EtatCommande.objects.filter(
-            enum_etat__libelle='Confirmation décalée',
-            date_fin__isnull=True,  # État encore actif
-            date_fin_delayed__lte=now  # Date de fin atteinte
-        ).select_related('commande', 'enum_etat', 'operateur')
-        
-        if not etats_delayed.exists():
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=10,
+            help='Secondes entre deux vérifications en mode boucle (défaut: 10)',
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=500,
+            help='Nombre maximum de commandes traitées par transaction (défaut: 500)',
+        )
+
+    def handle(self, *args, **options):
+        if not EnumEtatCmd.objects.filter(libelle='Confirmée').exists():
             self.stdout.write(
-                self.style.SUCCESS('Aucune confirmation décalée à traiter')
+                self.style.ERROR('ERREUR: État "Confirmée" non trouvé dans la configuration')
             )
             return
-        
-        # Récupérer l'état "Confirmée"
+
+        if not options['boucle']:
+            self.traiter(options['limite'], verbeux=True)
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Surveillance des confirmations décalées (toutes les {options["intervalle"]}s)...')
+        )
         try:
-            etat_confirmee = EnumEtatCmd.objects.get(libelle='Confirmée')
-        except EnumEtatCmd.DoesNotExist:
+            while True:
+                close_old_connections()
+                try:
+                    self.traiter(options['limite'], verbeux=False)
+                except Exception as e:
+                    # Ne pas arrêter le processus sur une erreur ponctuelle (base indisponible, ...)
+                    logger.error(f'Erreur lors du traitement des confirmations décalées: {str(e)}')
+                    self.stdout.write(self.style.ERROR(f'ERREUR: {str(e)}'))
+                time.sleep(max(1, options['intervalle']))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS('Arrêt de la surveillance des confirmations décalées'))
+
+    def traiter(self, limite, verbeux):
+        now = timezone.now()
+        traites = traiter_confirmations_decalees(now, limite=max(1, limite))
+
+        for id_yz in traites:
             self.stdout.write(
-                self.style.ERROR('ERREUR: État "Confirmée" non trouvé dans la configuration')
+                self.style.SUCCESS(f'OK: Commande {id_yz} : Confirmation décalée -> Confirmée')
             )
+
+        if not verbeux:
             return
-        
-        transitions_effectuees = 0
-        
-        for etat_delayed in etats_delayed:
-            try:
-                # Fermer l'état "Confirmation décalée"
-                etat_delayed.date_fin = now
-                etat_delayed.save()
-                
-                # Créer le nouvel état "Confirmée"
-                nouvel_etat = EtatCommande.objects.create(
-                    commande=etat_delayed.commande,
-                    enum_etat=etat_confirmee,
-                    operateur=etat_delayed.operateur,
-                    date_debut=now,
-                    commentaire=f'Transition automatique depuis "Confirmation décalée" (fin prévue: {etat_delayed.date_fin_delayed.strftime("%d/%m/%Y %H:%M")})'
-                )
-                
-                transitions_effectuees += 1
-                
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'OK: Commande {etat_delayed.commande.id_yz} : '
-                        f'Confirmation décalée -> Confirmée'
-                    )
-                )
-                
-                logger.info(
-                    f'Transition automatique: Commande {etat_delayed.commande.id_yz} '
-                    f'de "Confirmation décalée" vers "Confirmée"'
-                )
-                
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'ERREUR: Transition commande {etat_delayed.commande.id_yz}: {str(e)}'
-                    )
-                )
-                logger.error(
-                    f'Erreur transition automatique commande {etat_delayed.commande.id_yz}: {str(e)}'
-                )
-        
+
         # Résumé
         self.stdout.write('\n' + '='*60)
         self.stdout.write(
             self.style.SUCCESS(f'=== RÉSUMÉ DU TRAITEMENT ===')
         )
         self.stdout.write(
-            self.style.SUCCESS(f'Confirmations décalées traitées: {transitions_effectuees}')
+            self.style.SUCCESS(f'Confirmations décalées traitées: {len(traites)}')
         )
         self.stdout.write(
             self.style.SUCCESS(f'Heure de traitement: {now.strftime("%d/%m/%Y %H:%M:%S")}')
         )
         self.stdout.write('='*60)
-        
-        if transitions_effectuees > 0:
-            self.stdout.write(
-                self.style.SUCCESS('Traitement terminé avec succès !')
-            )
-        else:
-            self.stdout.write(
-                self.style.SUCCESS('Aucune transition effectuée')
-            )
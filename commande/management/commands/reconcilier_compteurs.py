@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from commande.compteurs import reconcilier
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule les compteurs de files (commandes par opérateur et état courant) à partir des "
+        "commandes et corrige ceux qui ont dérivé. En continu avec --boucle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help='Processus permanent : réconcilie les compteurs toutes les --intervalle secondes',
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=600,
+            help='Secondes entre deux réconciliations en mode boucle (défaut: 600)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                corriges = reconcilier()
+                if corriges or not options['boucle']:
+                    self.stdout.write(self.style.SUCCESS(f'✅ {corriges} compteur(s) de files corrigé(s)'))
+            except Exception as e:
+                if not options['boucle']:
+                    raise
+                # Ne pas arrêter le processus sur une erreur ponctuelle (base indisponible, ...)
+                self.stdout.write(self.style.ERROR(f'❌ Erreur lors de la réconciliation des compteurs: {str(e)}'))
+
+            if not options['boucle']:
+                return
+            time.sleep(max(1, options['intervalle']))
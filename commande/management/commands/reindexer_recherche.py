@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from client.models import Client
+from commande.models import Commande
+from commande.recherche import rafraichir_documents
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruit les documents de la recherche globale (clients puis commandes), "
+        "après une modification faite hors application (import SQL, correction manuelle, ...)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=5000,
+            help='Nombre de lignes traitées par lot (défaut: 5000)',
+        )
+        parser.add_argument(
+            '--commandes-seulement',
+            action='store_true',
+            help='Ne reconstruit que les documents des commandes',
+        )
+
+    def handle(self, *args, **options):
+        taille_lot = max(1, options['limite'])
+
+        if not options['commandes_seulement']:
+            modifies = 0
+            lot = []
+            for client in Client.objects.order_by('pk').iterator(chunk_size=taille_lot):
+                document = client.construire_document_recherche()
+                if document != client.document_recherche:
+                    client.document_recherche = document
+                    lot.append(client)
+                if len(lot) >= taille_lot:
+                    modifies += Client.objects.bulk_update(lot, ['document_recherche'])
+                    lot = []
+            if lot:
+                modifies += Client.objects.bulk_update(lot, ['document_recherche'])
+            self.stdout.write(f'Clients: {modifies} document(s) mis à jour')
+
+        total = 0
+        dernier = Commande.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        for debut in range(0, dernier + 1, taille_lot):
+            total += rafraichir_documents(Commande.objects.filter(pk__gte=debut, pk__lt=debut + taille_lot))
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} document(s) de commande reconstruits'))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from commande.repartition import PROFILS, TOLERANCE_AFFINITE, repartir
+
+
+class Command(BaseCommand):
+    help = (
+        "Répartit les commandes en attente (préparées pour la logistique, non affectées pour la confirmation) "
+        "entre les opérateurs actifs selon leur charge ouverte, leur débit et leurs régions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profil',
+            choices=sorted(PROFILS),
+            default='LOGISTIQUE',
+            help='Type de répartition (défaut: LOGISTIQUE)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Affiche le plan de répartition sans rien modifier',
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=None,
+            help='Nombre maximum de commandes réparties (les plus anciennes d\'abord)',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=TOLERANCE_AFFINITE,
+            help='Surcharge relative acceptée pour garder une commande dans une région déjà servie (défaut: 0.2)',
+        )
+
+    def handle(self, *args, **options):
+        plan = repartir(
+            options['profil'],
+            dry_run=options['dry_run'],
+            limite=options['limite'],
+            tolerance=options['tolerance'],
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Mode simulation (dry-run) - Aucune modification effectuée'))
+
+        for operateur in sorted(plan.operateurs, key=lambda op: -op.affectees):
+            self.stdout.write(
+                f'  {operateur.nom:<30} +{operateur.affectees:<5} charge {operateur.charge:<5} '
+                f'poids {operateur.poids:.1f}'
+            )
+        if plan.affectations:
+            self.stdout.write(f'Affinité régionale: {plan.affinite}/{len(plan.affectations)} commande(s)')
+        self.stdout.write(self.style.SUCCESS(f'✅ {plan.message}'))
@@ -53,6 +53,10 @@ class Command(BaseCommand):
             self.stdout.write('')
             self.stdout.write('Ou utilisez cette commande :')
             self.stdout.write(f'echo "*/5 * * * * cd {project_path} && {command}" | crontab -')
+            self.stdout.write('')
+            self.stdout.write('Pour un traitement à la minute près, lancez plutôt un processus permanent')
+            self.stdout.write('(service systemd, supervisor...) :')
+            self.stdout.write(f'cd {project_path} && {command} --boucle --intervalle 10')
         
         self.stdout.write('')
         self.stdout.write(
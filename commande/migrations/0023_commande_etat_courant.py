@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0001_initial'),
+        ('commande', '0022_panier_type_prix_gele'),
+        ('parametre', '0004_livreur'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='date_etat_courant',
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Date de début de l'état courant"),
+        ),
+        migrations.AddField(
+            model_name='commande',
+            name='etat_courant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='commandes_courantes', to='commande.enumetatcmd', verbose_name='État courant'),
+        ),
+        migrations.AddField(
+            model_name='commande',
+            name='operateur_etat_courant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='commandes_etat_courant', to='parametre.operateur', verbose_name="Opérateur de l'état courant"),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['etat_courant', '-date_etat_courant'], name='cmd_etat_courant_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['operateur_etat_courant', 'etat_courant'], name='cmd_operateur_etat_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations
+
+
+START_ID_YZ = 211971
+
+SEQUENCE_ID_YZ = 'commande_id_yz_seq'
+SEQUENCES_NUM_CMD = {
+    'OC-': 'commande_num_cmd_oc_seq',
+    'ADMIN-': 'commande_num_cmd_admin_seq',
+}
+
+
+def create_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        # sqlite (tests) : commande.sequences retombe sur le calcul à partir du maximum
+        return
+
+    Commande = apps.get_model('commande', 'Commande')
+    table_name = Commande._meta.db_table
+
+    with schema_editor.connection.cursor() as cursor:
+        # id_yz : continuer après le maximum existant, au minimum START_ID_YZ
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE_ID_YZ}")
+        cursor.execute(f"SELECT COALESCE(MAX(id_yz), 0) FROM {table_name}")
+        max_id_yz = cursor.fetchone()[0] or 0
+        cursor.execute(
+            "SELECT setval(%s, %s, false)",
+            [SEQUENCE_ID_YZ, max(START_ID_YZ, max_id_yz + 1)]
+        )
+
+        # num_cmd OC-/ADMIN- : continuer après le plus grand suffixe numérique existant
+        for prefix, sequence_name in SEQUENCES_NUM_CMD.items():
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence_name}")
+            cursor.execute(
+                f"SELECT COALESCE(MAX(CAST(SUBSTRING(num_cmd FROM %s) AS BIGINT)), 0) "
+                f"FROM {table_name} WHERE num_cmd ~ %s",
+                [len(prefix) + 1, f'^{prefix}[0-9]+$']
+            )
+            max_number = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT setval(%s, %s, false)", [sequence_name, max_number + 1])
+
+
+def drop_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        for sequence_name in [SEQUENCE_ID_YZ, *SEQUENCES_NUM_CMD.values()]:
+            cursor.execute(f"DROP SEQUENCE IF EXISTS {sequence_name}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('commande', '0023_commande_etat_courant'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequences, reverse_code=drop_sequences),
+    ]
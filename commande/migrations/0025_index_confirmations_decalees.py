@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commande', '0024_sequences_identifiants_commande'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='etatcommande',
+            index=models.Index(condition=models.Q(('date_fin__isnull', True), ('date_fin_delayed__isnull', False)), fields=['date_fin_delayed'], name='etat_cmd_delayed_ouvert_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commande', '0025_index_confirmations_decalees'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EtiquetteJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('commande_ids', models.JSONField(default=list)),
+                ('format_type', models.CharField(default='barcode', max_length=10)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('erreur', 'Erreur')], default='en_attente', max_length=20)),
+                ('nb_total', models.PositiveIntegerField(default=0, help_text="Nombre d'étiquettes à rendre")),
+                ('nb_rendues', models.PositiveIntegerField(default=0)),
+                ('fichier', models.FileField(blank=True, null=True, upload_to='etiquettes/')),
+                ('erreur', models.TextField(blank=True, null=True)),
+                ('date_creation', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_debut', models.DateTimeField(blank=True, null=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+                ('cree_par', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='etiquette_jobs', to=settings.AUTH_USER_MODEL)),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='commande.etiquettetemplate')),
+            ],
+            options={
+                'verbose_name': "Génération d'étiquettes",
+                'verbose_name_plural': "Générations d'étiquettes",
+                'ordering': ['-date_creation'],
+            },
+        ),
+    ]
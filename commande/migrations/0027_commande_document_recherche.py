@@ -0,0 +1,71 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:10
+
+from django.db import migrations, models
+from django.db.models import CharField, OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Cast, Coalesce, Concat, Lower
+
+# Index GIN pg_trgm servant les filtres LIKE '%mot%' de commande/recherche.py
+INDEX_TRIGRAMMES = {
+    'cmd_document_trgm_idx': 'commande_commande',
+    'client_document_trgm_idx': 'client_client',
+}
+
+
+def initialiser_documents(apps, schema_editor):
+    """Même expression que commande.recherche.expression_document, par lots de clés primaires"""
+    Commande = apps.get_model('commande', 'Commande')
+    Client = apps.get_model('client', 'Client')
+    Ville = apps.get_model('parametre', 'Ville')
+
+    ville = Ville.objects.filter(pk=OuterRef('ville_id'))
+    document = Lower(Concat(
+        'num_cmd', Value(' '),
+        Coalesce(Cast('id_yz', CharField()), Value('')), Value(' '),
+        Coalesce('ville_init', Value('')), Value(' '),
+        Coalesce(Subquery(ville.values('nom')[:1]), Value('')), Value(' '),
+        Coalesce(Subquery(ville.values('region__nom_region')[:1]), Value('')), Value(' '),
+        Coalesce(Subquery(Client.objects.filter(pk=OuterRef('client_id')).values('document_recherche')[:1]), Value('')),
+        Value(' '), Coalesce('adresse', Value('')),
+        output_field=TextField(),
+    ))
+
+    dernier = Commande.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for debut in range(0, dernier + 1, 20000):
+        Commande.objects.filter(pk__gte=debut, pk__lt=debut + 20000).update(document_recherche=document)
+
+
+def creer_index_trigrammes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        # sqlite (tests) : les filtres de recherche s'exécutent sans index
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for nom, table in INDEX_TRIGRAMMES.items():
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {nom} ON {table} USING gin (document_recherche gin_trgm_ops)"
+        )
+
+
+def supprimer_index_trigrammes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nom in INDEX_TRIGRAMMES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {nom}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0002_client_document_recherche'),
+        ('commande', '0026_etiquette_job'),
+        ('parametre', '0005_export_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='document_recherche',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Document de recherche'),
+        ),
+        migrations.RunPython(initialiser_documents, migrations.RunPython.noop),
+        migrations.RunPython(creer_index_trigrammes, supprimer_index_trigrammes),
+    ]
@@ -0,0 +1,44 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def compter_files(apps, schema_editor):
+    """Compteurs initiaux : une requête d'agrégat sur l'état courant dénormalisé"""
+    Commande = apps.get_model('commande', 'Commande')
+    CompteurFile = apps.get_model('commande', 'CompteurFile')
+    CompteurFile.objects.bulk_create([
+        CompteurFile(operateur_id=operateur_id, etat_id=etat_id, nombre=nombre)
+        for operateur_id, etat_id, nombre in Commande.objects.filter(etat_courant__isnull=False).values_list(
+            'operateur_etat_courant_id', 'etat_courant_id'
+        ).annotate(nombre=Count('id')).order_by()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commande', '0027_commande_document_recherche'),
+        ('parametre', '0005_export_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompteurFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.IntegerField(default=0)),
+                ('etat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compteurs_file', to='commande.enumetatcmd')),
+                ('operateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='compteurs_file', to='parametre.operateur')),
+            ],
+            options={
+                'verbose_name': 'Compteur de file',
+                'verbose_name_plural': 'Compteurs de files',
+                'constraints': [
+                    models.UniqueConstraint(condition=models.Q(('operateur__isnull', False)), fields=('operateur', 'etat'), name='compteur_file_operateur_etat_uniq'),
+                    models.UniqueConstraint(condition=models.Q(('operateur__isnull', True)), fields=('etat',), name='compteur_file_etat_sans_operateur_uniq'),
+                ],
+            },
+        ),
+        migrations.RunPython(compter_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commande', '0028_compteur_file'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='etatcommande',
+            index=models.Index(condition=models.Q(('date_fin__isnull', True)), fields=['commande', 'enum_etat'], name='etat_cmd_ouvert_cmd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='etatcommande',
+            index=models.Index(condition=models.Q(('date_fin__isnull', True), ('operateur__isnull', False)), fields=['operateur', 'enum_etat', '-date_debut'], name='etat_cmd_ouvert_op_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='etatcommande',
+            index=models.Index(fields=['commande', '-date_debut'], name='etat_cmd_cmd_debut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='etatcommande',
+            index=models.Index(fields=['enum_etat', 'date_debut'], name='etat_cmd_etat_debut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='etatcommande',
+            index=models.Index(fields=['operateur', 'date_debut'], name='etat_cmd_op_debut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['operateur', 'date_operation'], name='operation_op_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['commande', '-date_operation'], name='operation_cmd_date_idx'),
+        ),
+    ]
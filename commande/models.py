@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone
 from client.models import Client
 from article.models import Article, VarianteArticle
-from parametre.models import Ville, Operateur
+from parametre.models import Region, Ville, Operateur
+from commande.sequences import allouer_ids_yz, allouer_numero_commande
 
 # Create your models here.
 
@@ -95,6 +98,20 @@ class Commande(models.Model):
     # Relation avec Envoi pour les exports journaliers  
     envoi = models.ForeignKey('Envoi', on_delete=models.SET_NULL, null=True, blank=True, related_name='commandes_associees')
 
+    # État courant dénormalisé (maintenu par EtatCommande.save/delete)
+    etat_courant = models.ForeignKey(EnumEtatCmd, on_delete=models.SET_NULL, null=True, blank=True, related_name='commandes_courantes', verbose_name="État courant")
+    date_etat_courant = models.DateTimeField(null=True, blank=True, verbose_name="Date de début de l'état courant")
+    operateur_etat_courant = models.ForeignKey(Operateur, on_delete=models.SET_NULL, null=True, blank=True, related_name='commandes_etat_courant', verbose_name="Opérateur de l'état courant")
+
+    # Document de la recherche globale (commande/recherche.py), recalculé en base par save()
+    document_recherche = models.TextField(blank=True, default='', editable=False, verbose_name="Document de recherche")
+
+    # Champs dont dépend document_recherche (attname)
+    CHAMPS_DOCUMENT = ('num_cmd', 'id_yz', 'client_id', 'ville_id', 'ville_init', 'adresse')
+
+    # Champs écrits en base par leurs services, exclus d'une sauvegarde complète
+    CHAMPS_SERVICES = ('document_recherche', 'etat_courant', 'date_etat_courant', 'operateur_etat_courant')
+
     class Meta:
         verbose_name = "Commande"
         verbose_name_plural = "Commandes"
@@ -102,61 +119,81 @@ class Commande(models.Model):
         constraints = [
             models.CheckConstraint(check=models.Q(total_cmd__gte=0), name='total_cmd_positif'),
         ]
+        indexes = [
+            models.Index(fields=['etat_courant', '-date_etat_courant'], name='cmd_etat_courant_date_idx'),
+            models.Index(fields=['operateur_etat_courant', 'etat_courant'], name='cmd_operateur_etat_idx'),
+        ]
     
     # Point de départ souhaité pour id_yz
     START_ID_YZ = 211971
 
-    def save(self, *args, **kwargs):
-        # Générer l'ID YZ automatiquement si ce n'est pas encore fait
-        if self.id_yz is None:
-            last_id_yz = Commande.objects.aggregate(max_id=models.Max('id_yz'))['max_id']
-            base = self.START_ID_YZ - 1
-            # Si aucune commande, commencer à 211971; sinon continuer après le max existant
-            self.id_yz = max(last_id_yz or base, base) + 1 
-        
-        # Détecter automatiquement la source basée sur le numéro de commande
+    @classmethod
+    def allouer_ids_yz(cls, nombre):
+        """
+        Réserve `nombre` identifiants YZ uniques et croissants (séquence PostgreSQL, sans verrou)
+        pour des insertions unitaires ou en masse (bulk_create) et les retourne sous forme de liste.
+        """
+        return allouer_ids_yz(nombre)
+
+    def detecter_source(self):
+        """Détecte automatiquement la source basée sur le numéro de commande"""
         if self.num_cmd and not self.source:
             if self.num_cmd.startswith('YCN'):
                 self.source = 'Youcan'
             elif self.num_cmd.startswith('SHP'):
                 self.source = 'Shopify'
+
+    def save(self, *args, **kwargs):
+        # Générer l'ID YZ automatiquement si ce n'est pas encore fait
+        if self.id_yz is None:
+            # Première valeur : START_ID_YZ (211971), puis séquence
+            self.id_yz = self.allouer_ids_yz(1)[0]
+        
+        # Détecter automatiquement la source basée sur le numéro de commande
+        self.detecter_source()
         
         # Générer le numéro de commande selon l'origine si ce n'est pas déjà fait
         if not self.num_cmd:
             if self.origine == 'OC':
                 # Format pour les opérateurs de confirmation: OC-00001
-                prefix = 'OC-'
-                last_oc = Commande.objects.filter(
-                    num_cmd__startswith=prefix
-                ).order_by('-num_cmd').first()
-                
-                if last_oc:
-                    last_number = int(last_oc.num_cmd.split('-')[1])
-                    new_number = last_number + 1
-                else:
-                    new_number = 1
-                
-                self.num_cmd = f"{prefix}{new_number:05d}"
+                self.num_cmd = allouer_numero_commande('OC-')
                 
             elif self.origine == 'ADMIN':
                 # Format pour les administrateurs: ADMIN-00001
-                prefix = 'ADMIN-'
-                last_admin = Commande.objects.filter(
-                    num_cmd__startswith=prefix
-                ).order_by('-num_cmd').first()
-                
-                if last_admin:
-                    last_number = int(last_admin.num_cmd.split('-')[1])
-                    new_number = last_number + 1
-                else:
-                    new_number = 1
-                
-                self.num_cmd = f"{prefix}{new_number:05d}"
+                self.num_cmd = allouer_numero_commande('ADMIN-')
             else:
                 # Pour les commandes synchronisées, utiliser l'ID YZ comme avant
                 self.num_cmd = str(self.id_yz)
         
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # document_recherche est écrit par commande.recherche, l'état courant par les états de
+            # la commande : une instance chargée avant un renommage du client ou un changement
+            # d'état ne doit pas réécrire une valeur périmée (ni fausser les compteurs de files)
+            kwargs['update_fields'] = [
+                champ.name for champ in self._meta.concrete_fields
+                if not champ.primary_key and champ.name not in self.CHAMPS_SERVICES
+            ]
         super().save(*args, **kwargs)
+
+        if update_fields is None or {champ.removesuffix('_id') for champ in self.CHAMPS_DOCUMENT} & {
+            champ.removesuffix('_id') for champ in update_fields
+        }:
+            valeurs = self._valeurs_document()
+            if valeurs != getattr(self, '_document_source', None):
+                from commande.recherche import rafraichir_documents
+                rafraichir_documents(Commande.objects.filter(pk=self.pk))
+                self._document_source = valeurs
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._document_source = instance._valeurs_document()
+        return instance
+
+    def _valeurs_document(self):
+        # __dict__ : ne pas recharger un champ différé
+        return tuple(self.__dict__.get(champ) for champ in self.CHAMPS_DOCUMENT)
     
     @classmethod
     def update_sources_from_num_cmd(cls):
@@ -184,10 +221,45 @@ class Commande(models.Model):
     def __str__(self):
         return f"Commande {self.id_yz or self.num_cmd} - {self.client}"
     
+    @classmethod
+    def rafraichir_etat_courant(cls, queryset=None):
+        """
+        Recalcule en une seule requête UPDATE les champs dénormalisés de l'état courant
+        (etat_courant, date_etat_courant, operateur_etat_courant) à partir des
+        EtatCommande ouverts. Retourne le nombre de commandes mises à jour.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+
+        etat_ouvert = EtatCommande.objects.filter(
+            commande=models.OuterRef('pk'),
+            date_fin__isnull=True
+        ).order_by('-date_debut', '-id')
+
+        # Cette mise à jour contourne les compteurs de files : reconcilier() après coup
+        return queryset.order_by().update(
+            etat_courant=models.Subquery(etat_ouvert.values('enum_etat')[:1]),
+            date_etat_courant=models.Subquery(etat_ouvert.values('date_debut')[:1]),
+            operateur_etat_courant=models.Subquery(etat_ouvert.values('operateur')[:1]),
+        )
+
     @property
     def etat_actuel(self):
         """Retourne l'état actuel de la commande"""
+        # Utiliser les états préchargés (prefetch_related('etats')) pour éviter une requête
+        etats_precharges = getattr(self, '_prefetched_objects_cache', {}).get('etats')
+        if etats_precharges is not None:
+            return next((etat for etat in etats_precharges if etat.date_fin is None), None)
         return self.etats.filter(date_fin__isnull=True).first()
+
+    @property
+    def libelle_etat_actuel(self):
+        """Retourne le libellé de l'état actuel en s'appuyant sur le champ dénormalisé etat_courant"""
+        if self.etat_courant_id:
+            return self.etat_courant.libelle
+        etat = self.etat_actuel
+        return etat.enum_etat.libelle if etat else None
+
     @property
     def historique_etats(self):
         """Retourne l'historique complet des états"""
@@ -197,45 +269,12 @@ class Commande(models.Model):
         """
         Recalcule automatiquement les totaux de la commande selon le compteur upsell.
         Tous les articles de la commande prennent le prix upsell correspondant au compteur.
+        Le calcul est fait en une passe par commande/tarification.py.
         """
-        from commande.templatetags.commande_filters import get_prix_upsell_avec_compteur
-        
-        print(f"🔄 recalculer_totaux_upsell - Compteur actuel: {self.compteur}")
-        
-        nouveau_total = 0
-        
-        # Recalculer chaque panier selon le compteur upsell
-        for panier in self.paniers.all():
-            # Vérifier si une remise a été appliquée sur ce panier
-            if hasattr(panier, 'remise_appliquer') and panier.remise_appliquer:
-                # Une remise a été appliquée - NE PAS recalculer, conserver le prix remisé
-                print(f"   📦 {panier.article.nom} (REMISE APPLIQUÉE): qté={panier.quantite}, sous_total préservé={panier.sous_total}")
-                nouveau_total += float(panier.sous_total)
-            else:
-                # Aucune remise - calculer selon le compteur de la commande
-                prix_unitaire = get_prix_upsell_avec_compteur(panier.article, self.compteur)
-                nouveau_sous_total = prix_unitaire * panier.quantite
-                
-                print(f"   📦 {panier.article.nom} (upsell: {panier.article.isUpsell}): qté={panier.quantite}, prix={prix_unitaire}, sous_total={nouveau_sous_total}")
-                
-                # Mettre à jour le sous-total du panier si nécessaire
-                if panier.sous_total != nouveau_sous_total:
-                    panier.sous_total = float(nouveau_sous_total)
-                    panier.save()
-                
-                nouveau_total += float(nouveau_sous_total)
-        
-        # Ajouter les frais de livraison au total SEULEMENT si frais_livraison = True
-        if self.frais_livraison:
-            frais_livraison = self.ville.frais_livraison if self.ville else 0
-            nouveau_total_avec_frais = float(nouveau_total) + float(frais_livraison)
-        else:
-            nouveau_total_avec_frais = float(nouveau_total)
-        
-        # Mettre à jour le total de la commande
-        if self.total_cmd != nouveau_total_avec_frais:
-            self.total_cmd = nouveau_total_avec_frais
-            self.save(update_fields=['total_cmd'])
+        from commande.tarification import recalculer_commande
+
+        tarif = recalculer_commande(self, recalculer_compteur=False)
+        print(f"🔄 recalculer_totaux_upsell - Compteur: {self.compteur}, total: {tarif.total}")
     
     @property
     def sous_total_articles(self):
@@ -267,19 +306,14 @@ class Commande(models.Model):
         """
         Recalcule le compteur upsell en tenant compte des remises appliquées.
         Cette méthode doit être appelée chaque fois qu'une remise est appliquée/désactivée.
+        Les prix des lignes et le total sont recalculés dans la même passe.
         """
-        total_quantite_upsell_effective = self.calculer_quantite_upsell_effective()
-        ancien_compteur = self.compteur
-
-        # Appliquer la logique : compteur = max(0, total_quantite_upsell_effective - 1)
-        if total_quantite_upsell_effective >= 2:
-            self.compteur = total_quantite_upsell_effective - 1
-        else:
-            self.compteur = 0
+        from commande.tarification import recalculer_commande
 
+        ancien_compteur = self.compteur
+        recalculer_commande(self, recalculer_compteur=True)
         if ancien_compteur != self.compteur:
-            self.save(update_fields=['compteur'])
-            print(f"🔄 Compteur upsell recalculé: {ancien_compteur} → {self.compteur} (quantité effective: {total_quantite_upsell_effective})")
+            print(f"🔄 Compteur upsell recalculé: {ancien_compteur} → {self.compteur}")
 
         return self.compteur
 
@@ -289,7 +323,6 @@ class Commande(models.Model):
         À appeler dans les vues après changement de remise.
         """
         self.recalculer_compteur_upsell()
-        self.recalculer_totaux_upsell()
     
     @property
     def total_articles(self):
@@ -312,75 +345,23 @@ class Commande(models.Model):
         Corrige automatiquement tous les paniers d'articles en liquidation et en promotion
         pour s'assurer qu'ils n'ont pas remise_appliquer = True
         """
-        from django.db.models import Q
-        
-        # Corriger les paniers d'articles en liquidation
-        paniers_liquidation = self.paniers.filter(
-            article__phase='LIQUIDATION',
-            remise_appliquer=True
-        )
-        
-        for panier in paniers_liquidation:
-            print(f"🔧 Correction panier liquidation: {panier.article.nom}")
-            # Recalculer le sous-total avec le prix de liquidation
-            prix_liquidation = panier.article.Prix_liquidation or panier.article.prix_actuel or panier.article.prix_unitaire
-            panier.sous_total = float(prix_liquidation) * panier.quantite
-            panier.remise_appliquer = False
-            panier.type_remise_appliquee = ''
-            panier.save()
-        
-        # Corriger les paniers d'articles en promotion
-        # Utiliser une requête Django pour identifier les articles avec promotions actives
-        from django.utils import timezone
-        now = timezone.now()
-        
-        paniers_promotion = self.paniers.filter(
-            article__promotions__active=True,
-            article__promotions__date_debut__lte=now,
-            article__promotions__date_fin__gte=now,
-            remise_appliquer=True
-        ).distinct()
-        
-        for panier in paniers_promotion:
-            print(f"🔧 Correction panier promotion: {panier.article.nom}")
-            # Recalculer le sous-total avec le prix promotionnel
-            prix_promotion = panier.article.prix_actuel or panier.article.prix_unitaire
-            panier.sous_total = float(prix_promotion) * panier.quantite
-            panier.remise_appliquer = False
-            panier.type_remise_appliquee = ''
-            panier.save()
+        from commande.tarification import recalculer_commande
+
+        # Seules les lignes à remise interdite sont recalculées ; le total suit
+        recalculer_commande(self, recalculer_compteur=False, recalculer_lignes=False)
 
     def recalculer_total_avec_frais(self):
         """
         Recalcule le total de la commande en incluant les frais de livraison
         SEULEMENT si frais_livraison = True
         """
-        # Corriger d'abord les paniers en liquidation et en promotion
-        self.corriger_paniers_liquidation_et_promotion()
-        
-        # Calculer le sous-total des articles
-        sous_total_articles = sum(panier.sous_total for panier in self.paniers.all())
-        
-        if self.frais_livraison:
-            # Récupérer les frais de livraison de la ville
-            frais_ville = self.ville.frais_livraison if self.ville else 0
-            
-            # Calculer le nouveau total avec frais
-            nouveau_total = float(sous_total_articles) + float(frais_ville)
-            
-            # Mettre à jour le total si nécessaire
-            if self.total_cmd != nouveau_total:
-                self.total_cmd = nouveau_total
-                # Éviter la récursion en utilisant update_fields
-                Commande.objects.filter(id=self.id).update(total_cmd=nouveau_total)
-                print(f"✅ Frais de livraison ajoutés: {sous_total_articles} + {frais_ville} = {nouveau_total}")
-        else:
-            # Si frais_livraison = False, calculer le total sans frais
-            nouveau_total = float(sous_total_articles)
-            if self.total_cmd != nouveau_total:
-                self.total_cmd = nouveau_total
-                Commande.objects.filter(id=self.id).update(total_cmd=nouveau_total)
-                print(f"ℹ️  Frais de livraison désactivés - Total recalculé: {nouveau_total}")
+        from commande.tarification import recalculer_commande
+
+        # Corrige au passage les remises des paniers en liquidation et en promotion
+        ancien_total = self.total_cmd
+        tarif = recalculer_commande(self, recalculer_compteur=False, recalculer_lignes=False)
+        if ancien_total != tarif.total:
+            print(f"✅ Total recalculé: {tarif.sous_total_articles} + {tarif.frais_livraison} = {tarif.total}")
 
     # === Méthodes pour la gestion des articles retournés ===
     
@@ -520,119 +501,29 @@ class Panier(models.Model):
                 'recalcule': True si le prix a été recalculé, False sinon
             }
         """
-        from decimal import Decimal
-
-        # Validation
-        if not self.article or self.quantite <= 0:
-            return {
-                'prix_unitaire': 0,
-                'sous_total': 0,
-                'type_prix': 'error',
-                'recalcule': False
-            }
+        from commande import tarification
 
-        # PROTECTION: Ne PAS recalculer si la commande est confirmée ou dans un état avancé
-        # Les prix sont "gelés" au moment de la confirmation
-        etats_proteges = [
-            'Confirmée',
-            'En préparation',
-            'Préparation en cours',
-            'Préparée',
-            'Mise en distribution',
-            'En cours de livraison',
-            'En livraison',
-            'Livrée',
-            'Livrée Partiellement',
-            'Livrée avec changement',
-            'Retournée',
-            'Reportée'
-        ]
-
-        if not force_recalcul and self.commande.etat_actuel:
-            etat_actuel_libelle = self.commande.etat_actuel.enum_etat.libelle
-            if etat_actuel_libelle in etats_proteges:
-                # Commande confirmée ou avancée - NE PAS RECALCULER
-                prix_unitaire = Decimal(str(self.sous_total)) / Decimal(str(self.quantite))
-                return {
-                    'prix_unitaire': float(prix_unitaire),
-                    'sous_total': float(self.sous_total),
-                    'type_prix': 'prix_gele',
-                    'recalcule': False,
-                    'message': f'Prix gelé - Commande en état "{etat_actuel_libelle}"'
-                }
-
-        # 1. Si une remise a été appliquée - NE PAS RECALCULER
-        if self.remise_appliquer:
-            # Protéger contre les articles en liquidation/promotion
-            if self.article.phase == 'LIQUIDATION' or (hasattr(self.article, 'has_promo_active') and self.article.has_promo_active):
-                # Forcer la suppression de la remise
-                self.remise_appliquer = False
-                self.type_remise_appliquee = ''
-                # Continuer vers le calcul normal
-            else:
-                # Conserver le prix avec remise - le sous_total est déjà correct
-                prix_unitaire = Decimal(str(self.sous_total)) / Decimal(str(self.quantite))
-                return {
-                    'prix_unitaire': float(prix_unitaire),
-                    'sous_total': float(self.sous_total),
-                    'type_prix': f'remise_{self.type_remise_appliquee}',
-                    'recalcule': False
-                }
-
-        # 2. Déterminer le prix unitaire selon les règles métier
-        prix_unitaire = None
-        type_prix = 'normal'
-
-        # Promotion active - priorité sur tout sauf remise appliquée
-        if hasattr(self.article, 'has_promo_active') and self.article.has_promo_active:
-            prix_unitaire = self.article.prix_actuel or self.article.prix_unitaire
-            type_prix = 'promotion'
-
-        # Phase liquidation
-        elif self.article.phase == 'LIQUIDATION':
-            prix_unitaire = self.article.Prix_liquidation if hasattr(self.article, 'Prix_liquidation') and self.article.Prix_liquidation else self.article.prix_actuel or self.article.prix_unitaire
-            type_prix = 'liquidation'
-
-        # Phase test
-        elif self.article.phase == 'EN_TEST':
-            prix_unitaire = self.article.prix_actuel or self.article.prix_unitaire
-            type_prix = 'test'
-
-        # Article upsell avec compteur
-        elif hasattr(self.article, 'isUpsell') and self.article.isUpsell and self.commande.compteur > 0:
-            # Calculer le prix selon le compteur
-            if self.commande.compteur == 1 and self.article.prix_upsell_1:
-                prix_unitaire = self.article.prix_upsell_1
-            elif self.commande.compteur == 2 and self.article.prix_upsell_2:
-                prix_unitaire = self.article.prix_upsell_2
-            elif self.commande.compteur == 3 and self.article.prix_upsell_3:
-                prix_unitaire = self.article.prix_upsell_3
-            elif self.commande.compteur >= 4 and self.article.prix_upsell_4:
-                prix_unitaire = self.article.prix_upsell_4
-            else:
-                prix_unitaire = self.article.prix_actuel or self.article.prix_unitaire
-            type_prix = f'upsell_niveau_{self.commande.compteur}'
-
-        # Prix normal
+        etat_actuel_libelle = None if force_recalcul else self.commande.libelle_etat_actuel
+        if etat_actuel_libelle in tarification.ETATS_PRIX_GELES:
+            # Commande confirmée ou avancée - NE PAS RECALCULER
+            ligne = tarification._ligne_gelee(self, etat_actuel_libelle)
         else:
-            prix_unitaire = self.article.prix_actuel or self.article.prix_unitaire
-            type_prix = 'normal'
-
-        # 3. Calculer le sous-total
-        prix_unitaire = Decimal(str(prix_unitaire))
-        sous_total = prix_unitaire * Decimal(str(self.quantite))
-
-        # 4. Sauvegarder dans le panier avec le type de prix gelé
-        self.sous_total = float(sous_total)
-        self.type_prix_gele = type_prix  # Sauvegarder le type de prix (liquidation, promotion, etc.)
-        self.save(update_fields=['sous_total', 'remise_appliquer', 'type_remise_appliquee', 'type_prix_gele'])
-
-        return {
-            'prix_unitaire': float(prix_unitaire),
-            'sous_total': float(sous_total),
-            'type_prix': type_prix,
-            'recalcule': True
+            en_promotion = bool(self.article_id) and self.article.has_promo_active
+            ligne = tarification.prix_ligne(self, self.commande.compteur, en_promotion)
+            if ligne.recalcule:
+                self.sous_total = ligne.sous_total
+                self.type_prix_gele = ligne.type_prix
+                self.save(update_fields=tarification.CHAMPS_PANIER)
+
+        resultat = {
+            'prix_unitaire': float(ligne.prix_unitaire),
+            'sous_total': float(ligne.sous_total),
+            'type_prix': ligne.type_prix,
+            'recalcule': ligne.recalcule,
         }
+        if ligne.message:
+            resultat['message'] = ligne.message
+        return resultat
 
     def __str__(self):
         return f"{self.commande.num_cmd} - {self.article.nom} (x{self.quantite})"
@@ -657,9 +548,83 @@ class EtatCommande(models.Model):
                 name='date_debut_avant_date_fin'
             ),
         ]
+        indexes = [
+            # Échéances des confirmations décalées encore ouvertes (commande/confirmations_decalees.py)
+            models.Index(
+                fields=['date_fin_delayed'],
+                condition=models.Q(date_fin__isnull=True, date_fin_delayed__isnull=False),
+                name='etat_cmd_delayed_ouvert_idx'
+            ),
+            # État ouvert d'une commande (commande, date_fin IS NULL, enum_etat)
+            models.Index(
+                fields=['commande', 'enum_etat'],
+                condition=models.Q(date_fin__isnull=True),
+                name='etat_cmd_ouvert_cmd_idx'
+            ),
+            # Files des opérateurs : états ouverts d'un opérateur, par état, les plus récents d'abord
+            models.Index(
+                fields=['operateur', 'enum_etat', '-date_debut'],
+                condition=models.Q(date_fin__isnull=True, operateur__isnull=False),
+                name='etat_cmd_ouvert_op_idx'
+            ),
+            # Historique d'une commande (ordering -date_debut)
+            models.Index(fields=['commande', '-date_debut'], name='etat_cmd_cmd_debut_idx'),
+            # Périodes des KPIs : entrées dans un état, ou actions d'un opérateur, sur une plage de dates
+            models.Index(fields=['enum_etat', 'date_debut'], name='etat_cmd_etat_debut_idx'),
+            models.Index(fields=['operateur', 'date_debut'], name='etat_cmd_op_debut_idx'),
+        ]
     
     def __str__(self):
         return f"{self.commande.num_cmd} - {self.enum_etat.libelle}"
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.synchroniser_etat_courant()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.synchroniser_etat_courant()
+        return result
+
+    def synchroniser_etat_courant(self):
+        """
+        Répercute l'ouverture/la fermeture de cet état sur l'état courant dénormalisé de la commande
+        et sur les compteurs de files (commande/compteurs.py)
+        """
+        from commande.compteurs import ajuster, deplacer
+
+        with transaction.atomic(savepoint=False):
+            # no_key : compatible avec le verrou de clé étrangère pris par l'insertion de l'état
+            precedent = Commande.objects.select_for_update(no_key=True).filter(pk=self.commande_id).values_list(
+                'operateur_etat_courant_id', 'etat_courant_id'
+            ).first()
+            valeurs = self._valeurs_etat_courant()
+            Commande.objects.filter(pk=self.commande_id).update(**valeurs)
+            if precedent is not None:
+                ajuster(deplacer(
+                    {}, precedent, (valeurs['operateur_etat_courant_id'], valeurs['etat_courant_id'])
+                ))
+
+        # Garder l'instance de commande déjà chargée cohérente avec la base
+        if EtatCommande.commande.is_cached(self):
+            commande = self.commande
+            getattr(commande, '_prefetched_objects_cache', {}).pop('etats', None)
+            for champ, valeur in valeurs.items():
+                setattr(commande, champ, valeur)
+
+    def _valeurs_etat_courant(self):
+        etat_ouvert = EtatCommande.objects.filter(
+            commande_id=self.commande_id,
+            date_fin__isnull=True
+        ).order_by('-date_debut', '-id').values('enum_etat_id', 'date_debut', 'operateur_id').first() or {}
+
+        return {
+            'etat_courant_id': etat_ouvert.get('enum_etat_id'),
+            'date_etat_courant': etat_ouvert.get('date_debut'),
+            'operateur_etat_courant_id': etat_ouvert.get('operateur_id'),
+        }
     
     def terminer_etat(self, operateur=None):
         """Termine cet état en définissant la date_fin"""
@@ -691,6 +656,32 @@ class EtatCommande(models.Model):
             return f"{minutes:02d}m : {secondes:02d}s"
 
 
+class CompteurFile(models.Model):
+    """Nombre de commandes dont l'état courant est `etat` avec `operateur` (NULL : sans opérateur)"""
+    operateur = models.ForeignKey(Operateur, on_delete=models.CASCADE, null=True, blank=True, related_name='compteurs_file')
+    etat = models.ForeignKey(EnumEtatCmd, on_delete=models.CASCADE, related_name='compteurs_file')
+    nombre = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Compteur de file"
+        verbose_name_plural = "Compteurs de files"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['operateur', 'etat'],
+                condition=models.Q(operateur__isnull=False),
+                name='compteur_file_operateur_etat_uniq'
+            ),
+            models.UniqueConstraint(
+                fields=['etat'],
+                condition=models.Q(operateur__isnull=True),
+                name='compteur_file_etat_sans_operateur_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.etat} - {self.operateur or 'sans opérateur'} : {self.nombre}"
+
+
 class Operation(models.Model):
     TYPE_OPERATION_CHOICES = [
         # Opérations spécifiques de confirmation
@@ -730,6 +721,11 @@ class Operation(models.Model):
         verbose_name = "Opération"
         verbose_name_plural = "Opérations"
         ordering = ['-date_operation']
+        indexes = [
+            # Activité d'un opérateur sur une période (KPIs), dernière opération d'une commande
+            models.Index(fields=['operateur', 'date_operation'], name='operation_op_date_idx'),
+            models.Index(fields=['commande', '-date_operation'], name='operation_cmd_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_type_operation_display()} - {self.commande.num_cmd} par {self.operateur}"
@@ -889,6 +885,44 @@ class EtiquetteTemplate(models.Model):
         }
 
 
+class EtiquetteJob(models.Model):
+    """Génération d'un PDF d'étiquettes en arrière-plan (voir commande/etiquettes_pdf.py)"""
+    STATUT_CHOICES = [
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminé'),
+        ('erreur', 'Erreur'),
+    ]
+
+    template = models.ForeignKey(EtiquetteTemplate, on_delete=models.CASCADE, related_name='jobs')
+    commande_ids = models.JSONField(default=list)
+    format_type = models.CharField(max_length=10, default='barcode')
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    nb_total = models.PositiveIntegerField(default=0, help_text="Nombre d'étiquettes à rendre")
+    nb_rendues = models.PositiveIntegerField(default=0)
+    fichier = models.FileField(upload_to='etiquettes/', null=True, blank=True)
+    erreur = models.TextField(blank=True, null=True)
+    cree_par = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='etiquette_jobs')
+    date_creation = models.DateTimeField(default=timezone.now)
+    date_debut = models.DateTimeField(null=True, blank=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Génération d'étiquettes"
+        verbose_name_plural = "Générations d'étiquettes"
+        ordering = ['-date_creation']
+
+    def __str__(self):
+        return f"Étiquettes #{self.pk} ({self.template.name}) - {self.get_statut_display()}"
+
+    @property
+    def progression(self):
+        """Pourcentage d'étiquettes rendues"""
+        if self.statut == 'termine':
+            return 100
+        return int(self.nb_rendues * 100 / self.nb_total) if self.nb_total else 0
+
+
 class ArticleRetourne(models.Model):
     """
     Modèle pour stocker les articles/variantes retournés lors d'une livraison partielle.
@@ -999,9 +1033,15 @@ class ArticleRetourne(models.Model):
     def reintegrer_stock(self, operateur=None, commentaire=""):
         """Réintègre l'article en stock"""
         if self.peut_etre_reintegre():
+            from article import stock
+
             # Augmenter la quantité disponible de la variante
-            self.variante.qte_disponible += self.quantite_retournee
-            self.variante.save(update_fields=['qte_disponible'])
+            stock.retourner(
+                [(self.variante, self.quantite_retournee)],
+                commande=self.commande,
+                operateur=operateur,
+                commentaire=commentaire or f"Réintégration retour commande {self.commande.id_yz}",
+            )
             
             # Mettre à jour le statut
             self.statut_retour = 'reintegre_stock'
@@ -1012,3 +1052,54 @@ class ArticleRetourne(models.Model):
             
             return True
         return False
+
+
+# Document de recherche des commandes : suivre les renommages du client, de la ville et de la région
+
+@receiver(post_save, sender=Client)
+def rafraichir_documents_client(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_document_modifie', False):
+        from commande.recherche import rafraichir_documents
+        rafraichir_documents(Commande.objects.filter(client=instance))
+
+
+def _champs_geographiques(sender):
+    return ('nom', 'region_id') if sender is Ville else ('nom_region',)
+
+
+@receiver(pre_save, sender=Ville)
+@receiver(pre_save, sender=Region)
+def memoriser_nom_geographique(sender, instance, **kwargs):
+    champs = _champs_geographiques(sender)
+    instance._document_geographique = (
+        sender.objects.filter(pk=instance.pk).values_list(*champs).first() if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Ville)
+@receiver(post_save, sender=Region)
+def rafraichir_documents_geographiques(sender, instance, created, **kwargs):
+    valeurs = tuple(getattr(instance, champ) for champ in _champs_geographiques(sender))
+    if created or getattr(instance, '_document_geographique', valeurs) in (None, valeurs):
+        return
+    from commande.recherche import rafraichir_documents
+    filtre = {'ville': instance} if sender is Ville else {'ville__region': instance}
+    rafraichir_documents(Commande.objects.filter(**filtre))
+
+
+# Compteurs de files : retirer la commande supprimée de sa file
+
+@receiver(post_delete, sender=Commande)
+def retirer_commande_des_files(sender, instance, **kwargs):
+    if instance.etat_courant_id:
+        from commande.compteurs import ajuster
+        ajuster({(instance.operateur_etat_courant_id, instance.etat_courant_id): -1})
+
+
+# Registre des états (commande/etats.py) : recharger après toute modification des états
+
+@receiver(post_save, sender=EnumEtatCmd)
+@receiver(post_delete, sender=EnumEtatCmd)
+def invalider_registre_etats(sender, **kwargs):
+    from commande.etats import planifier_invalidation
+    planifier_invalidation()
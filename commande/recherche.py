@@ -0,0 +1,237 @@
+"""
+Recherche globale des interfaces (confirmation, logistique, préparation, supervision, administration).
+
+Chaque commande et chaque client porte un document de recherche dénormalisé
+(`document_recherche`, en minuscules) :
+  - client : nom, prénom, email, téléphone, adresse (Client.save) ;
+  - commande : numéro, identifiant YZ, ville initiale, ville, région, document du client, adresse
+    (recalculé en base par rafraichir_documents, depuis Commande.save et les signaux de
+    renommage du client / de la ville / de la région).
+
+Une catégorie de résultats = une requête :
+  - filtre : chaque mot de la requête est contenu dans le document (LIKE '%mot%'), servi sous
+    PostgreSQL par un index GIN pg_trgm (migration commande 0027) ; sous sqlite (tests) le même
+    filtre s'exécute sans index ;
+  - candidats : seuls les CANDIDATS documents correspondants les plus récents sont classés, ce qui
+    borne le coût d'une frappe courte ou très fréquente (« casa », « 06 ») ; un numéro de commande,
+    un identifiant ou un téléphone exact est toujours retenu ;
+  - classement : numéro / identifiant exact, puis correspondance sur le client, puis le reste ;
+    à rang égal, par similarité trigramme sous PostgreSQL, puis de la plus récente à la plus ancienne.
+
+Les compteurs par région / ville portent sur l'état courant dénormalisé, restreint aux états
+suivis par chaque interface (ETATS_ROLE). « Nouvelle » est le statut affiché d'une commande sans
+état courant (voir statut) : filtre_etats le traduit en etat_courant IS NULL.
+"""
+from django.db import connection
+from django.db.models import Case, CharField, Count, IntegerField, OuterRef, Q, Subquery, Sum, TextField, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat, Lower
+
+from .etats import ids_etats
+
+# Statut d'une commande qui n'a pas encore d'état
+NOUVELLE = 'Nouvelle'
+
+ETATS_ROLE = {
+    'CONFIRMATION': (NOUVELLE, 'Confirmée', 'Annulée'),
+    'LOGISTIQUE': ('Préparée', 'En livraison', 'Confirmée'),
+    'PREPARATION': ('En préparation', 'Collectée', 'Emballée'),
+    'SUPERVISION': ('Confirmée', 'En préparation', 'Préparée'),
+    'ADMIN': ('Confirmée', 'À imprimer', 'Préparée', 'En préparation'),
+}
+
+CANDIDATS = 200
+
+# Plus grand entier accepté pour une comparaison exacte sur id / id_yz
+ENTIER_MAX = 2 ** 31 - 1
+
+
+def termes(query):
+    """Mots distincts de la requête, en minuscules"""
+    mots = []
+    for mot in query.lower().split():
+        if mot not in mots:
+            mots.append(mot)
+    return mots
+
+
+def _filtre_document(mots, champ='document_recherche'):
+    filtre = Q()
+    for mot in mots:
+        filtre &= Q(**{f'{champ}__contains': mot})
+    return filtre
+
+
+def _similarite(query, champ='document_recherche'):
+    """Similarité trigramme (PostgreSQL) ; None sur les autres bases"""
+    if connection.vendor != 'postgresql':
+        return None
+    from django.contrib.postgres.search import TrigramWordSimilarity
+    return TrigramWordSimilarity(query.lower(), champ)
+
+
+def _classer(queryset, rang, query, *ordre):
+    queryset = queryset.annotate(rang=rang)
+    similarite = _similarite(query)
+    if similarite is not None:
+        queryset = queryset.annotate(similarite=similarite)
+        return queryset.order_by('rang', '-similarite', *ordre)
+    return queryset.order_by('rang', *ordre)
+
+
+def expression_document():
+    """Document de recherche d'une commande, calculé en SQL (sous-requêtes client / ville / région)"""
+    from client.models import Client
+    from parametre.models import Ville
+
+    ville = Ville.objects.filter(pk=OuterRef('ville_id'))
+    return Lower(Concat(
+        'num_cmd', Value(' '),
+        Coalesce(Cast('id_yz', CharField()), Value('')), Value(' '),
+        Coalesce('ville_init', Value('')), Value(' '),
+        Coalesce(Subquery(ville.values('nom')[:1]), Value('')), Value(' '),
+        Coalesce(Subquery(ville.values('region__nom_region')[:1]), Value('')), Value(' '),
+        Coalesce(Subquery(Client.objects.filter(pk=OuterRef('client_id')).values('document_recherche')[:1]), Value('')),
+        Value(' '), Coalesce('adresse', Value('')),
+        output_field=TextField(),
+    ))
+
+
+def rafraichir_documents(queryset):
+    """Recalcule le document de recherche des commandes du queryset en une requête UPDATE"""
+    return queryset.order_by().update(document_recherche=expression_document())
+
+
+def statut(commande):
+    """Libellé de l'état courant dénormalisé (sans requête si etat_courant est chargé)"""
+    return commande.etat_courant.libelle if commande.etat_courant_id else NOUVELLE
+
+
+def filtre_etats(etats, prefixe=''):
+    """
+    Q des commandes dont l'état courant est dans `etats` ; NOUVELLE désigne aussi les commandes
+    sans état courant. prefixe : chemin vers la commande ('villes__commandes__', ...).
+    """
+    filtre = Q(**{f'{prefixe}etat_courant_id__in': ids_etats(*etats)})
+    if NOUVELLE in etats:
+        filtre |= Q(**{f'{prefixe}etat_courant__isnull': True})
+    return filtre
+
+
+def rechercher_commandes(query, limite=10, etats=None):
+    """
+    Commandes correspondant à la requête, classées ; chaque commande porte `rang` :
+    1 = numéro ou identifiant, 2 = client, 3 = autre champ (ville, région, adresse).
+    etats : libellés d'état courant autorisés (None = tous).
+    """
+    from .models import Commande
+
+    query = query.strip()
+    mots = termes(query)
+    if not mots:
+        return []
+
+    commandes = Commande.objects.all()
+    if etats is not None:
+        commandes = commandes.filter(filtre_etats(etats))
+
+    numero = Q(num_cmd__in={query, query.upper()})
+    if query.isdigit() and int(query) <= ENTIER_MAX:
+        numero |= Q(pk=int(query)) | Q(id_yz=int(query))
+    candidats = commandes.filter(_filtre_document(mots)).order_by('-pk').values('pk')[:CANDIDATS]
+
+    rang = Case(
+        When(numero | Q(num_cmd__startswith=query) | Q(num_cmd__startswith=query.upper()), then=Value(1)),
+        When(_filtre_document(mots, 'client__document_recherche'), then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField(),
+    )
+    resultats = commandes.filter(Q(pk__in=candidats) | numero).select_related('client', 'ville__region', 'etat_courant')
+    return list(_classer(resultats, rang, query, '-pk')[:limite])
+
+
+def rechercher_clients(query, limite=8):
+    """Clients correspondant à la requête, avec leur nombre de commandes (`nb_commandes`)"""
+    from client.models import Client
+
+    query = query.strip()
+    mots = termes(query)
+    if not mots:
+        return []
+
+    candidats = Client.objects.filter(_filtre_document(mots)).order_by('-pk').values('pk')[:CANDIDATS]
+    rang = Case(
+        When(numero_tel=query, then=Value(1)),
+        When(Q(nom__istartswith=query) | Q(prenom__istartswith=query), then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField(),
+    )
+    clients = Client.objects.filter(Q(pk__in=candidats) | Q(numero_tel=query)).annotate(nb_commandes=Count('commandes'))
+    return list(_classer(clients, rang, query, '-pk')[:limite])
+
+
+def rechercher_articles(query, limite=5, description=True):
+    """Articles par nom / référence (et description), avec le stock disponible (`stock`) en une requête"""
+    from article.models import Article
+
+    filtre = Q(nom__icontains=query) | Q(reference__icontains=query)
+    if description:
+        filtre |= Q(description__icontains=query)
+    rang = Case(
+        When(Q(reference__iexact=query) | Q(nom__istartswith=query), then=Value(1)),
+        default=Value(2),
+        output_field=IntegerField(),
+    )
+    articles = Article.objects.filter(filtre).annotate(
+        rang=rang,
+        stock=Coalesce(Sum('variantes__qte_disponible', filter=Q(variantes__actif=True)), 0),
+    )
+    return list(articles.order_by('rang', 'nom')[:limite])
+
+
+def rechercher_regions(query, etats, limite=5):
+    """Régions par nom, avec leurs commandes dans les états `etats` (`nb_commandes`)"""
+    from parametre.models import Region
+
+    regions = Region.objects.filter(nom_region__icontains=query.strip()).annotate(
+        nb_commandes=Count('villes__commandes', filter=filtre_etats(etats, 'villes__commandes__'))
+    )
+    return list(regions.order_by('nom_region')[:limite])
+
+
+def rechercher_villes(query, etats, limite=5):
+    """Villes par nom ou région, avec leurs commandes dans les états `etats` (`nb_commandes`)"""
+    from parametre.models import Ville
+
+    query = query.strip()
+    villes = Ville.objects.filter(Q(nom__icontains=query) | Q(region__nom_region__icontains=query)).select_related(
+        'region'
+    ).annotate(nb_commandes=Count('commandes', filter=filtre_etats(etats, 'commandes__')))
+    return list(villes.order_by('nom')[:limite])
+
+
+def rechercher_villes_init(query, etats, limite=5):
+    """
+    Villes initiales (saisie d'origine des commandes) contenant la requête : [(ville_init, nb_commandes)].
+    Les valeurs sont prises parmi les candidats de l'index, puis comptées dans les états `etats`.
+    """
+    from .models import Commande
+
+    query = query.strip()
+    mots = termes(query)
+    if not mots:
+        return []
+
+    candidats = Commande.objects.filter(_filtre_document(mots)).order_by('-pk').values('pk')[:CANDIDATS]
+    valeurs = []
+    for ville_init in Commande.objects.filter(pk__in=candidats, ville_init__icontains=query).values_list(
+        'ville_init', flat=True
+    ).order_by().distinct():
+        if ville_init and len(valeurs) < limite:
+            valeurs.append(ville_init)
+    if not valeurs:
+        return []
+
+    comptes = dict(Commande.objects.filter(filtre_etats(etats), ville_init__in=valeurs).values_list(
+        'ville_init'
+    ).annotate(nombre=Count('id')).order_by())
+    return [(ville_init, comptes.get(ville_init, 0)) for ville_init in valeurs]
@@ -0,0 +1,205 @@
+"""
+Répartition automatique des commandes entre opérateurs, selon leur charge.
+
+Pour un profil (LOGISTIQUE : commandes préparées vers la livraison, CONFIRMATION :
+commandes non affectées vers les opérateurs de confirmation) :
+  1. la charge ouverte de chaque opérateur est lue en une requête d'agrégat, par région
+     (commandes dont l'état courant dénormalisé est un état de travail du profil) ;
+  2. le débit de chaque opérateur (commandes sorties de l'état cible sur les derniers jours)
+     donne son poids : un opérateur deux fois plus rapide reçoit deux fois plus de commandes ;
+  3. chaque commande, de la plus ancienne à la plus récente, va à l'opérateur de moindre
+     charge pondérée (charge / poids). Un opérateur qui a déjà des commandes dans la région
+     de la commande est préféré tant que sa charge pondérée ne dépasse pas celle du moins
+     chargé de plus de `tolerance` (20 % par défaut) : les tournées restent groupées ;
+  4. le plan est appliqué par le service de changement d'état en masse (commande/transitions.py).
+
+planifier() ne touche pas la base : elle sert au mode simulation (dry_run) et au benchmark
+(commande `benchmark_repartition`).
+"""
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from statistics import median
+from typing import Optional
+
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from .etats import ids_etats, obtenir_ou_creer_etat
+
+logger = logging.getLogger(__name__)
+
+PROFILS = {
+    'LOGISTIQUE': {
+        'types_operateur': ('LOGISTIQUE',),
+        'etat_source': 'Préparée',
+        'etat_cible': 'En cours de livraison',
+        'defauts_etat_cible': {'ordre': 60, 'couleur': '#F59E0B'},
+        'etats_charge': ('En cours de livraison', 'En livraison', 'Mise en distribution'),
+        # Une commande déjà passée en livraison n'est pas réaffectée automatiquement
+        'etats_exclus_historique': ('En cours de livraison', 'Livrée', 'Retournée'),
+        'commentaire': "Affectation automatique à {nom} pour livraison",
+    },
+    'CONFIRMATION': {
+        'types_operateur': ('CONFIRMATION',),
+        'etat_source': 'Non affectée',
+        'etat_cible': 'Affectée',
+        'defauts_etat_cible': {'ordre': 20, 'couleur': '#3B82F6'},
+        'etats_charge': ('Affectée', 'En cours de confirmation', 'Report de confirmation'),
+        'etats_exclus_historique': (),
+        'commentaire': "Affectation automatique à {nom} pour confirmation",
+    },
+}
+
+TOLERANCE_AFFINITE = 0.2
+JOURS_DEBIT = 7
+
+
+@dataclass
+class ChargeOperateur:
+    pk: int
+    nom: str
+    charge: int = 0
+    poids: float = 1.0
+    regions: Counter = field(default_factory=Counter)
+    affectees: int = 0
+
+    @property
+    def charge_ponderee(self):
+        return self.charge / self.poids
+
+
+@dataclass
+class PlanRepartition:
+    profil: str
+    affectations: dict = field(default_factory=dict)  # {commande_id: operateur_id}
+    operateurs: list = field(default_factory=list)
+    affinite: int = 0  # commandes affectées à un opérateur déjà présent dans leur région
+    message: str = ''
+    resultats: Optional[list] = None
+
+    def charges(self):
+        """Charge de chaque opérateur après application du plan"""
+        return {operateur.pk: operateur.charge for operateur in self.operateurs}
+
+
+def planifier(commandes, operateurs, tolerance=TOLERANCE_AFFINITE, profil=''):
+    """
+    Calcule le plan en mémoire. `commandes` : liste de (commande_id, region_id) dans l'ordre
+    de traitement ; `operateurs` : liste de ChargeOperateur (charges et régions modifiées en place).
+    """
+    plan = PlanRepartition(profil=profil, operateurs=operateurs)
+    if not operateurs:
+        return plan
+
+    for commande_id, region_id in commandes:
+        moins_charge = min(operateurs, key=lambda op: ((op.charge + 1) / op.poids, op.pk))
+        choisi = moins_charge
+        if region_id is not None and not moins_charge.regions[region_id]:
+            seuil = (moins_charge.charge + 1) / moins_charge.poids * (1 + tolerance)
+            proches = [op for op in operateurs if op.regions[region_id] and (op.charge + 1) / op.poids <= seuil]
+            if proches:
+                choisi = min(proches, key=lambda op: ((op.charge + 1) / op.poids, op.pk))
+        if region_id is not None and choisi.regions[region_id]:
+            plan.affinite += 1
+
+        plan.affectations[commande_id] = choisi.pk
+        choisi.charge += 1
+        choisi.affectees += 1
+        if region_id is not None:
+            choisi.regions[region_id] += 1
+    return plan
+
+
+def ponderer(operateurs, debits):
+    """
+    Poids proportionnel au débit ; plancher à la moitié du débit médian des opérateurs actifs
+    pour les nouveaux opérateurs. Sans aucun débit, tous les opérateurs ont le même poids.
+    """
+    valeurs = [debits.get(operateur.pk, 0) for operateur in operateurs]
+    positifs = [valeur for valeur in valeurs if valeur > 0]
+    plancher = median(positifs) / 2 if positifs else None
+    for operateur, debit in zip(operateurs, valeurs):
+        operateur.poids = max(debit, plancher) if plancher is not None else 1.0
+
+
+def charger_operateurs(config, maintenant=None):
+    """Opérateurs actifs du profil avec leur charge ouverte par région (une requête) et leur poids"""
+    from parametre.models import Operateur
+    from .models import Commande, EtatCommande
+
+    maintenant = maintenant or timezone.now()
+    operateurs = {
+        pk: ChargeOperateur(pk=pk, nom=f"{prenom} {nom}")
+        for pk, prenom, nom in Operateur.objects.filter(
+            type_operateur__in=config['types_operateur'], actif=True
+        ).order_by('pk').values_list('pk', 'prenom', 'nom')
+    }
+    if not operateurs:
+        return []
+
+    for operateur_id, region_id, nombre in Commande.objects.filter(
+        etat_courant_id__in=ids_etats(*config['etats_charge']),
+        operateur_etat_courant_id__in=list(operateurs),
+    ).values_list('operateur_etat_courant_id', 'ville__region_id').annotate(nombre=Count('id')).order_by():
+        operateurs[operateur_id].charge += nombre
+        if region_id is not None:
+            operateurs[operateur_id].regions[region_id] += nombre
+
+    debits = dict(EtatCommande.objects.filter(
+        enum_etat_id__in=ids_etats(config['etat_cible']),
+        operateur_id__in=list(operateurs),
+        date_fin__gte=maintenant - timedelta(days=JOURS_DEBIT),
+    ).values_list('operateur_id').annotate(nombre=Count('id')).order_by())
+    ponderer(list(operateurs.values()), {pk: nombre / JOURS_DEBIT for pk, nombre in debits.items()})
+    return list(operateurs.values())
+
+
+def commandes_a_repartir(config, limite=None):
+    """(commande_id, region_id) des commandes à répartir, les plus anciennes dans l'état source d'abord"""
+    from .models import Commande, EtatCommande
+
+    commandes = Commande.objects.filter(etat_courant_id__in=ids_etats(config['etat_source']))
+    if config['etats_exclus_historique']:
+        commandes = commandes.exclude(Exists(EtatCommande.objects.filter(
+            commande=OuterRef('pk'), enum_etat_id__in=ids_etats(*config['etats_exclus_historique'])
+        )))
+    commandes = commandes.order_by('date_etat_courant', 'pk').values_list('pk', 'ville__region_id')
+    return list(commandes[:limite] if limite else commandes)
+
+
+def repartir(profil='LOGISTIQUE', dry_run=False, limite=None, tolerance=TOLERANCE_AFFINITE):
+    """
+    Répartit les commandes du profil. En dry_run, retourne le plan sans rien écrire ;
+    sinon applique le plan (plan.resultats : résultats par commande du service de transition).
+    """
+    from .models import EnumEtatCmd
+    from .transitions import EFFECTUEE, changer_etats, compter
+
+    config = PROFILS[profil]
+    commandes = commandes_a_repartir(config, limite)
+    if not commandes:
+        return PlanRepartition(profil=profil, message=f"Aucune commande \"{config['etat_source']}\" à répartir")
+    operateurs = charger_operateurs(config)
+    if not operateurs:
+        return PlanRepartition(profil=profil, message=f"Aucun opérateur {profil.lower()} actif disponible")
+
+    plan = planifier(commandes, operateurs, tolerance, profil)
+    if dry_run:
+        plan.message = f"{len(plan.affectations)} commande(s) seraient réparties (simulation)"
+        return plan
+
+    etat_cible, _ = obtenir_ou_creer_etat(config['etat_cible'], defaults=config['defauts_etat_cible'])
+    noms = {operateur.pk: operateur.nom for operateur in operateurs}
+    plan.resultats = changer_etats(
+        list(plan.affectations),
+        etat_cible,
+        operateurs=plan.affectations,
+        etats_sources=(config['etat_source'],),
+        commentaire=lambda courant, operateur_id: config['commentaire'].format(nom=noms[operateur_id]),
+    )
+    effectuees = compter(plan.resultats)[EFFECTUEE]
+    plan.message = f"{effectuees} commandes réparties automatiquement"
+    logger.info(f"Répartition {profil}: {effectuees} commandes sur {len(operateurs)} opérateurs")
+    return plan
@@ -0,0 +1,64 @@
+"""
+Allocation des identifiants de commande (id_yz, numéros OC-/ADMIN-) via des séquences PostgreSQL.
+
+Les séquences sont créées et initialisées par la migration 0024_sequences_identifiants_commande.
+nextval() ne prend aucun verrou et n'est jamais annulé par un rollback : deux créations
+concurrentes ne peuvent donc pas obtenir la même valeur. Sur les autres bases (sqlite
+pour les tests), on retombe sur le calcul à partir du maximum existant.
+"""
+from django.db import connection, models
+
+SEQUENCE_ID_YZ = 'commande_id_yz_seq'
+
+# Préfixe de num_cmd -> séquence dédiée
+SEQUENCES_NUM_CMD = {
+    'OC-': 'commande_num_cmd_oc_seq',
+    'ADMIN-': 'commande_num_cmd_admin_seq',
+}
+
+
+def sequences_disponibles():
+    """Indique si la base courante gère les séquences (PostgreSQL)"""
+    return connection.vendor == 'postgresql'
+
+
+def prochaines_valeurs(sequence, nombre=1):
+    """Retourne `nombre` valeurs uniques et croissantes tirées de la séquence en une seule requête
+
+    Elles ne sont pas forcément consécutives : une création concurrente peut s'intercaler.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(%s) FROM generate_series(1, %s)",
+            [sequence, nombre]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def allouer_ids_yz(nombre=1):
+    """Réserve `nombre` identifiants YZ"""
+    from commande.models import Commande
+
+    if sequences_disponibles():
+        return prochaines_valeurs(SEQUENCE_ID_YZ, nombre)
+
+    # Fallback (sqlite) : continuer après le maximum existant
+    last_id_yz = Commande.objects.aggregate(max_id=models.Max('id_yz'))['max_id']
+    base = max(last_id_yz or Commande.START_ID_YZ - 1, Commande.START_ID_YZ - 1)
+    return list(range(base + 1, base + 1 + nombre))
+
+
+def allouer_numero_commande(prefix):
+    """Retourne le prochain numéro de commande pour le préfixe donné (ex: OC-00001)"""
+    from commande.models import Commande
+
+    if sequences_disponibles():
+        new_number = prochaines_valeurs(SEQUENCES_NUM_CMD[prefix])[0]
+    else:
+        # Fallback (sqlite) : continuer après le dernier numéro existant
+        last_commande = Commande.objects.filter(
+            num_cmd__startswith=prefix
+        ).order_by('-num_cmd').first()
+        new_number = int(last_commande.num_cmd.split('-')[1]) + 1 if last_commande else 1
+
+    return f"{prefix}{new_number:05d}"
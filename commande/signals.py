@@ -8,16 +8,21 @@ logger = logging.getLogger(__name__)
 
 
 @receiver(pre_save, sender=Commande)
-def detect_compteur_change(sender, instance, **kwargs):
+def detect_compteur_change(sender, instance, update_fields=None, **kwargs):
     """
     Détecte les changements du compteur et des frais de livraison avant la sauvegarde
     et stocke les anciennes valeurs pour comparaison
     """
+    if update_fields is not None and not {'compteur', 'frais_livraison'} & set(update_fields):
+        # Sauvegarde partielle qui ne touche ni le compteur ni les frais : rien à relire
+        instance._old_compteur = instance.compteur
+        instance._old_frais_livraison = instance.frais_livraison
+        return
     if instance.pk:
         try:
-            old_instance = Commande.objects.get(pk=instance.pk)
-            instance._old_compteur = old_instance.compteur
-            instance._old_frais_livraison = old_instance.frais_livraison
+            instance._old_compteur, instance._old_frais_livraison = Commande.objects.values_list(
+                'compteur', 'frais_livraison'
+            ).get(pk=instance.pk)
         except Commande.DoesNotExist:
             instance._old_compteur = 0
             instance._old_frais_livraison = False
@@ -56,12 +61,12 @@ def auto_recalcul_totaux_upsell(sender, instance, created, **kwargs):
         
         try:
             if compteur_changed:
-                # Déclencher le recalcul automatique des prix upsell
+                # Déclencher le recalcul automatique des prix upsell (frais de livraison inclus)
                 instance.recalculer_totaux_upsell()
                 print(f"🔄 Recalcul upsell déclenché pour commande {instance.id_yz}")
                 print(f"   Compteur: {old_compteur} → {nouveau_compteur}")
             
-            if frais_activated:
+            elif frais_activated:
                 # Recalculer avec les frais de livraison (seulement quand activés)
                 instance.recalculer_total_avec_frais()
                 print(f"🚚 Frais de livraison activés pour commande {instance.id_yz}")
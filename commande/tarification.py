@@ -0,0 +1,219 @@
+"""
+Moteur de tarification des paniers d'une commande.
+
+Le prix de chaque ligne, le compteur upsell, les frais de livraison et le total sont
+calculés en mémoire, en une passe, à partir de :
+  - la commande et sa ville ;
+  - ses paniers avec leurs articles (une requête), dont la promotion active est dénormalisée
+    (Article.has_promo_active, voir article/promotions.py).
+Les lignes modifiées sont ensuite enregistrées par un bulk_update et la commande par un
+seul UPDATE (sans passer par Commande.save() ni ses signaux).
+
+Règles de prix d'une ligne, par priorité :
+  1. remise appliquée (remise_appliquer) : le sous-total est conservé, sauf pour un article
+     en liquidation ou en promotion, dont la remise est retirée ;
+  2. promotion active : prix actuel ;
+  3. liquidation : Prix_liquidation, à défaut prix actuel ;
+  4. test : prix actuel ;
+  5. article upsell et compteur > 0 : prix upsell du niveau du compteur, à défaut prix actuel ;
+  6. sinon prix actuel (à défaut prix unitaire).
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import models
+from django.utils import timezone
+
+# États dans lesquels les prix sont gelés (fixés à la confirmation)
+ETATS_PRIX_GELES = (
+    'Confirmée',
+    'En préparation',
+    'Préparation en cours',
+    'Préparée',
+    'Mise en distribution',
+    'En cours de livraison',
+    'En livraison',
+    'Livrée',
+    'Livrée Partiellement',
+    'Livrée avec changement',
+    'Retournée',
+    'Reportée',
+)
+
+CHAMPS_PANIER = ['sous_total', 'remise_appliquer', 'type_remise_appliquee', 'type_prix_gele']
+
+
+@dataclass
+class PrixLigne:
+    panier: object
+    prix_unitaire: Decimal
+    sous_total: float
+    type_prix: str
+    recalcule: bool
+    message: str = ''
+
+
+@dataclass
+class Tarif:
+    compteur: int
+    lignes: list = field(default_factory=list)
+    sous_total_articles: float = 0
+    frais_livraison: float = 0
+    total: float = 0
+
+
+def articles_en_promotion(paniers):
+    """Identifiants des articles des paniers qui ont une promotion active (sans requête)"""
+    return {panier.article_id for panier in paniers if panier.article and panier.article.has_promo_active}
+
+
+def charger_paniers(commande):
+    """Paniers de la commande avec leurs articles, en réutilisant un prefetch éventuel"""
+    cache = getattr(commande, '_prefetched_objects_cache', {})
+    if 'paniers' in cache:
+        return list(cache['paniers'])
+    return list(commande.paniers.select_related('article').order_by('id'))
+
+
+def calculer_compteur(paniers):
+    """Compteur upsell : unités d'articles upsell sans remise appliquée, moins une (minimum 0)"""
+    quantite = sum(
+        panier.quantite for panier in paniers
+        if panier.article.isUpsell and not panier.remise_appliquer
+    )
+    return quantite - 1 if quantite >= 2 else 0
+
+
+def _prix_courant(article):
+    return article.prix_actuel if article.prix_actuel is not None else article.prix_unitaire
+
+
+def prix_ligne(panier, compteur, en_promotion):
+    """Prix d'une ligne selon les règles du module. Modifie les champs de remise du panier si besoin"""
+    article = panier.article
+    if not article or panier.quantite <= 0:
+        return PrixLigne(panier, Decimal('0'), 0, 'error', False)
+
+    if panier.remise_appliquer:
+        if article.phase == 'LIQUIDATION' or en_promotion:
+            # Remise interdite sur un article en liquidation ou en promotion
+            panier.remise_appliquer = False
+            panier.type_remise_appliquee = ''
+        else:
+            prix_unitaire = Decimal(str(panier.sous_total)) / Decimal(str(panier.quantite))
+            return PrixLigne(panier, prix_unitaire, float(panier.sous_total), f'remise_{panier.type_remise_appliquee}', False)
+
+    if en_promotion:
+        prix_unitaire, type_prix = article.prix_actuel or article.prix_unitaire, 'promotion'
+    elif article.phase == 'LIQUIDATION':
+        prix_unitaire, type_prix = article.Prix_liquidation or article.prix_actuel or article.prix_unitaire, 'liquidation'
+    elif article.phase == 'EN_TEST':
+        prix_unitaire, type_prix = article.prix_actuel or article.prix_unitaire, 'test'
+    elif article.isUpsell and compteur > 0:
+        niveau = min(compteur, 4)
+        prix_unitaire = getattr(article, f'prix_upsell_{niveau}') or _prix_courant(article)
+        type_prix = f'upsell_niveau_{niveau}'
+    else:
+        prix_unitaire, type_prix = _prix_courant(article), 'normal'
+
+    prix_unitaire = Decimal(str(prix_unitaire))
+    return PrixLigne(panier, prix_unitaire, float(prix_unitaire * Decimal(str(panier.quantite))), type_prix, True)
+
+
+def _ligne_gelee(panier, libelle):
+    prix_unitaire = Decimal(str(panier.sous_total)) / Decimal(str(panier.quantite)) if panier.quantite else Decimal('0')
+    return PrixLigne(
+        panier, prix_unitaire, float(panier.sous_total), 'prix_gele', False,
+        f'Prix gelé - Commande en état "{libelle}"'
+    )
+
+
+def tarifer(commande, paniers=None, promotions=None, recalculer_compteur=False, respecter_gel=False,
+            recalculer_lignes=True):
+    """
+    Calcule le tarif de la commande en mémoire, sans écrire.
+
+    recalculer_compteur : recalcule le compteur upsell à partir des paniers (sinon commande.compteur).
+    respecter_gel : ne reprice pas les lignes d'une commande confirmée ou dans un état avancé.
+    recalculer_lignes=False : seules les remises interdites (liquidation, promotion) sont corrigées,
+    les autres sous-totaux sont repris tels quels.
+    """
+    paniers = charger_paniers(commande) if paniers is None else paniers
+    if promotions is None:
+        promotions = articles_en_promotion(paniers)
+
+    compteur = calculer_compteur(paniers) if recalculer_compteur else commande.compteur
+    libelle_gel = None
+    if respecter_gel:
+        libelle = commande.libelle_etat_actuel
+        libelle_gel = libelle if libelle in ETATS_PRIX_GELES else None
+
+    tarif = Tarif(compteur=compteur)
+    for panier in paniers:
+        en_promotion = panier.article_id in promotions
+        if libelle_gel:
+            ligne = _ligne_gelee(panier, libelle_gel)
+        elif not recalculer_lignes and not (
+            panier.remise_appliquer and (panier.article.phase == 'LIQUIDATION' or en_promotion)
+        ):
+            ligne = PrixLigne(panier, Decimal('0'), float(panier.sous_total), panier.type_prix_gele, False)
+        else:
+            ligne = prix_ligne(panier, compteur, en_promotion)
+        tarif.lignes.append(ligne)
+        tarif.sous_total_articles += ligne.sous_total
+
+    if commande.frais_livraison and commande.ville_id:
+        tarif.frais_livraison = float(commande.ville.frais_livraison or 0)
+    tarif.total = float(tarif.sous_total_articles) + tarif.frais_livraison
+    return tarif
+
+
+def enregistrer(commande, tarif):
+    """Écrit les lignes modifiées (bulk_update) et la commande (un UPDATE). Retourne le nombre de lignes écrites"""
+    from .models import Commande, Panier
+
+    a_ecrire = []
+    for ligne in tarif.lignes:
+        panier = ligne.panier
+        valeurs_initiales = getattr(panier, '_valeurs_tarif', None)
+        panier.sous_total = ligne.sous_total
+        if ligne.recalcule:
+            panier.type_prix_gele = ligne.type_prix
+        if valeurs_initiales != tuple(getattr(panier, champ) for champ in CHAMPS_PANIER):
+            a_ecrire.append(panier)
+    if a_ecrire:
+        Panier.objects.bulk_update(a_ecrire, CHAMPS_PANIER)
+
+    if a_ecrire or commande.total_cmd != tarif.total or commande.compteur != tarif.compteur:
+        # update() ne passe pas par auto_now : date_modification est posée ici, pour que les
+        # faits journaliers (kpis/faits.dates_modifiees_depuis) recalculent la journée
+        commande.total_cmd = tarif.total
+        commande.compteur = tarif.compteur
+        commande.date_modification = timezone.now()
+        Commande.objects.filter(pk=commande.pk).update(
+            total_cmd=tarif.total, compteur=tarif.compteur, date_modification=commande.date_modification
+        )
+    return len(a_ecrire)
+
+
+def recalculer_commande(commande, recalculer_compteur=True, respecter_gel=False, recalculer_lignes=True):
+    """Recalcule et enregistre le tarif complet de la commande. Retourne le Tarif"""
+    paniers = charger_paniers(commande)
+    for panier in paniers:
+        # Valeurs lues en base, pour n'écrire que les lignes réellement modifiées
+        panier._valeurs_tarif = tuple(getattr(panier, champ) for champ in CHAMPS_PANIER)
+    tarif = tarifer(
+        commande, paniers,
+        recalculer_compteur=recalculer_compteur,
+        respecter_gel=respecter_gel,
+        recalculer_lignes=recalculer_lignes,
+    )
+    enregistrer(commande, tarif)
+    return tarif
+
+
+def prefetch_tarification():
+    """Prefetch à utiliser pour tarifer un lot de commandes sans requête par commande"""
+    from .models import Panier
+
+    return models.Prefetch('paniers', queryset=Panier.objects.select_related('article').order_by('id'))
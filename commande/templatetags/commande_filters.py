@@ -2,6 +2,8 @@ from django import template
 from datetime import timedelta
 from django.db.models import Q
 
+from commande.etats import id_etat
+
 register = template.Library()
 
 @register.filter
@@ -55,16 +57,27 @@ def get_etat(commande, libelle_etat):
     Utilisé principalement pour trouver l'opérateur et la date d'un état précis.
     """
     try:
+        etat_id = id_etat(libelle_etat)
+        if etat_id is None:
+            return None
+
+        # États déjà chargés (prefetch_related('etats')) : choisir sans requête
+        prefetches = getattr(commande, '_prefetched_objects_cache', {})
+        if 'etats' in prefetches:
+            etats = [etat for etat in prefetches['etats'] if etat.enum_etat_id == etat_id]
+            actuels = [etat for etat in etats if etat.date_fin is None]
+            return max(actuels or etats, key=lambda etat: etat.date_debut, default=None)
+
         # On cherche l'état actuel (sans date de fin) qui correspond au libellé
         etat = commande.etats.filter(
-            enum_etat__libelle__exact=libelle_etat,
+            enum_etat_id=etat_id,
             date_fin__isnull=True
         ).first()
         
         # Si on ne trouve pas d'état actuel, on prend le plus récent (historique)
         if not etat:
             etat = commande.etats.filter(
-                enum_etat__libelle__exact=libelle_etat
+                enum_etat_id=etat_id
             ).order_by('-date_debut').first()
             
         return etat
@@ -1,3 +1,600 @@
-from django.test import TestCase
+import io
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.operations import AddIndex
+from django.db.models.sql import Query
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from article.models import Article, Categorie
+from client.models import Client
+from commande import (
+    codes_barres, compteurs, confirmations_decalees, etats, etiquettes_pdf, recherche, repartition, sequences,
+    tarification, transitions,
+)
+from commande.models import Commande, CompteurFile, EnumEtatCmd, EtatCommande, EtiquetteJob, EtiquetteTemplate, Panier
+from commande.views_codes_barres import code_barre_image
+from parametre.models import Operateur, Region, Ville
+
+
+class CommandeTestCase(TestCase):
+    """Ville, client, deux opérateurs de confirmation et les états usuels"""
+
+    ETATS = ('Non affectée', 'Affectée', 'En cours de confirmation', 'Confirmée', 'Annulée', 'Livrée')
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom_region='Centre')
+        cls.ville = Ville.objects.create(nom='Casablanca', frais_livraison=30, region=region)
+        cls.client_test = Client.objects.create(nom='Alami', prenom='Sara', numero_tel='0612345678')
+        cls.op1, cls.op2 = [
+            Operateur.objects.create(
+                user=User.objects.create(username=f'confirmation{numero}'), nom=f'Op{numero}', prenom='Test',
+                mail=f'op{numero}@test.ma', type_operateur='CONFIRMATION',
+            )
+            for numero in (1, 2)
+        ]
+        cls.etats = {
+            libelle: EnumEtatCmd.objects.create(libelle=libelle, ordre=ordre)
+            for ordre, libelle in enumerate(cls.ETATS, start=1)
+        }
+        cls.categorie = Categorie.objects.create(nom='SANDALES')
+
+    def setUp(self):
+        cache.clear()
+
+    def commande(self, *etats, operateur=None, **champs):
+        """Commande passée successivement par les états `etats`"""
+        champs = {
+            'client': self.client_test, 'ville': self.ville, 'adresse': 'Rue 1', 'total_cmd': 0,
+            'frais_livraison': False, **champs,
+        }
+        commande = Commande.objects.create(**champs)
+        for libelle in etats:
+            EtatCommande.objects.filter(commande=commande, date_fin__isnull=True).update(date_fin=timezone.now())
+            EtatCommande.objects.create(commande=commande, enum_etat=self.etats[libelle], operateur=operateur or self.op1)
+        return Commande.objects.get(pk=commande.pk)
+
+    def article(self, reference, prix=200, **champs):
+        return Article.objects.create(
+            nom=reference, reference=reference, prix_unitaire=prix, categorie=self.categorie, **champs
+        )
+
+
+class SequencesTests(CommandeTestCase):
+    """Repli hors PostgreSQL (les tests tournent aussi sous sqlite) : suite du maximum existant"""
+
+    def test_identifiants_yz_uniques_et_croissants(self):
+        premiere = self.commande()
+        ids = Commande.allouer_ids_yz(3)
+
+        self.assertEqual(premiere.id_yz, Commande.START_ID_YZ)
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(ids, sorted(ids))
+        self.assertGreater(ids[0], premiere.id_yz)
+
+    def test_numeros_par_prefixe(self):
+        self.assertEqual(self.commande(origine='OC').num_cmd, 'OC-00001')
+        self.assertEqual(self.commande(origine='OC').num_cmd, 'OC-00002')
+        self.assertEqual(self.commande(origine='ADMIN').num_cmd, 'ADMIN-00001')
+        synchronisee = self.commande()
+        self.assertEqual(synchronisee.num_cmd, str(synchronisee.id_yz))
+
+    def test_sequence_postgresql(self):
+        if not sequences.sequences_disponibles():
+            self.skipTest("Séquences PostgreSQL uniquement")
+        valeurs = sequences.prochaines_valeurs(sequences.SEQUENCE_ID_YZ, 5)
+
+        self.assertEqual(len(set(valeurs)), 5)
+        self.assertEqual(valeurs, sorted(valeurs))
+
+
+class ConfirmationsDecaleesTests(CommandeTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.etats['Confirmation décalée'] = EnumEtatCmd.objects.create(libelle='Confirmation décalée', ordre=10)
+
+    def decalee(self, jours):
+        commande = self.commande('Affectée', 'Confirmation décalée', operateur=self.op2)
+        EtatCommande.objects.filter(commande=commande, date_fin__isnull=True).update(
+            date_fin_delayed=timezone.now() + timedelta(days=jours)
+        )
+        return commande
+
+    def test_echeances_atteintes_confirmees_par_lots(self):
+        recente, ancienne, future = self.decalee(-1), self.decalee(-3), self.decalee(2)
+
+        self.assertEqual(confirmations_decalees.traiter_confirmations_decalees(limite=1), [ancienne.id_yz, recente.id_yz])
+        courant = Commande.objects.values_list('etat_courant__libelle', 'operateur_etat_courant_id')
+        self.assertEqual(courant.get(pk=ancienne.pk), ('Confirmée', self.op2.pk))
+        self.assertEqual(courant.get(pk=future.pk)[0], 'Confirmation décalée')
+        self.assertEqual(EtatCommande.objects.filter(commande=recente, date_fin__isnull=True).count(), 1)
+        self.assertEqual(confirmations_decalees.traiter_lot(), [])
+
+
+class CodesBarresTests(SimpleTestCase):
+
+    def setUp(self):
+        dossier = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dossier, ignore_errors=True)
+        reglages = override_settings(CODES_BARRES_CACHE_DIR=dossier)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        codes_barres._lru.clear()
+
+    def test_image_calculee_une_seule_fois(self):
+        cle, png = codes_barres.obtenir_png('commande', 12345)
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        self.assertEqual(cle, codes_barres.empreinte('code128', '12345', codes_barres.PRESETS['commande'][1]))
+
+        with mock.patch.object(codes_barres, 'rendre_png') as rendre:
+            self.assertEqual(codes_barres.obtenir_png('commande', '12345'), (cle, png))
+            # Cache mémoire vidé : relue sur le disque
+            codes_barres._lru.clear()
+            self.assertEqual(codes_barres.obtenir_png('commande', '12345'), (cle, png))
+        rendre.assert_not_called()
+
+    def test_donnees_invalides(self):
+        for donnees in ('', 'x' * (codes_barres.LONGUEUR_MAX_DONNEES + 1)):
+            with self.subTest(longueur=len(donnees)), self.assertRaises(ValueError):
+                codes_barres.obtenir_png('qr', donnees)
+        self.assertEqual(codes_barres.obtenir_base64('qr', ''), '')
+        self.assertEqual(codes_barres.url_code('qr', None), '')
+
+    def test_pre_generer_les_images_absentes(self):
+        codes_barres.obtenir_png('ticket', 'YZ-1')
+
+        self.assertEqual(codes_barres.pre_generer('ticket', ['YZ-1', 'YZ-2', 'YZ-2', 'YZ-3', '']), 2)
+        self.assertEqual(codes_barres.pre_generer('ticket', ['YZ-2', 'YZ-3']), 0)
+
+    def test_vue_etag_et_version_du_preset(self):
+        user = mock.Mock(is_authenticated=True)
+        requete = RequestFactory().get(codes_barres.url_code('qr', 'YZ-1'))
+        requete.user = user
+        reponse = code_barre_image(requete, 'qr')
+        self.assertEqual((reponse.status_code, reponse['Content-Type']), (200, 'image/png'))
+        self.assertIn('immutable', reponse['Cache-Control'])
+
+        requete = RequestFactory().get('/', {'d': 'YZ-1', 'v': 'ancienne'}, HTTP_IF_NONE_MATCH=reponse['ETag'])
+        requete.user = user
+        reponse = code_barre_image(requete, 'qr')
+        self.assertEqual((reponse.status_code, reponse['Cache-Control']), (304, 'private, no-cache'))
+
+
+class EtiquettesPdfTests(CommandeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.template = EtiquetteTemplate.objects.create(name='Standard', barcode_height=20)
+        self.commande_etiquetee = self.commande()
+        for reference, quantite in (('A', 2), ('B', 1)):
+            Panier.objects.create(commande=self.commande_etiquetee, article=self.article(reference), quantite=quantite, sous_total=0)
+
+    def pages(self, pdf):
+        from pypdf import PdfReader
+
+        return len(PdfReader(io.BytesIO(pdf)).pages)
+
+    def test_donnees_sans_acces_base_au_rendu(self):
+        etiquettes = etiquettes_pdf.donnees_etiquettes([self.commande_etiquetee.pk])
+
+        self.assertEqual([(e['article'], e['quantite'], e['variante']) for e in etiquettes], [('A', 2, 'Standard'), ('B', 1, 'Standard')])
+        self.assertEqual(etiquettes[0]['entete'], f'Commande {self.commande_etiquetee.id_yz}')
+        with self.assertNumQueries(0):
+            self.assertTrue(etiquettes_pdf.rendre_pdf(etiquettes_pdf.parametres_template(self.template), 'qr', etiquettes).startswith(b'%PDF'))
+
+    @mock.patch.object(etiquettes_pdf, 'TAILLE_LOT', 2)
+    def test_lots_fusionnes_dans_l_ordre(self):
+        if not etiquettes_pdf.fusion_disponible():
+            self.skipTest("pypdf n'est pas installé")
+        parametres = etiquettes_pdf.parametres_template(self.template)
+        etiquettes = etiquettes_pdf.donnees_etiquettes([self.commande_etiquetee.pk]) * 3
+        progression = []
+
+        pdf = etiquettes_pdf.generer_pdf(parametres, 'barcode', etiquettes, lambda nb, total: progression.append((nb, total)), processus=1)
+        self.assertEqual(progression, [(2, 6), (4, 6), (6, 6)])
+        self.assertEqual(self.pages(pdf), self.pages(etiquettes_pdf.rendre_pdf(parametres, 'barcode', etiquettes[:2])) * 3)
+
+    def test_job_en_arriere_plan(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with self.captureOnCommitCallbacks() as rappels:
+            job = etiquettes_pdf.lancer_job(self.template, [self.commande_etiquetee.pk], 'barcode')
+        self.assertEqual(len(rappels), 1)
+
+        with override_settings(MEDIA_ROOT=media):
+            etiquettes_pdf.executer_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.statut, job.nb_total, job.nb_rendues), ('termine', 2, 2))
+        # Déjà pris en charge : pas de second rendu
+        self.assertEqual(etiquettes_pdf.executer_job(EtiquetteJob.objects.get(pk=job.pk)).statut, 'termine')
+
+
+class TarificationTests(CommandeTestCase):
+
+    def paniers(self, commande, *lignes):
+        for article, quantite in lignes:
+            Panier.objects.create(commande=commande, article=article, quantite=quantite, sous_total=0)
+        return Commande.objects.get(pk=commande.pk)
+
+    def test_prix_normal_et_frais_de_livraison(self):
+        commande = self.paniers(self.commande(frais_livraison=True), (self.article('A', 200), 2), (self.article('B', 150), 1))
+        tarif = tarification.recalculer_commande(commande)
+
+        self.assertEqual([ligne.type_prix for ligne in tarif.lignes], ['normal', 'normal'])
+        self.assertEqual(tarif.sous_total_articles, 550)
+        self.assertEqual(tarif.frais_livraison, 30)
+        self.assertEqual(Commande.objects.values_list('total_cmd', flat=True).get(pk=commande.pk), 580)
+        self.assertEqual(list(Panier.objects.filter(commande=commande).order_by('id').values_list('sous_total', flat=True)), [400, 150])
+
+    def test_prix_upsell_selon_le_compteur(self):
+        upsell = {'isUpsell': True, 'prix_upsell_1': 180, 'prix_upsell_2': 160, 'prix_upsell_3': 140, 'prix_upsell_4': 120}
+        commande = self.paniers(self.commande(), (self.article('U1', **upsell), 2), (self.article('U2', **upsell), 1))
+        tarif = tarification.recalculer_commande(commande)
+
+        # Trois unités upsell : compteur 2, prix du niveau 2 pour chaque article upsell
+        self.assertEqual(tarif.compteur, 2)
+        self.assertEqual([ligne.type_prix for ligne in tarif.lignes], ['upsell_niveau_2', 'upsell_niveau_2'])
+        self.assertEqual(tarif.total, 3 * 160)
+        self.assertEqual(Commande.objects.values_list('compteur', flat=True).get(pk=commande.pk), 2)
+
+    def test_liquidation_retire_la_remise(self):
+        article = self.article('L', 200, phase='LIQUIDATION', Prix_liquidation=90)
+        commande = self.paniers(self.commande(), (article, 1))
+        Panier.objects.filter(commande=commande).update(remise_appliquer=True, type_remise_appliquee='remise_1', sous_total=50)
+        tarif = tarification.recalculer_commande(Commande.objects.get(pk=commande.pk))
+
+        self.assertEqual(tarif.lignes[0].type_prix, 'liquidation')
+        self.assertEqual(tarif.total, 90)
+        self.assertFalse(Panier.objects.get(commande=commande).remise_appliquer)
+
+    def test_prix_geles_apres_confirmation(self):
+        commande = self.paniers(self.commande('Confirmée'), (self.article('G', 200), 1))
+        Panier.objects.filter(commande=commande).update(sous_total=170)
+        tarif = tarification.tarifer(Commande.objects.get(pk=commande.pk), respecter_gel=True)
+
+        self.assertEqual(tarif.lignes[0].type_prix, 'prix_gele')
+        self.assertEqual(tarif.total, 170)
+
+    def test_enregistrer_date_la_modification(self):
+        commande = self.paniers(self.commande(), (self.article('D', 200), 1))
+        tarification.recalculer_commande(commande)
+        ancienne = timezone.now() - timedelta(days=2)
+        Commande.objects.filter(pk=commande.pk).update(date_modification=ancienne)
+
+        # Rien à changer : aucune écriture
+        tarification.recalculer_commande(Commande.objects.get(pk=commande.pk))
+        self.assertEqual(Commande.objects.values_list('date_modification', flat=True).get(pk=commande.pk), ancienne)
+
+        Panier.objects.filter(commande=commande).update(quantite=3)
+        tarification.recalculer_commande(Commande.objects.get(pk=commande.pk))
+        total, date_modification = Commande.objects.values_list('total_cmd', 'date_modification').get(pk=commande.pk)
+        self.assertEqual(total, 600)
+        self.assertGreater(date_modification, ancienne)
+
+
+class TransitionsTests(CommandeTestCase):
+
+    def courant(self, commande):
+        return Commande.objects.values_list('etat_courant__libelle', 'operateur_etat_courant_id').get(pk=commande.pk)
+
+    def test_changer_etats_en_masse(self):
+        premiere, seconde = self.commande('Non affectée'), self.commande('Non affectée')
+        resultats = transitions.changer_etats(
+            [premiere.pk, str(seconde.pk)], self.etats['Affectée'], operateur=self.op2, commentaire='Affectation'
+        )
+
+        self.assertEqual([r.statut for r in resultats], [transitions.EFFECTUEE] * 2)
+        self.assertEqual(self.courant(premiere), ('Affectée', self.op2.pk))
+        # L'état précédent est fermé, un seul état ouvert par commande
+        ouverts = EtatCommande.objects.filter(commande__in=[premiere, seconde], date_fin__isnull=True)
+        self.assertEqual(sorted(ouverts.values_list('enum_etat__libelle', flat=True)), ['Affectée', 'Affectée'])
+        self.assertEqual(ouverts.first().commentaire, 'Affectation')
+
+    def test_issue_de_chaque_identifiant(self):
+        deja = self.commande('Affectée', operateur=self.op2)
+        livree = self.commande('Livrée')
+        nouvelle = self.commande('Non affectée')
+        resultats = transitions.changer_etats(
+            [nouvelle.pk, deja.pk, livree.pk, 999999, 'abc'], self.etats['Affectée'], operateur=self.op2,
+            etats_sources=('Non affectée', 'Affectée'),
+        )
+
+        self.assertEqual([r.statut for r in resultats], [
+            transitions.EFFECTUEE, transitions.IGNOREE, transitions.REFUSEE, transitions.INTROUVABLE, transitions.INTROUVABLE,
+        ])
+        self.assertEqual(self.courant(livree), ('Livrée', self.op1.pk))
+        self.assertEqual(transitions.compter(resultats), {
+            transitions.EFFECTUEE: 1, transitions.IGNOREE: 1, transitions.REFUSEE: 1, transitions.INTROUVABLE: 2,
+        })
+
+    def test_controle_et_operateurs_par_commande(self):
+        premiere, seconde = self.commande('Non affectée'), self.commande('Non affectée', total_cmd=0.5)
+        resultats = transitions.changer_etats(
+            [premiere.pk, seconde.pk], self.etats['Affectée'],
+            operateurs={premiere.pk: self.op1, seconde.pk: self.op2},
+            controle=lambda courant: 'montant trop faible' if courant.commande_id == seconde.pk else None,
+        )
+
+        self.assertEqual([r.ok for r in resultats], [True, False])
+        self.assertEqual(resultats[1].message, 'montant trop faible')
+        self.assertEqual(self.courant(premiere), ('Affectée', self.op1.pk))
+        self.assertEqual(self.courant(seconde), ('Non affectée', self.op1.pk))
+
+
+class RepartitionTests(CommandeTestCase):
+
+    def test_affinite_de_region_dans_la_tolerance(self):
+        def operateurs():
+            deja_present = repartition.ChargeOperateur(pk=1, nom='A', charge=5)
+            deja_present.regions[10] = 5
+            return [deja_present, repartition.ChargeOperateur(pk=2, nom='B', charge=4)]
+
+        plan = repartition.planifier([(100, 10), (101, 20)], operateurs())
+        self.assertEqual((plan.affectations, plan.affinite), ({100: 1, 101: 2}, 1))
+        self.assertEqual(repartition.planifier([(100, 10)], operateurs(), tolerance=0).affectations, {100: 2})
+
+    def test_poids_selon_le_debit(self):
+        operateurs = [repartition.ChargeOperateur(pk=pk, nom=str(pk)) for pk in (1, 2, 3)]
+        repartition.ponderer(operateurs, {1: 10, 3: 4})
+
+        # Un opérateur sans débit reçoit la moitié du débit médian des opérateurs actifs
+        self.assertEqual([operateur.poids for operateur in operateurs], [10, 3.5, 4])
+        self.assertEqual(repartition.planifier([(100, None), (101, None)], operateurs[:2]).affectations, {100: 1, 101: 1})
+
+    def test_poids_quand_le_debit_median_est_nul(self):
+        operateurs = [repartition.ChargeOperateur(pk=pk, nom=str(pk)) for pk in (1, 2, 3)]
+
+        # Débits inférieurs à 1 commande par jour : les opérateurs inactifs ne doivent pas peser plus
+        repartition.ponderer(operateurs, {1: 0.5})
+        self.assertEqual([operateur.poids for operateur in operateurs], [0.5, 0.25, 0.25])
+        self.assertEqual(repartition.planifier([(100, None)], operateurs).affectations, {100: 1})
+
+        repartition.ponderer(operateurs, {})
+        self.assertEqual([operateur.poids for operateur in operateurs], [1.0, 1.0, 1.0])
+
+    def test_repartir_vers_le_moins_charge(self):
+        for _ in range(2):
+            self.commande('Affectée', operateur=self.op1)
+        a_repartir = [self.commande('Non affectée') for _ in range(3)]
+
+        simulation = repartition.repartir('CONFIRMATION', dry_run=True)
+        self.assertIsNone(simulation.resultats)
+        self.assertEqual(Commande.objects.filter(etat_courant=self.etats['Non affectée']).count(), 3)
+
+        plan = repartition.repartir('CONFIRMATION')
+        self.assertEqual(plan.affectations, simulation.affectations)
+        self.assertEqual([plan.affectations[c.pk] for c in a_repartir], [self.op2.pk, self.op2.pk, self.op1.pk])
+        self.assertEqual(plan.charges(), {self.op1.pk: 3, self.op2.pk: 2})
+        self.assertEqual(Commande.objects.filter(etat_courant=self.etats['Affectée'], operateur_etat_courant=self.op2).count(), 2)
+        self.assertEqual(repartition.repartir('CONFIRMATION').affectations, {})
+
+
+class RechercheTests(CommandeTestCase):
+
+    def test_commandes_classees_par_rang(self):
+        par_numero = self.commande(num_cmd='OC-00042')
+        par_ville = self.commande()
+
+        resultats = recherche.rechercher_commandes('OC-00042')
+        self.assertEqual([(c.pk, c.rang) for c in resultats], [(par_numero.pk, 1)])
+        self.assertEqual({c.pk for c in recherche.rechercher_commandes('casablanca')}, {par_numero.pk, par_ville.pk})
+        self.assertEqual(recherche.rechercher_commandes('   '), [])
+
+    def test_nouvelle_designe_les_commandes_sans_etat(self):
+        sans_etat = self.commande()
+        confirmee = self.commande('Confirmée')
+        self.commande('Livrée')
+        etats = recherche.ETATS_ROLE['CONFIRMATION']
+
+        self.assertEqual(recherche.statut(sans_etat), recherche.NOUVELLE)
+        self.assertEqual({c.pk for c in recherche.rechercher_commandes('casa', etats=etats)}, {sans_etat.pk, confirmee.pk})
+        self.assertEqual([v.nb_commandes for v in recherche.rechercher_villes('casa', etats)], [2])
+        self.assertEqual([r.nb_commandes for r in recherche.rechercher_regions('centre', etats)], [2])
+
+
+class CompteursTests(CommandeTestCase):
+
+    def test_compteurs_suivent_les_etats(self):
+        commande = self.commande('Non affectée')
+        self.commande('Affectée', operateur=self.op2)
+        self.assertEqual(compteurs.par_etat(['Non affectée', 'Affectée', 'Confirmée']), {
+            'Non affectée': 1, 'Affectée': 1, 'Confirmée': 0,
+        })
+
+        EtatCommande.objects.filter(commande=commande, date_fin__isnull=True).update(date_fin=timezone.now())
+        EtatCommande.objects.create(commande=commande, enum_etat=self.etats['Affectée'], operateur=self.op2)
+        self.assertEqual(compteurs.par_etat(['Non affectée', 'Affectée'], operateur=self.op2), {
+            'Non affectée': 0, 'Affectée': 2,
+        })
+        self.assertEqual(compteurs.total(['Non affectée', 'Affectée']), 2)
+
+    def test_transition_en_masse_et_suppression(self):
+        commandes = [self.commande('Non affectée') for _ in range(3)]
+        transitions.changer_etats([c.pk for c in commandes[:2]], self.etats['Affectée'], operateur=self.op1)
+        self.assertEqual(compteurs.par_etat(['Non affectée', 'Affectée'], operateur=self.op1), {
+            'Non affectée': 1, 'Affectée': 2,
+        })
+
+        Commande.objects.get(pk=commandes[0].pk).delete()
+        self.assertEqual(compteurs.total(['Affectée'], operateur=self.op1), 1)
+
+    def test_reconcilier_corrige_les_derives(self):
+        self.commande('Confirmée')
+        self.commande('Confirmée', operateur=self.op2)
+        CompteurFile.objects.filter(operateur=self.op1).update(nombre=7)
+        CompteurFile.objects.filter(operateur=self.op2).delete()
+
+        self.assertEqual(compteurs.reconcilier(), 2)
+        self.assertEqual(compteurs.par_etat(['Confirmée'], operateur=self.op1), {'Confirmée': 1})
+        self.assertEqual(compteurs.total(['Confirmée']), 2)
+        self.assertEqual(compteurs.reconcilier(), 0)
+
+
+class EtatsTests(CommandeTestCase):
+
+    def test_registre_par_libelle(self):
+        confirmee = self.etats['Confirmée']
+
+        self.assertEqual(etats.ids_etats('confirmée', 'CONFIRMÉE', 'Inconnu', 'Livrée'), [confirmee.pk, self.etats['Livrée'].pk])
+        self.assertEqual(etats.libelle_etat(confirmee.pk), 'Confirmée')
+        self.assertEqual(etats.obtenir_etat('Confirmée'), confirmee)
+        with self.assertRaises(EnumEtatCmd.DoesNotExist):
+            etats.obtenir_etat('Inconnu')
+
+    def test_etat_cree_visible_dans_la_transaction(self):
+        etats.registre()
+        etat, cree = etats.obtenir_ou_creer_etat('Doublon', defaults={'ordre': 20})
+
+        self.assertTrue(cree)
+        self.assertEqual(etats.ids_etats('Doublon'), [etat.pk])
+        self.assertEqual(etats.obtenir_ou_creer_etat('doublon'), (etat, False))
+
+    def test_renommage_invalide_le_registre(self):
+        etat = self.etats['Livrée']
+        etat.libelle = 'Livrée au client'
+        etat.save()
+
+        self.assertEqual(etats.ids_etats('Livrée'), [])
+        self.assertEqual(etats.ids_etats('Livrée au client'), [etat.pk])
+
+
+class EtatCourantTests(CommandeTestCase):
+
+    def courant(self, commande):
+        return Commande.objects.values_list(
+            'etat_courant', 'date_etat_courant', 'operateur_etat_courant'
+        ).get(pk=commande.pk)
+
+    def test_synchronise_a_l_ouverture_la_fermeture_et_la_suppression(self):
+        commande = self.commande()
+        self.assertEqual(self.courant(commande), (None, None, None))
+
+        affectee = EtatCommande.objects.create(commande=commande, enum_etat=self.etats['Affectée'], operateur=self.op1)
+        self.assertEqual(self.courant(commande), (self.etats['Affectée'].pk, affectee.date_debut, self.op1.pk))
+
+        affectee.terminer_etat()
+        self.assertEqual(self.courant(commande), (None, None, None))
+
+        confirmee = EtatCommande.objects.create(commande=commande, enum_etat=self.etats['Confirmée'], operateur=self.op2)
+        self.assertEqual(self.courant(commande), (self.etats['Confirmée'].pk, confirmee.date_debut, self.op2.pk))
+        self.assertEqual(compteurs.par_etat(['Affectée', 'Confirmée'], operateur=self.op2), {'Affectée': 0, 'Confirmée': 1})
+
+        confirmee.delete()
+        self.assertEqual(self.courant(commande), (None, None, None))
+
+        # Réouverture de l'état précédent
+        affectee.date_fin = None
+        affectee.save()
+        self.assertEqual(self.courant(commande), (self.etats['Affectée'].pk, affectee.date_debut, self.op1.pk))
+        self.assertEqual(compteurs.total(['Affectée', 'Confirmée']), 1)
+
+    def test_backfill_recalcule_etat_courant_et_compteurs(self):
+        affectees = [self.commande('Non affectée', 'Affectée', operateur=self.op2) for _ in range(3)]
+        sans_etat = self.commande()
+        attendus = {c.pk: self.courant(c) for c in affectees}
+
+        # Données antérieures à la dénormalisation
+        Commande.objects.update(etat_courant=None, date_etat_courant=None, operateur_etat_courant=None)
+        CompteurFile.objects.all().delete()
+        self.assertEqual(Commande.rafraichir_etat_courant(Commande.objects.filter(pk=affectees[0].pk)), 1)
+        self.assertEqual(self.courant(affectees[0]), attendus[affectees[0].pk])
+
+        call_command('backfill_etat_courant', batch_size=2, stdout=io.StringIO())
+
+        self.assertEqual({c.pk: self.courant(c) for c in affectees}, attendus)
+        self.assertEqual(self.courant(sans_etat), (None, None, None))
+        self.assertEqual(compteurs.par_etat(['Non affectée', 'Affectée'], operateur=self.op2), {
+            'Non affectée': 0, 'Affectée': 3,
+        })
+
+
+class IndexEtatsOuvertsTests(CommandeTestCase):
+    """Les conditions des index partiels de EtatCommande doivent découler des filtres qui s'en servent"""
+
+    # Comparaisons qui excluent NULL (et impliquent donc « colonne IS NOT NULL »)
+    COMPARAISON = r'(?:=|IN \(|<=?|>=?|BETWEEN)'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.etats['Confirmation décalée'] = EnumEtatCmd.objects.create(libelle='Confirmation décalée', ordre=10)
+
+    def index(self, nom):
+        return next(index for index in EtatCommande._meta.indexes if index.name == nom)
+
+    def termes(self, index):
+        query = Query(EtatCommande, alias_cols=False)
+        sql, _ = query.build_where(index.condition).as_sql(query.get_compiler(connection=connection), connection)
+        return re.findall(r'"\w+" IS (?:NOT )?NULL', sql)
+
+    def requetes_etats(self, action):
+        with CaptureQueriesContext(connection) as contexte:
+            action()
+        table = connection.ops.quote_name(EtatCommande._meta.db_table)
+        return [requete['sql'].replace(f'{table}.', '') for requete in contexte.captured_queries if table in requete['sql']]
+
+    def implique(self, sql, terme):
+        colonne, non_nul = re.fullmatch(r'("\w+") IS (NOT )?NULL', terme).groups()
+        if non_nul:
+            return re.search(re.escape(colonne) + rf' (?:IS NOT NULL|{self.COMPARAISON})', sql) is not None
+        return f'{colonne} IS NULL' in sql
+
+    def test_filtres_couverts_par_les_index_partiels(self):
+        commande = self.commande('Affectée')
+        decalee = self.commande('Confirmation décalée', operateur=self.op2)
+        EtatCommande.objects.filter(commande=decalee).update(date_fin_delayed=timezone.now())
+
+        chemins = {
+            'etat_cmd_ouvert_cmd_idx': {
+                'synchronisation': lambda: EtatCommande.objects.create(
+                    commande=commande, enum_etat=self.etats['En cours de confirmation'], operateur=self.op1,
+                ),
+                'transitions': lambda: transitions.changer_etats([commande.pk], self.etats['Confirmée'], operateur=self.op1),
+                'etat_actuel': lambda: Commande.objects.get(pk=commande.pk).etat_actuel,
+            },
+            'etat_cmd_ouvert_op_idx': {
+                'commandes_count': lambda: self.op1.commandes_count,
+            },
+            'etat_cmd_delayed_ouvert_idx': {
+                'etats_echus': lambda: list(confirmations_decalees.etats_echus(timezone.now())),
+            },
+        }
+        # Tout nouvel index partiel doit déclarer ici les requêtes qui le justifient
+        self.assertEqual(set(chemins), {index.name for index in EtatCommande._meta.indexes if index.condition})
+
+        for nom, actions in chemins.items():
+            index = self.index(nom)
+            colonne = connection.ops.quote_name(EtatCommande._meta.get_field(index.fields[0].lstrip('-')).column)
+            termes = self.termes(index)
+            for libelle, action in actions.items():
+                with self.subTest(index=nom, chemin=libelle):
+                    requetes = [sql for sql in self.requetes_etats(action) if re.search(f'{colonne} {self.COMPARAISON}', sql)]
+                    self.assertTrue(
+                        any(all(self.implique(sql, terme) for terme in termes) for sql in requetes),
+                        f'{nom} ({" AND ".join(termes)}) inutilisable par : {requetes}',
+                    )
+
+    def test_migrations_conformes_au_modele(self):
+        operations = [
+            operation
+            for migration in ('0025_index_confirmations_decalees', '0029_index_etats_ouverts')
+            for operation in import_module(f'commande.migrations.{migration}').Migration.operations
+            if isinstance(operation, AddIndex) and operation.model_name == 'etatcommande'
+        ]
+        self.assertEqual(len(operations), len(EtatCommande._meta.indexes))
+        for operation in operations:
+            with self.subTest(index=operation.index.name):
+                self.assertEqual(operation.index.deconstruct(), self.index(operation.index.name).deconstruct())
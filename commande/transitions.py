@@ -0,0 +1,165 @@
+"""
+Changements d'état en masse des commandes (affectations, changements de statut).
+
+changer_etats() fait passer un lot de commandes vers un même état, dans une transaction :
+  1. les commandes sont verrouillées et leur état courant lu en une requête (champs
+     dénormalisés etat_courant / operateur_etat_courant) ;
+  2. chaque commande est validée : état source autorisé, contrôle propre à l'appelant,
+     transition sans effet (même état, même opérateur) ignorée ;
+  3. une requête UPDATE ferme tous les états ouverts des commandes retenues, un bulk_create
+     ouvre les nouveaux états, puis l'état courant dénormalisé est mis à jour (une requête
+     par opérateur) ainsi que les compteurs de files (commande/compteurs.py).
+
+Le résultat détaille l'issue de chaque identifiant demandé, dans l'ordre de la demande.
+Les opérations en masse n'émettent pas les signaux post_save : le cache des tableaux de bord
+est invalidé explicitement après le commit.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+EFFECTUEE = 'effectuee'
+IGNOREE = 'ignoree'
+REFUSEE = 'refusee'
+INTROUVABLE = 'introuvable'
+
+
+@dataclass
+class EtatCourant:
+    """État courant d'une commande, tel que lu avant la transition"""
+    commande_id: int
+    id_yz: Optional[int]
+    etat_id: Optional[int]
+    libelle: Optional[str]
+    operateur_id: Optional[int]
+
+
+@dataclass
+class ResultatTransition:
+    commande_id: object
+    id_yz: Optional[int] = None
+    statut: str = INTROUVABLE
+    message: str = ''
+
+    @property
+    def ok(self):
+        """La commande est dans l'état demandé (transition effectuée ou déjà en place)"""
+        return self.statut in (EFFECTUEE, IGNOREE)
+
+    def as_dict(self):
+        return {'commande_id': self.commande_id, 'id_yz': self.id_yz, 'statut': self.statut, 'message': self.message}
+
+
+def _identifiant(valeur):
+    try:
+        return int(valeur)
+    except (TypeError, ValueError):
+        return None
+
+
+def _pk(objet):
+    return getattr(objet, 'pk', objet)
+
+
+def changer_etats(commande_ids, etat_cible, operateur=None, commentaire=None, etats_sources=None, controle=None,
+                  operateurs=None, operateur_cloture=None, ignorer_identiques=True, maintenant=None):
+    """
+    Fait passer les commandes `commande_ids` à l'état `etat_cible` (EnumEtatCmd).
+
+    operateur : opérateur du nouvel état (instance ou id), ou `operateurs` {commande_id: opérateur}
+        pour une affectation différente par commande.
+    commentaire : texte du nouvel état, ou fonction (EtatCourant, operateur_id) -> texte.
+    etats_sources : libellés d'état courant autorisés (None pour une commande sans état) ;
+        None = tous. Les autres commandes sont refusées.
+    controle : fonction (EtatCourant) -> message d'erreur ou None, pour une règle propre à l'appelant.
+    operateur_cloture : opérateur enregistré sur les états fermés (comme terminer_etat(operateur)).
+    ignorer_identiques : une commande déjà dans l'état cible avec le même opérateur est ignorée.
+
+    Retourne la liste des ResultatTransition, une par identifiant demandé.
+    """
+    from .compteurs import ajuster, deplacer
+    from .models import Commande, EtatCommande
+
+    maintenant = maintenant or timezone.now()
+    operateurs = {_identifiant(cle): _pk(valeur) for cle, valeur in (operateurs or {}).items()}
+    operateur_id = _pk(operateur)
+    demandes = [(valeur, _identifiant(valeur)) for valeur in commande_ids]
+    ids = sorted({pk for _, pk in demandes if pk is not None})
+
+    resultats = {}
+    with transaction.atomic():
+        courants = {
+            ligne['pk']: EtatCourant(
+                ligne['pk'], ligne['id_yz'], ligne['etat_courant_id'],
+                ligne['etat_courant__libelle'], ligne['operateur_etat_courant_id'],
+            )
+            for ligne in Commande.objects.select_for_update(of=('self',)).filter(pk__in=ids).order_by('pk').values(
+                'pk', 'id_yz', 'etat_courant_id', 'etat_courant__libelle', 'operateur_etat_courant_id'
+            )
+        }
+
+        a_traiter = {}
+        for pk, courant in courants.items():
+            cible_operateur = operateurs.get(pk, operateur_id)
+            if etats_sources is not None and courant.libelle not in etats_sources:
+                resultats[pk] = ResultatTransition(pk, courant.id_yz, REFUSEE, f'état "{courant.libelle or "aucun"}" non autorisé')
+                continue
+            erreur = controle(courant) if controle else None
+            if erreur:
+                resultats[pk] = ResultatTransition(pk, courant.id_yz, REFUSEE, erreur)
+                continue
+            if ignorer_identiques and courant.etat_id == etat_cible.pk and courant.operateur_id == cible_operateur:
+                resultats[pk] = ResultatTransition(pk, courant.id_yz, IGNOREE, 'déjà dans cet état')
+                continue
+            a_traiter[pk] = cible_operateur
+            resultats[pk] = ResultatTransition(pk, courant.id_yz, EFFECTUEE)
+
+        if a_traiter:
+            fermeture = {'date_fin': maintenant}
+            if operateur_cloture is not None:
+                fermeture['operateur_id'] = _pk(operateur_cloture)
+            EtatCommande.objects.filter(commande_id__in=list(a_traiter), date_fin__isnull=True).update(**fermeture)
+
+            EtatCommande.objects.bulk_create([
+                EtatCommande(
+                    commande_id=pk,
+                    enum_etat=etat_cible,
+                    operateur_id=cible_operateur,
+                    date_debut=maintenant,
+                    commentaire=commentaire(courants[pk], cible_operateur) if callable(commentaire) else commentaire,
+                )
+                for pk, cible_operateur in a_traiter.items()
+            ])
+
+            # bulk_create ne passe pas par EtatCommande.save() : mettre à jour l'état courant
+            # dénormalisé, en une requête par opérateur
+            par_operateur = {}
+            deltas = {}
+            for pk, cible_operateur in a_traiter.items():
+                par_operateur.setdefault(cible_operateur, []).append(pk)
+                deplacer(deltas, (courants[pk].operateur_id, courants[pk].etat_id), (cible_operateur, etat_cible.pk))
+            for cible_operateur, pks in par_operateur.items():
+                Commande.objects.filter(pk__in=pks).update(
+                    etat_courant=etat_cible,
+                    date_etat_courant=maintenant,
+                    operateur_etat_courant_id=cible_operateur,
+                )
+            ajuster(deltas)
+
+            from kpis.cache import planifier_invalidation
+            planifier_invalidation()
+
+    return [
+        resultats.get(pk) or ResultatTransition(valeur, statut=INTROUVABLE, message='commande introuvable')
+        for valeur, pk in demandes
+    ]
+
+
+def compter(resultats):
+    """Nombre de résultats par statut"""
+    totaux = {EFFECTUEE: 0, IGNOREE: 0, REFUSEE: 0, INTROUVABLE: 0}
+    for resultat in resultats:
+        totaux[resultat.statut] += 1
+    return totaux
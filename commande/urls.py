@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views, views_etiquettes
+from . import views, views_etiquettes, views_codes_barres
 
 app_name = 'commande'
  
@@ -53,6 +53,7 @@ urlpatterns = [
     path('paniers/', views.liste_paniers, name='paniers'),
     # API
     path('api/commande/<int:commande_id>/panier/', views.api_panier_commande, name='api_panier_commande'),
+    path('api/compteurs-files/', views.api_compteurs_files, name='api_compteurs_files'),
     path('rechercher-client-telephone/', views.rechercher_client_telephone, name='rechercher_client_telephone'),
     
     # Étiquettes professionnelles
@@ -60,4 +61,9 @@ urlpatterns = [
     path('etiquettes/generate/', views_etiquettes.EtiquetteGeneratorView.as_view(), name='generate_etiquettes'),
     path('api/commande/<int:commande_id>/articles/', views_etiquettes.get_commande_articles, name='get_commande_articles'),
     path('etiquettes/preview/<int:commande_id>/<int:template_id>/', views_etiquettes.preview_etiquette, name='preview_etiquette'),
+    path('etiquettes/jobs/<int:job_id>/', views_etiquettes.etiquettes_job_statut, name='etiquettes_job_statut'),
+    path('etiquettes/jobs/<int:job_id>/telecharger/', views_etiquettes.etiquettes_job_telecharger, name='etiquettes_job_telecharger'),
+
+    # Images de codes-barres / QR codes (cache disque + cache HTTP)
+    path('codes/<str:preset>/', views_codes_barres.code_barre_image, name='code_barre_image'),
 ]
\ No newline at end of file
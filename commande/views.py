@@ -13,7 +13,13 @@ import json
 from .models import Commande, Panier, EnumEtatCmd, EtatCommande, Operation
 from client.models import Client
 from parametre.models import Ville, Operateur, Region # Import Region
+from parametre.operateurs import operateur_courant
+from article import reservations, stock
 from article.models import Article
+from . import compteurs, transitions
+from .etats import ids_etats, obtenir_etat, obtenir_ou_creer_etat
+from config.activite import sans_activite
+from config.pagination import PaginationCurseur, compter
 from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta, datetime
@@ -74,10 +80,7 @@ def liste_commandes(request):
     
     # Filtre par état spécifique
     if etat_filter:
-        commandes = commandes.filter(
-            etats__enum_etat_id=etat_filter,
-            etats__date_fin__isnull=True  # État actuel
-        ).distinct()
+        commandes = commandes.filter(etat_courant_id=etat_filter)  # État actuel
 
     # Nouveau filtre pour les commandes synchronisées
     if sync_filter:
@@ -109,8 +112,9 @@ def liste_commandes(request):
     end_range = request.GET.get('end_range', '')
     
     # Validation et conversion des paramètres
+    tout_afficher = items_per_page == 'all'
     try:
-        if items_per_page == 'all':
+        if tout_afficher:
             items_per_page = commandes.count()  # Afficher tous les éléments
         else:
             items_per_page = int(items_per_page)
@@ -148,36 +152,22 @@ def liste_commandes(request):
     else:
         page_number = request.GET.get('page', 1)
     
-    paginator = Paginator(commandes, items_per_page)
-    page_obj = paginator.get_page(page_number)
+    if start_range and end_range or tout_afficher:
+        paginator = Paginator(commandes, items_per_page or 1)
+        page_obj = paginator.get_page(page_number)
+    else:
+        # Pagination par curseur : une page profonde coûte autant que la première
+        page_obj = PaginationCurseur(commandes, items_per_page, ('id_yz',), requete=request).get_page(page_number)
 
-    # Calculer les statistiques des états de commandes
-    from .models import EtatCommande
-    
-    # Compter les commandes par état - utiliser distinct() pour éviter les doublons
-    commandes_non_affectees = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Non affectée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
-    
-    commandes_affectees = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Affectée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
-    
-    commandes_erronnees = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Erronée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
-    
-    commandes_doublons = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Doublon',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+    # Statistiques des états de commandes (compteurs de files)
+    files = compteurs.par_etat(['Non affectée', 'Affectée', 'Erronée', 'Doublon'])
+    commandes_non_affectees = files['Non affectée']
+    commandes_affectees = files['Affectée']
+    commandes_erronnees = files['Erronée']
+    commandes_doublons = files['Doublon']
     
     # Commandes nouvelles = commandes sans état actuel
-    commandes_avec_etat = EtatCommande.objects.filter(date_fin__isnull=True).values_list('commande_id', flat=True).distinct()
-    commandes_nouvelles = Commande.objects.exclude(id__in=commandes_avec_etat).count()
+    commandes_nouvelles = Commande.objects.filter(etat_courant__isnull=True).count()
 
     # Récupérer les opérateurs actifs pour l'affectation
     operateurs = Operateur.objects.filter(actif=True)
@@ -207,7 +197,7 @@ def liste_commandes(request):
         'villes_init': villes_init,
         'regions': regions,
         'etats': etats,
-        'total_commandes': Commande.objects.count(),
+        'total_commandes': compter(Commande.objects.all())[0],
         'commandes_non_affectees': commandes_non_affectees,
         'commandes_affectees': commandes_affectees,
         'commandes_erronnees': commandes_erronnees,
@@ -292,7 +282,7 @@ def creer_commande(request):
 
                 # Créer automatiquement l'état "Non affectée" pour la nouvelle commande
                 try:
-                    etat_non_affectee = EnumEtatCmd.objects.get(libelle='Non affectée')
+                    etat_non_affectee = obtenir_etat('Non affectée')
                     EtatCommande.objects.create(
                         commande=commande,
                         enum_etat=etat_non_affectee
@@ -309,9 +299,10 @@ def creer_commande(request):
                         enum_etat=etat_non_affectee
                     )
                 
-                # Traiter les articles du panier
+                # Traiter les articles du panier (le stock est réservé en un lot après la boucle)
                 total_commande = 0
                 article_counter = 0
+                lignes_stock = []
                 
                 while f'article_{article_counter}' in request.POST:
                     article_id = request.POST.get(f'article_{article_counter}')
@@ -325,15 +316,7 @@ def creer_commande(request):
                         if variante_id:
                             from article.models import VarianteArticle
                             variante = VarianteArticle.objects.get(pk=variante_id)
-                            
-                            # Vérifier la disponibilité du stock de la variante
-                            if variante.qte_disponible < quantite:
-                                messages.error(request, f"Stock insuffisant pour {article.nom} - {variante.couleur.nom} {variante.pointure.pointure}. Stock disponible: {variante.qte_disponible}")
-                                return render(request, 'commande/creer.html', context)
-                            
-                            # Décrémenter le stock de la variante
-                            variante.qte_disponible -= quantite
-                            variante.save()
+                            lignes_stock.append((variante, quantite))
                         
                         # Calculer le sous-total selon la logique upsell
                         from commande.templatetags.commande_filters import calculer_sous_total_upsell
@@ -357,6 +340,14 @@ def creer_commande(request):
                     
                     article_counter += 1
                 
+                # Décrémenter le stock des variantes (lève StockInsuffisant : la création est annulée)
+                stock.reserver(
+                    lignes_stock,
+                    commande=commande,
+                    operateur=getattr(request.user, 'profil_operateur', None),
+                    commentaire=f"Création commande {commande.id_yz}",
+                )
+                
                 # Mettre à jour le total de la commande
                 commande.total_cmd = total_commande
                 commande.save()
@@ -374,6 +365,10 @@ def creer_commande(request):
                 
         except Client.DoesNotExist:
             messages.error(request, "Le client sélectionné n'existe pas.")
+        except stock.StockInsuffisant as e:
+            for manque in e.manques:
+                variante = manque['variante']
+                messages.error(request, f"Stock insuffisant pour {variante.article.nom} - {variante.couleur.nom if variante.couleur else ''} {variante.pointure.pointure if variante.pointure else ''}. Stock disponible: {manque['disponible']}")
         except Article.DoesNotExist:
             messages.error(request, "Un des articles sélectionnés n'existe pas.")
         except Exception as e:
@@ -443,13 +438,14 @@ def modifier_commande(request, pk):
                 
                 elif action == 'update_panier':
                     # === MISE À JOUR DU PANIER UNIQUEMENT ===
-                    # Restaurer les stocks des anciens articles du panier avant de les supprimer
-                    anciens_paniers = Panier.objects.filter(commande=commande)
-                    for ancien_panier in anciens_paniers:
-                        if ancien_panier.variante:
-                            # Restaurer le stock de la variante
-                            ancien_panier.variante.qte_disponible += ancien_panier.quantite
-                            ancien_panier.variante.save()
+                    # Restaurer les stocks des anciens articles du panier avant de les supprimer :
+                    # remise en stock et nouvelles sorties sont appliquées ensemble, en un lot
+                    operateur_stock = getattr(request.user, 'profil_operateur', None)
+                    commentaire_stock = f"Modification panier cmd {commande.id_yz}"
+                    mouvements_stock = [
+                        stock.Mouvement(variante, quantite, 'entree', commentaire_stock)
+                        for variante, quantite in stock.lignes_paniers(Panier.objects.filter(commande=commande).select_related('variante'))
+                    ]
                     
                     # Supprimer tous les anciens articles du panier
                     Panier.objects.filter(commande=commande).delete()
@@ -473,15 +469,7 @@ def modifier_commande(request, pk):
                                 if variante_id:
                                     from article.models import VarianteArticle
                                     variante = VarianteArticle.objects.get(pk=variante_id)
-                                    
-                                    # Vérifier la disponibilité du stock de la variante
-                                    if variante.qte_disponible < quantite:
-                                        messages.error(request, f"Stock insuffisant pour {article.nom} - {variante.couleur.nom} {variante.pointure.pointure}. Stock disponible: {variante.qte_disponible}")
-                                        return render(request, 'commande/modifier.html', context)
-                                    
-                                    # Décrémenter le stock de la variante
-                                    variante.qte_disponible -= quantite
-                                    variante.save()
+                                    mouvements_stock.append(stock.Mouvement(variante, -quantite, 'sortie', commentaire_stock))
                                 
                                 # Calculer le sous-total selon la logique upsell
                                 from commande.templatetags.commande_filters import calculer_sous_total_upsell
@@ -506,6 +494,9 @@ def modifier_commande(request, pk):
                         
                         article_counter += 1
                     
+                    # Vérifier et appliquer les mouvements de stock (lève StockInsuffisant : rien n'est modifié)
+                    stock.appliquer(mouvements_stock, commande=commande, operateur=operateur_stock)
+                    
                     # Mettre à jour le total de la commande
                     commande.total_cmd = total_commande
                     commande.save()
@@ -889,13 +880,12 @@ def commandes_affectees(request):
     # Récupérer SEULEMENT les commandes avec un état "Affectée" exact et actuel
     # ✅ Optimisation : select_related pour éviter les N+1 queries
     commandes_affectees = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Affectée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Affectée')
     ).select_related(
         'client', 'ville', 'ville__region'
     ).prefetch_related(
         'etats__enum_etat', 'etats__operateur'
-    ).distinct().order_by('-date_cmd')
+    ).order_by('-date_cmd')
     
     # Filtrage par recherche
     search_query = request.GET.get('search', '')
@@ -952,11 +942,10 @@ def commandes_affectees(request):
     
     # ✅ Optimisation : Statistiques par opérateur en une seule requête
     operateurs_stats = commandes_affectees.filter(
-        etats__date_fin__isnull=True,
-        etats__operateur__isnull=False
+        operateur_etat_courant__isnull=False
     ).values(
-        'etats__operateur__nom', 
-        'etats__operateur__prenom'
+        'operateur_etat_courant__nom',
+        'operateur_etat_courant__prenom'
     ).annotate(
         count=Count('id'),
         montant=Sum('total_cmd')
@@ -965,7 +954,7 @@ def commandes_affectees(request):
     # Transformer en dictionnaire pour compatibilité avec le template
     operateurs_dict = {}
     for stat in operateurs_stats:
-        nom_complet = f"{stat['etats__operateur__prenom']} {stat['etats__operateur__nom']}"
+        nom_complet = f"{stat['operateur_etat_courant__prenom']} {stat['operateur_etat_courant__nom']}"
         operateurs_dict[nom_complet] = {
             'count': stat['count'],
             'montant': stat['montant']
@@ -1049,13 +1038,12 @@ def commandes_annulees(request):
     # ✅ Optimisation : Récupérer les commandes avec un état "Annulée" actuel
     # Avec select_related pour éviter les N+1 queries
     commandes_annulees = Commande.objects.filter(
-        etats__enum_etat__libelle__icontains='Annulée',
-        etats__date_fin__isnull=True
+        etat_courant__libelle__icontains='Annulée'
     ).select_related(
         'client', 'ville', 'ville__region'
     ).prefetch_related(
         'etats__enum_etat', 'etats__operateur'
-    ).distinct().order_by('-date_cmd')
+    ).order_by('-date_cmd')
     
     # Filtrage par recherche
     search_query = request.GET.get('search', '')
@@ -1183,34 +1171,19 @@ def commandes_annulees(request):
 @login_required
 def commandes_non_affectees(request):
     """Page des commandes non affectées"""
-    from .models import EtatCommande
-    from django.db.models import Q, OuterRef, Exists
-    
-    # ✅ Optimisation : Requête unifiée avec subquery pour les commandes non affectées
-    # Sous-requête pour identifier les commandes avec un état actuel
-    commandes_avec_etat_actuel = EtatCommande.objects.filter(
-        commande=OuterRef('pk'),
-        date_fin__isnull=True
-    )
+    from django.db.models import Q
     
     # Récupérer les commandes soit :
     # 1. Avec état "Non affectée" actuel
     # 2. Sans état actuel (nouvelles commandes)
     commandes_non_affectees = Commande.objects.filter(
-        Q(
-            # Commandes avec état "Non affectée" actuel
-            etats__enum_etat__libelle__exact='Non affectée',
-            etats__date_fin__isnull=True
-        ) |
-        Q(
-            # Commandes sans état actuel (nouvelles)
-            ~Exists(commandes_avec_etat_actuel)
-        )
+        Q(etat_courant_id__in=ids_etats('Non affectée')) |
+        Q(etat_courant__isnull=True)
     ).select_related(
         'client', 'ville', 'ville__region'
     ).prefetch_related(
         'etats__enum_etat', 'etats__operateur'
-    ).distinct().order_by('-date_cmd')
+    ).order_by('-date_cmd')
     
     # Filtrage par recherche
     search_query = request.GET.get('search', '')
@@ -1283,18 +1256,16 @@ def commandes_non_affectees(request):
     # ✅ Optimisation : Statistiques détaillées avec requêtes optimisées
     # Compter les commandes avec état "Non affectée"
     commandes_avec_etat_non_affectee_count = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Non affectée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Non affectée')
+    ).count()
     
     # Compter les nouvelles commandes (sans état)
     commandes_sans_etat_count = total_non_affectees - commandes_avec_etat_non_affectee_count
     
     # Statistiques des commandes affectées pour comparaison
     total_affectees = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Affectée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Affectée')
+    ).count()
     
     # Statistiques et listes des opérateurs
     from parametre.models import Operateur
@@ -1368,10 +1339,8 @@ def commandes_a_traiter(request):
     
     # Récupérer les commandes avec état "Doublon" ou "Erronée" actuel
     commandes_a_traiter = Commande.objects.filter(
-        Q(etats__enum_etat__libelle__exact='Doublon') | 
-        Q(etats__enum_etat__libelle__exact='Erronée'),
-        etats__date_fin__isnull=True
-    ).distinct().order_by('-date_cmd')
+        Q(etat_courant_id__in=ids_etats('Doublon', 'Erronée'))
+    ).order_by('-date_cmd')
     
     # Filtrage par recherche
     search_query = request.GET.get('search', '')
@@ -1436,20 +1405,17 @@ def commandes_a_traiter(request):
     
     # Statistiques par type
     commandes_doublons = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Doublon',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Doublon')
+    ).count()
     
     commandes_erronnees = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Erronée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Erronée')
+    ).count()
     
     # Statistiques des commandes traitées pour comparaison
     commandes_confirmees = Commande.objects.filter(
-        etats__enum_etat__libelle__exact='Confirmée',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Confirmée')
+    ).count()
     
     # Vérifier si c'est une requête AJAX
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -1510,39 +1476,26 @@ def affecter_commandes(request):
         operateur = get_object_or_404(Operateur, id=operateur_id)
         
         # Récupérer ou créer l'état "Affectée"
-        etat_affectee, created = EnumEtatCmd.objects.get_or_create(
-            libelle='Affectée',
+        etat_affectee, created = obtenir_ou_creer_etat(
+            'Affectée',
             defaults={'ordre': 20, 'couleur': '#3B82F6'}
         )
         
-        commandes_affectees = 0
-        for commande_id in commande_ids:
-            try:
-                commande = Commande.objects.get(id=commande_id)
-                
-                # Terminer l'état actuel s'il existe
-                etat_actuel = commande.etat_actuel
-                if etat_actuel:
-                    etat_actuel.terminer_etat(operateur)
-                
-                # Créer le nouvel état "Affectée"
-                from .models import EtatCommande
-                EtatCommande.objects.create(
-                    commande=commande,
-                    enum_etat=etat_affectee,
-                    operateur=operateur,
-                    commentaire=f"Commande affectée à {operateur.get_full_name()}"
-                )
-                
-                commandes_affectees += 1
-                
-            except Commande.DoesNotExist:
-                continue
+        # Terminer les états actuels et créer les états "Affectée" en une transaction
+        resultats = transitions.changer_etats(
+            commande_ids,
+            etat_affectee,
+            operateur=operateur,
+            operateur_cloture=operateur,
+            commentaire=f"Commande affectée à {operateur.get_full_name()}",
+        )
+        commandes_affectees = sum(1 for resultat in resultats if resultat.ok)
         
         return JsonResponse({
             'success': True,
             'message': f'{commandes_affectees} commande(s) affectée(s) à {operateur.get_full_name()}',
-            'commandes_affectees': commandes_affectees
+            'commandes_affectees': commandes_affectees,
+            'resultats': [resultat.as_dict() for resultat in resultats]
         })
         
     except Exception as e:
@@ -1562,33 +1515,21 @@ def changer_statut_commandes(request):
         
         nouvel_etat = get_object_or_404(EnumEtatCmd, id=nouvel_etat_id)
         
-        commandes_modifiees = 0
-        for commande_id in commande_ids:
-            try:
-                commande = Commande.objects.get(id=commande_id)
-                
-                # Terminer l'état actuel s'il existe
-                etat_actuel = commande.etat_actuel
-                if etat_actuel:
-                    etat_actuel.terminer_etat(request.user.operateur if hasattr(request.user, 'operateur') else None)
-                
-                # Créer le nouvel état
-                from .models import EtatCommande
-                EtatCommande.objects.create(
-                    commande=commande,
-                    enum_etat=nouvel_etat,
-                    operateur=request.user.operateur if hasattr(request.user, 'operateur') else None,
-                    commentaire=commentaire or f"Statut changé vers {nouvel_etat.libelle}"
-                )
-                
-                commandes_modifiees += 1
-                
-            except Commande.DoesNotExist:
-                continue
+        operateur = request.user.operateur if hasattr(request.user, 'operateur') else None
+        resultats = transitions.changer_etats(
+            commande_ids,
+            nouvel_etat,
+            operateur=operateur,
+            operateur_cloture=operateur,
+            commentaire=commentaire or f"Statut changé vers {nouvel_etat.libelle}",
+            ignorer_identiques=False,
+        )
+        commandes_modifiees = sum(1 for resultat in resultats if resultat.ok)
         
         return JsonResponse({
             'success': True, 
-            'message': f'{commandes_modifiees} commande(s) passée(s) au statut "{nouvel_etat.libelle}"'
+            'message': f'{commandes_modifiees} commande(s) passée(s) au statut "{nouvel_etat.libelle}"',
+            'resultats': [resultat.as_dict() for resultat in resultats]
         })
         
     except Exception as e:
@@ -1620,13 +1561,13 @@ def changer_statut_commande_unique(request, commande_id):
         elif nouveau_statut:
             # Récupérer ou créer l'état par libellé
             if nouveau_statut.lower() == 'non affectée':
-                nouvel_etat, created = EnumEtatCmd.objects.get_or_create(
-                    libelle='Non affectée',
+                nouvel_etat, created = obtenir_ou_creer_etat(
+                    'Non affectée',
                     defaults={'ordre': 10, 'couleur': '#6B7280'}
                 )
             else:
                 try:
-                    nouvel_etat = EnumEtatCmd.objects.get(libelle=nouveau_statut)
+                    nouvel_etat = obtenir_etat(nouveau_statut)
                 except EnumEtatCmd.DoesNotExist:
                     return JsonResponse({'success': False, 'message': f'L\'état "{nouveau_statut}" n\'existe pas'})
         else:
@@ -1673,8 +1614,8 @@ def desaffecter_commande_unique(request, commande_id):
             return JsonResponse({'success': False, 'message': 'Cette commande n\'est pas affectée'})
         
         # Récupérer ou créer l'état "Non affectée" 
-        etat_non_affectee, created = EnumEtatCmd.objects.get_or_create(
-            libelle='Non affectée',
+        etat_non_affectee, created = obtenir_ou_creer_etat(
+            'Non affectée',
             defaults={'ordre': 1, 'couleur': '#F59E0B'}
         )
         
@@ -1709,39 +1650,27 @@ def desaffecter_commandes(request):
             return JsonResponse({'success': False, 'error': 'Aucune commande sélectionnée'})
         
         # Récupérer ou créer l'état "En attente"
-        etat_en_attente, created = EnumEtatCmd.objects.get_or_create(
-            libelle='En attente',
+        etat_en_attente, created = obtenir_ou_creer_etat(
+            'En attente',
             defaults={'ordre': 5, 'couleur': '#9CA3AF'}
         )
         
-        commandes_desaffectees = 0
-        for commande_id in commande_ids:
-            try:
-                commande = Commande.objects.get(id=commande_id)
-                
-                # Vérifier si la commande est actuellement affectée
-                etat_actuel = commande.etat_actuel
-                if etat_actuel and etat_actuel.enum_etat.libelle == 'Affectée':
-                    # Terminer l'état actuel
-                    etat_actuel.terminer_etat(request.user.operateur if hasattr(request.user, 'operateur') else None)
-                    
-                    # Créer le nouvel état "En attente"
-                    from .models import EtatCommande
-                    EtatCommande.objects.create(
-                        commande=commande,
-                        enum_etat=etat_en_attente,
-                        operateur=request.user.operateur if hasattr(request.user, 'operateur') else None,
-                        commentaire="Commande désaffectée - remise en attente"
-                    )
-                    
-                    commandes_desaffectees += 1
-                
-            except Commande.DoesNotExist:
-                continue
+        # Seules les commandes actuellement "Affectée" sont remises en attente
+        operateur = request.user.operateur if hasattr(request.user, 'operateur') else None
+        resultats = transitions.changer_etats(
+            commande_ids,
+            etat_en_attente,
+            operateur=operateur,
+            operateur_cloture=operateur,
+            commentaire="Commande désaffectée - remise en attente",
+            etats_sources=('Affectée',),
+        )
+        commandes_desaffectees = transitions.compter(resultats)[transitions.EFFECTUEE]
         
         return JsonResponse({
             'success': True, 
-            'message': f'{commandes_desaffectees} commande(s) désaffectée(s) avec succès'
+            'message': f'{commandes_desaffectees} commande(s) désaffectée(s) avec succès',
+            'resultats': [resultat.as_dict() for resultat in resultats]
         })
         
     except Exception as e:
@@ -1763,8 +1692,7 @@ def liste_paniers(request):
     etat_filter = request.GET.get('etat', '')
     if etat_filter:
         paniers = paniers.filter(
-            commande__etats__enum_etat__libelle=etat_filter,
-            commande__etats__date_fin__isnull=True
+            commande__etat_courant_id__in=ids_etats(etat_filter)
         )
     
     # Filtrage par recherche
@@ -1847,28 +1775,22 @@ def liste_paniers(request):
     from .models import EtatCommande
     stats_etats = {
         'non_affectees': Panier.objects.filter(
-            commande__etats__enum_etat__libelle__exact='Non affectée',
-            commande__etats__date_fin__isnull=True
+            commande__etat_courant_id__in=ids_etats('Non affectée')
         ).count(),
         'affectees': Panier.objects.filter(
-            commande__etats__enum_etat__libelle__exact='Affectée',
-            commande__etats__date_fin__isnull=True
+            commande__etat_courant_id__in=ids_etats('Affectée')
         ).count(),
         'confirmees': Panier.objects.filter(
-            commande__etats__enum_etat__libelle__exact='Confirmée',
-            commande__etats__date_fin__isnull=True
+            commande__etat_courant_id__in=ids_etats('Confirmée')
         ).count(),
         'livrees': Panier.objects.filter(
-            commande__etats__enum_etat__libelle__exact='Livrée',
-            commande__etats__date_fin__isnull=True
+            commande__etat_courant_id__in=ids_etats('Livrée')
         ).count(),
         'doublons': Panier.objects.filter(
-            commande__etats__enum_etat__libelle__exact='Doublon',
-            commande__etats__date_fin__isnull=True
+            commande__etat_courant_id__in=ids_etats('Doublon')
         ).count(),
         'annulees': Panier.objects.filter(
-            commande__etats__enum_etat__libelle__exact='Annulée',
-            commande__etats__date_fin__isnull=True
+            commande__etat_courant_id__in=ids_etats('Annulée')
         ).count(),
     }
     
@@ -2046,8 +1968,8 @@ def annuler_commande(request, pk):
             return JsonResponse({'success': False, 'message': 'Cette commande est déjà annulée'})
         
         # Récupérer ou créer l'état "Annulée"
-        etat_annulee, created = EnumEtatCmd.objects.get_or_create(
-            libelle='Annulée',
+        etat_annulee, created = obtenir_ou_creer_etat(
+            'Annulée',
             defaults={'ordre': 70, 'couleur': '#EF4444'}
         )
         
@@ -2064,13 +1986,14 @@ def annuler_commande(request, pk):
             commentaire=f"Commande annulée - Motif: {motif}"
         )
         
-        # Restaurer les stocks des articles de la commande
-        paniers = commande.paniers.all()
-        for panier in paniers:
-            if panier.variante:
-                # Restaurer le stock de la variante
-                panier.variante.qte_disponible += panier.quantite
-                panier.variante.save()
+        # Restaurer les stocks des articles de la commande (et rendre les réservations éventuelles)
+        reservations.liberer_commande(commande)
+        stock.liberer(
+            stock.lignes_paniers(commande.paniers.all()),
+            commande=commande,
+            operateur=getattr(request.user, 'profil_operateur', None),
+            commentaire=f"Annulation commande {commande.id_yz} - Motif: {motif}",
+        )
         
         # Sauvegarder le motif d'annulation dans la commande
         commande.motif_annulation = motif
@@ -2096,70 +2019,18 @@ def annuler_commande(request, pk):
         return JsonResponse({'success': False, 'message': str(e)})
 
 # Fonction utilitaire pour automatiser les changements d'état
-def repartition_automatique_commandes():
+def repartition_automatique_commandes(dry_run=False):
     """
     Répartit automatiquement les commandes préparées aux opérateurs logistiques
-    selon un algorithme de répartition par ville/région
+    selon leur charge, leur débit et leurs régions (voir commande/repartition.py)
     """
-    from .models import EnumEtatCmd, EtatCommande
-    from parametre.models import Operateur
-    from django.db.models import Count
+    from .repartition import repartir
     
     try:
-        # Récupérer les commandes préparées non encore affectées pour la livraison
-        commandes_preparees = Commande.objects.filter(
-            etats__enum_etat__libelle='Préparée',
-            etats__date_fin__isnull=True  # État actif
-        ).exclude(
-            # Exclure celles qui ont déjà un état de livraison
-            etats__enum_etat__libelle__in=['En cours de livraison', 'Livrée', 'Retournée']
-        ).select_related('ville', 'ville__region').distinct()
-        
-        if not commandes_preparees.exists():
-            return 0, "Aucune commande préparée à répartir"
-        
-        # Récupérer les opérateurs logistiques actifs
-        operateurs_logistiques = Operateur.objects.filter(
-            type_operateur='LOGISTIQUE',
-            actif=True
-        )
-        
-        if not operateurs_logistiques.exists():
-            return 0, "Aucun opérateur logistique actif disponible"
-        
-        # Créer ou récupérer l'état "En cours de livraison"
-        etat_livraison, created = EnumEtatCmd.objects.get_or_create(
-            libelle='En cours de livraison',
-            defaults={'ordre': 60, 'couleur': '#F59E0B'}
-        )
-        
-        commandes_affectees = 0
-        
-        # Algorithme de répartition simple : round-robin par opérateur
-        operateurs_list = list(operateurs_logistiques)
-        operateur_index = 0
-        
-        for commande in commandes_preparees:
-            # Sélectionner l'opérateur suivant (round-robin)
-            operateur_selectionne = operateurs_list[operateur_index]
-            operateur_index = (operateur_index + 1) % len(operateurs_list)
-            
-            # Terminer l'état "Préparée"
-            etat_actuel = commande.etat_actuel
-            if etat_actuel and etat_actuel.enum_etat.libelle == 'Préparée':
-                etat_actuel.terminer_etat()
-            
-            # Créer l'état "En cours de livraison" avec l'opérateur affecté
-            EtatCommande.objects.create(
-                commande=commande,
-                enum_etat=etat_livraison,
-                operateur=operateur_selectionne,
-                commentaire=f"Affectation automatique à {operateur_selectionne.nom_complet} pour livraison"
-            )
-            
-            commandes_affectees += 1
-        
-        return commandes_affectees, f"{commandes_affectees} commandes réparties automatiquement"
+        plan = repartir('LOGISTIQUE', dry_run=dry_run)
+        if plan.resultats is None:
+            return (len(plan.affectations) if dry_run else 0), plan.message
+        return transitions.compter(plan.resultats)[transitions.EFFECTUEE], plan.message
         
     except Exception as e:
         return 0, f"Erreur lors de la répartition automatique: {str(e)}"
@@ -2174,39 +2045,39 @@ def gerer_changement_etat_automatique(commande, nouvel_etat_libelle, operateur=N
     try:
         # Récupérer ou créer l'état cible
         if nouvel_etat_libelle.lower() == 'non affectée':
-            nouvel_etat, created = EnumEtatCmd.objects.get_or_create(
-                libelle='Non affectée',
+            nouvel_etat, created = obtenir_ou_creer_etat(
+                'Non affectée',
                 defaults={'ordre': 10, 'couleur': '#6B7280'}
             )
             redirect_url = reverse('commande:non_affectees')
         elif nouvel_etat_libelle.lower() == 'annulée':
-            nouvel_etat, created = EnumEtatCmd.objects.get_or_create(
-                libelle='Annulée',
+            nouvel_etat, created = obtenir_ou_creer_etat(
+                'Annulée',
                 defaults={'ordre': 70, 'couleur': '#EF4444'}
             )
             redirect_url = reverse('commande:annulees')
         elif nouvel_etat_libelle == 'En cours de livraison':
-            nouvel_etat, created = EnumEtatCmd.objects.get_or_create(
-                libelle='En cours de livraison',
+            nouvel_etat, created = obtenir_ou_creer_etat(
+                'En cours de livraison',
                 defaults={'ordre': 60, 'couleur': '#F59E0B'}
             )
             redirect_url = None
         elif nouvel_etat_libelle == 'Préparée':
             # Cas spécial : quand une commande devient "Préparée", déclencher la répartition automatique
-            nouvel_etat, created = EnumEtatCmd.objects.get_or_create(
-                libelle='Préparée',
+            nouvel_etat, created = obtenir_ou_creer_etat(
+                'Préparée',
                 defaults={'ordre': 50, 'couleur': '#10B981'}
             )
             redirect_url = None
         else:
             # Pour les autres états, essayer de les récupérer ou les créer
             try:
-                nouvel_etat = EnumEtatCmd.objects.get(libelle=nouvel_etat_libelle)
+                nouvel_etat = obtenir_etat(nouvel_etat_libelle)
                 redirect_url = None
             except EnumEtatCmd.DoesNotExist:
                 # Créer l'état s'il n'existe pas avec des valeurs par défaut
-                nouvel_etat, created = EnumEtatCmd.objects.get_or_create(
-                    libelle=nouvel_etat_libelle,
+                nouvel_etat, created = obtenir_ou_creer_etat(
+                    nouvel_etat_libelle,
                     defaults={'ordre': 50, 'couleur': '#6366F1'}
                 )
                 redirect_url = None
@@ -2256,9 +2127,8 @@ def statistiques_motifs_annulation(request):
     
     # Récupérer les commandes annulées avec leurs motifs
     commandes_annulees = Commande.objects.filter(
-        etats__enum_etat__libelle__icontains='Annulée',
-        etats__date_fin__isnull=True
-    ).distinct()
+        etat_courant__libelle__icontains='Annulée'
+    )
     
     # Statistiques par motif
     motifs_stats = {}
@@ -2312,7 +2182,7 @@ def commandes_confirmees(request):
     # Récupérer toutes les commandes confirmées (qui ont eu l'état "Confirmée" dans leur historique)
     # Note: On ne filtre pas sur l'état actuel car l'état "Confirmée" est fermé après confirmation
     commandes_confirmees = Commande.objects.filter(
-        etats__enum_etat__libelle='Confirmée'
+        etats__enum_etat_id__in=ids_etats('Confirmée')
     ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations').distinct()
     
     # Recherche
@@ -2388,7 +2258,7 @@ def commandes_confirmees(request):
     from django.db.models import Case, When, IntegerField
     
     stats_temporelles = Commande.objects.filter(
-        etats__enum_etat__libelle='Confirmée'
+        etats__enum_etat_id__in=ids_etats('Confirmée')
     ).aggregate(
         confirmees_aujourd_hui=Count(
             'id',
@@ -2421,7 +2291,7 @@ def commandes_confirmees(request):
     for commande in page_obj:
         # Priorité: état Confirmée porté par un opérateur de type CONFIRMATION
         etat_conf_op = commande.etats.filter(
-            enum_etat__libelle='Confirmée',
+            enum_etat_id__in=ids_etats('Confirmée'),
             operateur__type_operateur='CONFIRMATION'
         ).order_by('-date_debut').first()
 
@@ -2429,7 +2299,7 @@ def commandes_confirmees(request):
             commande.etat_confirmation = etat_conf_op
         else:
             # Fallback: n'importe quel état Confirmée (le plus ancien pour refléter l'action originale)
-            etat_conf_any = commande.etats.filter(enum_etat__libelle='Confirmée').order_by('date_debut').first()
+            etat_conf_any = commande.etats.filter(enum_etat_id__in=ids_etats('Confirmée')).order_by('date_debut').first()
             commande.etat_confirmation = etat_conf_any
     
     # Récupérer les opérateurs de préparation actifs
@@ -2492,10 +2362,9 @@ def commandes_preparees(request):
     # Une commande est "préparée" si elle a un état "Préparée" actif
     # ET qu'elle n'a AUCUN état lié à la livraison.
     base_commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Préparée')
     ).exclude(
-        etats__enum_etat__libelle__in=['En cours de livraison', 'Livrée', 'Retournée']
+        etats__enum_etat_id__in=ids_etats('En cours de livraison', 'Livrée', 'Retournée')
     ).distinct()
 
     # Statistiques (calculées avant le filtrage par recherche)
@@ -2632,9 +2501,8 @@ def suivi_confirmations(request):
     
     # Récupérer toutes les commandes EN COURS DE CONFIRMATION
     commandes_en_cours = Commande.objects.filter(
-        etats__enum_etat__libelle='En cours de confirmation',
-        etats__date_fin__isnull=True
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations').distinct()
+        etat_courant_id__in=ids_etats('En cours de confirmation')
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations')
     
     # Recherche
     search_query = request.GET.get('search', '')
@@ -2650,7 +2518,7 @@ def suivi_confirmations(request):
         ).distinct()
     
     # Tri par date de début de confirmation (plus récentes en premier)
-    commandes_en_cours = commandes_en_cours.order_by('-etats__date_debut')
+    commandes_en_cours = commandes_en_cours.order_by('-date_etat_courant')
     
     # Pagination
     if commandes_en_cours.exists():
@@ -2668,28 +2536,24 @@ def suivi_confirmations(request):
     
     # Compter par période - commandes EN COURS DE CONFIRMATION
     en_cours_aujourd_hui = Commande.objects.filter(
-        etats__enum_etat__libelle='En cours de confirmation',
-        etats__date_fin__isnull=True,
-        etats__date_debut__date=today
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('En cours de confirmation'),
+        date_etat_courant__date=today
+    ).count()
     
     en_cours_hier = Commande.objects.filter(
-        etats__enum_etat__libelle='En cours de confirmation',
-        etats__date_fin__isnull=True,
-        etats__date_debut__date=yesterday
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('En cours de confirmation'),
+        date_etat_courant__date=yesterday
+    ).count()
     
     en_cours_semaine = Commande.objects.filter(
-        etats__enum_etat__libelle='En cours de confirmation',
-        etats__date_fin__isnull=True,
-        etats__date_debut__date__gte=this_week
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('En cours de confirmation'),
+        date_etat_courant__date__gte=this_week
+    ).count()
     
     # Compter les commandes en attente (pour information)
     en_attente_count = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Affectée', 'En cours de confirmation'],
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Affectée', 'En cours de confirmation')
+    ).count()
     
     # Montant total des commandes en cours de confirmation
     if commandes_en_cours.exists():
@@ -2707,7 +2571,7 @@ def suivi_confirmations(request):
     commandes_par_operateur = {}
     if commandes_en_cours.exists():
         for commande in commandes_en_cours:
-            etat_en_cours = commande.etats.filter(enum_etat__libelle='En cours de confirmation').first()
+            etat_en_cours = commande.etats.filter(enum_etat_id__in=ids_etats('En cours de confirmation')).first()
             if etat_en_cours and etat_en_cours.operateur:
                 operateur_nom = f"{etat_en_cours.operateur.prenom} {etat_en_cours.operateur.nom}"
                 if operateur_nom not in commandes_par_operateur:
@@ -2769,7 +2633,7 @@ def affecter_preparation(request, commande_id):
         try:
             # Vérifier que l'utilisateur est admin ou superviseur
             try:
-                operateur_admin = Operateur.objects.get(user=request.user, type_operateur__in=['ADMIN', 'SUPERVISEUR_PREPARATION'])
+                operateur_admin = operateur_courant(request, 'ADMIN', 'SUPERVISEUR_PREPARATION')
             except Operateur.DoesNotExist:
                 return JsonResponse({'success': False, 'message': 'Accès non autorisé.'})
             
@@ -2792,8 +2656,8 @@ def affecter_preparation(request, commande_id):
             
             # Vérifier si un état "En préparation" existe
             try:
-                etat_preparation, created = EnumEtatCmd.objects.get_or_create(
-                    libelle='En préparation',
+                etat_preparation, created = obtenir_ou_creer_etat(
+                    'En préparation',
                     defaults={'ordre': 40, 'couleur': '#3B82F6'}
                 )
             except Exception as e:
@@ -2861,7 +2725,7 @@ def affecter_livraison(request, commande_id):
         
         # Vérifier si la commande a un état "Préparée" actif.
         # C'est plus robuste que de se fier à la propriété `etat_actuel`.
-        est_prete = commande.etats.filter(enum_etat__libelle='Préparée', date_fin__isnull=True).exists()
+        est_prete = commande.etats.filter(enum_etat_id__in=ids_etats('Préparée'), date_fin__isnull=True).exists()
         
         if not est_prete:
             return JsonResponse({'success': False, 'message': f'La commande {commande.id_yz} n\'est pas prête pour la livraison.'}, status=400)
@@ -2905,29 +2769,27 @@ def affecter_livraison_multiple(request):
             type_operateur__in=['LIVRAISON', 'LOGISTIQUE']
         )
         
-        commandes_affectees_yz = []
-        commandes_erreurs_yz = []
+        etat_livraison, created = obtenir_ou_creer_etat(
+            'En cours de livraison',
+            defaults={'ordre': 60, 'couleur': '#F59E0B'}
+        )
 
-        with transaction.atomic():
-            commandes_a_traiter = Commande.objects.filter(id__in=commandes_ids)
-            for commande in commandes_a_traiter:
-                try:
-                    # Vérifier si la commande a un état "Préparée" actif.
-                    est_prete = commande.etats.filter(enum_etat__libelle='Préparée', date_fin__isnull=True).exists()
-
-                    if not est_prete:
-                        commandes_erreurs_yz.append(f"{commande.id_yz} (non prête)")
-                        continue
-
-                    gerer_changement_etat_automatique(
-                        commande, 
-                        'En cours de livraison', 
-                        operateur=operateur,
-                        commentaire=commentaire
-                    )
-                    commandes_affectees_yz.append(commande.id) # We'll use the command ID
-                except Exception as e:
-                    commandes_erreurs_yz.append(f"{commande.id_yz} ({str(e)})")
+        # Seules les commandes actuellement "Préparée" passent en livraison
+        resultats = transitions.changer_etats(
+            commandes_ids,
+            etat_livraison,
+            operateur=operateur,
+            operateur_cloture=operateur,
+            commentaire=commentaire or f"Changement automatique vers '{etat_livraison.libelle}'",
+            etats_sources=('Préparée',),
+            ignorer_identiques=False,
+        )
+        commandes_affectees_yz = [resultat.commande_id for resultat in resultats if resultat.statut == transitions.EFFECTUEE]
+        commandes_erreurs_yz = [
+            f"{resultat.id_yz} (non prête)" if resultat.statut == transitions.REFUSEE
+            else f"{resultat.commande_id} ({resultat.message})"
+            for resultat in resultats if not resultat.ok
+        ]
 
         message = f"{len(commandes_affectees_yz)} commande(s) affectée(s) avec succès."
         if commandes_erreurs_yz:
@@ -2950,7 +2812,7 @@ def affecter_preparation_multiple(request):
     try:
         # Vérifier que l'utilisateur est Admin ou Superviseur préparation
         try:
-            operateur_admin = Operateur.objects.get(user=request.user)
+            operateur_admin = operateur_courant(request)
             if operateur_admin.type_operateur not in ['ADMIN', 'SUPERVISEUR_PREPARATION']:
                 return JsonResponse({'success': False, 'message': 'Accès non autorisé.'})
         except Operateur.DoesNotExist:
@@ -2976,95 +2838,56 @@ def affecter_preparation_multiple(request):
 
         # Vérifier si un état "En préparation" existe
         try:
-            etat_preparation, created = EnumEtatCmd.objects.get_or_create(
-                libelle='En préparation',
+            etat_preparation, created = obtenir_ou_creer_etat(
+                'En préparation',
                 defaults={'ordre': 40, 'couleur': '#3B82F6'}
             )
         except Exception as e:
             return JsonResponse({'success': False, 'message': f'Erreur lors de la récupération de l\'état: {str(e)}'})
 
+        # Une commande est affectable si elle a été confirmée (même si l'état "Confirmée" est déjà clos)
+        commandes_confirmees = set(EtatCommande.objects.filter(
+            commande_id__in=[pk for pk in commandes_ids if str(pk).isdigit()],
+            enum_etat_id__in=ids_etats('Confirmée')
+        ).values_list('commande_id', flat=True))
+
+        def commentaire_affectation(courant, operateur_id):
+            action = "Réaffectée" if courant.libelle == 'En préparation' else "Affectée"
+            return f"{action} à la préparation par {operateur_admin.nom_complet}. {commentaire}".strip()
+
+        if operateur_admin.type_operateur == 'SUPERVISEUR_PREPARATION':
+            type_operation = 'AFFECTATION_SUPERVISION'
+            conclusion = f"Commande affectée à {operateur_preparation.nom_complet} par le superviseur de préparation. {commentaire}".strip()
+        else:
+            type_operation = 'AFFECTATION_ADMIN'
+            conclusion = f"Commande affectée à {operateur_preparation.nom_complet} par l'administrateur. {commentaire}".strip()
+
         with transaction.atomic():
-            commandes_a_traiter = Commande.objects.filter(id__in=commandes_ids)
-            for commande in commandes_a_traiter:
-                try:
-                    # Si la commande est Confirmée (même si l'état est déjà clos) OU déjà en file de prépa, on permet l'affectation
-                    etat_actuel = commande.etat_actuel
-                    etat_confirm = commande.etats.filter(enum_etat__libelle='Confirmée').order_by('-date_debut').first()
-                    if not etat_confirm:
-                        commandes_erreurs_yz.append(f"{commande.id_yz} (non confirmée)")
-                        continue
-
-                    # Si l'état actuel est Confirmée, le clore; sinon, si déjà À imprimer/En préparation, on ne clôture pas
-                    if etat_actuel and etat_actuel.enum_etat.libelle == 'Confirmée':
-                        # Ne pas écraser l'opérateur de confirmation
-                        etat_actuel.terminer_etat()
-                    
-                    # Gestion réaffectation propre
-                    etat_a_imprimer_actif = commande.etats.filter(
-                        enum_etat__libelle='À imprimer', date_fin__isnull=True
-                    ).first()
-                    etat_en_prep_actif = commande.etats.filter(
-                        enum_etat__libelle='En préparation', date_fin__isnull=True
-                    ).first()
-
-                    # Si déjà en préparation
-                    if etat_en_prep_actif:
-                        # Même opérateur => idempotent, rien à faire
-                        if etat_en_prep_actif.operateur and etat_en_prep_actif.operateur_id == operateur_preparation.id:
-                            pass
-                        else:
-                            # Clore l'état en cours puis créer un nouvel état pour le nouvel opérateur
-                            try:
-                                etat_en_prep_actif.terminer_etat()
-                            except Exception:
-                                etat_en_prep_actif.date_fin = timezone.now()
-                                etat_en_prep_actif.save(update_fields=['date_fin'])
-                            from .models import EtatCommande
-                            EtatCommande.objects.create(
-                                commande=commande,
-                                enum_etat=etat_preparation,
-                                operateur=operateur_preparation,
-                                commentaire=f"Réaffectée à la préparation par {operateur_admin.nom_complet}. {commentaire}".strip(),
-                                date_debut=timezone.now()
-                            )
-                    else:
-                        # Pas encore en préparation: clore À imprimer si actif, puis créer En préparation
-                        if etat_a_imprimer_actif:
-                            try:
-                                etat_a_imprimer_actif.terminer_etat()
-                            except Exception:
-                                etat_a_imprimer_actif.date_fin = timezone.now()
-                                etat_a_imprimer_actif.save(update_fields=['date_fin'])
-                        from .models import EtatCommande
-                        EtatCommande.objects.create(
-                            commande=commande,
-                            enum_etat=etat_preparation,
-                            operateur=operateur_preparation,
-                            commentaire=f"Affectée à la préparation par {operateur_admin.nom_complet}. {commentaire}".strip(),
-                            date_debut=timezone.now()
-                        )
-                    
-                    # Créer une opération d'affectation selon le type d'opérateur
-                    if operateur_admin.type_operateur == 'SUPERVISEUR_PREPARATION':
-                        # Créer une opération d'affectation par supervision
-                        Operation.objects.create(
-                            commande=commande,
-                            type_operation='AFFECTATION_SUPERVISION',
-                            operateur=operateur_admin,
-                            conclusion=f"Commande affectée à {operateur_preparation.nom_complet} par le superviseur de préparation. {commentaire}".strip()
-                        )
-                    else:
-                        # Créer une opération d'affectation par admin
-                        Operation.objects.create(
-                            commande=commande,
-                            type_operation='AFFECTATION_ADMIN',
-                            operateur=operateur_admin,
-                            conclusion=f"Commande affectée à {operateur_preparation.nom_complet} par l'administrateur. {commentaire}".strip()
-                        )
-                    
-                    commandes_affectees_yz.append(commande.id_yz)
-                except Exception as e:
-                    commandes_erreurs_yz.append(f"{commande.id_yz} ({str(e)})")
+            # Clore l'état en cours (Confirmée, À imprimer, ou En préparation d'un autre opérateur)
+            # et créer "En préparation" ; déjà en préparation chez le même opérateur => rien à faire
+            resultats = transitions.changer_etats(
+                commandes_ids,
+                etat_preparation,
+                operateur=operateur_preparation,
+                commentaire=commentaire_affectation,
+                controle=lambda courant: None if courant.commande_id in commandes_confirmees else "non confirmée",
+            )
+
+            # Créer une opération d'affectation selon le type d'opérateur
+            Operation.objects.bulk_create([
+                Operation(
+                    commande_id=resultat.commande_id,
+                    type_operation=type_operation,
+                    operateur=operateur_admin,
+                    conclusion=conclusion,
+                )
+                for resultat in resultats if resultat.ok
+            ])
+
+        commandes_affectees_yz = [resultat.id_yz for resultat in resultats if resultat.ok]
+        commandes_erreurs_yz = [
+            f"{resultat.id_yz or resultat.commande_id} ({resultat.message})" for resultat in resultats if not resultat.ok
+        ]
 
         message = f"{len(commandes_affectees_yz)} commande(s) affectée(s) avec succès à {operateur_preparation.nom_complet} pour préparation."
         if commandes_erreurs_yz:
@@ -3079,6 +2902,17 @@ def affecter_preparation_multiple(request):
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=500)
 
+@sans_activite
+@login_required
+def api_compteurs_files(request):
+    """API des badges : commandes par état courant, pour l'opérateur connecté et au total"""
+    operateur = Operateur.objects.filter(user=request.user).first()
+    return JsonResponse({
+        'success': True,
+        'operateur': compteurs.par_etat(operateur=operateur) if operateur else {},
+        'total': compteurs.par_etat(),
+    })
+
 @login_required
 def api_panier_commande(request, commande_id):
     """API pour récupérer le contenu du panier d'une commande"""
@@ -3087,7 +2921,7 @@ def api_panier_commande(request, commande_id):
     
     # Vérifier que l'utilisateur est autorisé (admin ou opérateur)
     try:
-        operateur = Operateur.objects.get(user=request.user)
+        operateur = operateur_courant(request)
     except Operateur.DoesNotExist:
         return JsonResponse({'error': 'Accès non autorisé'}, status=403)
     
@@ -3150,9 +2984,8 @@ def suivi_preparations(request):
     
     # Récupérer toutes les commandes en préparation
     commandes_preparation = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['À imprimer', 'En préparation'],
-        etats__date_fin__isnull=True
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations', 'paniers__article').distinct()
+        etat_courant_id__in=ids_etats('À imprimer', 'En préparation')
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations', 'paniers__article')
     
     # Recherche
     search_query = request.GET.get('search', '')
@@ -3168,7 +3001,7 @@ def suivi_preparations(request):
         ).distinct()
     
     # Tri par date de début de préparation (plus récentes en premier)
-    commandes_preparation = commandes_preparation.order_by('-etats__date_debut')
+    commandes_preparation = commandes_preparation.order_by('-date_etat_courant')
     
     # Créer une copie des données non paginées pour les statistiques AVANT la pagination
     commandes_non_paginees = commandes_preparation
@@ -3225,22 +3058,20 @@ def suivi_preparations(request):
     
     # Compter par période et par état
     a_imprimer_count = Commande.objects.filter(
-        etats__enum_etat__libelle='À imprimer',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('À imprimer')
+    ).count()
     
     en_preparation_count = Commande.objects.filter(
-        etats__enum_etat__libelle='En préparation',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('En préparation')
+    ).count()
     
     preparees_aujourd_hui = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
+        etats__enum_etat_id__in=ids_etats('Préparée'),
         etats__date_debut__date=today
     ).distinct().count()
     
     preparees_semaine = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
+        etats__enum_etat_id__in=ids_etats('Préparée'),
         etats__date_debut__date__gte=this_week
     ).distinct().count()
     
@@ -3251,7 +3082,7 @@ def suivi_preparations(request):
     commandes_par_operateur = {}
     for commande in commandes_non_paginees:
         etat_actuel = commande.etats.filter(
-            enum_etat__libelle__in=['À imprimer', 'En préparation'],
+            enum_etat_id__in=ids_etats('À imprimer', 'En préparation'),
             date_fin__isnull=True
         ).first()
         
@@ -3313,9 +3144,8 @@ def commandes_livrees(request):
     
     # Récupérer toutes les commandes livrées
     commandes_livrees = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée',
-        etats__date_fin__isnull=True
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations').distinct()
+        etat_courant_id__in=ids_etats('Livrée')
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations')
     
     # Recherche
     search_query = request.GET.get('search', '')
@@ -3333,7 +3163,7 @@ def commandes_livrees(request):
         ).distinct()
     
     # Tri par date de livraison (plus récentes en premier)
-    commandes_livrees = commandes_livrees.order_by('-etats__date_debut')
+    commandes_livrees = commandes_livrees.order_by('-date_etat_courant')
     
     # Créer une copie des données non paginées pour les statistiques AVANT la pagination
     commandes_non_paginees = commandes_livrees
@@ -3391,28 +3221,24 @@ def commandes_livrees(request):
     
     # Compter par période
     livrees_aujourd_hui = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée',
-        etats__date_fin__isnull=True,
-        etats__date_debut__date=today
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Livrée'),
+        date_etat_courant__date=today
+    ).count()
     
     livrees_hier = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée',
-        etats__date_fin__isnull=True,
-        etats__date_debut__date=yesterday
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Livrée'),
+        date_etat_courant__date=yesterday
+    ).count()
     
     livrees_semaine = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée',
-        etats__date_fin__isnull=True,
-        etats__date_debut__date__gte=this_week
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Livrée'),
+        date_etat_courant__date__gte=this_week
+    ).count()
     
     livrees_mois = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée',
-        etats__date_fin__isnull=True,
-        etats__date_debut__date__gte=this_month
-    ).distinct().count()
+        etat_courant_id__in=ids_etats('Livrée'),
+        date_etat_courant__date__gte=this_month
+    ).count()
     
     # Montant total des commandes livrées
     montant_total = commandes_non_paginees.aggregate(total=Sum('total_cmd'))['total'] or 0
@@ -3424,7 +3250,7 @@ def commandes_livrees(request):
     commandes_par_operateur = {}
     for commande in commandes_livrees:
         etat_livraison = commande.etats.filter(
-            enum_etat__libelle='Livrée',
+            enum_etat_id__in=ids_etats('Livrée'),
             date_fin__isnull=True
         ).first()
         
@@ -3486,6 +3312,7 @@ def rechercher_client_telephone(request):
     """API pour rechercher un client par numéro de téléphone"""
     from django.http import JsonResponse
     from client.models import Client
+    from client import telephone as recherche_telephone
     
     if request.method == 'GET':
         telephone = request.GET.get('telephone', '').strip()
@@ -3497,8 +3324,8 @@ def rechercher_client_telephone(request):
             }, status=400)
         
         try:
-            # Rechercher le client par numéro de téléphone
-            client = Client.objects.get(numero_tel=telephone, is_active=True)
+            # Rechercher le client par numéro de téléphone (quelle que soit la saisie)
+            client = recherche_telephone.trouver(telephone).get(is_active=True)
             
             return JsonResponse({
                 'success': True,
@@ -3521,7 +3348,7 @@ def rechercher_client_telephone(request):
             
         except Client.MultipleObjectsReturned:
             # Si plusieurs clients avec le même numéro (cas rare)
-            clients = Client.objects.filter(numero_tel=telephone, is_active=True)
+            clients = recherche_telephone.trouver(telephone).filter(is_active=True)
             return JsonResponse({
                 'success': False,
                 'error': f'Plusieurs clients trouvés avec ce numéro ({clients.count()})'
@@ -0,0 +1,37 @@
+"""
+Vue servant les images de codes-barres et QR codes (voir commande/codes_barres.py)
+"""
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified
+from django.views.decorators.http import require_GET
+
+from .codes_barres import PRESETS, obtenir_png, version_preset
+
+# L'URL contient les données et la version du preset : son contenu ne change jamais
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+@login_required
+@require_GET
+def code_barre_image(request, preset):
+    """Image PNG d'un code-barres (?d=<données>) selon un preset de commande/codes_barres.py"""
+    if preset not in PRESETS:
+        return HttpResponseBadRequest("Type de code inconnu")
+
+    try:
+        cle, png = obtenir_png(preset, request.GET.get('d', ''))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    etag = f'"{cle}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(png, content_type='image/png')
+    response['ETag'] = etag
+    # URL d'une ancienne version du preset : ne pas la figer dans le cache du navigateur
+    if request.GET.get('v') == version_preset(preset):
+        response['Cache-Control'] = CACHE_CONTROL
+    else:
+        response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -1,9 +1,10 @@
 """
 Vues pour la génération d'étiquettes professionnelles avec ReportLab
 """
-from django.http import HttpResponse, JsonResponse
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404
-from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
@@ -13,19 +14,11 @@ import json
 import io
 from datetime import datetime
 
-# ReportLab imports
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm, inch
-from reportlab.lib.colors import Color, black, white
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
-from reportlab.graphics.barcode import code128, qr
-from reportlab.graphics.shapes import Drawing
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+# Rendu ReportLab (lots, pool de processus, jobs en arrière-plan)
+from . import etiquettes_pdf
 
 # Models
-from .models import Commande, Panier, EtiquetteTemplate
+from .models import Commande, Panier, EtiquetteTemplate, EtiquetteJob
 from article.models import Article
 from client.models import Client
 
@@ -45,9 +38,9 @@ class EtiquetteGeneratorView(View):
         }
         return render(request, 'commande/etiquettes_generator.html', context)
     
-    @method_decorator(csrf_exempt)
+    @method_decorator(login_required)
     def post(self, request):
-        """Générer les étiquettes PDF"""
+        """Générer les étiquettes PDF (en arrière-plan pour les gros volumes ou si async=true)"""
         try:
             data = json.loads(request.body)
             commande_ids = data.get('commande_ids', [])
@@ -61,15 +54,17 @@ class EtiquetteGeneratorView(View):
             template = get_object_or_404(EtiquetteTemplate, id=template_id, is_active=True)
             
             # Récupérer les commandes
-            commandes = Commande.objects.filter(
-                id__in=commande_ids
-            ).select_related('client').prefetch_related('paniers__article')
-            
-            if not commandes.exists():
+            commande_ids = list(Commande.objects.filter(id__in=commande_ids).values_list('id', flat=True))
+            if not commande_ids:
                 return JsonResponse({'error': 'Aucune commande trouvée'}, status=404)
             
+            seuil = getattr(settings, 'ETIQUETTES_SEUIL_ASYNC', 100)
+            if data.get('async') or len(commande_ids) > seuil:
+                job = etiquettes_pdf.lancer_job(template, commande_ids, format_type, request.user)
+                return JsonResponse(serialiser_job(job), status=202)
+            
             # Générer le PDF
-            pdf_buffer = self.generate_etiquettes_pdf(commandes, template, format_type)
+            pdf_buffer = self.generate_etiquettes_pdf(commande_ids, template, format_type)
             
             # Retourner le PDF
             response = HttpResponse(pdf_buffer.getvalue(), content_type='application/pdf')
@@ -80,126 +75,51 @@ class EtiquetteGeneratorView(View):
             return JsonResponse({'error': f'Erreur lors de la génération: {str(e)}'}, status=500)
     
     def generate_etiquettes_pdf(self, commandes, template, format_type):
-        """Générer le PDF des étiquettes"""
-        buffer = io.BytesIO()
-        
-        # Créer le document PDF
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=template.get_dimensions(),
-            rightMargin=template.margin_right * mm,
-            leftMargin=template.margin_left * mm,
-            topMargin=template.margin_top * mm,
-            bottomMargin=template.margin_bottom * mm
-        )
-        
-        # Styles
-        styles = getSampleStyleSheet()
-        
-        # Styles personnalisés
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=template.font_size_title,
-            textColor=Color(0.17, 0.24, 0.31),  # #2c3e50
-            alignment=TA_CENTER,
-            spaceAfter=12,
-        )
-        
-        text_style = ParagraphStyle(
-            'CustomText',
-            parent=styles['Normal'],
-            fontSize=template.font_size_text,
-            textColor=Color(0.2, 0.2, 0.2),  # #333333
-            alignment=TA_LEFT,
-            spaceAfter=6,
+        """Générer le PDF des étiquettes (commandes : instances ou identifiants)"""
+        commande_ids = [getattr(commande, 'id', commande) for commande in commandes]
+        pdf = etiquettes_pdf.generer_pdf(
+            etiquettes_pdf.parametres_template(template),
+            format_type,
+            etiquettes_pdf.donnees_etiquettes(commande_ids),
         )
-        
-        # Construire le contenu
-        story = []
-        
-        for commande in commandes:
-            # Générer une étiquette pour chaque article de la commande
-            for panier in commande.paniers.all():
-                # En-tête
-                if template.show_header:
-                    header_text = f"Commande {commande.id_yz or commande.num_cmd}"
-                    story.append(Paragraph(header_text, title_style))
-                    story.append(Spacer(1, 6))
-                
-                # Informations de l'article
-                article_info = f"""
-                <b>Référence:</b> {panier.article.nom}<br/>
-                <b>Variante:</b> {panier.variante.nom if panier.variante else 'Standard'}<br/>
-                <b>Quantité:</b> {panier.quantite}<br/>
-                <b>Client:</b> {commande.client.nom}<br/>
-                <b>Date:</b> {commande.date_cmd.strftime('%d/%m/%Y')}
-                """
-                story.append(Paragraph(article_info, text_style))
-                story.append(Spacer(1, 12))
-                
-                # Code-barres ou QR code
-                if format_type == 'barcode' and template.show_barcode:
-                    barcode = self.create_barcode(panier.article.nom, template)
-                    if barcode:
-                        story.append(barcode)
-                        story.append(Spacer(1, 12))
-                
-                elif format_type == 'qr' and template.show_qr:
-                    qr_code = self.create_qr_code(panier.article.nom, template)
-                    if qr_code:
-                        story.append(qr_code)
-                        story.append(Spacer(1, 12))
-                
-                # Pied de page
-                if template.show_footer:
-                    footer_text = f"<b>Yoozak</b> - Système de gestion des commandes"
-                    story.append(Paragraph(footer_text, text_style))
-                
-                # Saut de page entre les étiquettes
-                story.append(Spacer(1, 20))
-        
-        # Construire le PDF
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
-    
-    def create_barcode(self, text, template):
-        """Créer un code-barres"""
-        try:
-            # Créer le code-barres
-            barcode = code128.Code128(
-                text,
-                barWidth=template.barcode_width * mm,
-                barHeight=template.barcode_height * mm,
-                fontSize=template.font_size_barcode
-            )
-            
-            # Créer un Drawing pour le code-barres
-            drawing = Drawing(200, 100)
-            drawing.add(barcode)
-            
-            return drawing
-            
-        except Exception as e:
-            print(f"Erreur création code-barres: {e}")
-            return None
-    
-    def create_qr_code(self, text, template):
-        """Créer un QR code"""
-        try:
-            # Créer le QR code
-            qr_code = qr.QrCodeWidget(text)
-            
-            # Créer un Drawing pour le QR code
-            drawing = Drawing(template.qr_size, template.qr_size)
-            drawing.add(qr_code)
-            
-            return drawing
-            
-        except Exception as e:
-            print(f"Erreur création QR code: {e}")
-            return None
+        return io.BytesIO(pdf)
+
+
+def serialiser_job(job):
+    return {
+        'success': True,
+        'job_id': job.pk,
+        'statut': job.statut,
+        'statut_libelle': job.get_statut_display(),
+        'nb_total': job.nb_total,
+        'nb_rendues': job.nb_rendues,
+        'progression': job.progression,
+        'erreur': job.erreur,
+        'statut_url': reverse('commande:etiquettes_job_statut', args=[job.pk]),
+        'telechargement_url': reverse('commande:etiquettes_job_telecharger', args=[job.pk]) if job.statut == 'termine' else None,
+    }
+
+
+def _get_job(request, job_id):
+    job = get_object_or_404(EtiquetteJob, id=job_id)
+    if job.cree_par_id != request.user.id and not request.user.is_superuser:
+        raise Http404("Génération introuvable")
+    return job
+
+
+@login_required
+def etiquettes_job_statut(request, job_id):
+    """Progression d'une génération d'étiquettes en arrière-plan"""
+    return JsonResponse(serialiser_job(_get_job(request, job_id)))
+
+
+@login_required
+def etiquettes_job_telecharger(request, job_id):
+    """Téléchargement du PDF d'une génération d'étiquettes terminée"""
+    job = _get_job(request, job_id)
+    if job.statut != 'termine' or not job.fichier:
+        return JsonResponse({'success': False, 'error': "Le PDF n'est pas encore disponible", 'statut': job.statut}, status=409)
+    return FileResponse(job.fichier.open('rb'), as_attachment=True, filename=f"etiquettes_{job.pk}.pdf", content_type='application/pdf')
 
 
 @login_required
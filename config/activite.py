@@ -0,0 +1,104 @@
+"""
+Suivi de la dernière activité des utilisateurs connectés (déconnexion après inactivité).
+
+L'horodatage précis de la dernière requête part dans un cookie signé (SESSION_ACTIVITE_COOKIE),
+lié à la clé de session : le contrôle d'inactivité le lit sans écrire en base. La session
+(request.session['last_activity']) n'est enregistrée que lorsque cet horodatage a avancé de
+plus de SESSION_ACTIVITE_GRANULARITE secondes, soit une écriture de session par minute
+d'activité au plus au lieu d'une par clic. La dernière activité retenue est la plus récente
+des deux : sans cookie (autre navigateur, cookie effacé), la session seule fait foi.
+
+Les requêtes de rafraîchissement automatique (compteurs, tableaux temps réel) ne sont pas une
+activité de l'utilisateur : elles sont contrôlées mais ne prolongent pas la session. Une vue
+les déclare avec @sans_activite ; un appel JavaScript vers une vue mixte (page + ?ajax=...)
+envoie l'en-tête X-Activite-Passive: 1.
+"""
+import datetime
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core import signing
+from django.utils.timezone import now
+
+SEL = 'config.activite'
+EN_TETE_PASSIF = 'HTTP_X_ACTIVITE_PASSIVE'
+
+
+def granularite():
+    return getattr(settings, 'SESSION_ACTIVITE_GRANULARITE', 60)
+
+
+def nom_cookie():
+    return getattr(settings, 'SESSION_ACTIVITE_COOKIE', 'yz_activite')
+
+
+def sans_activite(view_func):
+    """Vue appelée par un rafraîchissement automatique : ne prolonge pas la session"""
+    @wraps(view_func)
+    def wrapped_view(request, *args, **kwargs):
+        return view_func(request, *args, **kwargs)
+    wrapped_view.sans_activite = True
+    return wrapped_view
+
+
+def requete_passive(request, view_func=None):
+    return bool(getattr(view_func, 'sans_activite', False) or request.META.get(EN_TETE_PASSIF) == '1')
+
+
+def _signeur(request):
+    # Lié à la session : un cookie d'une autre session (ou d'avant la connexion) est ignoré
+    empreinte = hashlib.sha256((request.session.session_key or '').encode()).hexdigest()[:16]
+    return signing.Signer(salt=f'{SEL}:{empreinte}')
+
+
+def derniere_activite(request):
+    """Dernière activité connue (datetime), la plus récente du cookie et de la session ; None sinon"""
+    candidates = []
+    valeur = request.session.get('last_activity')
+    if valeur:
+        try:
+            candidates.append(datetime.datetime.fromisoformat(valeur))
+        except (TypeError, ValueError):
+            pass
+    signe = request.COOKIES.get(nom_cookie())
+    if signe and request.session.session_key:
+        try:
+            horodatage = float(_signeur(request).unsign(signe))
+            candidates.append(datetime.datetime.fromtimestamp(horodatage, tz=datetime.timezone.utc))
+        except (signing.BadSignature, ValueError, OverflowError):
+            pass
+    return max(candidates) if candidates else None
+
+
+def enregistrer_activite(request, response):
+    """Horodate l'activité : cookie à chaque requête, session seulement au-delà de la granularité"""
+    maintenant = now()
+    valeur = request.session.get('last_activity')
+    try:
+        ecart = (maintenant - datetime.datetime.fromisoformat(valeur)).total_seconds() if valeur else None
+    except (TypeError, ValueError):
+        ecart = None
+    if ecart is None or ecart >= granularite() or ecart < 0:
+        request.session['last_activity'] = maintenant.isoformat()
+
+    if request.session.session_key:
+        response.set_cookie(
+            nom_cookie(),
+            _signeur(request).sign(f'{maintenant.timestamp():.0f}'),
+            max_age=settings.SESSION_COOKIE_AGE,
+            path=settings.SESSION_COOKIE_PATH,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+    return response
+
+
+def oublier_activite(response):
+    response.delete_cookie(
+        nom_cookie(), path=settings.SESSION_COOKIE_PATH, domain=settings.SESSION_COOKIE_DOMAIN,
+        samesite=settings.SESSION_COOKIE_SAMESITE,
+    )
+    return response
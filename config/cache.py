@@ -0,0 +1,327 @@
+"""
+Cache à deux niveaux : LRU en mémoire du processus (L1) devant le cache partagé (L2).
+
+Avec DatabaseCache seul, chaque lecture du cache est une requête SQL. Ce backend garde les
+entrées lues ou écrites récemment dans un dictionnaire LRU borné, partagé par les threads du
+processus (comme LocMemCache) :
+
+  - L1 : MAX_ENTRIES_L1 entrées au plus, chacune gardée TTL_L1 secondes au plus (et jamais au-delà
+    de son propre timeout) ; les valeurs sont picklées, une entrée lue n'est pas partagée ;
+  - L2 : un autre alias de CACHES (OPTIONS['L2']) : la table yz_cache_table (DatabaseCache) par
+    défaut, Redis quand CACHE_L2_URL est renseigné. L'alias reste visible de createcachetable.
+
+Invalidation entre processus par tampons de version : chaque clé appartient à l'un des
+NOMBRE_TAMPONS compartiments (empreinte de la clé). Une écriture (set, delete, incr...) écrit
+d'abord dans L2, puis y remplace le tampon de son compartiment par une valeur unique. Chaque
+processus relit tous les tampons en une requête (get_many) au plus toutes les VERIFICATION_TAMPONS
+secondes, hors verrou ; une entrée L1 gardée sous un autre tampon que le tampon courant est relue
+dans L2. Une valeur lue dans L2 est gardée sous le tampon connu avant la lecture : une écriture
+concurrente change ce tampon et l'entrée est écartée. Une valeur modifiée par un autre processus
+est donc vue au plus VERIFICATION_TAMPONS secondes plus tard. add() ne change pas de tampon : la clé était absente, et les absences ne sont pas gardées.
+
+Statistiques par niveau (hits / misses / taux) : cache.stats(), reprises par kpis.cache.get_stats().
+"""
+import hashlib
+import pickle
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+TAMPON_KEY = 'cache:l1:tampon:{compartiment}'
+
+COMPTEURS = ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses', 'evictions', 'invalidations')
+
+
+class _Niveau1:
+    """Entrées L1 et tampons connus d'un cache, communs aux threads du processus"""
+
+    def __init__(self):
+        self.verrou = threading.RLock()
+        self.entrees = OrderedDict()
+        # Remplacé, jamais modifié sur place : lisible hors verrou
+        self.tampons = {}
+        self.tampons_lus_a = None
+        self.lecture_en_cours = False
+        # Compartiments changés par ce processus : {compartiment: instant (monotonic)}
+        self.changements = {}
+        self.stats = dict.fromkeys(COMPTEURS, 0)
+
+
+_niveaux = {}
+_niveaux_verrou = threading.Lock()
+
+
+class CacheDeuxNiveaux(BaseCache):
+    """
+    Backend CACHES. OPTIONS : L2 (alias du cache partagé, 'partage' par défaut), MAX_ENTRIES_L1
+    (1000), TTL_L1 (30 s), VERIFICATION_TAMPONS (2 s), NOMBRE_TAMPONS (64).
+    LOCATION nomme le L1 du processus.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        options = dict(params.get('OPTIONS') or {})
+        self.alias_l2 = options.pop('L2', 'partage')
+        self.max_entries_l1 = int(options.pop('MAX_ENTRIES_L1', 1000))
+        self.ttl_l1 = float(options.pop('TTL_L1', 30))
+        self.verification_tampons = float(options.pop('VERIFICATION_TAMPONS', 2))
+        self.nombre_tampons = max(1, int(options.pop('NOMBRE_TAMPONS', 64)))
+        super().__init__(dict(params, OPTIONS=options))
+
+        with _niveaux_verrou:
+            self._n1 = _niveaux.setdefault(location or 'defaut', _Niveau1())
+
+    @property
+    def l2(self):
+        # Instance du thread courant, comme tout cache obtenu par caches[alias]
+        return caches[self.alias_l2]
+
+    # --- L1 -----------------------------------------------------------------------------
+
+    def _compartiment(self, cle):
+        empreinte = hashlib.blake2b(cle.encode(), digest_size=4).digest()
+        return int.from_bytes(empreinte, 'big') % self.nombre_tampons
+
+    def _compter(self, compteur, nombre=1):
+        if nombre:
+            with self._n1.verrou:
+                self._n1.stats[compteur] += nombre
+
+    def _tampons(self):
+        """
+        {compartiment: tampon} connus, relus dans L2 au plus toutes les VERIFICATION_TAMPONS s. La
+        lecture se fait hors verrou, par un seul thread ; les autres gardent les tampons précédents.
+        """
+        n1 = self._n1
+        with n1.verrou:
+            perimes = n1.tampons_lus_a is None or time.monotonic() - n1.tampons_lus_a >= self.verification_tampons
+            if not perimes or n1.lecture_en_cours:
+                return n1.tampons
+            n1.lecture_en_cours = True
+        debut = time.monotonic()
+        try:
+            cles = [TAMPON_KEY.format(compartiment=numero) for numero in range(self.nombre_tampons)]
+            lus = self.l2.get_many(cles)
+        finally:
+            with n1.verrou:
+                n1.lecture_en_cours = False
+        with n1.verrou:
+            tampons = {numero: lus.get(cle) for numero, cle in enumerate(cles)}
+            # Un tampon changé par ce processus pendant la lecture est plus récent que celui lu
+            for numero, instant in n1.changements.items():
+                if instant >= debut:
+                    tampons[numero] = n1.tampons.get(numero)
+            n1.changements = {numero: instant for numero, instant in n1.changements.items() if instant >= debut}
+            n1.tampons = tampons
+            n1.tampons_lus_a = debut
+            return tampons
+
+    def _tampon(self, cle):
+        """Tampon courant du compartiment de la clé complète `cle`"""
+        return self._tampons().get(self._compartiment(cle))
+
+    def _changer_tampons(self, cles):
+        """
+        Invalide les clés complètes `cles` dans le L1 des autres processus (après l'écriture dans L2).
+        Retourne {compartiment: nouveau tampon}.
+        """
+        nouveaux = {self._compartiment(cle): secrets.token_hex(8) for cle in cles}
+        if not nouveaux:
+            return nouveaux
+        self.l2.set_many(
+            {TAMPON_KEY.format(compartiment=numero): tampon for numero, tampon in nouveaux.items()}, timeout=None
+        )
+        # Les autres entrées de ces compartiments seront relues dans L2 : une écriture d'un autre
+        # processus a pu leur échapper depuis la dernière lecture des tampons
+        with self._n1.verrou:
+            self._n1.tampons = {**self._n1.tampons, **nouveaux}
+            maintenant = time.monotonic()
+            self._n1.changements.update(dict.fromkeys(nouveaux, maintenant))
+        return nouveaux
+
+    def _lire_l1(self, cle):
+        """(trouvée, valeur) de l'entrée L1 de la clé complète `cle`"""
+        n1 = self._n1
+        tampons = self._tampons()
+        with n1.verrou:
+            entree = n1.entrees.get(cle)
+            if entree is None:
+                return False, None
+            valeur, expire_a, tampon, compartiment = entree
+            if expire_a is not None and expire_a <= time.time():
+                del n1.entrees[cle]
+                return False, None
+            if compartiment is not None and tampon != tampons.get(compartiment):
+                del n1.entrees[cle]
+                n1.stats['invalidations'] += 1
+                return False, None
+            n1.entrees.move_to_end(cle)
+        return True, pickle.loads(valeur)
+
+    def _ecrire_l1(self, cle, valeur, timeout, tampon):
+        """
+        Garde la valeur en L1. `tampon` est celui connu avant la lecture (ou celui posé par
+        l'écriture) de la valeur dans L2, jamais le tampon courant à ce moment-ci
+        """
+        expire_a = self.get_backend_timeout(timeout)
+        limite = time.time() + self.ttl_l1
+        expire_a = limite if expire_a is None else min(expire_a, limite)
+        valeur = pickle.dumps(valeur, self.pickle_protocol)
+        compartiment = self._compartiment(cle)
+        n1 = self._n1
+        with n1.verrou:
+            n1.entrees[cle] = (valeur, expire_a, tampon, compartiment)
+            n1.entrees.move_to_end(cle)
+            while len(n1.entrees) > self.max_entries_l1:
+                n1.entrees.popitem(last=False)
+                n1.stats['evictions'] += 1
+
+    def _retirer_l1(self, cle):
+        with self._n1.verrou:
+            return self._n1.entrees.pop(cle, None) is not None
+
+    # --- API du cache -------------------------------------------------------------------
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        tampon = self._tampon(cle)
+        if not self.l2.add(key, value, timeout=timeout, version=version):
+            return False
+        self._ecrire_l1(cle, value, timeout, tampon)
+        return True
+
+    def get(self, key, default=None, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        trouvee, valeur = self._lire_l1(cle)
+        if trouvee:
+            self._compter('l1_hits')
+            return valeur
+        self._compter('l1_misses')
+        absente = object()
+        tampon = self._tampon(cle)
+        valeur = self.l2.get(key, absente, version=version)
+        if valeur is absente:
+            self._compter('l2_misses')
+            return default
+        self._compter('l2_hits')
+        self._ecrire_l1(cle, valeur, DEFAULT_TIMEOUT, tampon)
+        return valeur
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout=timeout, version=version)
+        tampon = self._changer_tampons([cle])[self._compartiment(cle)]
+        self._ecrire_l1(cle, value, timeout, tampon)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        # Le nouveau timeout est repris à la prochaine lecture dans L2
+        self._retirer_l1(cle)
+        return self.l2.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        self._retirer_l1(cle)
+        retiree = self.l2.delete(key, version=version)
+        self._changer_tampons([cle])
+        return retiree
+
+    def has_key(self, key, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        if self._lire_l1(cle)[0]:
+            return True
+        return self.l2.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        valeur = self.l2.incr(key, delta, version=version)
+        tampon = self._changer_tampons([cle])[self._compartiment(cle)]
+        self._ecrire_l1(cle, valeur, DEFAULT_TIMEOUT, tampon)
+        return valeur
+
+    def get_many(self, keys, version=None):
+        trouvees = {}
+        a_lire = []
+        for key in keys:
+            trouvee, valeur = self._lire_l1(self.make_and_validate_key(key, version=version))
+            if trouvee:
+                trouvees[key] = valeur
+            else:
+                a_lire.append(key)
+        self._compter('l1_hits', len(trouvees))
+        self._compter('l1_misses', len(keys) - len(trouvees))
+        if a_lire:
+            tampons = self._tampons()
+            lues = self.l2.get_many(a_lire, version=version)
+            self._compter('l2_hits', len(lues))
+            self._compter('l2_misses', len(a_lire) - len(lues))
+            for key, valeur in lues.items():
+                cle = self.make_key(key, version=version)
+                self._ecrire_l1(cle, valeur, DEFAULT_TIMEOUT, tampons.get(self._compartiment(cle)))
+            trouvees.update(lues)
+        return trouvees
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        echecs = self.l2.set_many(data, timeout=timeout, version=version) if data else []
+        nouveaux = self._changer_tampons([self.make_key(key, version=version) for key in data if key not in echecs])
+        for key, valeur in data.items():
+            if key not in echecs:
+                cle = self.make_and_validate_key(key, version=version)
+                self._ecrire_l1(cle, valeur, timeout, nouveaux[self._compartiment(cle)])
+        return echecs
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            self._retirer_l1(self.make_and_validate_key(key, version=version))
+        if keys:
+            self.l2.delete_many(keys, version=version)
+            self._changer_tampons([self.make_key(key, version=version) for key in keys])
+
+    def clear(self):
+        self.l2.clear()
+        with self._n1.verrou:
+            self._n1.entrees.clear()
+            self._n1.tampons = {}
+            self._n1.tampons_lus_a = None
+        # Nouveaux tampons partout : les autres processus abandonnent toutes leurs entrées L1
+        self.l2.set_many(
+            {TAMPON_KEY.format(compartiment=numero): secrets.token_hex(8) for numero in range(self.nombre_tampons)},
+            timeout=None,
+        )
+
+    # --- Supervision --------------------------------------------------------------------
+
+    def stats(self):
+        """Hits / misses par niveau pour le processus courant"""
+        with self._n1.verrou:
+            compteurs = dict(self._n1.stats)
+            entrees = len(self._n1.entrees)
+
+        def taux(hits, misses):
+            total = hits + misses
+            return round(hits / total * 100, 1) if total else 0
+
+        return {
+            'l1': {
+                'hits': compteurs['l1_hits'],
+                'misses': compteurs['l1_misses'],
+                'taux_hit': taux(compteurs['l1_hits'], compteurs['l1_misses']),
+                'entrees': entrees,
+                'max_entrees': self.max_entries_l1,
+                'evictions': compteurs['evictions'],
+                'invalidations': compteurs['invalidations'],
+            },
+            'l2': {
+                'alias': self.alias_l2,
+                'backend': f'{type(self.l2).__module__}.{type(self.l2).__name__}',
+                'hits': compteurs['l2_hits'],
+                'misses': compteurs['l2_misses'],
+                'taux_hit': taux(compteurs['l2_hits'], compteurs['l2_misses']),
+            },
+        }
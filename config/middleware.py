@@ -3,9 +3,10 @@ from django.contrib.auth import logout
 from django.utils.timezone import now
 from django.shortcuts import redirect
 from django.contrib import messages
-import datetime
 from django.urls import reverse
 from parametre.models import Operateur # Import d'Operateur pour Operateur.DoesNotExist
+from parametre.operateurs import attacher, operateur_courant
+from .activite import derniere_activite, enregistrer_activite, oublier_activite, requete_passive
 import logging
 
 logger = logging.getLogger(__name__)
@@ -37,28 +38,46 @@ class CSRFDebugMiddleware:
         response = self.get_response(request)
         return response
 
+class OperateurMiddleware:
+    """Résout une fois le profil opérateur de la requête : request.operateur, request.role_operateur"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.user.is_authenticated:
+            attacher(request)
+        else:
+            request.operateur = None
+            request.role_operateur = None
+        return self.get_response(request)
+
 class SessionTimeoutMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
         if request.user.is_authenticated:
-            # Vérifier la dernière activité de l'utilisateur
-            last_activity = request.session.get('last_activity')
+            # Vérifier la dernière activité de l'utilisateur (cookie signé ou session)
+            last_activity = derniere_activite(request)
             
             if last_activity:
-                last_activity = datetime.datetime.fromisoformat(last_activity)
                 time_elapsed = (now() - last_activity).total_seconds()
                 
                 if time_elapsed > settings.SESSION_IDLE_TIMEOUT:
                     logout(request)
                     messages.warning(request, "Votre session a expiré en raison d'une longue période d'inactivité. Veuillez vous reconnecter.")
-                    return redirect(settings.LOGIN_URL)
-            
-            # Mettre à jour le timestamp de dernière activité
-            request.session['last_activity'] = now().isoformat()
+                    return oublier_activite(redirect(settings.LOGIN_URL))
 
-        return self.get_response(request)
+        response = self.get_response(request)
+
+        # Mettre à jour la dernière activité, sauf pour les rafraîchissements automatiques
+        if request.user.is_authenticated and not requete_passive(request, getattr(request, '_vue_activite', None)):
+            enregistrer_activite(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._vue_activite = view_func
+        return None
 
 class UserTypeValidationMiddleware:
     def __init__(self, get_response):
@@ -78,6 +97,7 @@ class UserTypeValidationMiddleware:
             '/password_reset/', # Si vous avez des URLs de réinitialisation de mot de passe
             '/__reload__/', # Pour le middleware de rechargement automatique en développement
             '/api/csrf/', # Pour les routes CSRF
+            '/commande/codes/', # Images de codes-barres / QR codes, partagées par tous les espaces
             # '/notifications/', # Notifications supprimées
         )
         self.universal_allowed_exact_paths = (
@@ -105,7 +125,7 @@ class UserTypeValidationMiddleware:
                 return self.get_response(request)
             # Utilisateur non superuser: rediriger proprement vers son espace sans message intrusif
             try:
-                profil = request.user.profil_operateur
+                profil = operateur_courant(request)
                 user_type = profil.type_operateur if profil and profil.actif else None
             except Exception:
                 user_type = None
@@ -123,7 +143,7 @@ class UserTypeValidationMiddleware:
             return redirect(settings.LOGIN_URL)
 
         try:
-            profil = request.user.profil_operateur
+            profil = operateur_courant(request)
             if not profil.actif:
                 messages.error(request, "Votre compte opérateur est désactivé. Veuillez contacter l'administrateur. (Code: MWI-007)")
                 logout(request)
@@ -0,0 +1,309 @@
+"""
+Pagination par curseur (keyset) des listes de commandes et de clients.
+
+Une page est lue par « WHERE clé > dernière clé vue ORDER BY clé LIMIT n + 1 » sur un ordre
+total (champs de tri, puis id) : la page 500 coûte autant que la page 1, sans OFFSET ni
+COUNT(DISTINCT) à chaque page. Le paramètre de page porte un curseur opaque (signé) : sens
+de lecture, clé de la dernière / première ligne affichée et numéro de page (affichage seul).
+
+Le total affiché est approché : fourni par l'appelant (compteurs de files), sinon estimé par
+le planificateur PostgreSQL (EXPLAIN) au-delà de SEUIL_COMPTAGE_EXACT lignes ; en deçà, ou
+sur une autre base, il est compté exactement.
+
+PageCurseur reprend l'interface de django.core.paginator.Page utilisée par les gabarits
+(has_next, next_page_number, start_index, paginator.count...) : next_page_number() et
+previous_page_number() renvoient des curseurs, à placer tels quels dans le paramètre de page,
+et paginator.derniere_page le curseur de la dernière page. Un numéro de page (?page=3) reste
+accepté, par OFFSET, pour les liens déjà enregistrés.
+"""
+import json
+import math
+from collections.abc import Sequence
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
+
+SEL = 'config.pagination'
+SEUIL_COMPTAGE_EXACT = 10000
+
+APRES = 'a'
+AVANT = 'b'
+FIN = 'f'
+
+
+def estimation_planificateur(queryset):
+    """Nombre de lignes estimé par le planificateur PostgreSQL, None sur une autre base"""
+    connexion = connections[queryset.db]
+    if connexion.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connexion.cursor() as curseur:
+        curseur.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = curseur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def compter(queryset, seuil=SEUIL_COMPTAGE_EXACT):
+    """(total, approché) : estimation du planificateur au-delà de `seuil`, comptage exact sinon"""
+    estimation = estimation_planificateur(queryset)
+    if estimation is not None and estimation > seuil:
+        return estimation, True
+    return queryset.count(), False
+
+
+def _encoder(valeur):
+    if isinstance(valeur, (datetime, date, time)):
+        return valeur.isoformat()
+    if isinstance(valeur, Decimal):
+        return str(valeur)
+    return valeur
+
+
+class PaginationCurseur:
+    """
+    Paginateur par curseur d'un queryset. `ordre` : champs de tri ('-date_cmd', 'id_yz'...),
+    complétés par l'id pour un ordre total ; les valeurs NULL sont placées en fin de liste.
+    total : nombre de lignes s'il est déjà connu (compteurs de files), sinon compter().
+    """
+
+    def __init__(self, queryset, per_page, ordre=('-id',), total=None, parametre='page', requete=None):
+        self.queryset = queryset
+        self.per_page = max(1, int(per_page))
+        champs = [(champ.lstrip('-'), champ.startswith('-')) for champ in ordre]
+        if not any(nom in ('id', 'pk') for nom, _ in champs):
+            champs.append(('id', champs[-1][1] if champs else True))
+        self.champs = [(nom, desc, self._nullable(queryset.model, nom)) for nom, desc in champs]
+        self._total = total
+        self.parametre = parametre
+        self.requete = requete
+
+    @staticmethod
+    def _nullable(modele, nom):
+        try:
+            return nom != 'pk' and modele._meta.get_field(nom).null
+        except FieldDoesNotExist:
+            return False
+
+    @cached_property
+    def _comptage(self):
+        if self._total is not None:
+            return self._total, False
+        return compter(self.queryset)
+
+    @property
+    def count(self):
+        return self._comptage[0]
+
+    @property
+    def approche(self):
+        return self._comptage[1]
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    @property
+    def derniere_page(self):
+        return self._jeton(FIN, None, self.num_pages)
+
+    def _jeton(self, sens, valeurs, numero):
+        return signing.dumps([sens, valeurs, numero], salt=SEL, compress=True)
+
+    def _ordonner(self, inverse=False):
+        ordre = []
+        for nom, desc, nullable in self.champs:
+            # NULL en fin de liste dans l'ordre normal, donc en tête dans l'ordre inverse ; sans
+            # NULL possible, un ordre simple garde l'usage des index
+            position = {}
+            if nullable:
+                position = {'nulls_first': True} if inverse else {'nulls_last': True}
+            ordre.append(F(nom).desc(**position) if desc != inverse else F(nom).asc(**position))
+        return self.queryset.order_by(*ordre)
+
+    def _valeurs(self, ligne):
+        if isinstance(ligne, dict):
+            return [_encoder(ligne[nom]) for nom, _, _ in self.champs]
+        return [_encoder(getattr(ligne, nom)) for nom, _, _ in self.champs]
+
+    def _decoder(self, valeurs):
+        options = self.queryset.model._meta
+        decodees = []
+        for (nom, _, _), valeur in zip(self.champs, valeurs):
+            try:
+                champ = options.pk if nom == 'pk' else options.get_field(nom)
+            except FieldDoesNotExist:
+                # Annotation : valeur gardée telle quelle
+                decodees.append(valeur)
+                continue
+            decodees.append(None if valeur is None else champ.to_python(valeur))
+        return decodees
+
+    def _condition(self, valeurs, inverse=False):
+        """Lignes strictement après (avant si inverse) la clé `valeurs` dans l'ordre de la liste"""
+        condition = Q(pk__in=[])
+        egalite = Q()
+        for (nom, desc, nullable), valeur in zip(self.champs, valeurs):
+            if valeur is None:
+                # NULL est en fin de liste : rien après, toutes les valeurs renseignées avant
+                suite = Q(**{f'{nom}__isnull': False}) if inverse else Q(pk__in=[])
+                condition |= egalite & suite
+                egalite &= Q(**{f'{nom}__isnull': True})
+                continue
+            plus_loin = 'lt' if desc != inverse else 'gt'
+            suite = Q(**{f'{nom}__{plus_loin}': valeur})
+            if nullable and not inverse:
+                suite |= Q(**{f'{nom}__isnull': True})
+            condition |= egalite & suite
+            egalite &= Q(**{nom: valeur})
+
+        # Borne sur le premier champ, redondante, qui permet de démarrer le parcours d'index à la clé
+        nom, desc, nullable = self.champs[0]
+        if not nullable and valeurs[0] is not None:
+            condition &= Q(**{f"{nom}__{'lte' if desc != inverse else 'gte'}": valeurs[0]})
+        return condition
+
+    def _lire(self, sens, valeurs):
+        """Lignes de la page et présence d'une page au-delà dans le sens de lecture"""
+        if sens == APRES:
+            lignes = list(self._ordonner().filter(self._condition(valeurs))[:self.per_page + 1])
+        elif sens == AVANT:
+            lignes = list(self._ordonner(inverse=True).filter(self._condition(valeurs, inverse=True))[:self.per_page + 1])
+        else:
+            # Dernière page : le reste de la division du total, pas une page pleine qui
+            # chevaucherait l'avant-dernière
+            taille = self.count - (self.num_pages - 1) * self.per_page
+            if not 0 < taille <= self.per_page:
+                taille = self.per_page
+            lignes = list(self._ordonner(inverse=True)[:taille + 1])
+            encore = len(lignes) > taille
+            lignes = lignes[:taille]
+            lignes.reverse()
+            return lignes, encore
+        encore = len(lignes) > self.per_page
+        lignes = lignes[:self.per_page]
+        if sens == AVANT:
+            lignes.reverse()
+        return lignes, encore
+
+    def get_page(self, valeur=None):
+        """Page désignée par `valeur` : curseur, numéro de page, ou première page"""
+        valeur = str(valeur or '').strip()
+        if valeur.isdigit() and int(valeur) > 1:
+            return self._page_numero(int(valeur))
+        curseur = None
+        if valeur and not valeur.isdigit():
+            try:
+                curseur = signing.loads(valeur, salt=SEL)
+            except signing.BadSignature:
+                curseur = None
+        if not curseur:
+            lignes, suivante = self._premiere()
+            return PageCurseur(lignes, 1, self, precedente=False, suivante=suivante)
+
+        sens, valeurs, numero = curseur
+        valeurs = self._decoder(valeurs) if valeurs is not None else None
+        lignes, encore = self._lire(sens, valeurs)
+        if sens == APRES:
+            if not lignes:
+                return self.get_page()
+            return PageCurseur(lignes, max(numero, 2), self, precedente=True, suivante=encore)
+        if sens == AVANT and not encore:
+            numero = 1
+        return PageCurseur(lignes, max(numero, 1), self, precedente=encore, suivante=sens == AVANT)
+
+    def _premiere(self):
+        lignes = list(self._ordonner()[:self.per_page + 1])
+        return lignes[:self.per_page], len(lignes) > self.per_page
+
+    def _page_numero(self, numero):
+        debut = (numero - 1) * self.per_page
+        lignes = list(self._ordonner()[debut:debut + self.per_page + 1])
+        if not lignes:
+            return self.get_page()
+        return PageCurseur(lignes[:self.per_page], numero, self, precedente=True, suivante=len(lignes) > self.per_page)
+
+    def url(self, jeton):
+        """Paramètres de la requête courante, la page remplacée par `jeton`"""
+        parametres = {}
+        if self.requete is not None:
+            parametres = {cle: valeur for cle, valeur in self.requete.GET.lists() if cle != self.parametre}
+        parametres[self.parametre] = [jeton]
+        return '?' + urlencode(parametres, doseq=True)
+
+
+class PageCurseur(Sequence):
+    def __init__(self, object_list, number, paginator, precedente, suivante):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._precedente = precedente
+        self._suivante = suivante
+
+    def __repr__(self):
+        return f'<Page {self.number} (curseur)>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return bool(self._suivante and self.object_list)
+
+    def has_previous(self):
+        return bool(self._precedente and self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        if not self.has_next():
+            return None
+        return self.paginator._jeton(APRES, self.paginator._valeurs(self.object_list[-1]), self.number + 1)
+
+    def previous_page_number(self):
+        if not self.has_previous():
+            return None
+        return self.paginator._jeton(AVANT, self.paginator._valeurs(self.object_list[0]), self.number - 1)
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 if self.object_list else 0
+
+    @property
+    def url_suivante(self):
+        return self.paginator.url(self.next_page_number()) if self.has_next() else None
+
+    @property
+    def url_precedente(self):
+        return self.paginator.url(self.previous_page_number()) if self.has_previous() else None
+
+    def meta(self):
+        """Pagination d'une réponse JSON"""
+        return {
+            'page': self.number,
+            'par_page': self.paginator.per_page,
+            'suivante': self.next_page_number(),
+            'precedente': self.previous_page_number(),
+            'total': self.paginator.count,
+            'total_approche': self.paginator.approche,
+        }
+
+
+def paginer(request, queryset, per_page, ordre=('-id',), total=None, parametre='page'):
+    """Page de `queryset` désignée par le paramètre `parametre` de la requête"""
+    pagination = PaginationCurseur(queryset, per_page, ordre, total=total, parametre=parametre, requete=request)
+    return pagination.get_page(request.GET.get(parametre))
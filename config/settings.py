@@ -76,10 +76,10 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'config.middleware.OperateurMiddleware',
     'config.middleware.SessionTimeoutMiddleware',
     'config.middleware.UserTypeValidationMiddleware',
     'config.middleware.CSRFDebugMiddleware',
-    'commande.middleware.DelayedConfirmationMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_browser_reload.middleware.BrowserReloadMiddleware',
 ]
@@ -129,17 +129,58 @@ DATABASES = {
  }
 
 # Cache configuration for performance optimization
+# 'default' : LRU en mémoire du processus devant le cache partagé 'partage' (config/cache.py).
+# 'partage' : table yz_cache_table, ou Redis si CACHE_L2_URL est renseigné (redis://localhost:6379/1)
+CACHE_L2_URL = config('CACHE_L2_URL', default='')
+
 CACHES = {
     'default': {
+        'BACKEND': 'config.cache.CacheDeuxNiveaux',
+        'LOCATION': 'yz_cache_l1',
+        'TIMEOUT': 900,  # 15 minutes
+        'OPTIONS': {
+            'L2': 'partage',
+            'MAX_ENTRIES_L1': config('CACHE_L1_MAX_ENTRIES', default=2000, cast=int),
+            'TTL_L1': config('CACHE_L1_TTL', default=30, cast=int),
+            'VERIFICATION_TAMPONS': config('CACHE_L1_VERIFICATION', default=2, cast=int),
+        }
+    },
+    'partage': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'yz_cache_table',
-        'TIMEOUT': 900,  # 15 minutes
+        'TIMEOUT': 900,
         'OPTIONS': {
             'MAX_ENTRIES': 5000,
         }
-    }
+    } if not CACHE_L2_URL else {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_L2_URL,
+        'TIMEOUT': 900,
+    },
 }
 
+# Durée de vie (secondes) des réponses JSON des tableaux de bord en cache (kpis/cache.py)
+KPI_CACHE_TTL = config('KPI_CACHE_TTL', default=60, cast=int)
+# Fenêtre anti-rebond (secondes) : au plus un changement de génération par fenêtre, les écritures
+# arrivées pendant la fenêtre sont prises en compte à sa fin (kpis/cache.py)
+KPI_CACHE_ANTI_REBOND = config('KPI_CACHE_ANTI_REBOND', default=2, cast=int)
+
+# Exports en arrière-plan (parametre/exports.py) : 'thread' (dans le processus web)
+# ou 'commande' (jobs exécutés par `python manage.py executer_exports --boucle`)
+EXPORTS_MODE_EXECUTION = config('EXPORTS_MODE_EXECUTION', default='thread')
+
+# Cache disque des images de codes-barres / QR codes (commande/codes_barres.py)
+CODES_BARRES_CACHE_DIR = config('CODES_BARRES_CACHE_DIR', default=str(BASE_DIR / 'media' / 'codes_barres'))
+CODES_BARRES_PROCESSUS = config('CODES_BARRES_PROCESSUS', default=0, cast=int)  # 0 = min(4, CPU)
+
+# Étiquettes PDF (commande/etiquettes_pdf.py) : au-delà de ce nombre de commandes, génération en arrière-plan
+ETIQUETTES_SEUIL_ASYNC = config('ETIQUETTES_SEUIL_ASYNC', default=100, cast=int)
+ETIQUETTES_PROCESSUS = config('ETIQUETTES_PROCESSUS', default=0, cast=int)  # 0 = min(4, CPU)
+
+# Réservations de stock des commandes en confirmation (article/reservations.py) : durée de vie
+# d'une réservation sans activité ; libérées par `python manage.py balayer_reservations --boucle`
+RESERVATIONS_STOCK_TTL_MINUTES = config('RESERVATIONS_STOCK_TTL_MINUTES', default=120, cast=int)
+
 # Session cache for better performance
 SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 SESSION_CACHE_ALIAS = 'default'
@@ -270,7 +311,9 @@ SESSION_COOKIE_AGE = 86400  # 24 heures en secondes
 SESSION_COOKIE_SECURE = True  # Force cookie sécurisé derrière le proxy HTTPS
 SESSION_COOKIE_HTTPONLY = True  # Protection XSS
 SESSION_COOKIE_SAMESITE = 'Lax'
-SESSION_SAVE_EVERY_REQUEST = True  # Rafraîchir la session à chaque requête
+# La session n'est enregistrée que si elle change : la dernière activité n'y est reportée qu'une
+# fois par SESSION_ACTIVITE_GRANULARITE secondes (config/activite.py), ce qui prolonge aussi le cookie
+SESSION_SAVE_EVERY_REQUEST = False
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # La session persiste même après fermeture du navigateur
 SESSION_COOKIE_NAME = 'yz_cmd_sessionid'  # Nom personnalisé du cookie de session
 
@@ -315,9 +358,18 @@ CSRF_COOKIE_NAME = 'yz_csrf_token'
 # Configuration Google Sheets
 GOOGLE_CREDENTIALS_FILE = os.path.join(BASE_DIR, 'credentials.json')
 GOOGLE_SHEET_URL = config('GOOGLE_SHEET_URL', default='')
+# Taille des lots pour l'import en masse de la synchronisation (0 = traitement ligne par ligne)
+GOOGLE_SHEET_SYNC_BATCH_SIZE = config('GOOGLE_SHEET_SYNC_BATCH_SIZE', default=500, cast=int)
 
 # Délai d'inactivité avant déconnexion (en secondes) - 2 heures
 SESSION_IDLE_TIMEOUT = 7200
+# Écart minimal (secondes) entre deux enregistrements de la dernière activité dans la session ;
+# entre-temps, elle est portée par un cookie signé (config/activite.py)
+SESSION_ACTIVITE_GRANULARITE = config('SESSION_ACTIVITE_GRANULARITE', default=60, cast=int)
+SESSION_ACTIVITE_COOKIE = 'yz_cmd_activite'
+
+# Durée de vie (secondes) du profil opérateur en cache, effacé à chaque modification (parametre/operateurs.py)
+OPERATEUR_CACHE_TTL = config('OPERATEUR_CACHE_TTL', default=300, cast=int)
 
 # Configuration de redirection après connexion
 LOGIN_REDIRECT_URL = '/home/'
@@ -0,0 +1,209 @@
+import datetime
+from importlib import import_module
+from unittest import mock
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from client.models import Client
+from config import activite
+from config.cache import CacheDeuxNiveaux
+from config.pagination import PaginationCurseur, paginer
+
+
+class PaginationCurseurTests(TestCase):
+    """23 clients, noms en double et emails parfois vides, lus par pages de 5"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Client.objects.bulk_create([
+            Client(
+                nom=f'Nom{numero % 7}', prenom='Test', numero_tel=f'06000000{numero:02d}',
+                email=None if numero % 4 == 0 else f'client{numero:02d}@test.ma',
+            )
+            for numero in range(23)
+        ])
+
+    def parcourir(self, pagination, page):
+        """Pages de `page` en suivant les curseurs, dans l'ordre de la liste"""
+        pages = []
+        while True:
+            pages.append([client.pk for client in page])
+            if not page.has_next():
+                return pages
+            page = pagination.get_page(page.next_page_number())
+
+    def attendu(self, *ordre):
+        pks = list(Client.objects.order_by(*ordre).values_list('pk', flat=True))
+        return [pks[debut:debut + 5] for debut in range(0, len(pks), 5)]
+
+    def test_parcours_en_avant_sur_un_ordre_total(self):
+        pagination = PaginationCurseur(Client.objects.all(), 5, ('nom',))
+        page = pagination.get_page()
+
+        self.assertEqual((page.number, page.has_previous(), page.start_index(), page.end_index()), (1, False, 1, 5))
+        self.assertEqual(self.parcourir(pagination, page), self.attendu('nom', 'id'))
+        self.assertEqual((pagination.count, pagination.num_pages, pagination.approche), (23, 5, False))
+
+    def test_valeurs_nulles_en_fin_de_liste(self):
+        pagination = PaginationCurseur(Client.objects.all(), 5, ('-email',))
+        pages = self.parcourir(pagination, pagination.get_page())
+
+        attendu = [client.pk for client in Client.objects.filter(email__isnull=False).order_by('-email', '-id')]
+        attendu += [client.pk for client in Client.objects.filter(email__isnull=True).order_by('-id')]
+        self.assertEqual(sum(pages, []), attendu)
+
+    def test_derniere_page_puis_retour_en_arriere(self):
+        pagination = PaginationCurseur(Client.objects.all(), 5, ('nom',))
+        page = pagination.get_page(pagination.derniere_page)
+
+        # Dernière page : les 3 lignes restantes, pas une page pleine
+        self.assertEqual((page.number, len(page), page.has_next(), page.start_index()), (5, 3, False, 21))
+        pages = []
+        while True:
+            pages.insert(0, [client.pk for client in page])
+            if not page.has_previous():
+                break
+            page = pagination.get_page(page.previous_page_number())
+        self.assertEqual(page.number, 1)
+        self.assertEqual(pages, self.attendu('nom', 'id'))
+
+    def test_numero_de_page_et_curseur_invalide(self):
+        pagination = PaginationCurseur(Client.objects.all(), 5, ('nom',))
+
+        self.assertEqual([client.pk for client in pagination.get_page('3')], self.attendu('nom', 'id')[2])
+        self.assertEqual(pagination.get_page('99').number, 1)
+        self.assertEqual(pagination.get_page('curseur-altéré').number, 1)
+        jeton_etranger = signing.dumps(['a', [0], 2], salt='autre')
+        self.assertEqual(pagination.get_page(jeton_etranger).number, 1)
+
+    def test_total_fourni_et_parametres_conserves(self):
+        requete = RequestFactory().get('/clients/', {'q': 'nom', 'page': ''})
+        page = paginer(requete, Client.objects.all(), 5, ('nom',), total=40)
+
+        self.assertEqual(page.paginator.num_pages, 8)
+        self.assertTrue(page.url_suivante.startswith('?q=nom&page='))
+        self.assertEqual(page.meta()['total'], 40)
+        self.assertIsNone(page.meta()['precedente'])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-defaut'},
+    'l2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-l2'},
+})
+class CacheDeuxNiveauxTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['l2'].clear()
+
+    def niveau(self, processus, **options):
+        """Cache d'un « processus » : L1 propre (LOCATION), L2 commun"""
+        options = {'L2': 'l2', 'VERIFICATION_TAMPONS': 0, **options}
+        return CacheDeuxNiveaux(f'{self.id()}-{processus}', {'TIMEOUT': 300, 'OPTIONS': options})
+
+    def test_lecture_l2_gardee_en_l1(self):
+        cache = self.niveau('a')
+        caches['l2'].set('cle', 'valeur')
+
+        self.assertEqual(cache.get('cle'), 'valeur')
+        self.assertEqual(cache.get('cle'), 'valeur')
+        self.assertEqual((cache.stats()['l1']['hits'], cache.stats()['l2']['hits']), (1, 1))
+        self.assertEqual(cache.get('absente', 'defaut'), 'defaut')
+
+    def test_ecriture_d_un_autre_processus(self):
+        lecteur, ecrivain = self.niveau('lecteur'), self.niveau('ecrivain')
+        ecrivain.set('cle', 1)
+        self.assertEqual(lecteur.get('cle'), 1)
+
+        ecrivain.set('cle', 2)
+        self.assertEqual(lecteur.get('cle'), 2)
+        ecrivain.incr('cle')
+        self.assertEqual(lecteur.get('cle'), 3)
+        ecrivain.delete('cle')
+        self.assertIsNone(lecteur.get('cle'))
+
+    def test_ecriture_concurrente_pendant_la_lecture_l2(self):
+        lecteur, ecrivain = self.niveau('lecteur'), self.niveau('ecrivain')
+        ecrivain.set('cle', 'ancienne')
+        lire = caches['l2'].get
+
+        def lecture_lente(key, *args, **kwargs):
+            valeur = lire(key, *args, **kwargs)
+            if key == 'cle':
+                ecrivain.set('cle', 'nouvelle')
+            return valeur
+
+        with mock.patch.object(caches['l2'], 'get', side_effect=lecture_lente):
+            self.assertEqual(lecteur.get('cle'), 'ancienne')
+        # La valeur lue est gardée sous le tampon d'avant la lecture : écartée ensuite
+        self.assertEqual(lecteur.get('cle'), 'nouvelle')
+
+    def test_tampons_relus_au_plus_toutes_les_n_secondes(self):
+        lecteur, ecrivain = self.niveau('lecteur', VERIFICATION_TAMPONS=3600), self.niveau('ecrivain')
+        ecrivain.set('cle', 1)
+        self.assertEqual(lecteur.get('cle'), 1)
+
+        ecrivain.set('cle', 2)
+        self.assertEqual(lecteur.get('cle'), 1)
+        lecteur._n1.tampons_lus_a -= 3600
+        self.assertEqual(lecteur.get('cle'), 2)
+
+    def test_add_get_many_et_eviction(self):
+        cache = self.niveau('a', MAX_ENTRIES_L1=2)
+        self.assertTrue(cache.add('a', 1))
+        self.assertFalse(cache.add('a', 2))
+        cache.set_many({'b': 2, 'c': 3})
+
+        self.assertEqual(cache.stats()['l1']['entrees'], 2)
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']), {'a': 1, 'b': 2, 'c': 3})
+        cache.delete_many(['a', 'b'])
+        self.assertEqual(self.niveau('b').get_many(['a', 'b', 'c']), {'c': 3})
+
+
+class ActiviteTests(TestCase):
+
+    def requete(self, session=None, cookie=None, **meta):
+        requete = RequestFactory().get('/', **meta)
+        requete.session = session or import_module(settings.SESSION_ENGINE).SessionStore()
+        if requete.session.session_key is None:
+            requete.session.create()
+        if cookie:
+            requete.COOKIES[activite.nom_cookie()] = cookie
+        return requete
+
+    def test_cookie_a_chaque_requete_session_par_granularite(self):
+        requete = self.requete()
+        reponse = activite.enregistrer_activite(requete, HttpResponse())
+        premiere = requete.session['last_activity']
+        cookie = reponse.cookies[activite.nom_cookie()].value
+
+        # Requête suivante dans la granularité : cookie renouvelé, session inchangée
+        requete = self.requete(requete.session, cookie)
+        self.assertAlmostEqual(activite.derniere_activite(requete).timestamp(), timezone.now().timestamp(), delta=1)
+        activite.enregistrer_activite(requete, HttpResponse())
+        self.assertEqual(requete.session['last_activity'], premiere)
+
+        requete.session['last_activity'] = (timezone.now() - datetime.timedelta(seconds=activite.granularite())).isoformat()
+        activite.enregistrer_activite(requete, HttpResponse())
+        self.assertNotEqual(requete.session['last_activity'], premiere)
+
+    def test_cookie_d_une_autre_session_ignore(self):
+        autre = self.requete()
+        cookie = activite.enregistrer_activite(autre, HttpResponse()).cookies[activite.nom_cookie()].value
+        il_y_a_une_heure = timezone.now() - datetime.timedelta(hours=1)
+        requete = self.requete(cookie=cookie)
+        requete.session['last_activity'] = il_y_a_une_heure.isoformat()
+
+        self.assertEqual(activite.derniere_activite(requete), il_y_a_une_heure)
+        self.assertIsNone(activite.derniere_activite(self.requete(cookie='altéré')))
+
+    def test_requetes_passives(self):
+        vue = activite.sans_activite(lambda request: HttpResponse())
+
+        self.assertTrue(activite.requete_passive(self.requete(), vue))
+        self.assertTrue(activite.requete_passive(self.requete(HTTP_X_ACTIVITE_PASSIVE='1')))
+        self.assertFalse(activite.requete_passive(self.requete()))
@@ -6,6 +6,7 @@ from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.decorators.http import require_POST
 from parametre.models import Operateur
+from parametre.operateurs import operateur_courant
 import json
 import subprocess
 import os
@@ -22,7 +23,7 @@ def home_redirect(request):
     
     # Vérifier si l'utilisateur a un profil opérateur
     try:
-        operateur = Operateur.objects.get(user=user, actif=True)
+        operateur = operateur_courant(request, actif=True)
         
         # Redirection selon le type d'opérateur
         if operateur.type_operateur == 'PREPARATION':
@@ -207,6 +208,9 @@ def corriger_clients_ajax(request):
                     
                     # Sauvegarder les modifications du client principal
                     client_principal.save()
+                    # Les commandes transférées reprennent le document de recherche du client principal
+                    from commande.recherche import rafraichir_documents
+                    rafraichir_documents(client_principal.commandes.all())
         
         return JsonResponse({
             'success': True,
@@ -0,0 +1,205 @@
+"""
+Cache en lecture des APIs JSON des tableaux de bord (KPIs, vue 360).
+
+Les réponses sont stockées dans le cache Django (CACHES['default']) sous une clé
+composée de l'endpoint, d'un numéro de génération et des paramètres GET normalisés.
+Toute écriture sur Commande / EtatCommande / Panier incrémente la génération (voir
+kpis/signals.py) : les anciennes entrées ne sont plus jamais lues et expirent d'elles-mêmes.
+KPI_CACHE_TTL borne l'âge d'une réponse servie depuis le cache.
+
+L'invalidation est planifiée une seule fois par transaction, et au plus une fois par
+fenêtre KPI_CACHE_ANTI_REBOND : les écritures arrivées pendant la fenêtre sont notées
+et la génération change à la première lecture qui suit la fin de la fenêtre.
+
+Quand plusieurs navigateurs demandent en même temps une entrée absente, un seul
+processus la recalcule (verrou posé via cache.add) ; les autres attendent le résultat.
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+
+GENERATION_KEY = 'dashboards:generation'
+ANTI_REBOND_KEY = 'dashboards:anti_rebond'
+EN_ATTENTE_KEY = 'dashboards:invalidation_en_attente'
+STATS_KEY = 'dashboards:stats:{compteur}'
+
+# Paramètres ajoutés par le navigateur pour éviter le cache HTTP (jQuery, fetch)
+PARAMETRES_IGNORES = {'_', 'timestamp', 't'}
+
+# Attente maximale d'un recalcul lancé par un autre processus
+ATTENTE_MAX = 10
+INTERVALLE_ATTENTE = 0.05
+
+COMPTEURS = ('hits', 'misses', 'attentes', 'recalculs')
+
+# Compteurs du processus courant, reportés périodiquement dans le cache partagé
+_stats_lock = threading.Lock()
+_stats_locales = dict.fromkeys(COMPTEURS, 0)
+_stats_a_reporter = dict.fromkeys(COMPTEURS, 0)
+_dernier_report = time.monotonic()
+INTERVALLE_REPORT = 30
+
+
+def get_ttl():
+    return getattr(settings, 'KPI_CACHE_TTL', 60)
+
+
+def get_anti_rebond():
+    return getattr(settings, 'KPI_CACHE_ANTI_REBOND', 2)
+
+
+def generation_actuelle():
+    valeurs = cache.get_many([GENERATION_KEY, EN_ATTENTE_KEY, ANTI_REBOND_KEY])
+    # Écritures arrivées pendant une fenêtre anti-rebond terminée : un seul processus les applique
+    if EN_ATTENTE_KEY in valeurs and ANTI_REBOND_KEY not in valeurs and cache.delete(EN_ATTENTE_KEY):
+        invalider_cache_dashboards()
+        valeurs[GENERATION_KEY] = cache.get(GENERATION_KEY)
+    generation = valeurs.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def invalider_cache_dashboards():
+    """Rend obsolètes toutes les réponses en cache en changeant de génération"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+def _invalider_apres_ecriture():
+    """Change de génération, sauf pendant la fenêtre anti-rebond où l'invalidation est seulement notée"""
+    if cache.add(ANTI_REBOND_KEY, 1, timeout=get_anti_rebond()):
+        invalider_cache_dashboards()
+    else:
+        cache.set(EN_ATTENTE_KEY, 1, timeout=None)
+
+
+def planifier_invalidation():
+    """
+    Invalide le cache après le commit de la transaction en cours (immédiatement hors transaction).
+    Un seul rappel par transaction, quel que soit le nombre d'écritures.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(
+        rappel is _invalider_apres_ecriture for _, rappel, _ in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(_invalider_apres_ecriture)
+
+
+def _compter(compteur):
+    global _dernier_report
+    with _stats_lock:
+        _stats_locales[compteur] += 1
+        _stats_a_reporter[compteur] += 1
+        if time.monotonic() - _dernier_report < INTERVALLE_REPORT:
+            return
+        a_reporter = dict(_stats_a_reporter)
+        for nom in COMPTEURS:
+            _stats_a_reporter[nom] = 0
+        _dernier_report = time.monotonic()
+
+    for nom, valeur in a_reporter.items():
+        if not valeur:
+            continue
+        cle = STATS_KEY.format(compteur=nom)
+        if not cache.add(cle, valeur, timeout=None):
+            try:
+                cache.incr(cle, valeur)
+            except ValueError:
+                cache.set(cle, valeur, timeout=None)
+
+
+def get_stats():
+    """Compteurs hit/miss du processus courant et cumulés (tous processus, report toutes les 30 s)"""
+    with _stats_lock:
+        locales = dict(_stats_locales)
+    globales = {nom: cache.get(STATS_KEY.format(compteur=nom), 0) for nom in COMPTEURS}
+
+    def ratio(stats):
+        total = stats['hits'] + stats['misses']
+        return round(stats['hits'] / total * 100, 1) if total else 0
+
+    return {
+        'processus': dict(locales, taux_hit=ratio(locales)),
+        'global': dict(globales, taux_hit=ratio(globales)),
+        'generation': generation_actuelle(),
+        'ttl': get_ttl(),
+        # Hits / misses du L1 (processus) et du cache partagé (config/cache.py)
+        'niveaux': cache.stats() if hasattr(cache, 'stats') else None,
+    }
+
+
+def construire_cle(endpoint, request, par_utilisateur=False):
+    parametres = sorted(
+        (cle, tuple(sorted(valeurs)))
+        for cle, valeurs in request.GET.lists()
+        if cle not in PARAMETRES_IGNORES
+    )
+    if par_utilisateur:
+        parametres.append(('__user', request.user.pk))
+    empreinte = hashlib.md5(repr(parametres).encode()).hexdigest()
+    return f'dashboards:{endpoint}:{generation_actuelle()}:{empreinte}'
+
+
+def _reponse_depuis_cache(entree, statut):
+    response = HttpResponse(entree['content'], content_type=entree['content_type'])
+    response['X-Cache'] = statut
+    return response
+
+
+def cache_dashboard(endpoint, ttl=None, par_utilisateur=False):
+    """
+    Décorateur de vue : met en cache la JsonResponse (GET, statut 200) de l'endpoint.
+
+    À placer sous les décorateurs d'authentification, qui doivent rester évalués à chaque requête.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view_func(request, *args, **kwargs)
+
+            cle = construire_cle(endpoint, request, par_utilisateur)
+            entree = cache.get(cle)
+            if entree is not None:
+                _compter('hits')
+                return _reponse_depuis_cache(entree, 'HIT')
+
+            _compter('misses')
+            cle_verrou = f'{cle}:verrou'
+            verrou_obtenu = cache.add(cle_verrou, 1, timeout=ATTENTE_MAX)
+            if not verrou_obtenu:
+                # Un autre processus recalcule déjà cette entrée : attendre son résultat
+                _compter('attentes')
+                limite = time.monotonic() + ATTENTE_MAX
+                while time.monotonic() < limite:
+                    time.sleep(INTERVALLE_ATTENTE)
+                    entree = cache.get(cle)
+                    if entree is not None:
+                        return _reponse_depuis_cache(entree, 'WAIT')
+
+            try:
+                _compter('recalculs')
+                response = view_func(request, *args, **kwargs)
+                if isinstance(response, JsonResponse) and response.status_code == 200:
+                    cache.set(cle, {
+                        'content': response.content,
+                        'content_type': response['Content-Type'],
+                    }, timeout=ttl or get_ttl())
+                    response['X-Cache'] = 'MISS'
+                return response
+            finally:
+                if verrou_obtenu:
+                    cache.delete(cle_verrou)
+        return wrapped_view
+    return decorator
@@ -0,0 +1,147 @@
+"""
+Alimentation de la table de faits FaitCommandesJournalier.
+
+Les faits sont recalculés par journée entière (date de commande) : une journée
+touchée depuis le dernier watermark est supprimée puis réinsérée en une fois, ce
+qui reste exact quand une commande change d'état, d'opérateur ou de montant.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef, Q, Sum
+from django.utils import timezone
+
+from commande.models import Commande, EtatCommande, Panier
+from commande.etats import ids_etats
+from kpis.cache import invalider_cache_dashboards
+from kpis.models import FaitCommandesJournalier, KPIWatermark
+
+WATERMARK_FAITS_COMMANDES = 'faits_commandes'
+
+# Clé de regroupement (champs Commande) -> champ de la table de faits
+DIMENSIONS = {
+    'date_cmd': 'date',
+    'ville__region_id': 'region_id',
+    'ville_id': 'ville_id',
+    'etat_courant_id': 'etat_id',
+    'operateur_etat_courant_id': 'operateur_id',
+    'source': 'source',
+}
+
+
+def _a_eu_etat(libelle):
+    return Exists(EtatCommande.objects.filter(
+        commande_id=OuterRef('pk'),
+        enum_etat_id__in=ids_etats(libelle),
+    ))
+
+
+def calculer_faits(dates):
+    """Construit (sans les enregistrer) les lignes de faits des journées données"""
+    commandes = Commande.objects.filter(date_cmd__in=dates).annotate(
+        a_ete_livree=_a_eu_etat('Livrée'),
+        a_ete_retournee=_a_eu_etat('Retournée'),
+        a_ete_annulee=_a_eu_etat('Annulée'),
+    )
+
+    lignes = commandes.order_by().values(*DIMENSIONS).annotate(
+        nb_commandes=Count('id'),
+        ca_total=Sum('total_cmd'),
+        ca_max=Max('total_cmd'),
+        nb_livrees=Count('id', filter=Q(a_ete_livree=True)),
+        ca_livre=Sum('total_cmd', filter=Q(a_ete_livree=True)),
+        ca_max_livre=Max('total_cmd', filter=Q(a_ete_livree=True)),
+        nb_retournees=Count('id', filter=Q(a_ete_retournee=True)),
+        nb_annulees=Count('id', filter=Q(a_ete_annulee=True)),
+        ca_annule=Sum('total_cmd', filter=Q(a_ete_annulee=True)),
+    )
+
+    # Les paniers sont agrégés à part pour ne pas dupliquer total_cmd dans la jointure
+    paniers = defaultdict(lambda: (0, 0))
+    for ligne in Panier.objects.filter(commande__date_cmd__in=dates).order_by().values(
+        *[f'commande__{champ}' for champ in DIMENSIONS]
+    ).annotate(quantite=Sum('quantite'), montant=Sum('sous_total')):
+        cle = tuple(ligne[f'commande__{champ}'] for champ in DIMENSIONS)
+        paniers[cle] = (ligne['quantite'] or 0, ligne['montant'] or 0)
+
+    faits = []
+    for ligne in lignes:
+        cle = tuple(ligne[champ] for champ in DIMENSIONS)
+        nb_articles, montant_paniers = paniers[cle]
+        faits.append(FaitCommandesJournalier(
+            **{DIMENSIONS[champ]: ligne[champ] for champ in DIMENSIONS},
+            nb_total=ligne['nb_commandes'],
+            montant_total=ligne['ca_total'] or 0,
+            montant_max=ligne['ca_max'] or 0,
+            nb_articles=nb_articles,
+            montant_paniers=montant_paniers,
+            nb_livrees=ligne['nb_livrees'],
+            montant_livre=ligne['ca_livre'] or 0,
+            montant_max_livre=ligne['ca_max_livre'] or 0,
+            nb_retournees=ligne['nb_retournees'],
+            nb_annulees=ligne['nb_annulees'],
+            montant_annule=ligne['ca_annule'] or 0,
+        ))
+    return faits
+
+
+def dates_modifiees_depuis(instant):
+    """Dates de commande dont au moins une commande a changé (état ou commande) depuis `instant`"""
+    commandes_touchees = EtatCommande.objects.filter(
+        Q(date_debut__gte=instant) | Q(date_fin__gte=instant)
+    ).values('commande_id')
+    return set(Commande.objects.filter(
+        Q(id__in=commandes_touchees) | Q(date_modification__gte=instant)
+    ).order_by().values_list('date_cmd', flat=True).distinct())
+
+
+def toutes_les_dates():
+    return set(Commande.objects.order_by().values_list('date_cmd', flat=True).distinct())
+
+
+def rafraichir_dates(dates, batch_size=31):
+    """Recalcule les faits des journées données, par lots de `batch_size` jours. Retourne le nombre de lignes écrites"""
+    dates = sorted(dates)
+    total = 0
+    for i in range(0, len(dates), batch_size):
+        lot = dates[i:i + batch_size]
+        faits = calculer_faits(lot)
+        with transaction.atomic():
+            FaitCommandesJournalier.objects.filter(date__in=lot).delete()
+            FaitCommandesJournalier.objects.bulk_create(faits, batch_size=1000)
+        total += len(faits)
+    return total
+
+
+def lire_watermark(nom=WATERMARK_FAITS_COMMANDES):
+    watermark = KPIWatermark.objects.filter(nom=nom).first()
+    return watermark.valeur if watermark else None
+
+
+def ecrire_watermark(valeur, nom=WATERMARK_FAITS_COMMANDES):
+    KPIWatermark.objects.update_or_create(nom=nom, defaults={'valeur': valeur})
+
+
+def rafraichir_faits(complet=False, marge=timedelta(minutes=5), batch_size=31):
+    """
+    Rafraîchissement incrémental : recalcule les journées modifiées depuis le dernier
+    watermark (moins une marge pour les transactions encore ouvertes lors du passage
+    précédent), ou toutes les journées si `complet` ou si aucun watermark n'existe.
+    Retourne (nombre de journées, nombre de lignes).
+    """
+    debut = timezone.now()
+    watermark = lire_watermark()
+
+    if complet or watermark is None:
+        dates = toutes_les_dates()
+        # Journées qui n'ont plus aucune commande
+        dates |= set(FaitCommandesJournalier.objects.values_list('date', flat=True).distinct())
+    else:
+        dates = dates_modifiees_depuis(watermark - marge)
+
+    nb_lignes = rafraichir_dates(dates, batch_size=batch_size)
+    ecrire_watermark(debut)
+    if dates:
+        invalider_cache_dashboards()
+    return len(dates), nb_lignes
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from kpis.faits import rafraichir_faits
+
+
+class Command(BaseCommand):
+    help = (
+        "Rafraîchit la table de faits des KPIs (FaitCommandesJournalier) à partir des "
+        "changements d'état depuis le dernier passage. À planifier (cron) toutes les quelques minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--complet',
+            action='store_true',
+            help='Recalcule toutes les journées au lieu des seules journées modifiées',
+        )
+        parser.add_argument(
+            '--marge',
+            type=int,
+            default=5,
+            help='Marge en minutes retranchée au watermark pour rattraper les transactions tardives (défaut: 5)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=31,
+            help='Nombre de journées recalculées par transaction (défaut: 31)',
+        )
+
+    def handle(self, *args, **options):
+        nb_jours, nb_lignes = rafraichir_faits(
+            complet=options['complet'],
+            marge=timedelta(minutes=options['marge']),
+            batch_size=max(1, options['batch_size']),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Faits KPIs rafraîchis : {nb_jours} journée(s), {nb_lignes} ligne(s)'
+        ))
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commande', '0024_sequences_identifiants_commande'),
+        ('kpis', '0001_initial'),
+        ('parametre', '0004_livreur'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KPIWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=100, unique=True)),
+                ('valeur', models.DateTimeField()),
+                ('date_modification', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Watermark KPI',
+                'verbose_name_plural': 'Watermarks KPIs',
+            },
+        ),
+        migrations.CreateModel(
+            name='FaitCommandesJournalier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('source', models.CharField(blank=True, max_length=100, null=True)),
+                ('nb_total', models.PositiveIntegerField(default=0)),
+                ('montant_total', models.FloatField(default=0)),
+                ('montant_max', models.FloatField(default=0)),
+                ('nb_articles', models.PositiveIntegerField(default=0, help_text='Somme des quantités des paniers')),
+                ('montant_paniers', models.FloatField(default=0, help_text='Somme des sous-totaux des paniers')),
+                ('nb_livrees', models.PositiveIntegerField(default=0)),
+                ('montant_livre', models.FloatField(default=0)),
+                ('montant_max_livre', models.FloatField(default=0)),
+                ('nb_retournees', models.PositiveIntegerField(default=0)),
+                ('nb_annulees', models.PositiveIntegerField(default=0)),
+                ('montant_annule', models.FloatField(default=0)),
+                ('date_calcul', models.DateTimeField(auto_now=True)),
+                ('etat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commande.enumetatcmd')),
+                ('operateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='parametre.operateur')),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parametre.region')),
+                ('ville', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parametre.ville')),
+            ],
+            options={
+                'verbose_name': 'Fait commandes journalier',
+                'verbose_name_plural': 'Faits commandes journaliers',
+                'indexes': [models.Index(fields=['date', 'etat'], name='kpi_fait_date_etat_idx'), models.Index(fields=['date', 'region'], name='kpi_fait_date_region_idx')],
+            },
+        ),
+    ]
@@ -31,3 +31,65 @@ class KPIConfiguration(models.Model):
     
     def __str__(self):
         return f"{self.nom_parametre} = {self.valeur} {self.unite}"
+
+
+class FaitCommandesJournalier(models.Model):
+    """
+    Table de faits agrégée pour les tableaux de bord KPIs.
+
+    Une ligne par combinaison (date de commande, région, ville, état actuel, opérateur
+    de l'état actuel, source). Les compteurs "livrées/retournées/annulées" comptent les
+    commandes ayant eu cet état à un moment quelconque, comme les anciens calculs
+    `etats__enum_etat__libelle__iexact=...` des vues KPIs.
+    Alimentée par la commande `rafraichir_faits_kpis` (voir kpis/faits.py).
+    """
+    date = models.DateField()
+    region = models.ForeignKey('parametre.Region', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    ville = models.ForeignKey('parametre.Ville', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    etat = models.ForeignKey('commande.EnumEtatCmd', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    operateur = models.ForeignKey('parametre.Operateur', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    source = models.CharField(max_length=100, null=True, blank=True)
+
+    # Toutes commandes
+    nb_total = models.PositiveIntegerField(default=0)
+    montant_total = models.FloatField(default=0)
+    montant_max = models.FloatField(default=0)
+    nb_articles = models.PositiveIntegerField(default=0, help_text="Somme des quantités des paniers")
+    montant_paniers = models.FloatField(default=0, help_text="Somme des sous-totaux des paniers")
+
+    # Commandes passées par l'état "Livrée"
+    nb_livrees = models.PositiveIntegerField(default=0)
+    montant_livre = models.FloatField(default=0)
+    montant_max_livre = models.FloatField(default=0)
+
+    # Retours et annulations
+    nb_retournees = models.PositiveIntegerField(default=0)
+    nb_annulees = models.PositiveIntegerField(default=0)
+    montant_annule = models.FloatField(default=0)
+
+    date_calcul = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Fait commandes journalier"
+        verbose_name_plural = "Faits commandes journaliers"
+        indexes = [
+            models.Index(fields=['date', 'etat'], name='kpi_fait_date_etat_idx'),
+            models.Index(fields=['date', 'region'], name='kpi_fait_date_region_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.nb_total} commandes ({self.montant_total} DH)"
+
+
+class KPIWatermark(models.Model):
+    """Dernier point de rafraîchissement incrémental d'une table de faits KPI"""
+    nom = models.CharField(max_length=100, unique=True)
+    valeur = models.DateTimeField()
+    date_modification = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Watermark KPI"
+        verbose_name_plural = "Watermarks KPIs"
+
+    def __str__(self):
+        return f"{self.nom} @ {self.valeur}"
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from commande.models import Commande, EtatCommande, Panier
+from kpis.cache import planifier_invalidation
+
+
+@receiver(post_save, sender=Commande)
+@receiver(post_delete, sender=Commande)
+@receiver(post_save, sender=EtatCommande)
+@receiver(post_delete, sender=EtatCommande)
+@receiver(post_save, sender=Panier)
+@receiver(post_delete, sender=Panier)
+def invalider_cache_dashboards_commande(sender, **kwargs):
+    """Toute modification d'une commande, de ses états ou de son panier rend les tableaux de bord obsolètes"""
+    planifier_invalidation()
@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from article.models import Article, Categorie
+from client.models import Client
+from commande.models import Commande, EnumEtatCmd, EtatCommande, Panier
+from kpis import cache as cache_kpis, faits, views
+from kpis.models import FaitCommandesJournalier
+from parametre.models import Operateur, Region, Ville
+
+
+class FaitsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom_region='Centre')
+        cls.ville = Ville.objects.create(nom='Casablanca', frais_livraison=30, region=region)
+        cls.client_test = Client.objects.create(nom='Alami', prenom='Sara', numero_tel='0612345678')
+        cls.user = User.objects.create(username='confirmation')
+        cls.operateur = Operateur.objects.create(
+            user=cls.user, nom='Op', prenom='Test', mail='op@test.ma', type_operateur='CONFIRMATION',
+        )
+        cls.etats = {
+            libelle: EnumEtatCmd.objects.create(libelle=libelle, ordre=ordre)
+            for ordre, libelle in enumerate(('Affectée', 'Confirmée', 'Annulée', 'Livrée', 'Retournée'), start=1)
+        }
+        cls.aujourd_hui = timezone.now().date()
+
+    def setUp(self):
+        cache.clear()
+
+    def commande(self, total, *etats, date_cmd=None):
+        commande = Commande.objects.create(
+            client=self.client_test, ville=self.ville, adresse='Rue 1', total_cmd=total,
+            date_cmd=date_cmd or self.aujourd_hui,
+        )
+        for libelle in etats:
+            EtatCommande.objects.filter(commande=commande, date_fin__isnull=True).update(date_fin=timezone.now())
+            EtatCommande.objects.create(commande=commande, enum_etat=self.etats[libelle], operateur=self.operateur)
+        return commande
+
+    def faits_du_jour(self, **filtres):
+        return FaitCommandesJournalier.objects.filter(date=self.aujourd_hui, **filtres)
+
+
+class FaitsTests(FaitsTestCase):
+
+    def test_faits_par_etat_courant(self):
+        livree = self.commande(100, 'Affectée', 'Livrée')
+        article = Article.objects.create(
+            nom='Sandale', reference='SAN-1', prix_unitaire=45, categorie=Categorie.objects.create(nom='SANDALES')
+        )
+        Panier.objects.create(commande=livree, article=article, quantite=2, sous_total=90)
+        self.commande(200, 'Affectée', 'Livrée', 'Retournée')
+        self.commande(50, 'Annulée')
+        self.commande(70, date_cmd=self.aujourd_hui - timedelta(days=2))
+
+        self.assertEqual(faits.rafraichir_faits(), (2, 4))
+        ligne = self.faits_du_jour(etat=self.etats['Livrée']).get()
+        self.assertEqual(
+            (ligne.nb_total, ligne.montant_total, ligne.nb_articles, ligne.montant_paniers, ligne.nb_livrees),
+            (1, 100, 2, 90, 1),
+        )
+        # La commande retournée a aussi été livrée
+        retournee = self.faits_du_jour(etat=self.etats['Retournée']).get()
+        self.assertEqual((retournee.nb_livrees, retournee.nb_retournees, retournee.montant_livre), (1, 1, 200))
+        self.assertEqual(self.faits_du_jour(etat=self.etats['Annulée']).get().montant_annule, 50)
+        self.assertTrue(FaitCommandesJournalier.objects.filter(etat__isnull=True, nb_total=1).exists())
+
+    def test_rafraichissement_incremental(self):
+        commande = self.commande(100, 'Affectée')
+        ancienne = self.commande(70, 'Affectée', date_cmd=self.aujourd_hui - timedelta(days=3))
+        faits.rafraichir_faits()
+        FaitCommandesJournalier.objects.filter(date=ancienne.date_cmd).update(nb_total=99)
+
+        # Seule la journée de la commande modifiée est recalculée
+        EtatCommande.objects.filter(commande=commande, date_fin__isnull=True).update(date_fin=timezone.now())
+        EtatCommande.objects.create(commande=commande, enum_etat=self.etats['Confirmée'], operateur=self.operateur)
+        self.assertEqual(faits.rafraichir_faits(marge=timedelta(0)), (1, 1))
+        self.assertEqual(self.faits_du_jour().get().etat_id, self.etats['Confirmée'].pk)
+        self.assertEqual(FaitCommandesJournalier.objects.get(date=ancienne.date_cmd).nb_total, 99)
+
+        # Un rafraîchissement complet retire les journées sans commande
+        ancienne.delete()
+        faits.rafraichir_faits(complet=True)
+        self.assertFalse(FaitCommandesJournalier.objects.filter(date=ancienne.date_cmd).exists())
+
+
+class CacheDashboardTests(FaitsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.appels = 0
+
+        @cache_kpis.cache_dashboard('test', par_utilisateur=True)
+        def vue(request):
+            self.appels += 1
+            return JsonResponse({'appel': self.appels})
+
+        self.vue = vue
+
+    def get(self, user=None, **parametres):
+        requete = RequestFactory().get('/kpis/test/', parametres)
+        requete.user = user or self.user
+        return self.vue(requete)
+
+    def test_reponse_servie_depuis_le_cache(self):
+        self.assertEqual(self.get(period='7j')['X-Cache'], 'MISS')
+        reponse = self.get(period='7j', _='1700000000')
+
+        self.assertEqual((reponse['X-Cache'], json.loads(reponse.content)), ('HIT', {'appel': 1}))
+        self.assertEqual(self.get(period='30j')['X-Cache'], 'MISS')
+        self.assertEqual(self.get(User.objects.create(username='autre'), period='7j')['X-Cache'], 'MISS')
+
+    def test_ecriture_sur_une_commande_change_de_generation(self):
+        self.get(period='7j')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.commande(100)
+
+        self.assertEqual(self.get(period='7j')['X-Cache'], 'MISS')
+        self.assertEqual(self.appels, 2)
+
+    def test_une_invalidation_par_transaction(self):
+        with self.captureOnCommitCallbacks() as rappels:
+            self.commande(100, 'Affectée', 'Confirmée')
+            self.commande(200, 'Affectée')
+        self.assertEqual(len(rappels), 1)
+
+    def test_anti_rebond(self):
+        generation = cache_kpis.generation_actuelle()
+        cache_kpis._invalider_apres_ecriture()
+        cache_kpis._invalider_apres_ecriture()
+        self.assertEqual(cache_kpis.generation_actuelle(), generation + 1)
+
+        # Fin de la fenêtre : l'écriture notée entre-temps est appliquée une seule fois
+        cache.delete(cache_kpis.ANTI_REBOND_KEY)
+        self.assertEqual(cache_kpis.generation_actuelle(), generation + 2)
+        self.assertEqual(cache_kpis.generation_actuelle(), generation + 2)
+
+    def test_requete_post_et_erreur_non_gardees(self):
+        requete = RequestFactory().post('/kpis/test/')
+        requete.user = self.user
+        self.assertNotIn('X-Cache', self.vue(requete))
+
+        @cache_kpis.cache_dashboard('erreur')
+        def vue_en_erreur(request):
+            return JsonResponse({'success': False}, status=500)
+
+        for _ in range(2):
+            requete = RequestFactory().get('/kpis/erreur/')
+            self.assertNotIn('X-Cache', vue_en_erreur(requete))
+
+
+class ExportEtatCommandesTests(FaitsTestCase):
+
+    def requete(self, **parametres):
+        requete = RequestFactory().get('/kpis/', {'period': 'aujourd_hui', **parametres})
+        requete.user = self.user
+        return requete
+
+    def test_export_csv_reprend_les_chiffres_du_tableau_de_bord(self):
+        self.commande(100, 'Affectée', 'Livrée')
+        self.commande(200, 'Affectée', 'Livrée')
+        self.commande(50, 'Affectée')
+        self.commande(70)
+        faits.rafraichir_faits()
+
+        tableau = json.loads(views.vue_quantitative_data(self.requete()).content)['data']['etats_commandes']
+        lignes = {
+            ligne[0]: ligne
+            for ligne in csv.reader(io.StringIO(views.export_etat_commandes_csv(self.requete()).content.decode('utf-8-sig')))
+        }
+
+        self.assertEqual(
+            (lignes['Livrée'][1], lignes['Affectée'][1], lignes['Reçue'][1]),
+            (str(tableau['livree']), str(tableau['affectee']), str(tableau['recue'])),
+        )
+        self.assertEqual(lignes['Livrée'][1:6], ['2', '50.0%', '300', '150', 'Op'])
+        self.assertEqual(lignes['TOTAL'][1], '4')
+
+    def test_export_excel_periode_personnalisee(self):
+        if views.openpyxl is None:
+            self.skipTest("openpyxl n'est pas installé")
+        self.commande(100, 'Livrée', date_cmd=self.aujourd_hui - timedelta(days=10))
+        self.commande(80, 'Livrée')
+        faits.rafraichir_faits()
+        debut, fin = self.aujourd_hui - timedelta(days=15), self.aujourd_hui - timedelta(days=5)
+
+        for parametres in ({'period': f'custom:{debut}:{fin}'}, {'period': 'personnalise', 'date_debut': debut, 'date_fin': fin}):
+            with self.subTest(**parametres):
+                reponse = views.export_etat_commandes_excel(self.requete(**parametres))
+                feuille = views.openpyxl.load_workbook(io.BytesIO(reponse.content)).active
+                lignes = {ligne[0]: ligne for ligne in feuille.iter_rows(values_only=True)}
+                self.assertEqual(lignes['Livrée'][1:3], (1, '100.0%'))
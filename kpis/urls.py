@@ -16,6 +16,7 @@ urlpatterns = [
     path('api/vue-quantitative/', views.vue_quantitative_data, name='vue_quantitative_data'),
     path('performance-operateurs-data/', views.performance_operateurs_data, name='performance_operateurs_data'),
     path('operator-history/', views.operator_history_data, name='operator_history_data'),
+    path('api/cache-stats/', views.cache_stats_data, name='cache_stats_data'),
     path('api/operator-realtime-times/', views.operator_realtime_times_data, name='operator_realtime_times_data'),
     path('export/performance-operateurs/csv/', views.export_performance_operateurs_csv, name='export_performance_operateurs_csv'),
     path('export/performance-operateurs/excel/', views.export_performance_operateurs_excel, name='export_performance_operateurs_excel'),
@@ -16,9 +16,13 @@ except ImportError:
 import logging
 
 from commande.models import Commande, Panier, EtatCommande, Operation, EnumEtatCmd
+from commande.etats import ids_etats
 from article.models import Article
 from client.models import Client
 from parametre.models import Operateur
+from kpis.models import FaitCommandesJournalier
+from kpis.cache import cache_dashboard, get_stats
+from config.activite import sans_activite
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +85,7 @@ def validate_integer_value(nom_parametre, valeur):
     return True, valeur
 
 @login_required
+@cache_dashboard('kpis.ventes')
 def ventes_data(request):
     """API pour les données de l'onglet Ventes - E-commerce téléphonique Yoozak"""
     try:
@@ -89,21 +94,21 @@ def ventes_data(request):
         debut_mois = aujourd_hui.replace(day=1)
         mois_precedent = (debut_mois - timedelta(days=1)).replace(day=1)
         debut_30j = aujourd_hui - timedelta(days=30)
-        # === KPI 1: CA par Période (Commandes livrées uniquement) ===
-        # CA de ce mois (du 1er du mois jusqu'à aujourd'hui) - Commandes livrées
-        ca_mois_actuel = Commande.objects.filter(
-            date_cmd__gte=debut_mois,
-            date_cmd__lte=aujourd_hui,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).aggregate(total=Sum('total_cmd'))['total'] or 0
-        
-        # CA mois précédent (du 1er au dernier jour du mois précédent) - Commandes livrées
         fin_mois_precedent = debut_mois - timedelta(days=1)
-        ca_mois_precedent = Commande.objects.filter(
-            date_cmd__gte=mois_precedent,
-            date_cmd__lte=fin_mois_precedent,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).aggregate(total=Sum('total_cmd'))['total'] or 0
+
+        # Agrégats des commandes livrées lus dans la table de faits (kpis/faits.py)
+        livrees_mois = FaitCommandesJournalier.objects.filter(
+            date__gte=debut_mois,
+            date__lte=aujourd_hui
+        ).aggregate(ca=Sum('montant_livre'), nb=Sum('nb_livrees'), max_cmd=Max('montant_max_livre'))
+        livrees_mois_precedent = FaitCommandesJournalier.objects.filter(
+            date__gte=mois_precedent,
+            date__lte=fin_mois_precedent
+        ).aggregate(ca=Sum('montant_livre'), nb=Sum('nb_livrees'))
+
+        # === KPI 1: CA par Période (Commandes livrées uniquement) ===
+        ca_mois_actuel = livrees_mois['ca'] or 0
+        ca_mois_precedent = livrees_mois_precedent['ca'] or 0
         
         # Tendance CA
         if ca_mois_precedent > 0:
@@ -111,38 +116,19 @@ def ventes_data(request):
         else:
             tendance_ca = 100 if ca_mois_actuel > 0 else 0
         
+        # === KPI 3: Nombre de Commandes (Commandes livrées uniquement) ===
+        nb_commandes_mois = livrees_mois['nb'] or 0
+        nb_commandes_mois_precedent = livrees_mois_precedent['nb'] or 0
+
         # === KPI 2: Panier Moyen (Commandes livrées uniquement) ===
-        panier_moyen_mois = Commande.objects.filter(
-            date_cmd__gte=debut_mois,
-            date_cmd__lte=aujourd_hui,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).aggregate(moyenne=Avg('total_cmd'))['moyenne'] or 0
-        
-        # Panier moyen mois précédent - Commandes livrées
-        panier_moyen_precedent = Commande.objects.filter(
-            date_cmd__gte=mois_precedent,
-            date_cmd__lte=fin_mois_precedent,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).aggregate(moyenne=Avg('total_cmd'))['moyenne'] or 0
+        panier_moyen_mois = ca_mois_actuel / nb_commandes_mois if nb_commandes_mois else 0
+        panier_moyen_precedent = ca_mois_precedent / nb_commandes_mois_precedent if nb_commandes_mois_precedent else 0
         
         # Tendance panier moyen
         if panier_moyen_precedent > 0:
             tendance_panier = ((panier_moyen_mois - panier_moyen_precedent) / panier_moyen_precedent) * 100
         else:
             tendance_panier = 100 if panier_moyen_mois > 0 else 0
-        # === KPI 3: Nombre de Commandes (Commandes livrées uniquement) ===
-        nb_commandes_mois = Commande.objects.filter(
-            date_cmd__gte=debut_mois,
-            date_cmd__lte=aujourd_hui,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).count()
-        
-        nb_commandes_mois_precedent = Commande.objects.filter(
-            date_cmd__gte=mois_precedent,
-            date_cmd__lte=fin_mois_precedent,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).count()
-        
         # Tendance nombre de commandes
         if nb_commandes_mois_precedent > 0:
             tendance_commandes = ((nb_commandes_mois - nb_commandes_mois_precedent) / nb_commandes_mois_precedent) * 100
@@ -156,8 +142,7 @@ def ventes_data(request):
             .filter(
                 paniers__commande__date_cmd__gte=debut_mois, 
                 paniers__commande__date_cmd__lte=aujourd_hui,
-                paniers__commande__etats__enum_etat__libelle__iexact='Livrée',
-                paniers__commande__etats__date_fin__isnull=True  # État actuel
+                paniers__commande__etat_courant_id__in=ids_etats('Livrée')
             )
             .annotate(
                 ca_total=Sum('paniers__sous_total'),
@@ -171,39 +156,36 @@ def ventes_data(request):
         
         # Top Région par CA (ce mois)
         # Filtrer d'abord les commandes avec des régions valides
-        top_regions = (Commande.objects
-            .filter(date_cmd__gte=debut_mois, date_cmd__lte=aujourd_hui)
-            .exclude(etats__enum_etat__libelle__iexact='Annulée')
-            .exclude(ville__region__nom_region__isnull=True)  # Exclure les régions nulles
-            .exclude(ville__region__nom_region__exact='')     # Exclure les régions vides
-            .values('ville__region__nom_region')
+        # (commandes jamais annulées = total - annulées)
+        top_regions = (FaitCommandesJournalier.objects
+            .filter(date__gte=debut_mois, date__lte=aujourd_hui)
+            .exclude(region__nom_region__isnull=True)  # Exclure les régions nulles
+            .exclude(region__nom_region__exact='')     # Exclure les régions vides
+            .values('region__nom_region')
             .annotate(
-                ca_total=Sum('total_cmd'),
-                nb_commandes=Count('id')
+                ca_total=Sum(F('montant_total') - F('montant_annule')),
+                nb_commandes=Sum(F('nb_total') - F('nb_annulees'))
             )
+            .filter(nb_commandes__gt=0)
             .order_by('-ca_total')[:5]
         )
         
         top_region = top_regions.first() if top_regions else None
         
         # Vérifier s'il y a des commandes sans région pour diagnostic
-        commandes_sans_region = Commande.objects.filter(
-            date_cmd__gte=debut_mois,
-            date_cmd__lte=aujourd_hui,
-            ville__region__nom_region__isnull=True
-        ).exclude(etats__enum_etat__libelle__iexact='Annulée').count()
+        commandes_sans_region = FaitCommandesJournalier.objects.filter(
+            date__gte=debut_mois,
+            date__lte=aujourd_hui,
+            region__isnull=True
+        ).aggregate(nb=Sum(F('nb_total') - F('nb_annulees')))['nb'] or 0
         
         # Commande maximale (ce mois) - Basée sur les commandes livrées
-        commande_max = Commande.objects.filter(
-            date_cmd__gte=debut_mois,
-            date_cmd__lte=aujourd_hui,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).aggregate(max_cmd=Max('total_cmd'))['max_cmd'] or 0
+        commande_max = livrees_mois['max_cmd'] or 0
         
         # Répartition par Catégorie
         ventes_par_categorie = (Article.objects
             .filter(paniers__commande__date_cmd__gte=debut_30j)
-            .exclude(paniers__commande__etats__enum_etat__libelle__iexact='Annulée')
+            .exclude(paniers__commande__etats__enum_etat_id__in=ids_etats('Annulée'))
             .values('categorie')
             .annotate(
                 ca_total=Sum('paniers__sous_total'),
@@ -213,14 +195,14 @@ def ventes_data(request):
         )
         
         # Répartition Géographique (Top 5 villes)
-        ventes_par_ville = (Commande.objects
-            .filter(date_cmd__gte=debut_30j)
-            .exclude(etats__enum_etat__libelle__iexact='Annulée')
-            .values('ville__nom', 'ville__region__nom_region')
+        ventes_par_ville = (FaitCommandesJournalier.objects
+            .filter(date__gte=debut_30j)
+            .values('ville__nom', 'region__nom_region')
             .annotate(
-                ca_total=Sum('total_cmd'),
-                nb_commandes=Count('id')
+                ca_total=Sum(F('montant_total') - F('montant_annule')),
+                nb_commandes=Sum(F('nb_total') - F('nb_annulees'))
             )
+            .filter(nb_commandes__gt=0)
             .order_by('-ca_total')[:5]
         )
         
@@ -233,7 +215,7 @@ def ventes_data(request):
                 .annotate(
                     nb_appels=Count('id'),
                     commandes_confirmees=Count('commande__etats__enum_etat__libelle', 
-                                            filter=Q(commande__etats__enum_etat__libelle__iexact='Confirmée'))
+                                            filter=Q(commande__etats__enum_etat_id__in=ids_etats('Confirmée')))
                 )
                 .order_by('-nb_appels')[:3]
             )
@@ -284,8 +266,8 @@ def ventes_data(request):
                     'pourcentage': round((float(top_modele.ca_total) / ca_mois_actuel * 100), 1) if top_modele and top_modele.ca_total and ca_mois_actuel > 0 else 0
                 },
                 'top_region': {
-                    'nom': (top_region['ville__region__nom_region'] 
-                           if top_region and top_region['ville__region__nom_region'] 
+                    'nom': (top_region['region__nom_region'] 
+                           if top_region and top_region['region__nom_region'] 
                            else 'Données géographiques manquantes sur les commandes'),
                     'ca': float(top_region['ca_total']) if top_region else 0,
                     'ca_formate': (format_number_fr(top_region['ca_total']) 
@@ -323,6 +305,7 @@ def ventes_data(request):
         }, status=500)
 
 @login_required
+@cache_dashboard('kpis.evolution_ca')
 def evolution_ca_data(request):
     """API pour l'évolution du CA sur une période donnée"""
     try:
@@ -335,14 +318,13 @@ def evolution_ca_data(request):
         fin_date = timezone.now()
         debut_date = fin_date - timedelta(days=nb_jours)
         
-        # Calcul des données réelles basées sur les commandes livrées
-        commandes_par_jour = Commande.objects.filter(
-            date_cmd__gte=debut_date,
-            date_cmd__lte=fin_date,
-            etats__enum_etat__libelle__iexact='Livrée',
-            etats__date_fin__isnull=False
-        ).extra(select={'date_seule': 'DATE(date_cmd)'}).values('date_seule').annotate(
-            ca_jour=Sum('total_cmd')
+        # Calcul des données réelles basées sur les commandes livrées (table de faits)
+        commandes_par_jour = FaitCommandesJournalier.objects.filter(
+            date__gte=debut_date.date(),
+            date__lte=fin_date.date(),
+            nb_livrees__gt=0
+        ).values(date_seule=F('date')).annotate(
+            ca_jour=Sum('montant_livre')
         ).order_by('date_seule')
         
         # Construction des données de réponse
@@ -428,6 +410,7 @@ def evolution_ca_data(request):
         }, status=500)
 
 @login_required
+@cache_dashboard('kpis.top_modeles')
 def top_modeles_data(request):
     """API pour les données du top modèles par CA"""
     try:
@@ -446,7 +429,7 @@ def top_modeles_data(request):
                 filter=Q(
                     paniers__commande__date_cmd__gte=debut_date,
                     paniers__commande__date_cmd__lte=fin_date,
-                    paniers__commande__etats__enum_etat__libelle__iexact='Livrée',
+                    paniers__commande__etats__enum_etat_id__in=ids_etats('Livrée'),
                     paniers__commande__etats__date_fin__isnull=False
                 )
             ),
@@ -455,7 +438,7 @@ def top_modeles_data(request):
                 filter=Q(
                     paniers__commande__date_cmd__gte=debut_date,
                     paniers__commande__date_cmd__lte=fin_date,
-                    paniers__commande__etats__enum_etat__libelle__iexact='Livrée',
+                    paniers__commande__etats__enum_etat_id__in=ids_etats('Livrée'),
                     paniers__commande__etats__date_fin__isnull=False
                 )
             )
@@ -507,6 +490,7 @@ def top_modeles_data(request):
         }, status=500)
 
 @login_required
+@cache_dashboard('kpis.performance_regions')
 def performance_regions_data(request):
     """API pour les données de performance par région"""
     try:
@@ -522,21 +506,22 @@ def performance_regions_data(request):
             debut_periode = aujourd_hui - timedelta(days=30)
         
         # Récupérer les données par région
-        regions_data = Commande.objects.filter(
-            date_cmd__gte=debut_periode,
-            date_cmd__lte=aujourd_hui,
+        # Commandes dont l'état actuel n'est pas "Annulée" (table de faits)
+        regions_data = list(FaitCommandesJournalier.objects.filter(
+            date__gte=debut_periode,
+            date__lte=aujourd_hui,
             ville__isnull=False,
-            ville__region__isnull=False
+            region__isnull=False
         ).exclude(
-            etats__enum_etat__libelle__iexact='Annulée',
-            etats__date_fin__isnull=True
+            etat__libelle__iexact='Annulée'
         ).values(
-            'ville__region__nom_region'
+            'region__nom_region'
         ).annotate(
-            ca_total=Sum('total_cmd'),
-            nb_commandes=Count('id'),
-            ca_moyen=Avg('total_cmd')
-        ).order_by('-ca_total')
+            ca_total=Sum('montant_total'),
+            nb_commandes=Sum('nb_total')
+        ).order_by('-ca_total'))
+        for region in regions_data:
+            region['ca_moyen'] = (region['ca_total'] / region['nb_commandes']) if region['nb_commandes'] else 0
           # Calculer le total général pour les pourcentages
         total_ca_general = sum(region['ca_total'] or 0 for region in regions_data)
         
@@ -577,7 +562,7 @@ def performance_regions_data(request):
             ]
             
             regions_formattees.append({
-                'nom_region': region['ville__region__nom_region'],
+                'nom_region': region['region__nom_region'],
                 'ca_total': float(ca_total),
                 'ca_total_format': f"{ca_total/1000:.0f}K DH" if ca_total >= 1000 else f"{ca_total:.0f} DH",
                 'nb_commandes': region['nb_commandes'],
@@ -616,6 +601,7 @@ def performance_regions_data(request):
         }, status=500)
 
 @login_required
+@cache_dashboard('kpis.clients')
 def clients_data(request):
     """API pour les données de l'onglet Clients - Analyse comportementale Yoozak"""
     try:
@@ -646,7 +632,7 @@ def clients_data(request):
         # Clients qui ont au moins une commande livrée
         clients_actifs_ids = Commande.objects.filter(
             date_cmd__gte=debut_30j,
-            etats__enum_etat__libelle__iexact='Livrée'
+            etats__enum_etat_id__in=ids_etats('Livrée')
         ).values_list('client_id', flat=True).distinct()
         
         clients_actifs_30j = len(set(clients_actifs_ids))
@@ -656,7 +642,7 @@ def clients_data(request):
         clients_actifs_precedent_ids = Commande.objects.filter(
             date_cmd__gte=debut_periode_precedente,
             date_cmd__lt=debut_30j,
-            etats__enum_etat__libelle__iexact='Livrée'
+            etats__enum_etat_id__in=ids_etats('Livrée')
         ).values_list('client_id', flat=True).distinct()
         
         clients_actifs_precedent = len(set(clients_actifs_precedent_ids))
@@ -669,31 +655,23 @@ def clients_data(request):
         # === KPI 3: Taux de Retour ===
         # CALCUL CORRECT - basé sur les commandes livrées uniquement
         # On ne peut retourner que ce qui a été livré !
-        commandes_livrees_30j = Commande.objects.filter(
-            date_cmd__gte=debut_30j,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).distinct().count()
+        faits_30j = FaitCommandesJournalier.objects.filter(
+            date__gte=debut_30j
+        ).aggregate(livrees=Sum('nb_livrees'), retournees=Sum('nb_retournees'))
+        commandes_livrees_30j = faits_30j['livrees'] or 0
         
         # Commandes réellement retournées (avec état "Retournée")
-        commandes_retournees = Commande.objects.filter(
-            date_cmd__gte=debut_30j,
-            etats__enum_etat__libelle__iexact='Retournée'
-        ).distinct().count()
+        commandes_retournees = faits_30j['retournees'] or 0
         
         taux_retour = (commandes_retournees / commandes_livrees_30j * 100) if commandes_livrees_30j > 0 else 0
         
         # Taux retour période précédente
-        commandes_livrees_precedent = Commande.objects.filter(
-            date_cmd__gte=debut_periode_precedente,
-            date_cmd__lt=debut_30j,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).distinct().count()
-        
-        retours_precedent = Commande.objects.filter(
-            date_cmd__gte=debut_periode_precedente,
-            date_cmd__lt=debut_30j,
-            etats__enum_etat__libelle__iexact='Retournée'
-        ).distinct().count()
+        faits_precedent = FaitCommandesJournalier.objects.filter(
+            date__gte=debut_periode_precedente,
+            date__lt=debut_30j
+        ).aggregate(livrees=Sum('nb_livrees'), retournees=Sum('nb_retournees'))
+        commandes_livrees_precedent = faits_precedent['livrees'] or 0
+        retours_precedent = faits_precedent['retournees'] or 0
         
         taux_retour_precedent = (retours_precedent / commandes_livrees_precedent * 100) if commandes_livrees_precedent > 0 else 0
         tendance_retour = taux_retour - taux_retour_precedent
@@ -706,7 +684,7 @@ def clients_data(request):
         # Clients actifs sur 90 jours (commandes livrées uniquement)
         clients_actifs_90j_ids = Commande.objects.filter(
             date_cmd__gte=debut_90j,
-            etats__enum_etat__libelle__iexact='Livrée'
+            etats__enum_etat_id__in=ids_etats('Livrée')
         ).values_list('client_id', flat=True).distinct()
         clients_actifs_90j = len(set(clients_actifs_90j_ids))
         
@@ -716,7 +694,7 @@ def clients_data(request):
             nb_commandes_livrees = Commande.objects.filter(
                 client_id=client_id,
                 date_cmd__gte=debut_90j,
-                etats__enum_etat__libelle__iexact='Livrée'
+                etats__enum_etat_id__in=ids_etats('Livrée')
             ).count()
             if nb_commandes_livrees >= 2:
                 clients_fideles_90j += 1
@@ -728,7 +706,7 @@ def clients_data(request):
         clients_actifs_90j_precedent_ids = Commande.objects.filter(
             date_cmd__gte=debut_90j_precedent,
             date_cmd__lt=debut_90j,
-            etats__enum_etat__libelle__iexact='Livrée'
+            etats__enum_etat_id__in=ids_etats('Livrée')
         ).values_list('client_id', flat=True).distinct()
         clients_actifs_90j_precedent = len(set(clients_actifs_90j_precedent_ids))
         
@@ -738,7 +716,7 @@ def clients_data(request):
                 client_id=client_id,
                 date_cmd__gte=debut_90j_precedent,
                 date_cmd__lt=debut_90j,
-                etats__enum_etat__libelle__iexact='Livrée'
+                etats__enum_etat_id__in=ids_etats('Livrée')
             ).count()
             if nb_commandes_livrees_precedent >= 2:
                 clients_fideles_90j_precedent += 1
@@ -752,7 +730,7 @@ def clients_data(request):
         top_clients_data = []
         commandes_avec_ca = Commande.objects.filter(
             date_cmd__gte=debut_30j,
-            etats__enum_etat__libelle__iexact='Livrée'
+            etats__enum_etat_id__in=ids_etats('Livrée')
         ).values('client_id').annotate(
             ca_total=Sum('total_cmd'),
             nb_commandes=Count('id')
@@ -775,18 +753,17 @@ def clients_data(request):
                 continue
           # Performance mensuelle
         # Commandes du mois en cours (livrées uniquement)
-        commandes_mois_actuel = Commande.objects.filter(
-            date_cmd__gte=debut_mois,
-            date_cmd__lte=aujourd_hui,
-            etats__enum_etat__libelle__iexact='Livrée'
-        ).count()
+        commandes_mois_actuel = FaitCommandesJournalier.objects.filter(
+            date__gte=debut_mois,
+            date__lte=aujourd_hui
+        ).aggregate(nb=Sum('nb_livrees'))['nb'] or 0
         
         # CA moyen par client actif - CALCUL CORRECT basé sur commandes livrées
         # Utiliser le CA total de TOUS les clients actifs, pas seulement le top 5
         ca_total_tous_clients_actifs = Commande.objects.filter(
             date_cmd__gte=debut_30j,
             client_id__in=clients_actifs_ids,
-            etats__enum_etat__libelle__iexact='Livrée'
+            etats__enum_etat_id__in=ids_etats('Livrée')
         ).aggregate(ca_total=Sum('total_cmd'))['ca_total'] or 0
         
         ca_moyen_par_client = ca_total_tous_clients_actifs / clients_actifs_30j if clients_actifs_30j > 0 else 0
@@ -796,7 +773,7 @@ def clients_data(request):
                               if Commande.objects.filter(
                                   client_id=client_id, 
                                   date_cmd__gte=debut_90j,
-                                  etats__enum_etat__libelle__iexact='Livrée'
+                                  etats__enum_etat_id__in=ids_etats('Livrée')
                               ).count() >= 3)
         
         clients_nouveaux_testeurs = Client.objects.filter(
@@ -809,7 +786,7 @@ def clients_data(request):
                                  if Commande.objects.filter(
                                      client_id=client_id, 
                                      date_cmd__gte=debut_90j,
-                                     etats__enum_etat__libelle__iexact='Livrée'
+                                     etats__enum_etat_id__in=ids_etats('Livrée')
                                  ).count() == 2)
         
         clients_vip = len(top_clients_data)
@@ -896,6 +873,7 @@ def clients_data(request):
         }, status=500)
 
 @login_required
+@cache_dashboard('kpis.vue_quantitative')
 def vue_quantitative_data(request):
     """API pour les données de l'onglet État des commandes"""
     try:
@@ -949,17 +927,12 @@ def vue_quantitative_data(request):
             date_debut = aujourd_hui - timedelta(days=jours)
             date_fin = aujourd_hui
         
-        # Récupérer toutes les commandes dans la période avec leur état actuel (dernier état non terminé)
-        # On utilise une sous-requête pour obtenir l'état le plus récent pour chaque commande
-        commandes_avec_etat = Commande.objects.filter(
-            etats__date_debut__date__gte=date_debut,  # Filtrer sur la date de l'état plutôt que la date de commande
-            etats__date_debut__date__lte=date_fin,
-            etats__date_fin__isnull=True  # États actuels (non terminés)
-        ).select_related('etats__enum_etat').values(
-            'id',
-            'num_cmd',
-            'etats__enum_etat__libelle'
-        )
+        # Commandes passées sur la période (date de commande) regroupées par état actuel (table de faits).
+        # Avant la table de faits, la période portait sur la date de début de l'état actuel.
+        commandes_par_etat = FaitCommandesJournalier.objects.filter(
+            date__gte=date_debut,
+            date__lte=date_fin
+        ).values('etat__libelle').annotate(nb=Sum('nb_total'))
         
         # Initialiser les compteurs pour tous les états requis
         etats_compteurs = {
@@ -994,18 +967,14 @@ def vue_quantitative_data(request):
         }
         
         # Compter les commandes par état
-        for commande in commandes_avec_etat:
-            libelle_etat = commande['etats__enum_etat__libelle']
-            if libelle_etat in mapping_etats:
+        for ligne in commandes_par_etat:
+            libelle_etat = ligne['etat__libelle']
+            if libelle_etat is None:
+                # Commandes sans état défini : les considérer comme "reçues"
+                etats_compteurs['recue'] += ligne['nb']
+            elif libelle_etat in mapping_etats:
                 cle_etat = mapping_etats[libelle_etat]
-                etats_compteurs[cle_etat] += 1
-        
-        # Pour les commandes sans état défini dans la période, les considérer comme "reçues"
-        commandes_sans_etat = Commande.objects.filter(
-            etats__isnull=True
-        ).count()
-        
-        etats_compteurs['recue'] += commandes_sans_etat
+                etats_compteurs[cle_etat] += ligne['nb']
         
         # Calculer le total des commandes
         total_commandes = sum(etats_compteurs.values())
@@ -1039,7 +1008,8 @@ def vue_quantitative_data(request):
                     'libelle': period,
                     'jours': jours,
                     'date_debut': date_debut.isoformat(),
-                    'date_fin': date_fin.isoformat()
+                    'date_fin': date_fin.isoformat(),
+                    'base': 'date_commande'
                 },
                 'derniere_maj': timezone.now().isoformat()
             }
@@ -1055,6 +1025,7 @@ def vue_quantitative_data(request):
         }, status=500)
 
 @login_required
+@cache_dashboard('kpis.performance_operateurs')
 def performance_operateurs_data(request):
     """
     API pour les données de l'onglet Performance Opérateurs
@@ -1073,34 +1044,34 @@ def performance_operateurs_data(request):
             # --- Métriques sur l'état ACTUEL ---
             commands_affected=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Affectée', etats_modifies__date_fin__isnull=True),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Affectée'), etats_modifies__date_fin__isnull=True),
                 distinct=True
             ),
             commands_in_progress=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='En cours de confirmation', etats_modifies__date_fin__isnull=True),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('En cours de confirmation'), etats_modifies__date_fin__isnull=True),
                 distinct=True
             ),
 
             # --- Métriques HISTORIQUES (tous les temps) ---
             commands_confirmed=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée'),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée')),
                 distinct=True
             ),
 
             # --- Métriques FINANCIERES sur commandes confirmées ---
             panier_moyen=Avg(
                 'etats_modifies__commande__total_cmd',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée')
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'))
             ),
             panier_min=Min(
                 'etats_modifies__commande__total_cmd',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée')
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'))
             ),
             panier_max=Max(
                 'etats_modifies__commande__total_cmd',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée')
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'))
             ),
             # Note: is_upsell a été supprimé du modèle Commande
             # Les métriques upsell ne sont plus disponibles au niveau commande
@@ -1115,7 +1086,7 @@ def performance_operateurs_data(request):
             ),
             commands_confirmed_30j=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée', etats_modifies__date_debut__gte=date_limite_30j),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'), etats_modifies__date_debut__gte=date_limite_30j),
                 distinct=True
             ),
 
@@ -1221,34 +1192,34 @@ def export_performance_operateurs_excel(request):
             # --- Métriques sur l'état ACTUEL ---
             commands_affected=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Affectée', etats_modifies__date_fin__isnull=True),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Affectée'), etats_modifies__date_fin__isnull=True),
                 distinct=True
             ),
             commands_in_progress=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='En cours de confirmation', etats_modifies__date_fin__isnull=True),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('En cours de confirmation'), etats_modifies__date_fin__isnull=True),
                 distinct=True
             ),
 
             # --- Métriques HISTORIQUES (tous les temps) ---
             commands_confirmed=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée'),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée')),
                 distinct=True
             ),
 
             # --- Métriques FINANCIERES sur commandes confirmées ---
             panier_moyen=Avg(
                 'etats_modifies__commande__total_cmd',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée')
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'))
             ),
             panier_min=Min(
                 'etats_modifies__commande__total_cmd',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée')
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'))
             ),
             panier_max=Max(
                 'etats_modifies__commande__total_cmd',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée')
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'))
             ),
             # Note: is_upsell a été supprimé du modèle Commande
             # Les métriques upsell ne sont plus disponibles au niveau commande
@@ -1263,7 +1234,7 @@ def export_performance_operateurs_excel(request):
             ),
             commands_confirmed_30j=Count(
                 'etats_modifies__commande',
-                filter=Q(etats_modifies__enum_etat__libelle__iexact='Confirmée', etats_modifies__date_debut__gte=date_limite_30j),
+                filter=Q(etats_modifies__enum_etat_id__in=ids_etats('Confirmée'), etats_modifies__date_debut__gte=date_limite_30j),
                 distinct=True
             ),
 
@@ -1455,6 +1426,7 @@ def export_performance_operateurs_excel(request):
         return HttpResponse(f"Erreur lors de l'export Excel: {str(e)}", status=500)
 
 @api_login_required
+@cache_dashboard('kpis.operator_history')
 def operator_history_data(request):
     """API pour récupérer l'historique récent d'un opérateur"""
     try:
@@ -1572,6 +1544,15 @@ def operator_history_data(request):
             'error': 'erreur_historique'
         }, status=500)
 
+@api_login_required
+def cache_stats_data(request):
+    """API de supervision du cache des tableaux de bord (hits/miss)"""
+    return JsonResponse({
+        'success': True,
+        'stats': get_stats(),
+        'timestamp': timezone.now().isoformat()
+    })
+
 @login_required
 def dashboard(request):
     """Page principale du dashboard KPIs"""
@@ -1580,6 +1561,7 @@ def dashboard(request):
         'selected_period': selected_period
     })
 
+@sans_activite
 @api_login_required
 def operator_realtime_times_data(request):
     """
@@ -1591,7 +1573,7 @@ def operator_realtime_times_data(request):
         # 1. Récupérer tous les états pertinents pour les opérateurs de confirmation en une seule requête.
         etats_pertinents = EtatCommande.objects.filter(
             operateur__type_operateur='CONFIRMATION',
-            enum_etat__libelle__in=['En cours de confirmation', 'Confirmée']
+            enum_etat_id__in=ids_etats('En cours de confirmation', 'Confirmée')
         ).select_related('operateur', 'commande', 'enum_etat', 'operateur__user').order_by('commande_id', 'date_debut')
 
         # Dictionnaires pour stocker les données intermédiaires
@@ -1736,7 +1718,7 @@ def export_performance_operateurs_csv(request):
     for operateur in operateurs:
         commandes_confirmees = Commande.objects.filter(
             etats__operateur=operateur,
-            etats__enum_etat__libelle__iexact='Confirmée',
+            etats__enum_etat_id__in=ids_etats('Confirmée'),
             etats__date_debut__date__gte=date_debut,
             etats__date_debut__date__lte=date_fin
         ).distinct()
@@ -1745,8 +1727,8 @@ def export_performance_operateurs_csv(request):
         n_conf = 0
         n_arr = 0
         for cmd in commandes_confirmees:
-            etat_conf = cmd.etats.filter(enum_etat__libelle__iexact='Confirmée', operateur=operateur).order_by('date_debut').first()
-            etat_en_cours = cmd.etats.filter(enum_etat__libelle__iexact='En cours de confirmation', operateur=operateur).order_by('date_debut').first()
+            etat_conf = cmd.etats.filter(enum_etat_id__in=ids_etats('Confirmée'), operateur=operateur).order_by('date_debut').first()
+            etat_en_cours = cmd.etats.filter(enum_etat_id__in=ids_etats('En cours de confirmation'), operateur=operateur).order_by('date_debut').first()
             if etat_conf and etat_en_cours:
                 delta = etat_conf.date_debut - etat_en_cours.date_debut
                 total_confirmation += delta
@@ -1766,46 +1748,90 @@ def export_performance_operateurs_csv(request):
         ])
     return response
 
+ETATS_EXPORT_ETAT_COMMANDES = [
+    'Non affectée',
+    'Affectée',
+    'En cours de confirmation',
+    'Confirmée',
+    'Erronée',
+    'Doublon',
+    'En préparation',
+    'Préparée',
+    'En livraison',
+    'Livrée',
+    'Retournée',
+    'Reçue'
+]
+
+
+def _periode_export_etat_commandes(request):
+    """(period, date_debut, date_fin) des exports de l'onglet État des commandes"""
+    period = request.GET.get('period', 'aujourd_hui')
+    aujourd_hui = timezone.now().date()
+    if period == 'aujourd_hui':
+        return period, aujourd_hui, aujourd_hui
+    if period == 'ce_mois':
+        return period, aujourd_hui.replace(day=1), aujourd_hui
+    if period == 'cette_annee':
+        return period, aujourd_hui.replace(month=1, day=1), aujourd_hui
+    # Période personnalisée : custom:YYYY-MM-DD:YYYY-MM-DD (comme le tableau de bord) ou date_debut / date_fin
+    debut, fin = request.GET.get('date_debut'), request.GET.get('date_fin')
+    if period.startswith('custom:') and len(period.split(':')) == 3:
+        debut, fin = period.split(':')[1:]
+    try:
+        return period, datetime.strptime(debut, '%Y-%m-%d').date(), datetime.strptime(fin, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return period, aujourd_hui, aujourd_hui
+
+
+def _etats_commandes_export(date_debut, date_fin):
+    """
+    {libellé: métriques} de l'onglet État des commandes, lues dans FaitCommandesJournalier comme
+    vue_quantitative_data : commandes de la période (date de commande) par état actuel. Les
+    commandes sans état sont comptées en "Reçue".
+    """
+    faits = FaitCommandesJournalier.objects.filter(date__gte=date_debut, date__lte=date_fin)
+    etats_enrichis = {etat: {
+        'nombre': 0,
+        'valeur_totale': 0,
+        'panier_moyen': 0,
+        'temps_moyen': 0,
+        'operateur_principal': 'N/A',
+        'derniere_activite': 'N/A'
+    } for etat in ETATS_EXPORT_ETAT_COMMANDES}
+
+    for ligne in faits.values('etat__libelle').annotate(
+        nombre=Sum('nb_total'), valeur=Sum('montant_total'), derniere=Max('date')
+    ).order_by():
+        etat = ligne['etat__libelle'] or 'Reçue'
+        if etat not in etats_enrichis or not ligne['nombre']:
+            continue
+        data = etats_enrichis[etat]
+        data['nombre'] += ligne['nombre']
+        data['valeur_totale'] += ligne['valeur'] or 0
+        data['panier_moyen'] = data['valeur_totale'] / data['nombre']
+        data['derniere_activite'] = ligne['derniere'].strftime('%d/%m/%Y')
+
+    # Opérateur principal : celui de l'état actuel du plus grand nombre de commandes
+    principaux = {}
+    for ligne in faits.filter(operateur__isnull=False).values('etat__libelle', 'operateur__nom').annotate(
+        nombre=Sum('nb_total')
+    ).order_by('-nombre'):
+        principaux.setdefault(ligne['etat__libelle'] or 'Reçue', ligne['operateur__nom'])
+    for etat, nom in principaux.items():
+        if etat in etats_enrichis:
+            etats_enrichis[etat]['operateur_principal'] = nom
+
+    return etats_enrichis
+
+
 @login_required
 def export_etat_commandes_csv(request):
     """Export CSV du suivi de l'état des commandes"""
     try:
-        # Récupérer la période depuis les paramètres de requête
-        period = request.GET.get('period', 'aujourd_hui')
-        
-        # Déterminer les dates de début et fin en fonction de la période
-        aujourd_hui = timezone.now().date()
-        if period == 'aujourd_hui':
-            date_debut = aujourd_hui
-            date_fin = aujourd_hui
-        elif period == 'ce_mois':
-            date_debut = aujourd_hui.replace(day=1)
-            date_fin = aujourd_hui
-        elif period == 'cette_annee':
-            date_debut = aujourd_hui.replace(month=1, day=1)
-            date_fin = aujourd_hui
-        else:  # période personnalisée
-            try:
-                from datetime import datetime
-                date_debut = datetime.strptime(request.GET.get('date_debut'), '%Y-%m-%d').date()
-                date_fin = datetime.strptime(request.GET.get('date_fin'), '%Y-%m-%d').date()
-            except (TypeError, ValueError):
-                date_debut = aujourd_hui
-                date_fin = aujourd_hui
-        
-        # Récupérer les données via la fonction existante
-        from django.test import RequestFactory
-        factory = RequestFactory()
-        test_request = factory.get(f'/kpis/api/vue-quantitative/?period={period}')
-        test_request.user = request.user
-        
-        json_response = vue_quantitative_data(test_request)
-        if json_response.status_code != 200:
-            return HttpResponse("Erreur lors de la génération des données.", status=500)
-        
-        import json
-        content = json.loads(json_response.content)
-        etats_data = content.get('etats', {})
+        period, date_debut, date_fin = _periode_export_etat_commandes(request)
+        # Mêmes chiffres que le tableau de bord (table de faits)
+        etats_enrichis = _etats_commandes_export(date_debut, date_fin)
         
         # Créer la réponse CSV
         response = HttpResponse(content_type='text/csv')
@@ -1820,73 +1846,11 @@ def export_etat_commandes_csv(request):
             'Valeur totale (MAD)', 
             'Panier moyen (MAD)',
             'Opérateur principal',
-            'Dernière activité'
+            'Dernière commande'
         ])
         
-        # Récupérer des données enrichies
-        etats_enrichis = {}
-        
-        # Liste complète de tous les états possibles
-        tous_etats = [
-            'Non affectée',
-            'Affectée', 
-            'En cours de confirmation',
-            'Confirmée',
-            'Erronée',
-            'Doublon',
-            'En préparation',
-            'Préparée',
-            'En livraison',
-            'Livrée',
-            'Retournée',
-            'Reçue'
-        ]
-        
-        # Traiter tous les états, même ceux avec 0 commandes
-        for etat in tous_etats:
-            nombre = etats_data.get(etat, 0)
-            
-            if nombre > 0:
-                # Récupérer les commandes pour cet état
-                commandes_etat = Commande.objects.filter(
-                    etats__enum_etat__libelle__iexact=etat,
-                    etats__date_debut__date__gte=date_debut,
-                    etats__date_debut__date__lte=date_fin,
-                    etats__date_fin__isnull=True
-                ).select_related('etats__operateur')
-                
-                # Calculer les métriques
-                valeur_totale = commandes_etat.aggregate(total=Sum('total_cmd'))['total'] or 0
-                panier_moyen = commandes_etat.aggregate(moyen=Avg('total_cmd'))['moyen'] or 0
-                
-                # Opérateur principal
-                operateur_principal = commandes_etat.values('etats__operateur__nom').annotate(
-                    count=Count('id')
-                ).order_by('-count').first()
-                
-                # Dernière activité
-                derniere_activite = commandes_etat.aggregate(
-                    derniere=Max('etats__date_debut')
-                )['derniere']
-                
-                etats_enrichis[etat] = {
-                    'nombre': nombre,
-                    'valeur_totale': valeur_totale,
-                    'panier_moyen': panier_moyen,
-                    'operateur_principal': operateur_principal['etats__operateur__nom'] if operateur_principal else 'N/A',
-                    'derniere_activite': derniere_activite.strftime('%d/%m/%Y %H:%M') if derniere_activite else 'N/A'
-                }
-            else:
-                etats_enrichis[etat] = {
-                    'nombre': 0,
-                    'valeur_totale': 0,
-                    'panier_moyen': 0,
-                    'operateur_principal': 'N/A',
-                    'derniere_activite': 'N/A'
-                }
-        
         # Données enrichies
-        total_commandes = sum(etats_data.values())
+        total_commandes = sum(data['nombre'] for data in etats_enrichis.values())
         total_valeur = sum(data['valeur_totale'] for data in etats_enrichis.values())
         
         for etat, data in etats_enrichis.items():
@@ -1923,42 +1887,9 @@ def export_etat_commandes_csv(request):
 def export_etat_commandes_excel(request):
     """Export Excel du suivi de l'état des commandes"""
     try:
-        # Récupérer la période depuis les paramètres de requête
-        period = request.GET.get('period', 'aujourd_hui')
-        
-        # Déterminer les dates de début et fin en fonction de la période
-        aujourd_hui = timezone.now().date()
-        if period == 'aujourd_hui':
-            date_debut = aujourd_hui
-            date_fin = aujourd_hui
-        elif period == 'ce_mois':
-            date_debut = aujourd_hui.replace(day=1)
-            date_fin = aujourd_hui
-        elif period == 'cette_annee':
-            date_debut = aujourd_hui.replace(month=1, day=1)
-            date_fin = aujourd_hui
-        else:  # période personnalisée
-            try:
-                from datetime import datetime
-                date_debut = datetime.strptime(request.GET.get('date_debut'), '%Y-%m-%d').date()
-                date_fin = datetime.strptime(request.GET.get('date_fin'), '%Y-%m-%d').date()
-            except (TypeError, ValueError):
-                date_debut = aujourd_hui
-                date_fin = aujourd_hui
-        
-        # Récupérer les données via la fonction existante
-        from django.test import RequestFactory
-        factory = RequestFactory()
-        test_request = factory.get(f'/kpis/api/vue-quantitative/?period={period}')
-        test_request.user = request.user
-        
-        json_response = vue_quantitative_data(test_request)
-        if json_response.status_code != 200:
-            return HttpResponse("Erreur lors de la génération des données.", status=500)
-        
-        import json
-        content = json.loads(json_response.content)
-        etats_data = content.get('etats', {})
+        period, date_debut, date_fin = _periode_export_etat_commandes(request)
+        # Mêmes chiffres que le tableau de bord (table de faits)
+        etats_enrichis = _etats_commandes_export(date_debut, date_fin)
         
         # Vérifier que openpyxl est disponible
         if not openpyxl:
@@ -1996,7 +1927,7 @@ def export_etat_commandes_excel(request):
             'Panier moyen (MAD)',
             'Temps moyen traitement (min)',
             'Opérateur principal',
-            'Dernière activité'
+            'Dernière commande'
         ]
         
         # Écrire les en-têtes
@@ -2007,75 +1938,7 @@ def export_etat_commandes_excel(request):
             cell.alignment = header_alignment
             cell.border = border
 
-        # Calculer le total et récupérer des données enrichies
-        total_commandes = sum(etats_data.values())
-        
-        # Récupérer des données supplémentaires pour chaque état
-        etats_enrichis = {}
-        
-        # Liste complète de tous les états possibles
-        tous_etats = [
-            'Non affectée',
-            'Affectée', 
-            'En cours de confirmation',
-            'Confirmée',
-            'Erronée',
-            'Doublon',
-            'En préparation',
-            'Préparée',
-            'En livraison',
-            'Livrée',
-            'Retournée',
-            'Reçue'
-        ]
-        
-        # Traiter tous les états, même ceux avec 0 commandes
-        for etat in tous_etats:
-            nombre = etats_data.get(etat, 0)
-            
-            if nombre > 0:
-                # Récupérer les commandes pour cet état
-                commandes_etat = Commande.objects.filter(
-                    etats__enum_etat__libelle__iexact=etat,
-                    etats__date_debut__date__gte=date_debut,
-                    etats__date_debut__date__lte=date_fin,
-                    etats__date_fin__isnull=True
-                ).select_related('etats__operateur')
-                
-                # Calculer les métriques
-                valeur_totale = commandes_etat.aggregate(total=Sum('total_cmd'))['total'] or 0
-                panier_moyen = commandes_etat.aggregate(moyen=Avg('total_cmd'))['moyen'] or 0
-                
-                # Opérateur principal (celui qui a traité le plus de commandes)
-                operateur_principal = commandes_etat.values('etats__operateur__nom').annotate(
-                    count=Count('id')
-                ).order_by('-count').first()
-                
-                # Dernière activité
-                derniere_activite = commandes_etat.aggregate(
-                    derniere=Max('etats__date_debut')
-                )['derniere']
-                
-                # Temps moyen de traitement (simplifié)
-                temps_moyen = 0  # À calculer plus précisément si nécessaire
-                
-                etats_enrichis[etat] = {
-                    'nombre': nombre,
-                    'valeur_totale': valeur_totale,
-                    'panier_moyen': panier_moyen,
-                    'temps_moyen': temps_moyen,
-                    'operateur_principal': operateur_principal['etats__operateur__nom'] if operateur_principal else 'N/A',
-                    'derniere_activite': derniere_activite.strftime('%d/%m/%Y %H:%M') if derniere_activite else 'N/A'
-                }
-            else:
-                etats_enrichis[etat] = {
-                    'nombre': 0,
-                    'valeur_totale': 0,
-                    'panier_moyen': 0,
-                    'temps_moyen': 0,
-                    'operateur_principal': 'N/A',
-                    'derniere_activite': 'N/A'
-                }
+        total_commandes = sum(data['nombre'] for data in etats_enrichis.values())
         
         # Écrire les données enrichies
         row = 2
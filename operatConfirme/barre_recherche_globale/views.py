@@ -10,6 +10,10 @@ import json
 from commande.models import Commande, EtatCommande, EnumEtatCmd
 from parametre.models import Region, Ville, Operateur
 from article.models import Article
+from commande.recherche import (
+    ETATS_ROLE, NOUVELLE, filtre_etats, rechercher_articles, rechercher_clients, rechercher_commandes,
+    rechercher_regions, rechercher_villes, rechercher_villes_init, statut,
+)
 
 
 @login_required
@@ -84,125 +88,40 @@ def search_commandes_confirmation(query, request=None):
     """Recherche dans les commandes pour confirmation"""
     commandes = []
     
-    # Recherche par ID numérique
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            # Pour la recherche par ID, être plus permissif
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd.id}),
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par numéro externe
-    try:
-        cmd_externe = Commande.objects.get(num_cmd__icontains=query)
-        commandes.append({
-            'id': cmd_externe.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd_externe.id} ({cmd_externe.num_cmd})',
-            'subtitle': f'Client: {cmd_externe.client.nom if cmd_externe.client else "N/A"} - {cmd_externe.total_cmd} DH',
-            'status': get_commande_status(cmd_externe),
-            'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd_externe.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 1
-        })
-    except Commande.DoesNotExist:
-        pass
-    
-    # Recherche par client (exclure les recherches déjà faites par numéro externe)
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    ).exclude(
-        num_cmd__icontains=query
-    )[:10]
-    
-    for cmd in commandes_client:
-        # Pour la recherche par client, être plus permissif
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville/ville_init (exclure les recherches déjà faites)
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query) |
-        Q(ville_init__icontains=query)
-    ).exclude(
-        Q(num_cmd__icontains=query) |
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:10]
-    
-    for cmd in commandes_geo:
-        # Pour la recherche par géographie, être plus permissif
-        ville_display = cmd.ville.nom if cmd.ville else "N/A"
-        if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
-            ville_display = f"{cmd.ville_init} → {ville_display}"
+    # Une requête classée : numéro / ID, puis client, puis géographie (commande/recherche.py)
+    for cmd in rechercher_commandes(query, limite=10):
+        if cmd.rang == 3:
+            ville_display = cmd.ville.nom if cmd.ville else "N/A"
+            if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
+                ville_display = f"{cmd.ville_init} → {ville_display}"
+            subtitle = f'{ville_display} - {cmd.total_cmd} DH'
+        else:
+            subtitle = f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH'
         
         commandes.append({
             'id': cmd.id,
             'type': 'commande',
             'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'{ville_display} - {cmd.total_cmd} DH',
+            'subtitle': subtitle,
             'status': get_commande_status(cmd),
             'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd.id}),
             'icon': 'fas fa-shopping-cart',
-            'priority': 3
+            'priority': cmd.rang
         })
     
-    # Dédupliquer les résultats par ID de commande
-    commandes_uniques = []
-    ids_vus = set()
-    
-    for cmd in commandes:
-        if cmd['id'] not in ids_vus:
-            commandes_uniques.append(cmd)
-            ids_vus.add(cmd['id'])
-    
-    return commandes_uniques[:10]
+    return commandes
 
 
 def search_clients(query):
     """Recherche dans les clients"""
     clients = []
     
-    from client.models import Client
-    
-    clients_match = Client.objects.filter(
-        Q(nom__icontains=query) |
-        Q(prenom__icontains=query) |
-        Q(email__icontains=query) |
-        Q(numero_tel__icontains=query)
-    )[:8]
-    
-    for client in clients_match:
-        # Compter les commandes de ce client
-        nb_commandes = Commande.objects.filter(client=client).count()
-        
+    for client in rechercher_clients(query, limite=8):
         clients.append({
             'id': client.id,
             'type': 'client',
             'title': f'{client.nom} {client.prenom}',
-            'subtitle': f'{client.email} - {client.numero_tel} - {nb_commandes} commandes',
+            'subtitle': f'{client.email} - {client.numero_tel} - {client.nb_commandes} commandes',
             'status': 'Actif',
             'url': f'/client/detail/{client.id}/',
             'icon': 'fas fa-user',
@@ -216,23 +135,13 @@ def search_regions_confirmation(query, request=None):
     """Recherche dans les régions pour confirmation"""
     regions = []
     
-    regions_match = Region.objects.filter(
-        Q(nom_region__icontains=query)
-    )[:5]
-    
-    for region in regions_match:
-        # Compter les commandes à confirmer de cette région (plus inclusif)
-        nb_commandes = Commande.objects.filter(
-            ville__region=region,
-            etats__enum_etat__libelle__in=["Nouvelle", "Confirmée", "Annulée"],
-            etats__date_fin__isnull=True
-        ).count()
-        
+    # Commandes à confirmer de chaque région (plus inclusif)
+    for region in rechercher_regions(query, ETATS_ROLE['CONFIRMATION']):
         regions.append({
             'id': region.id,
             'type': 'region',
             'title': region.nom_region,
-            'subtitle': f'{nb_commandes} commandes à confirmer',
+            'subtitle': f'{region.nb_commandes} commandes à confirmer',
             'status': 'Active',
             'url': f'/operatConfirme/commandes-confirmees/?region={region.nom_region}',
             'icon': 'fas fa-map',
@@ -246,29 +155,12 @@ def search_villes_confirmation(query, request=None):
     """Recherche dans les villes pour confirmation"""
     villes = []
     
-    villes_match = Ville.objects.filter(
-        Q(nom__icontains=query) |
-        Q(region__nom_region__icontains=query)
-    )[:5]
-    
-    # Ajouter aussi les villes initiales qui correspondent
-    villes_init_match = Commande.objects.filter(
-        ville_init__icontains=query
-    ).values_list('ville_init', flat=True).distinct()[:5]
-    
-    for ville in villes_match:
-        # Compter les commandes à confirmer de cette ville (plus inclusif)
-        nb_commandes = Commande.objects.filter(
-            ville=ville,
-            etats__enum_etat__libelle__in=["Nouvelle", "Confirmée", "Annulée"],
-            etats__date_fin__isnull=True
-        ).count()
-        
+    for ville in rechercher_villes(query, ETATS_ROLE['CONFIRMATION']):
         villes.append({
             'id': ville.id,
             'type': 'ville',
             'title': ville.nom,
-            'subtitle': f'{ville.region.nom_region} - {nb_commandes} commandes à confirmer',
+            'subtitle': f'{ville.region.nom_region} - {ville.nb_commandes} commandes à confirmer',
             'status': 'Active',
             'url': f'/operatConfirme/commandes-confirmees/?ville={ville.nom}',
             'icon': 'fas fa-map-marker-alt',
@@ -276,25 +168,17 @@ def search_villes_confirmation(query, request=None):
         })
     
     # Ajouter les villes initiales trouvées
-    for ville_init in villes_init_match:
-        if ville_init:
-            # Compter les commandes avec cette ville initiale
-            nb_commandes_init = Commande.objects.filter(
-                ville_init=ville_init,
-                etats__enum_etat__libelle__in=["Nouvelle", "Confirmée", "Annulée"],
-                etats__date_fin__isnull=True
-            ).count()
-            
-            villes.append({
-                'id': f'init_{ville_init}',
-                'type': 'ville_init',
-                'title': f'{ville_init} (Ville Initiale)',
-                'subtitle': f'{nb_commandes_init} commandes à confirmer',
-                'status': 'Active',
-                'url': f'/operatConfirme/commandes-confirmees/?ville_init={ville_init}',
-                'icon': 'fas fa-map-marker-alt',
-                'priority': 1
-            })
+    for ville_init, nb_commandes_init in rechercher_villes_init(query, ETATS_ROLE['CONFIRMATION']):
+        villes.append({
+            'id': f'init_{ville_init}',
+            'type': 'ville_init',
+            'title': f'{ville_init} (Ville Initiale)',
+            'subtitle': f'{nb_commandes_init} commandes à confirmer',
+            'status': 'Active',
+            'url': f'/operatConfirme/commandes-confirmees/?ville_init={ville_init}',
+            'icon': 'fas fa-map-marker-alt',
+            'priority': 1
+        })
     
     return villes
 
@@ -303,19 +187,13 @@ def search_articles_confirmation(query):
     """Recherche dans les articles pour confirmation"""
     articles = []
     
-    articles_match = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query) |
-        Q(description__icontains=query)
-    )[:5]
-    
-    for article in articles_match:
+    for article in rechercher_articles(query, limite=5):
         articles.append({
             'id': article.id,
             'type': 'article',
             'title': article.nom,
-            'subtitle': f'Réf: {article.reference} - Stock: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
+            'subtitle': f'Réf: {article.reference} - Stock: {article.stock}',
+            'status': 'En stock' if article.stock > 0 else 'Rupture',
             'url': f'/article/detail/{article.id}/',
             'icon': 'fas fa-box',
             'priority': 1
@@ -365,10 +243,7 @@ def is_commande_for_confirmation(commande, request=None):
 
 def get_commande_status(commande):
     """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
+    return statut(commande)
 
 
 @login_required
@@ -400,8 +275,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes récentes à confirmer
     recent_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle="Nouvelle",
-        etats__date_fin__isnull=True
+        filtre_etats([NOUVELLE])
     ).order_by('-id')[:3]
     
     for cmd in recent_commandes:
@@ -412,10 +286,7 @@ def search_suggestions_api(request):
     
     # Suggestions de régions avec commandes à confirmer
     active_regions = Region.objects.annotate(
-        nb_commandes=Count('villes__commandes', filter=Q(
-            villes__commandes__etats__enum_etat__libelle="Nouvelle",
-            villes__commandes__etats__date_fin__isnull=True
-        ))
+        nb_commandes=Count('villes__commandes', filter=filtre_etats([NOUVELLE], 'villes__commandes__'))
     ).filter(nb_commandes__gt=0)[:3]
     
     for region in active_regions:
@@ -3,9 +3,11 @@ from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from django.core.paginator import Paginator
 from commande.models import Commande
+from commande.etats import ids_etats, obtenir_etat, obtenir_ou_creer_etat
 from django.contrib import messages
 from django.contrib.auth.models import User, Group
 from parametre.models import Operateur, Ville # Assurez-vous que ce chemin est correct
+from parametre.operateurs import operateur_courant
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm # Importez PasswordChangeForm
 from django.http import JsonResponse
@@ -16,7 +18,10 @@ from datetime import datetime, timedelta
 from django.db.models import Sum
 from django.db import models, transaction
 from client.models import Client
+from article import reservations
 from article.models import Article, VarianteArticle
+from commande import compteurs as compteurs_files
+from commande import tarification
 import logging
 from django.urls import reverse
 from django.template.loader import render_to_string
@@ -34,7 +39,7 @@ def dashboard(request):
     
     try:
         # Récupérer le profil opérateur de l'utilisateur connecté
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur de confirmation non trouvé.")
         return redirect('login')
@@ -45,9 +50,9 @@ def dashboard(request):
     
     # Récupérer les commandes affectées à cet opérateur
     commandes_affectees = Commande.objects.filter(
-        Q(etats__operateur=operateur, etats__date_fin__isnull=True, etats__enum_etat__libelle__in=['Affectée', 'En cours de confirmation']) |
-        Q(etats__date_fin__isnull=True, etats__enum_etat__libelle='Retour Confirmation')
-    ).distinct().select_related(
+        Q(operateur_etat_courant=operateur, etat_courant_id__in=ids_etats('Affectée', 'En cours de confirmation')) |
+        Q(etat_courant_id__in=ids_etats('Retour Confirmation'))
+    ).select_related(
         'client', 'ville', 'ville__region'
     ).prefetch_related(
         'etats__enum_etat', 'paniers__article'
@@ -56,28 +61,19 @@ def dashboard(request):
     # Statistiques des commandes affectées à cet opérateur
     stats = {}
     
+    # Files de l'opérateur et commandes retournées par la préparation (compteurs de files)
+    files = compteurs_files.par_etat(['Affectée', 'En cours de confirmation'], operateur)
     # Commandes en attente de confirmation (affectées mais pas encore en cours de confirmation)
-    stats['commandes_en_attente'] = commandes_affectees.filter(
-        etats__enum_etat__libelle='Affectée',
-        etats__date_fin__isnull=True
-    ).count()
-    
+    stats['commandes_en_attente'] = files['Affectée']
     # Commandes en cours de confirmation
-    stats['commandes_en_cours'] = commandes_affectees.filter(
-        etats__enum_etat__libelle='En cours de confirmation',
-        etats__date_fin__isnull=True
-    ).count()
-    
+    stats['commandes_en_cours'] = files['En cours de confirmation']
     # Commandes retournées par la préparation
-    stats['commandes_retournees'] = Commande.objects.filter(
-        etats__enum_etat__libelle='Retour Confirmation',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+    stats['commandes_retournees'] = compteurs_files.total(['Retour Confirmation'])
     
     # Commandes confirmées par cet opérateur (toutes)
     commandes_confirmees_all = Commande.objects.filter(
         etats__operateur=operateur,
-        etats__enum_etat__libelle='Confirmée'
+        etats__enum_etat_id__in=ids_etats('Confirmée')
     ).distinct()
     
     stats['commandes_confirmees'] = commandes_confirmees_all.count()
@@ -101,13 +97,13 @@ def dashboard(request):
         # Commandes marquées erronées par cet opérateur
     stats['commandes_erronnees'] = Commande.objects.filter(
         etats__operateur=operateur,
-        etats__enum_etat__libelle='Erronée'
+        etats__enum_etat_id__in=ids_etats('Erronée')
     ).distinct().count()
 
     # Commandes annulées par cet opérateur
     stats['commandes_annulees'] = Commande.objects.filter(
         etats__operateur=operateur,
-        etats__enum_etat__libelle='Annulée'
+        etats__enum_etat_id__in=ids_etats('Annulée')
     ).distinct().count()
 
     stats['total_commandes'] = commandes_affectees.count()
@@ -128,28 +124,28 @@ def dashboard(request):
 @login_required
 def liste_commandes(request):
     """Liste des commandes affectées à l'opérateur de confirmation connecté"""
-    from django.core.paginator import Paginator
     from django.db.models import Q, Count, Sum
     from commande.models import Commande, EtatCommande
+    from config.pagination import PaginationCurseur
     
     try:
         # Récupérer le profil opérateur de l'utilisateur connecté
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur de confirmation non trouvé.")
         return redirect('login')
     
     # Commandes à afficher :
     # Celles qui sont explicitement affectées à l'opérateur avec un état actif.
+    # Filtrage direct sur l'état courant dénormalisé (pas de jointure sur les états ni de distinct)
     commandes_list = Commande.objects.filter(
-        etats__operateur=operateur,
-        etats__date_fin__isnull=True,
-        etats__enum_etat__libelle__in=['Affectée', 'En cours de confirmation', 'Report de confirmation']
-    ).distinct().select_related(
+        operateur_etat_courant=operateur,
+        etat_courant_id__in=ids_etats('Affectée', 'En cours de confirmation', 'Report de confirmation')
+    ).select_related(
         'client', 'ville', 'ville__region'
     ).prefetch_related(
         'etats__enum_etat', 'paniers__article'
-    ).order_by('-etats__date_debut')
+    )
     
     # Recherche
     search_query = request.GET.get('search', '').strip()
@@ -164,29 +160,15 @@ def liste_commandes(request):
             Q(adresse__icontains=search_query)
         )
     
-    # Statistiques pour l'affichage des onglets/badges
+    # Statistiques pour l'affichage des onglets/badges (compteurs de files de l'opérateur)
+    compteurs = compteurs_files.par_etat(
+        ['Affectée', 'En cours de confirmation', 'Report de confirmation'], operateur
+    )
     stats = {
-        'en_attente': Commande.objects.filter(
-            etats__operateur=operateur,
-            etats__date_fin__isnull=True,
-            etats__enum_etat__libelle='Affectée'
-        ).distinct().count(),
-
-        'en_cours': Commande.objects.filter(
-            etats__operateur=operateur,
-            etats__date_fin__isnull=True,
-            etats__enum_etat__libelle='En cours de confirmation'
-        ).distinct().count(),
-
+        'en_attente': compteurs['Affectée'],
+        'en_cours': compteurs['En cours de confirmation'],
         # Reportées de confirmation (avec date_report en date_fin_delayed)
-        'reportees': Commande.objects.filter(
-            etats__operateur=operateur,
-            etats__date_fin__isnull=True,
-            etats__enum_etat__libelle='Report de confirmation'
-        ).distinct().count(),
-
-        # Ancien compteur conservé si utilisé ailleurs (retours de préparation)
-      
+        'reportees': compteurs['Report de confirmation'],
     }
     stats['total'] = stats['en_attente'] + stats['en_cours'] + stats['reportees']
 
@@ -200,14 +182,19 @@ def liste_commandes(request):
     }
     
     current_tab_display_name = "Toutes"
+    total = stats['total']
     if tab in tab_map:
-        commandes_list = commandes_list.filter(etats__enum_etat__libelle=tab_map[tab]['libelle'], etats__date_fin__isnull=True)
+        commandes_list = commandes_list.filter(etat_courant_id__in=ids_etats(tab_map[tab]['libelle']))
         current_tab_display_name = tab_map[tab]['display']
-    
-    # Pagination
-    paginator = Paginator(commandes_list, 15)  # 15 commandes par page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        total = stats.get(tab)
+    if search_query:
+        # Total de la recherche compté (ou estimé) par la pagination
+        total = None
+
+    # Pagination par curseur sur la date d'entrée dans l'état courant, total lu dans les compteurs de files
+    page_obj = PaginationCurseur(
+        commandes_list, 25, ('-date_etat_courant',), total=total, requete=request
+    ).get_page(request.GET.get('page'))
     
     # Préparer un mapping des dates de report pour affichage (commande_id -> date_fin_delayed)
     dates_report = {}
@@ -216,7 +203,7 @@ def liste_commandes(request):
         etats_reportes = EtatCommande.objects.filter(
             operateur=operateur,
             date_fin__isnull=True,
-            enum_etat__libelle='Report de confirmation'
+            enum_etat_id__in=ids_etats('Report de confirmation')
         ).select_related('commande')
         for etat in etats_reportes:
             dates_report[etat.commande_id] = etat.date_fin_delayed
@@ -226,8 +213,8 @@ def liste_commandes(request):
     context = {
         'page_title': 'Mes Commandes à Confirmer',
         'page_subtitle': f"Gestion des commandes qui vous sont affectées ou retournées.",
-        'commandes': commandes_list,  # Passer toutes les commandes pour la pagination intelligente
-        'page_obj': page_obj,  # Garder pour compatibilité si nécessaire
+        'commandes': page_obj,
+        'page_obj': page_obj,
         'search_query': search_query,
         'operateur': operateur,
         'stats': stats,
@@ -261,7 +248,7 @@ def confirmer_commande_ajax(request, commande_id):
     
     try:
         # Récupérer l'opérateur
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Profil d\'opérateur de confirmation non trouvé.'})
     
@@ -318,11 +305,15 @@ def confirmer_commande_ajax(request, commande_id):
             except Exception as e:
                 print(f"⚠️ DEBUG: Erreur lors de la sauvegarde des infos de livraison: {str(e)}")
             
-            # Vérifier le stock et décrémenter les articles
+            # Vérifier le stock et décrémenter les articles (un seul lot pour la commande)
+            from article import stock
+
             articles_decrémentes = []
             stock_insuffisant = []
+            lignes_variantes = []
+            lignes_articles = []
             
-            for panier in commande.paniers.all():
+            for panier in commande.paniers.select_related('article', 'variante'):
                 article = panier.article
                 variante = panier.variante
                 quantite_commandee = panier.quantite
@@ -331,38 +322,30 @@ def confirmer_commande_ajax(request, commande_id):
                 if variante:
                     # Vérifier que la variante existe encore et appartient bien à l'article
                     try:
-                        variante_verifiee = VarianteArticle.objects.get(
+                        variante_verifiee = VarianteArticle.objects.select_related('couleur', 'pointure').get(
                             id=variante.id,
                             article=article,
                             actif=True
                         )
-                        stock_disponible = variante_verifiee.qte_disponible
                         nom_article = f"{article.nom} - {variante_verifiee.couleur}/{variante_verifiee.pointure}"
                         print(f"📦 DEBUG: Variante {nom_article} (ID:{variante_verifiee.id})")
-                        # Utiliser la variante vérifiée
-                        variante = variante_verifiee
+                        lignes_variantes.append((variante_verifiee, quantite_commandee, nom_article))
+                        continue
                     except VarianteArticle.DoesNotExist:
                         # La variante n'existe plus, basculer sur l'article principal
                         print(f"⚠️ ATTENTION: Variante {variante.id} introuvable pour l'article {article.id}")
                         print(f"   Basculement vers l'article principal...")
-                        variante = None
-                        stock_disponible = article.qte_disponible
                         nom_article = f"{article.nom} (article principal - variante supprimée)"
-                        print(f"📦 DEBUG: Article principal {nom_article} (ID:{article.id})")
-
+                        
                         # Mettre à jour le panier pour supprimer la référence incorrecte
                         panier.variante = None
                         panier.save()
                         print(f"🔧 DEBUG: Panier {panier.id} corrigé (variante supprimée)")
                 else:
-                    stock_disponible = article.qte_disponible
                     nom_article = article.nom
-                    print(f"📦 DEBUG: Article {nom_article} (ID:{article.id})")
-                
-                print(f"   - Stock actuel: {stock_disponible}")
-                print(f"   - Quantité commandée: {quantite_commandee}")
                 
-                # Vérifier si le stock est suffisant
+                stock_disponible = article.qte_disponible
+                print(f"📦 DEBUG: Article {nom_article} (ID:{article.id}) - Stock: {stock_disponible}, Demandé: {quantite_commandee}")
                 if stock_disponible < quantite_commandee:
                     stock_insuffisant.append({
                         'article': nom_article,
@@ -371,33 +354,52 @@ def confirmer_commande_ajax(request, commande_id):
                     })
                     print(f"❌ DEBUG: Stock insuffisant pour {nom_article}")
                 else:
-                    # Décrémentation directe et simple du stock
-                    ancien_stock = stock_disponible
-
-                    # Décrémenter directement le stock sur la variante ou l'article
-                    if variante:
-                        # Décrémenter sur la variante
-                        variante.qte_disponible = max(0, variante.qte_disponible - quantite_commandee)
-                        variante.save()
-                        nouveau_stock = variante.qte_disponible
-                        print(f"✅ DEBUG: Stock variante mis à jour: {ancien_stock} → {nouveau_stock}")
-                    else:
-                        # Décrémenter sur l'article principal
-                        article.qte_disponible = max(0, article.qte_disponible - quantite_commandee)
-                        article.save()
-                        nouveau_stock = article.qte_disponible
-                        print(f"✅ DEBUG: Stock article mis à jour: {ancien_stock} → {nouveau_stock}")
-
+                    lignes_articles.append((article, quantite_commandee, nom_article, stock_disponible))
+            
+            # Décrémenter les variantes : contrôle et écriture sous verrou, tout ou rien
+            # Les réservations de la commande sont consommées par la sortie de stock ; le contrôle
+            # porte sur le stock vendable, hors réservations des autres commandes en confirmation
+            if lignes_variantes and not stock_insuffisant:
+                try:
+                    with transaction.atomic():
+                        reservations.consommer_commande(commande)
+                        mouvements = stock.reserver(
+                            [(variante, quantite) for variante, quantite, _ in lignes_variantes],
+                            commande=commande,
+                            operateur=operateur,
+                            commentaire=f"Confirmation commande {commande.id_yz}",
+                            reservations=True,
+                        )
+                    for (variante, quantite, nom_article), mouvement in zip(lignes_variantes, mouvements):
+                        articles_decrémentes.append({
+                            'article': nom_article,
+                            'ancien_stock': mouvement.qte_apres_mouvement + quantite,
+                            'nouveau_stock': mouvement.qte_apres_mouvement,
+                            'quantite_decrémententée': quantite
+                        })
+                except stock.StockInsuffisant as e:
+                    noms = {variante.id: nom_article for variante, _, nom_article in lignes_variantes}
+                    for manque in e.manques:
+                        stock_insuffisant.append({
+                            'article': noms[manque['variante_id']],
+                            'stock_actuel': manque['disponible'],
+                            'quantite_demandee': manque['demande']
+                        })
+            
+            # Décrémenter sur l'article principal (répartition sur ses variantes actives)
+            if not stock_insuffisant:
+                reservations.consommer_commande(commande)
+                for article, quantite, nom_article, ancien_stock in lignes_articles:
+                    stock.mouvement_article(
+                        article, quantite, 'sortie', operateur=operateur, commande=commande,
+                        commentaire=f"Confirmation commande {commande.id_yz}",
+                    )
                     articles_decrémentes.append({
                         'article': nom_article,
                         'ancien_stock': ancien_stock,
-                        'nouveau_stock': nouveau_stock,
-                        'quantite_decrémententée': quantite_commandee
+                        'nouveau_stock': ancien_stock - quantite,
+                        'quantite_decrémententée': quantite
                     })
-                    
-                    print(f"✅ DEBUG: Stock mis à jour pour {nom_article}")
-                    print(f"   - Ancien stock: {ancien_stock}")
-                    print(f"   - Nouveau stock: {nouveau_stock}")
             
             # Si il y a des problèmes de stock, annuler la transaction
             if stock_insuffisant:
@@ -416,7 +418,7 @@ def confirmer_commande_ajax(request, commande_id):
                 })
             
             # Déterminer l'état suivant: toujours "Confirmée"
-            enum_suivant = EnumEtatCmd.objects.get(libelle='Confirmée')
+            enum_suivant = obtenir_etat('Confirmée')
             print(f"⚡ DEBUG: Confirmation immédiate (forcée)")
             
             # Fermer l'état actuel
@@ -481,7 +483,7 @@ def confirmer_commande(request, commande_id):
     if request.method == 'POST':
         try:
             # Récupérer l'opérateur
-            operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+            operateur = operateur_courant(request, 'CONFIRMATION')
             
             # Récupérer la commande
             commande = Commande.objects.get(pk=commande_id)
@@ -500,7 +502,7 @@ def confirmer_commande(request, commande_id):
             etat_actuel.terminer_etat(operateur)
             
             # Créer un nouvel état "confirmée"
-            enum_confirmee = EnumEtatCmd.objects.get(libelle='Confirmée')
+            enum_confirmee = obtenir_etat('Confirmée')
             EtatCommande.objects.create(
                 commande=commande,
                 enum_etat=enum_confirmee,
@@ -530,7 +532,7 @@ def marquer_erronnee(request, commande_id):
     if request.method == 'POST':
         try:
             # Récupérer l'opérateur
-            operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+            operateur = operateur_courant(request, 'CONFIRMATION')
             
             # Récupérer la commande
             commande = Commande.objects.get(pk=commande_id)
@@ -549,7 +551,7 @@ def marquer_erronnee(request, commande_id):
             etat_actuel.terminer_etat(operateur)
             
             # Créer un nouvel état "erronée"
-            enum_erronnee = EnumEtatCmd.objects.get(libelle='Erronée')
+            enum_erronnee = obtenir_etat('Erronée')
             EtatCommande.objects.create(
                 commande=commande,
                 enum_etat=enum_erronnee,
@@ -589,11 +591,11 @@ def commandes_confirmees(request):
             return redirect('login')
         
         # Récupérer l'objet Operateur correspondant à l'utilisateur connecté
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
         
         # Récupérer seulement les commandes confirmées par cet opérateur
         mes_commandes_confirmees = Commande.objects.filter(
-            etats__enum_etat__libelle='Confirmée',
+            etats__enum_etat_id__in=ids_etats('Confirmée'),
             etats__operateur=operateur  # Inclure même si l'état Confirmée est clôturé
         ).select_related('client', 'ville', 'ville__region').prefetch_related('etats', 'operations').distinct()
         
@@ -618,13 +620,13 @@ def commandes_confirmees(request):
         # Commandes confirmées cette semaine
         stats['confirmees_semaine'] = mes_commandes_confirmees.filter(
             etats__date_debut__date__gte=week_start,
-            etats__enum_etat__libelle='Confirmée'
+            etats__enum_etat_id__in=ids_etats('Confirmée')
         ).count()
         
         # Commandes confirmées aujourd'hui
         stats['confirmees_aujourdhui'] = mes_commandes_confirmees.filter(
             etats__date_debut__date=today,
-            etats__enum_etat__libelle='Confirmée'
+            etats__enum_etat_id__in=ids_etats('Confirmée')
         ).count()
         
     except Operateur.DoesNotExist:
@@ -719,7 +721,7 @@ def creer_operateur_confirme(request):
 def profile_confirme(request):
     """Page de profil pour l'opérateur de confirmation"""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur non trouvé.")
         return redirect('login') # Rediriger vers la page de connexion ou une page d'erreur
@@ -729,7 +731,7 @@ def profile_confirme(request):
 def modifier_profile_confirme(request):
     """Page de modification de profil pour l'opérateur de confirmation"""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur non trouvé.")
         return redirect('login')
@@ -798,7 +800,7 @@ def detail_commande(request, commande_id):
     
     try:
         # Récupérer l'opérateur
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur de confirmation non trouvé.")
         return redirect('login')
@@ -882,7 +884,7 @@ def confirmation(request):
     
     try:
         # Récupérer l'opérateur
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur de confirmation non trouvé.")
         return redirect('login')
@@ -897,14 +899,13 @@ def confirmation(request):
     ]
     
     commandes_a_confirmer = Commande.objects.filter(
-        etats__operateur=operateur,
-        etats__date_fin__isnull=True,  # États actifs (non terminés)
-        etats__enum_etat__libelle__in=etats_confirmables
+        operateur_etat_courant=operateur,
+        etat_courant_id__in=ids_etats(*etats_confirmables)
     ).select_related(
         'client', 'ville', 'ville__region'
     ).prefetch_related(
         'paniers__article', 'etats__enum_etat'
-    ).distinct().order_by('-date_cmd', '-date_creation')
+    ).order_by('-date_cmd', '-date_creation')
     
     context = {
         'operateur': operateur,
@@ -922,14 +923,13 @@ def lancer_confirmations(request):
     if request.method == 'POST':
         try:
             # Récupérer l'opérateur
-            operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+            operateur = operateur_courant(request, 'CONFIRMATION')
             
             # Récupérer toutes les commandes affectées à cet opérateur qui sont en attente
             commandes_a_traiter = Commande.objects.filter(
-                etats__operateur=operateur,
-                etats__date_fin__isnull=True,
-                etats__enum_etat__libelle='affectee'
-            ).distinct()
+                operateur_etat_courant=operateur,
+                etat_courant_id__in=ids_etats('affectee')
+            )
             
             # Compteur pour les commandes traitées
             commandes_traitees = 0
@@ -948,8 +948,8 @@ def lancer_confirmations(request):
                         etat_actuel.terminer_etat(operateur)
                         
                         # Créer un nouvel état "en cours de confirmation"
-                        enum_en_cours = EnumEtatCmd.objects.get_or_create(
-                            libelle='en_cours_confirmation',
+                        enum_en_cours = obtenir_ou_creer_etat(
+                            'en_cours_confirmation',
                             defaults={'ordre': 2, 'couleur': '#3B82F6'}
                         )[0]
                         
@@ -1022,7 +1022,7 @@ def selectionner_operation(request):
                 })
 
             # Récupérer l'opérateur
-            operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+            operateur = operateur_courant(request, 'CONFIRMATION')
             
             # Récupérer la commande
             commande = Commande.objects.get(id=commande_id)
@@ -1031,7 +1031,7 @@ def selectionner_operation(request):
             etat_actuel = commande.etats.filter(
                 operateur=operateur,
                 date_fin__isnull=True,
-                enum_etat__libelle='En cours de confirmation'
+                enum_etat_id__in=ids_etats('En cours de confirmation')
             ).first()
             
             if not etat_actuel:
@@ -1112,7 +1112,7 @@ def confirmer_commandes_ajax(request):
             
             # État "Confirmée"
             try:
-                etat_confirmee = EnumEtatCmd.objects.get(libelle='Confirmée')
+                etat_confirmee = obtenir_etat('Confirmée')
             except EnumEtatCmd.DoesNotExist:
                 return JsonResponse({
                     'success': False,
@@ -1124,8 +1124,7 @@ def confirmer_commandes_ajax(request):
                     # Récupérer la commande
                     commande = Commande.objects.get(
                         id=commande_id,
-                        etats__operateur=operateur,
-                        etats__date_fin__isnull=True
+                        operateur_etat_courant=operateur
                     )
                     
                     # Récupérer l'état actuel (non terminé) de cette commande pour cet opérateur
@@ -1194,7 +1193,7 @@ def lancer_confirmation(request, commande_id):
         try:
             # Récupérer l'opérateur de confirmation
             try:
-                operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+                operateur = operateur_courant(request, 'CONFIRMATION')
             except Operateur.DoesNotExist:
                 return JsonResponse({
                     'success': False,
@@ -1236,7 +1235,7 @@ def lancer_confirmation(request, commande_id):
             
             # États requis
             try:
-                etat_en_cours = EnumEtatCmd.objects.get(libelle='En cours de confirmation')
+                etat_en_cours = obtenir_etat('En cours de confirmation')
             except EnumEtatCmd.DoesNotExist:
                 return JsonResponse({
                     'success': False,
@@ -1256,6 +1255,9 @@ def lancer_confirmation(request, commande_id):
                 commentaire="Confirmation lancée par l'opérateur"
             )
             
+            # Le panier retient son stock pendant la confirmation
+            reservations.synchroniser_commande(commande, operateur, forcer=True)
+            
             return JsonResponse({
                 'success': True,
                 'message': f'Confirmation lancée avec succès pour la commande {commande.id_yz}'
@@ -1288,7 +1290,7 @@ def lancer_confirmations_masse(request):
             
             # Récupérer l'opérateur de confirmation
             try:
-                operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+                operateur = operateur_courant(request, 'CONFIRMATION')
             except Operateur.DoesNotExist:
                 return JsonResponse({
                     'success': False,
@@ -1300,7 +1302,7 @@ def lancer_confirmations_masse(request):
             
             # État "En cours de confirmation"
             try:
-                etat_en_cours = EnumEtatCmd.objects.get(libelle='En cours de confirmation')
+                etat_en_cours = obtenir_etat('En cours de confirmation')
             except EnumEtatCmd.DoesNotExist:
                 return JsonResponse({
                     'success': False,
@@ -1316,8 +1318,7 @@ def lancer_confirmations_masse(request):
                     # Récupérer la commande
                     commande = Commande.objects.get(
                         id=commande_id,
-                        etats__operateur=operateur,
-                        etats__date_fin__isnull=True
+                        operateur_etat_courant=operateur
                     )
                     
                     # Récupérer l'état actuel (non terminé) de cette commande pour cet opérateur
@@ -1340,6 +1341,7 @@ def lancer_confirmations_masse(request):
                             date_debut=timezone.now(),
                             commentaire="Confirmation lancée en masse"
                         )
+                        reservations.synchroniser_commande(commande, operateur, forcer=True)
                         
                         launched_count += 1
                 
@@ -1395,7 +1397,7 @@ def annuler_commande_confirmation(request, commande_id):
             
             # Récupérer l'opérateur de confirmation
             try:
-                operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+                operateur = operateur_courant(request, 'CONFIRMATION')
             except Operateur.DoesNotExist:
                 return JsonResponse({
                     'success': False,
@@ -1438,8 +1440,8 @@ def annuler_commande_confirmation(request, commande_id):
                 })
             
             # Récupérer ou créer l'état "Annulée"
-            etat_annulee, created = EnumEtatCmd.objects.get_or_create(
-                libelle='Annulée',
+            etat_annulee, created = obtenir_ou_creer_etat(
+                'Annulée',
                 defaults={'ordre': 70, 'couleur': '#EF4444'}
             )
             
@@ -1456,6 +1458,9 @@ def annuler_commande_confirmation(request, commande_id):
                 commentaire=f"Commande annulée par l'opérateur de confirmation - Motif: {motif}"
             )
             
+            # Rendre le stock retenu par le panier
+            reservations.liberer_commande(commande)
+            
             # Sauvegarder le motif d'annulation dans la commande
             commande.motif_annulation = motif
             commande.save()
@@ -1516,7 +1521,7 @@ def reporter_commande_confirmation(request, commande_id):
 
             # Récupérer l'opérateur de confirmation
             try:
-                operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+                operateur = operateur_courant(request, 'CONFIRMATION')
             except Operateur.DoesNotExist:
                 return JsonResponse({
                     'success': False,
@@ -1553,8 +1558,8 @@ def reporter_commande_confirmation(request, commande_id):
                 })
 
             # Créer (ou récupérer) l'état Reportée
-            etat_reportee, _ = EnumEtatCmd.objects.get_or_create(
-                libelle='Report de confirmation',
+            etat_reportee, _ = obtenir_ou_creer_etat(
+                'Report de confirmation',
                 defaults={'ordre':15, 'couleur':'#6B7280'}
             )
             
@@ -1586,7 +1591,27 @@ def reporter_commande_confirmation(request, commande_id):
 
     return JsonResponse({'success': False, 'message': 'Méthode non autorisée'})
 
+def synchroniser_reservations_apres(vue):
+    """Après une modification (POST) du panier, aligne les réservations de stock de la commande"""
+    from functools import wraps
+
+    @wraps(vue)
+    def wrapper(request, commande_id, *args, **kwargs):
+        response = vue(request, commande_id, *args, **kwargs)
+        if request.method == 'POST':
+            commande = Commande.objects.select_related('etat_courant').filter(id=commande_id).first()
+            if commande:
+                try:
+                    reservations.synchroniser_commande(commande, getattr(request.user, 'profil_operateur', None))
+                except Exception as e:
+                    # La réservation ne doit pas faire échouer la modification : le balayage rattrapera
+                    print(f"⚠️ Synchronisation des réservations de la commande {commande_id} impossible: {e}")
+        return response
+    return wrapper
+
+
 @login_required
+@synchroniser_reservations_apres
 def modifier_commande(request, commande_id):
     """Page de modification complète d'une commande pour les opérateurs de confirmation"""
     from commande.models import Commande, Operation, Panier
@@ -1595,7 +1620,7 @@ def modifier_commande(request, commande_id):
     
     try:
         # Récupérer l'opérateur
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur de confirmation non trouvé.")
         return redirect('login')
@@ -1719,36 +1744,8 @@ def modifier_commande(request, commande_id):
                         )
                         print(f"➕ Nouvel article ajouté: ID={article.id}, quantité={quantite}")
                     
-                    # Recalculer le compteur après ajout
-                    if article.isUpsell and hasattr(article, 'prix_upsell_1') and article.prix_upsell_1 is not None:
-                        # Compter la quantité totale d'articles upsell (après ajout)
-                        from django.db.models import Sum
-                        total_quantite_upsell = commande.paniers.filter(article__isUpsell=True).aggregate(
-                            total=Sum('quantite')
-                        )['total'] or 0
-                        
-                        # Le compteur ne s'incrémente qu'à partir de 2 unités d'articles upsell
-                        # 0-1 unités upsell → compteur = 0
-                        # 2+ unités upsell → compteur = total_quantite_upsell - 1
-                        if total_quantite_upsell >= 2:
-                            commande.compteur = total_quantite_upsell - 1
-                        else:
-                            commande.compteur = 0
-                        
-                        commande.save()
-                        
-                        # Recalculer TOUS les articles de la commande avec le nouveau compteur
-                        commande.recalculer_totaux_upsell()
-                    else:
-                        # Pour les articles normaux, juste calculer le sous-total
-                        from commande.templatetags.commande_filters import get_prix_upsell_avec_compteur
-                        prix_unitaire = get_prix_upsell_avec_compteur(article, commande.compteur)
-                        sous_total = prix_unitaire * panier.quantite
-                        panier.sous_total = float(sous_total)
-                        panier.save()
-                    
-                    # Recalculer le total de la commande avec les frais de livraison
-                    commande.recalculer_total_avec_frais()
+                    # Recalculer en une passe le compteur, les prix de tous les articles et le total
+                    tarification.recalculer_commande(commande)
                     
                     # Déterminer si c'était un ajout ou une mise à jour
                     message = 'Article ajouté avec succès' if not panier_existant else f'Quantité mise à jour ({panier.quantite})'
@@ -1798,41 +1795,15 @@ def modifier_commande(request, commande_id):
                     # Créer le nouveau panier
                     nouvel_article = Article.objects.get(id=nouvel_article_id)
                     
-                    # Recalculer le compteur après remplacement
-                    from django.db.models import Sum
-                    total_quantite_upsell = commande.paniers.filter(article__isUpsell=True).aggregate(
-                        total=Sum('quantite')
-                    )['total'] or 0
-                    
-                    # Ajouter la quantité si le nouvel article est upsell
-                    if nouvel_article.isUpsell:
-                        total_quantite_upsell += nouvelle_quantite
-                    
-                    # Appliquer la logique : compteur = max(0, total_quantite_upsell - 1)
-                    if total_quantite_upsell >= 2:
-                        commande.compteur = total_quantite_upsell - 1
-                    else:
-                        commande.compteur = 0
-                    
-                    commande.save()
-                    
-                    # Recalculer TOUS les articles de la commande avec le nouveau compteur
-                    commande.recalculer_totaux_upsell()
-                    
-                    # Calculer le sous-total selon le compteur de la commande
-                    from commande.templatetags.commande_filters import get_prix_upsell_avec_compteur
-                    prix_unitaire = get_prix_upsell_avec_compteur(nouvel_article, commande.compteur)
-                    sous_total = prix_unitaire * nouvelle_quantite
-                    
                     nouveau_panier = Panier.objects.create(
                         commande=commande,
                         article=nouvel_article,
                         quantite=nouvelle_quantite,
-                        sous_total=float(sous_total)
+                        sous_total=0  # Calculé par le recalcul ci-dessous
                     )
                     
-                    # Recalculer le total de la commande avec les frais de livraison
-                    commande.recalculer_total_avec_frais()
+                    # Recalculer en une passe le compteur, les prix de tous les articles et le total
+                    tarification.recalculer_commande(commande)
                     
                     return JsonResponse({
                         'success': True,
@@ -1874,29 +1845,8 @@ def modifier_commande(request, commande_id):
                     # Supprimer l'article
                     panier.delete()
                     
-                    # Recalculer le compteur après suppression
-                    if etait_upsell:
-                        # Compter la quantité totale d'articles upsell restants (après suppression)
-                        from django.db.models import Sum
-                        total_quantite_upsell = commande.paniers.filter(article__isUpsell=True).aggregate(
-                            total=Sum('quantite')
-                        )['total'] or 0
-                        
-                        # Le compteur ne s'incrémente qu'à partir de 2 unités d'articles upsell
-                        # 0-1 unités upsell → compteur = 0
-                        # 2+ unités upsell → compteur = total_quantite_upsell - 1
-                        if total_quantite_upsell >= 2:
-                            commande.compteur = total_quantite_upsell - 1
-                        else:
-                            commande.compteur = 0
-                        
-                        commande.save()
-                        
-                        # Recalculer TOUS les articles de la commande avec le nouveau compteur
-                        commande.recalculer_totaux_upsell()
-                    
-                    # Recalculer le total de la commande avec les frais de livraison
-                    commande.recalculer_total_avec_frais()
+                    # Recalculer en une passe le compteur, les prix de tous les articles et le total
+                    tarification.recalculer_commande(commande)
                     
                     return JsonResponse({
                         'success': True,
@@ -1943,7 +1893,6 @@ def modifier_commande(request, commande_id):
                 try:
                     panier = Panier.objects.get(id=panier_id, commande=commande)
                     ancienne_quantite = panier.quantite
-                    etait_upsell = panier.article.isUpsell
                     
                     # Vérifier si une remise a été appliquée sur ce panier
                     if hasattr(panier, 'remise_appliquer') and panier.remise_appliquer:
@@ -1957,34 +1906,12 @@ def modifier_commande(request, commande_id):
                         # Aucune remise appliquée - utiliser la logique normale
                         panier.quantite = nouvelle_quantite
                         panier.save()
-                        
-                        # Recalculer le compteur si c'était un article upsell
-                        if etait_upsell:
-                            # Compter la quantité totale d'articles upsell (après modification)
-                            from django.db.models import Sum
-                            total_quantite_upsell = commande.paniers.filter(article__isUpsell=True).aggregate(
-                                total=Sum('quantite')
-                            )['total'] or 0
-                            
-                            # Le compteur ne s'incrémente qu'à partir de 2 unités d'articles upsell
-                            if total_quantite_upsell >= 2:
-                                commande.compteur = total_quantite_upsell - 1
-                            else:
-                                commande.compteur = 0
-                            
-                            commande.save()
-                            
-                            # Recalculer TOUS les articles de la commande avec le nouveau compteur
-                            commande.recalculer_totaux_upsell()
-                        else:
-                            # Pour les articles normaux, juste recalculer le sous-total
-                            from commande.templatetags.commande_filters import get_prix_upsell_avec_compteur
-                            prix_unitaire = get_prix_upsell_avec_compteur(panier.article, commande.compteur)
-                            panier.sous_total = float(prix_unitaire * nouvelle_quantite)
-                            panier.save()
                     
-                    # Recalculer le total de la commande avec les frais de livraison
-                    commande.recalculer_total_avec_frais()
+                    # Recalculer en une passe le compteur, les prix de tous les articles et le total
+                    tarif = tarification.recalculer_commande(commande)
+                    panier.sous_total = next(
+                        (ligne.sous_total for ligne in tarif.lignes if ligne.panier.pk == panier.pk), panier.sous_total
+                    )
                     
                     return JsonResponse({
                         'success': True,
@@ -2676,7 +2603,7 @@ def api_operations_commande(request, commande_id):
     """API pour récupérer les opérations d'une commande mises à jour"""
     try:
         # Vérifier que l'utilisateur est un opérateur de confirmation
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
         
         # Récupérer la commande
         commande = Commande.objects.get(id=commande_id)
@@ -2741,29 +2668,38 @@ def api_operations_commande(request, commande_id):
 @login_required
 def api_articles_disponibles(request):
     try:
-        # Récupérer tous les articles disponibles
+        from django.conf import settings
+        from django.db.models import Exists, OuterRef, Prefetch
+        from django.db.models.functions import Coalesce
+        from article.models import Promotion
+
+        # Compléter le prix actuel manquant en une seule requête
+        Article.objects.filter(actif=True, prix_actuel__isnull=True).update(prix_actuel=models.F('prix_unitaire'))
+
+        # Stock vendable (physique - réservé) précalculé sur les variantes actives
+        maintenant = timezone.now()
         articles = Article.objects.filter(
             actif=True, 
-        ).order_by('nom')
+        ).select_related('categorie').annotate(
+            stock_vendable=Coalesce(Sum('variantes__qte_vendable', filter=Q(variantes__actif=True)), 0),
+            promo_active=Exists(Promotion.objects.filter(
+                articles=OuterRef('pk'), active=True, date_debut__lte=maintenant, date_fin__gte=maintenant
+            )),
+        ).prefetch_related(Prefetch(
+            'variantes',
+            queryset=VarianteArticle.objects.filter(actif=True).select_related('couleur', 'pointure').order_by('pk'),
+            to_attr='variantes_actives',
+        )).order_by('nom')
         
         # Préparer les données des articles
         articles_data = []
         for article in articles:
-            # Mettre à jour le prix actuel si nécessaire
-            if article.prix_actuel is None:
-                article.prix_actuel = article.prix_unitaire
-                article.save(update_fields=['prix_actuel'])
-            
-            # S'assurer que qte_disponible est bien un entier
-            stock = article.qte_disponible
-            if stock is None:
-                stock = 0
+            premiere_variante = article.variantes_actives[0] if article.variantes_actives else None
             
             # Déterminer l'URL de l'image
             image_url = None
             if article.image:
                 # Construire l'URL complète pour l'image locale
-                from django.conf import settings
                 image_url = f"{settings.MEDIA_URL}{article.image.name}"
             elif article.image_url:
                 image_url = article.image_url
@@ -2772,8 +2708,8 @@ def api_articles_disponibles(request):
                 'id': article.id,
                 'nom': article.nom,
                 'reference': article.reference or '',
-                'pointure': article.pointure or '',
-                'couleur': article.couleur or '',
+                'pointure': premiere_variante.pointure.pointure if premiere_variante and premiere_variante.pointure else '',
+                'couleur': premiere_variante.couleur.nom if premiere_variante and premiere_variante.couleur else '',
                 'categorie': (str(article.categorie) if article.categorie else ''),
                 'prix_unitaire': float(article.prix_unitaire),
                 'prix_actuel': float(article.prix_actuel or article.prix_unitaire),
@@ -2781,10 +2717,10 @@ def api_articles_disponibles(request):
                 'prix_upsell_2': float(article.prix_upsell_2) if article.prix_upsell_2 else None,
                 'prix_upsell_3': float(article.prix_upsell_3) if article.prix_upsell_3 else None,
                 'prix_upsell_4': float(article.prix_upsell_4) if article.prix_upsell_4 else None,
-                'qte_disponible': stock,
+                'qte_disponible': max(0, article.stock_vendable),
                 'isUpsell': bool(article.isUpsell),
                 'phase': article.phase,
-                'has_promo_active': article.has_promo_active,
+                'has_promo_active': article.promo_active,
                 'description': article.description or '',
                 'image_url': image_url,
             })
@@ -2806,7 +2742,7 @@ def api_commentaires_disponibles(request):
     """API pour récupérer la liste des commentaires prédéfinis depuis le modèle"""
     try:
         # Vérifier que l'utilisateur est un opérateur de confirmation
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         return JsonResponse({'error': 'Accès non autorisé'}, status=403)
     
@@ -2848,7 +2784,7 @@ def creer_commande(request):
     """Créer une nouvelle commande - Interface opérateur de confirmation"""
     try:
         # Récupérer le profil opérateur de l'utilisateur connecté
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur de confirmation non trouvé.")
         return redirect('login')
@@ -2992,7 +2928,7 @@ def creer_commande(request):
 
                 # Créer l'état initial "Affectée" directement à l'opérateur créateur
                 try:
-                    etat_affectee = EnumEtatCmd.objects.get(libelle='Affectée')
+                    etat_affectee = obtenir_etat('Affectée')
                     EtatCommande.objects.create(
                         commande=commande,
                         enum_etat=etat_affectee,
@@ -3001,7 +2937,7 @@ def creer_commande(request):
                     )
                 except EnumEtatCmd.DoesNotExist:
                     try:
-                        etat_initial = EnumEtatCmd.objects.get(libelle='Non affectée')
+                        etat_initial = obtenir_etat('Non affectée')
                         EtatCommande.objects.create(
                             commande=commande,
                             enum_etat=etat_initial,
@@ -3075,7 +3011,7 @@ def api_panier_commande(request, commande_id):
     """API pour récupérer le contenu du panier d'une commande"""
     try:
         # Vérifier que l'utilisateur est un opérateur de confirmation
-        operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+        operateur = operateur_courant(request, 'CONFIRMATION')
     except Operateur.DoesNotExist:
         return JsonResponse({'error': 'Accès non autorisé'}, status=403)
     
@@ -3189,8 +3125,9 @@ def api_recherche_client_tel(request):
         query = request.GET.get('q', '').strip()
         results = []
         if query and len(query) >= 3:
-            from client.models import Client
-            clients = Client.objects.filter(numero_tel__icontains=query).order_by('prenom', 'nom')[:10]
+            from client import telephone
+            # Numéro exact, début ou fin de numéro, sur les colonnes indexées
+            clients = telephone.rechercher(query, limite=10)
             for c in clients:
                 results.append({
                     'id': c.pk,
@@ -3207,6 +3144,7 @@ def rechercher_client_telephone(request):
     """API pour rechercher un client par numéro de téléphone exact"""
     from django.http import JsonResponse
     from client.models import Client
+    from client import telephone as recherche_telephone
     
     if request.method == 'GET':
         telephone = request.GET.get('telephone', '').strip()
@@ -3218,8 +3156,8 @@ def rechercher_client_telephone(request):
             }, status=400)
         
         try:
-            # Rechercher le client par numéro de téléphone exact
-            client = Client.objects.get(numero_tel=telephone, is_active=True)
+            # Rechercher le client par numéro de téléphone exact (quelle que soit la saisie)
+            client = recherche_telephone.trouver(telephone).get(is_active=True)
             
             return JsonResponse({
                 'success': True,
@@ -3242,7 +3180,7 @@ def rechercher_client_telephone(request):
             
         except Client.MultipleObjectsReturned:
             # Si plusieurs clients avec le même numéro (cas rare)
-            clients = Client.objects.filter(numero_tel=telephone, is_active=True)
+            clients = recherche_telephone.trouver(telephone).filter(is_active=True)
             return JsonResponse({
                 'success': False,
                 'error': f'Plusieurs clients trouvés avec ce numéro ({clients.count()})'
@@ -3418,7 +3356,9 @@ def get_article_variants(request, article_id):
                 'couleur': variante.couleur.nom if variante.couleur else None,
                 'pointure': variante.pointure.pointure if variante.pointure else None,
                 'taille': None,  # À adapter selon votre modèle si vous avez des tailles
-                'stock': variante.qte_disponible,
+                'stock': max(0, variante.qte_vendable),
+                'stock_physique': variante.qte_disponible,
+                'stock_reserve': variante.qte_reservee,
                 'prix_unitaire': float(variante.prix_unitaire),
                 'prix_actuel': float(variante.prix_actuel),
                 'reference_variante': variante.reference_variante,
@@ -3457,7 +3397,7 @@ def get_prix_remise_article(request, commande_id, panier_id):
     try:
         # Vérifier l'opérateur
         try:
-            operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+            operateur = operateur_courant(request, 'CONFIRMATION')
         except Operateur.DoesNotExist:
             return JsonResponse({
                 'success': False,
@@ -3636,7 +3576,7 @@ def activer_remise_panier(request, panier_id):
     if request.method == 'POST':
         try:
             # Récupérer l'opérateur
-            operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+            operateur = operateur_courant(request, 'CONFIRMATION')
             print(f"✅ DEBUG: Opérateur trouvé: {operateur}")
         except Operateur.DoesNotExist:
             print(f"❌ DEBUG: Opérateur non trouvé pour user={request.user}")
@@ -3757,7 +3697,7 @@ def desactiver_remise_panier(request, panier_id):
     if request.method == 'POST':
         try:
             # Récupérer l'opérateur
-            operateur = Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+            operateur = operateur_courant(request, 'CONFIRMATION')
         except Operateur.DoesNotExist:
             return JsonResponse({
                 'success': False,
@@ -12,6 +12,7 @@ from django.core.paginator import Paginator
 from django.utils import timezone
 
 from parametre.models import Operateur
+from parametre.operateurs import operateur_courant
 from commande.models import Commande, ArticleRetourne
 
 
@@ -19,7 +20,7 @@ from commande.models import Commande, ArticleRetourne
 def liste_articles_retournes(request):
     """Liste des articles retournés en attente de traitement"""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
@@ -79,7 +80,7 @@ def liste_articles_retournes(request):
 def detail_article_retourne(request, retour_id):
     """Détail d'un article retourné"""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
@@ -105,7 +106,7 @@ def detail_article_retourne(request, retour_id):
 def traiter_article_retourne(request, retour_id):
     """Traiter un article retourné (réintégrer, marquer défectueux, etc.)"""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
 
@@ -181,7 +182,7 @@ def traiter_article_retourne(request, retour_id):
 def reintegrer_automatique(request):
     """Réintégrer automatiquement tous les articles retournés éligibles"""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
 
@@ -236,7 +237,7 @@ def reintegrer_automatique(request):
 def statistiques_retours(request):
     """Page de statistiques des retours"""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
@@ -7,8 +7,12 @@ from datetime import datetime, timedelta
 import json
 
 from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.etats import ids_etats
 from parametre.models import Region, Ville, Operateur
 from article.models import Article
+from commande.recherche import (
+    ETATS_ROLE, rechercher_commandes, rechercher_regions, rechercher_villes, rechercher_villes_init, statut,
+)
 
 
 @login_required
@@ -83,101 +87,28 @@ def search_commandes_logistique(query, request=None):
     """Recherche dans les commandes pour logistique"""
     commandes = []
     
-    # Recherche par ID numérique
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            # Pour la recherche par ID, être plus permissif
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id}',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': f'/operateur-logistique/commande/{cmd.id}/',
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par numéro externe
-    try:
-        cmd_externe = Commande.objects.get(num_cmd__icontains=query)
-        commandes.append({
-            'id': cmd_externe.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd_externe.id} ({cmd_externe.num_cmd})',
-            'subtitle': f'Client: {cmd_externe.client.nom if cmd_externe.client else "N/A"} - {cmd_externe.total_cmd} DH',
-            'status': get_commande_status(cmd_externe),
-            'url': f'/operateur-logistique/commande/{cmd_externe.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 1
-        })
-    except Commande.DoesNotExist:
-        pass
-    
-    # Recherche par client (exclure les recherches déjà faites par numéro externe)
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    ).exclude(
-        num_cmd__icontains=query
-    )[:10]
-    
-    for cmd in commandes_client:
-        # Pour la recherche par client, être plus permissif
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': f'/operateur-logistique/commande/{cmd.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville/ville_init (exclure les recherches déjà faites)
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query) |
-        Q(ville_init__icontains=query)
-    ).exclude(
-        Q(num_cmd__icontains=query) |
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:10]
-    
-    for cmd in commandes_geo:
-        # Pour la recherche par géographie, être plus permissif
-        ville_display = cmd.ville.nom if cmd.ville else "N/A"
-        if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
-            ville_display = f"{cmd.ville_init} → {ville_display}"
+    # Une requête classée : numéro / ID, puis client, puis géographie (commande/recherche.py)
+    for cmd in rechercher_commandes(query, limite=10):
+        if cmd.rang == 3:
+            ville_display = cmd.ville.nom if cmd.ville else "N/A"
+            if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
+                ville_display = f"{cmd.ville_init} → {ville_display}"
+            subtitle = f'{ville_display} - {cmd.total_cmd} DH'
+        else:
+            subtitle = f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH'
         
         commandes.append({
             'id': cmd.id,
             'type': 'commande',
             'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'{ville_display} - {cmd.total_cmd} DH',
+            'subtitle': subtitle,
             'status': get_commande_status(cmd),
             'url': f'/operateur-logistique/commande/{cmd.id}/',
             'icon': 'fas fa-shopping-cart',
-            'priority': 3
+            'priority': cmd.rang
         })
     
-    # Dédupliquer les résultats par ID de commande
-    commandes_uniques = []
-    ids_vus = set()
-    
-    for cmd in commandes:
-        if cmd['id'] not in ids_vus:
-            commandes_uniques.append(cmd)
-            ids_vus.add(cmd['id'])
-    
-    return commandes_uniques[:10]
+    return commandes
 
 
 def search_livraisons(query, request=None):
@@ -199,9 +130,8 @@ def search_livraisons(query, request=None):
     
     # Recherche par commandes préparées (prêtes pour livraison)
     commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-        etats__date_fin__isnull=True
-    )[:5]
+        etat_courant_id__in=ids_etats(*ETATS_ROLE['LOGISTIQUE'])
+    ).select_related('client', 'etat_courant')[:5]
     
     for cmd in commandes_preparees:
         # Pour les livraisons, être plus permissif
@@ -238,9 +168,8 @@ def search_retours(query, request=None):
     
     # Recherche par commandes retournées
     commandes_retournees = Commande.objects.filter(
-        etats__enum_etat__libelle__in=["Retournée", "En SAV", "Annulée"],
-        etats__date_fin__isnull=True
-    )[:5]
+        etat_courant_id__in=ids_etats("Retournée", "En SAV", "Annulée")
+    ).select_related('client', 'etat_courant')[:5]
     
     for cmd in commandes_retournees:
         # Pour les retours, être plus permissif
@@ -262,26 +191,13 @@ def search_regions_logistique(query, request=None):
     """Recherche dans les régions pour logistique"""
     regions = []
     
-    regions_match = Region.objects.filter(
-        Q(nom_region__icontains=query)
-    )[:5]
-    
-    for region in regions_match:
-        # Compter les commandes à livrer de cette région (plus inclusif)
-        commandes_region = Commande.objects.filter(
-            ville__region=region,
-            etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-            etats__date_fin__isnull=True
-        )
-        
-        # Compter toutes les commandes de la région
-        nb_commandes = commandes_region.count()
-        
+    # Commandes à livrer de chaque région (plus inclusif)
+    for region in rechercher_regions(query, ETATS_ROLE['LOGISTIQUE']):
         regions.append({
             'id': region.id,
             'type': 'region',
             'title': region.nom_region,
-            'subtitle': f'{nb_commandes} commandes à livrer',
+            'subtitle': f'{region.nb_commandes} commandes à livrer',
             'status': 'Active',
             'url': f'/operateur-logistique/commandes/?region={region.nom_region}',
             'icon': 'fas fa-map',
@@ -295,32 +211,12 @@ def search_villes_logistique(query, request=None):
     """Recherche dans les villes pour logistique"""
     villes = []
     
-    villes_match = Ville.objects.filter(
-        Q(nom__icontains=query) |
-        Q(region__nom_region__icontains=query)
-    )[:5]
-    
-    # Ajouter aussi les villes initiales qui correspondent
-    villes_init_match = Commande.objects.filter(
-        ville_init__icontains=query
-    ).values_list('ville_init', flat=True).distinct()[:5]
-    
-    for ville in villes_match:
-        # Compter les commandes à livrer de cette ville (plus inclusif)
-        commandes_ville = Commande.objects.filter(
-            ville=ville,
-            etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-            etats__date_fin__isnull=True
-        )
-        
-        # Compter toutes les commandes de la ville
-        nb_commandes = commandes_ville.count()
-        
+    for ville in rechercher_villes(query, ETATS_ROLE['LOGISTIQUE']):
         villes.append({
             'id': ville.id,
             'type': 'ville',
             'title': ville.nom,
-            'subtitle': f'{ville.region.nom_region} - {nb_commandes} commandes à livrer',
+            'subtitle': f'{ville.region.nom_region} - {ville.nb_commandes} commandes à livrer',
             'status': 'Active',
             'url': f'/operateur-logistique/commandes/?ville={ville.nom}',
             'icon': 'fas fa-map-marker-alt',
@@ -328,25 +224,17 @@ def search_villes_logistique(query, request=None):
         })
     
     # Ajouter les villes initiales trouvées
-    for ville_init in villes_init_match:
-        if ville_init:
-            # Compter les commandes avec cette ville initiale
-            nb_commandes_init = Commande.objects.filter(
-                ville_init=ville_init,
-                etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-                etats__date_fin__isnull=True
-            ).count()
-            
-            villes.append({
-                'id': f'init_{ville_init}',
-                'type': 'ville_init',
-                'title': f'{ville_init} (Ville Initiale)',
-                'subtitle': f'{nb_commandes_init} commandes à livrer',
-                'status': 'Active',
-                'url': f'/operateur-logistique/commandes/?ville_init={ville_init}',
-                'icon': 'fas fa-map-marker-alt',
-                'priority': 1
-            })
+    for ville_init, nb_commandes_init in rechercher_villes_init(query, ETATS_ROLE['LOGISTIQUE']):
+        villes.append({
+            'id': f'init_{ville_init}',
+            'type': 'ville_init',
+            'title': f'{ville_init} (Ville Initiale)',
+            'subtitle': f'{nb_commandes_init} commandes à livrer',
+            'status': 'Active',
+            'url': f'/operateur-logistique/commandes/?ville_init={ville_init}',
+            'icon': 'fas fa-map-marker-alt',
+            'priority': 1
+        })
     
     return villes
 
@@ -412,10 +300,7 @@ def is_commande_for_logistique(commande, request=None):
 
 def get_commande_status(commande):
     """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
+    return statut(commande)
 
 
 @login_required
@@ -447,8 +332,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes prêtes pour livraison
     recent_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle="Préparée",
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats("Préparée")
     ).order_by('-id')[:3]
     
     for cmd in recent_commandes:
@@ -459,8 +343,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes en retour
     commandes_retour = Commande.objects.filter(
-        etats__enum_etat__libelle__in=["Retournée", "En SAV"],
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats("Retournée", "En SAV")
     ).order_by('-id')[:3]
     
     for cmd in commandes_retour:
@@ -5,11 +5,13 @@ from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.http import JsonResponse
 from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.etats import ids_etats, obtenir_etat
 from django.db import transaction
 from datetime import datetime
 import json
 from article.models import Article
 from parametre.models import Operateur
+from parametre.operateurs import operateur_courant
 
 @login_required
 @require_POST
@@ -42,7 +44,7 @@ def changer_etat_livraison(request, commande_id):
                 etat_actuel.save()
 
             # Créer le nouvel état
-            enum_etat = EnumEtatCmd.objects.get(libelle=nouvel_etat)
+            enum_etat = obtenir_etat(nouvel_etat)
             
             # Traitement spécifique selon l'état
             details_supplementaires = ""
@@ -144,18 +146,17 @@ def _render_sav_list_custom(request, commandes, template_name):
 def commandes_reportees(request):
     """Affiche les commandes dont la livraison est reportée."""
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Reportée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Reportée')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur',
         'envois', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Enrichir les données pour chaque commande
     for commande in commandes:
         # Trouver l'état actuel (Reportée)
         commande.etat_actuel_sav = commande.etats.filter(
-            enum_etat__libelle='Reportée',
+            enum_etat_id__in=ids_etats('Reportée'),
             date_fin__isnull=True
         ).first()
         
@@ -268,7 +269,7 @@ def commandes_livrees_partiellement(request):
     # Récupérer toutes les commandes qui ont eu une livraison partielle
     # (même si elles ont été renvoyées en préparation ensuite)
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée Partiellement'
+        etats__enum_etat_id__in=ids_etats('Livrée Partiellement')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur',
         'envois', 'paniers__article'  # Ajouter les paniers et articles
@@ -278,7 +279,7 @@ def commandes_livrees_partiellement(request):
     for commande in commandes:
         # Trouver l'état "Livrée Partiellement" le plus récent
         etat_livraison_partielle = commande.etats.filter(
-            enum_etat__libelle='Livrée Partiellement'
+            enum_etat_id__in=ids_etats('Livrée Partiellement')
         ).order_by('-date_debut').first()
         
         if etat_livraison_partielle:
@@ -413,18 +414,17 @@ def commandes_livrees_partiellement(request):
 def commandes_retournees(request):
     """Affiche les commandes retournées par l'opérateur logistique."""
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Retournée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Retournée')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur',
         'envois', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Enrichir les données pour chaque commande
     for commande in commandes:
         # Trouver l'état actuel
         commande.etat_actuel_sav = commande.etats.filter(
-            enum_etat__libelle='Retournée',
+            enum_etat_id__in=ids_etats('Retournée'),
             date_fin__isnull=True
         ).first()
         
@@ -464,8 +464,7 @@ def commandes_livrees(request):
     
     # Base query pour les commandes livrées
     base_query = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Livrée')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur',
         'envois', 'paniers__article'
@@ -527,7 +526,7 @@ def commandes_livrees(request):
             base_query = base_query.filter(etats__date_debut__date__range=[first_day_last_year, last_day_last_year])
     
     # Ajouter l'ordre et distinct une seule fois
-    base_query = base_query.order_by('-etats__date_debut').distinct()
+    base_query = base_query.order_by('-date_etat_courant').distinct()
     
     # Filtrer selon l'onglet sélectionné
     if current_tab == 'payees':
@@ -592,7 +591,7 @@ def commandes_livrees(request):
 def marquer_commande_payee(request, commande_id):
     """Marquer une commande comme payée."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
     
@@ -10,7 +10,9 @@ from django.db                      import transaction
 import json
 
 from parametre.models import Operateur
+from parametre.operateurs import operateur_courant
 from commande.models  import Commande, Envoi, EnumEtatCmd, EtatCommande
+from commande.etats import ids_etats, obtenir_ou_creer_etat
 from article.models   import Article
 
 
@@ -19,23 +21,22 @@ from article.models   import Article
 def dashboard(request):
     """Page d'accueil de l'interface opérateur logistique."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
     
 
-    commandes_retournees = Commande.objects.filter(etats__enum_etat__libelle="Retournée").distinct().count()
+    commandes_retournees = Commande.objects.filter(etats__enum_etat_id__in=ids_etats("Retournée")).distinct().count()
     # Toutes les commandes qui sont PASSÉES par l'état "Mise en distribution" (peu importe date_fin)
-    commandes_distribution = Commande.objects.filter(etats__enum_etat__libelle="Mise en distribution").distinct().count()
+    commandes_distribution = Commande.objects.filter(etats__enum_etat_id__in=ids_etats("Mise en distribution")).distinct().count()
 
     #Nombre totale de commandes 
     total_commandes = Commande.objects.count()
 
     # Commandes livrées (totales ou partielles)
     livrees = Commande.objects.filter(
-    Q(etats__enum_etat__libelle="Livrée") |
-    Q(etats__enum_etat__libelle="Livrée partiellement")).distinct().count()
+    Q(etats__enum_etat_id__in=ids_etats("Livrée", "Livrée partiellement"))).distinct().count()
 
 
     #Taux de livraison sur le nombre total de commande de manière générale
@@ -56,8 +57,7 @@ def dashboard(request):
     from parametre.models import Ville
 
     top_villes = Commande.objects.filter(
-        Q(etats__enum_etat__libelle="Livrée") |
-        Q(etats__enum_etat__libelle="Livrée partiellement")
+        Q(etats__enum_etat_id__in=ids_etats("Livrée", "Livrée partiellement"))
     ).values('ville').annotate(
         nombre_livraisons=Count('id', distinct=True)
     ).order_by('-nombre_livraisons')[:10]
@@ -100,7 +100,7 @@ def dashboard(request):
 def liste_commandes(request):
     """Liste des commandes affectées à cet opérateur logistique."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
@@ -108,8 +108,7 @@ def liste_commandes(request):
     # Récupérer les commandes avec les relations nécessaires
     # Essayer plusieurs états possibles pour les commandes logistiques
     commandes_list = Commande.objects.filter(
-        Q(etats__enum_etat__libelle='Mise en distribution'),
-        etats__date_fin__isnull=True
+        Q(etat_courant_id__in=ids_etats('Mise en distribution'))
     ).select_related(
         'client', 
         'ville', 
@@ -117,7 +116,7 @@ def liste_commandes(request):
     ).prefetch_related(
         'etats__enum_etat',
         'etats__operateur'
-    ).distinct().order_by('-etats__date_debut')
+    ).distinct().order_by('-date_etat_courant')
     
     # Gestion du filtre de temps
     start_date = request.GET.get('start_date')
@@ -135,7 +134,7 @@ def liste_commandes(request):
             
             # Filtrer par date de début des états "En livraison"
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date__range=[start_datetime.date(), end_datetime.date()]
             )
             print(f"🔍 Filtre de temps appliqué: {start_date} à {end_date}")
@@ -148,20 +147,20 @@ def liste_commandes(request):
         
         if preset == 'today':
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date=today
             )
         elif preset == 'yesterday':
             yesterday = today - timedelta(days=1)
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date=yesterday
             )
         elif preset == 'this_week':
             # Lundi de cette semaine
             monday = today - timedelta(days=today.weekday())
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date__gte=monday
             )
         elif preset == 'last_week':
@@ -169,14 +168,14 @@ def liste_commandes(request):
             last_monday = today - timedelta(days=today.weekday() + 7)
             last_sunday = last_monday + timedelta(days=6)
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date__range=[last_monday, last_sunday]
             )
         elif preset == 'this_month':
             # Premier jour du mois
             first_day = today.replace(day=1)
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date__gte=first_day
             )
         elif preset == 'last_month':
@@ -191,14 +190,14 @@ def liste_commandes(request):
             else:
                 last_day_last_month = (today.replace(month=today.month, day=1) - timedelta(days=1))
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date__range=[first_day_last_month, last_day_last_month]
             )
         elif preset == 'this_year':
             # Premier jour de l'année
             first_day_year = today.replace(month=1, day=1)
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date__gte=first_day_year
             )
         elif preset == 'last_year':
@@ -206,7 +205,7 @@ def liste_commandes(request):
             first_day_last_year = today.replace(year=today.year-1, month=1, day=1)
             last_day_last_year = today.replace(year=today.year-1, month=12, day=31)
             commandes_list = commandes_list.filter(
-                etats__enum_etat__libelle__in=['En cours de livraison', 'En livraison','Mise en distribution'],
+                etats__enum_etat_id__in=ids_etats('En cours de livraison', 'En livraison','Mise en distribution'),
                 etats__date_debut__date__range=[first_day_last_year, last_day_last_year]
             )
         
@@ -233,32 +232,23 @@ def liste_commandes(request):
     
     # Commandes d'aujourd'hui
     affectees_aujourd_hui = Commande.objects.filter(
-        Q(etats__enum_etat__libelle='En cours de livraison') |
-        Q(etats__enum_etat__libelle='En livraison')|
-        Q(etats__enum_etat__libelle='Mise en distribution'),
-        etats__date_fin__isnull=True,
-        etats__date_debut__date=today
-    ).distinct().count()
+        Q(etat_courant_id__in=ids_etats('En cours de livraison', 'En livraison', 'Mise en distribution')),
+        date_etat_courant__date=today
+    ).count()
     
     # Commandes de cette semaine
     monday = today - timedelta(days=today.weekday())
     affectees_semaine = Commande.objects.filter(
-        Q(etats__enum_etat__libelle='En cours de livraison') |
-        Q(etats__enum_etat__libelle='En livraison')|
-        Q(etats__enum_etat__libelle='Mise en distribution'),
-        etats__date_fin__isnull=True,
-        etats__date_debut__date__gte=monday
-    ).distinct().count()
+        Q(etat_courant_id__in=ids_etats('En cours de livraison', 'En livraison', 'Mise en distribution')),
+        date_etat_courant__date__gte=monday
+    ).count()
     
     # Commandes de ce mois
     first_day = today.replace(day=1)
     affectees_mois = Commande.objects.filter(
-        Q(etats__enum_etat__libelle='En cours de livraison') |
-        Q(etats__enum_etat__libelle='En livraison')|
-        Q(etats__enum_etat__libelle='Mise en distribution'),
-        etats__date_fin__isnull=True,
-        etats__date_debut__date__gte=first_day
-    ).distinct().count()
+        Q(etat_courant_id__in=ids_etats('En cours de livraison', 'En livraison', 'Mise en distribution')),
+        date_etat_courant__date__gte=first_day
+    ).count()
     
     # Calculer le total des montants
     total_montant = sum(cmd.total_cmd or 0 for cmd in commandes_list)
@@ -332,7 +322,7 @@ def detail_commande(request, commande_id):
 def profile_logistique(request):
     """Afficher le profil de l'opérateur logistique."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
@@ -348,7 +338,7 @@ def profile_logistique(request):
 def modifier_profile_logistique(request):
     """Modifier le profil de l'opérateur logistique."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
@@ -420,7 +410,7 @@ def marquer_livree(request, commande_id):
 def signaler_probleme(request, commande_id):
     """Afficher le formulaire pour signaler un problème avec une commande."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         messages.error(request, "Profil d'opérateur logistique non trouvé.")
         return redirect('login')
@@ -441,7 +431,7 @@ def signaler_probleme(request, commande_id):
 def changer_etat_sav(request, commande_id):
     """Changer l'état d'une commande pour le SAV (Reportée, Livrée, etc.)."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
     
@@ -470,8 +460,8 @@ def changer_etat_sav(request, commande_id):
                 commande.etat_actuel.terminer_etat(operateur)
             
             # Créer le nouvel état
-            etat_enum, _ = EnumEtatCmd.objects.get_or_create(
-                libelle=nouvel_etat,
+            etat_enum, _ = obtenir_ou_creer_etat(
+                nouvel_etat,
                 defaults={'ordre': 80, 'couleur': '#6B7280'}
             )
             
@@ -613,7 +603,7 @@ def api_articles(request):
 def ajouter_article(request, commande_id):
     """Ajouter un article à une commande."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
     
@@ -644,15 +634,20 @@ def ajouter_article(request, commande_id):
         
         # Vérifier le stock si la commande est confirmée
         if commande.etat_actuel and commande.etat_actuel.enum_etat.libelle == 'Confirmée':
-            if variante.qte_disponible < quantite:
+            from article import stock
+
+            # Décrémenter le stock de la variante (contrôlé sous verrou)
+            try:
+                stock.reserver(
+                    [(variante, quantite)], commande=commande, operateur=operateur,
+                    commentaire=f'Ajout article cmd {commande.id_yz}',
+                )
+            except stock.StockInsuffisant as e:
+                manque = e.manques[0]
                 return JsonResponse({
                     'success': False, 
-                    'error': f'Stock insuffisant. Disponible: {variante.qte_disponible}, Demandé: {quantite}'
+                    'error': f"Stock insuffisant. Disponible: {manque['disponible']}, Demandé: {manque['demande']}"
                 })
-            
-            # Décrémenter le stock de la variante
-            variante.qte_disponible -= quantite
-            variante.save()
         
         # Calculer le prix selon le compteur de la commande
         prix_unitaire = article.prix_unitaire
@@ -698,7 +693,7 @@ def ajouter_article(request, commande_id):
 def modifier_quantite_article(request, commande_id):
     """Modifier la quantité d'un article dans une commande."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
     
@@ -726,15 +721,20 @@ def modifier_quantite_article(request, commande_id):
                         'error': f'Variante {panier.variante} désactivée.'
                     })
                 
-                if difference > 0 and panier.variante.qte_disponible < difference:
+                from article import stock
+
+                # Ajuster le stock de la variante (contrôlé sous verrou)
+                try:
+                    stock.ajuster(
+                        panier.variante, difference, commande=commande, operateur=operateur,
+                        commentaire=f'Ajustement qté cmd {commande.id_yz}',
+                    )
+                except stock.StockInsuffisant as e:
+                    manque = e.manques[0]
                     return JsonResponse({
                         'success': False, 
-                        'error': f'Stock insuffisant. Disponible: {panier.variante.qte_disponible}, Demandé: {difference}'
+                        'error': f"Stock insuffisant. Disponible: {manque['disponible']}, Demandé: {manque['demande']}"
                     })
-                
-                # Ajuster le stock de la variante
-                panier.variante.qte_disponible -= difference
-                panier.variante.save()
             else:
                 # Cas sans variante (pour compatibilité avec les anciens paniers)
                 return JsonResponse({
@@ -771,7 +771,7 @@ def modifier_quantite_article(request, commande_id):
 def livraison_partielle(request, commande_id):
     """Gérer une livraison partielle avec sélection d'articles."""
     try:
-        operateur = Operateur.objects.get(user=request.user, type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
     
@@ -832,8 +832,8 @@ def livraison_partielle(request, commande_id):
             etat_actuel.terminer_etat(operateur)
             
             # 2. Créer l'état "Livrée Partiellement"
-            etat_livree_partiellement, _ = EnumEtatCmd.objects.get_or_create(
-                libelle='Livrée Partiellement',
+            etat_livree_partiellement, _ = obtenir_ou_creer_etat(
+                'Livrée Partiellement',
                 defaults={'ordre': 70, 'couleur': '#3B82F6'}
             )
             
@@ -1131,7 +1131,7 @@ def marque_retournee(request, commande_id):
     """Gérer une livraison partielle avec sélection d'articles."""
 
     try : 
-        operateur = Operateur.objects.get(user=request.user,type_operateur='LOGISTIQUE')
+        operateur = operateur_courant(request, 'LOGISTIQUE')
     except Operateur.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Profil d\'opérateur logistique non trouvé.'})
     
@@ -1157,8 +1157,8 @@ def marque_retournee(request, commande_id):
         etat_actuel.terminer_etat(operateur)
 
 
-        etat_retournee, _ = EnumEtatCmd.objects.get_or_create(
-            libelle='Retournée',
+        etat_retournee, _ = obtenir_ou_creer_etat(
+            'Retournée',
             defaults={'ordre': 32, 'couleur': '#f73b3b'}
         )
             
@@ -8,8 +8,10 @@ from datetime import datetime, timedelta
 import json
 
 from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.etats import ids_etats
 from parametre.models import Region, Ville, Operateur
 from article.models import Article
+from commande.recherche import ETATS_ROLE, rechercher_articles, rechercher_commandes, rechercher_regions, rechercher_villes, statut
 
 
 @staff_member_required
@@ -86,58 +88,21 @@ def search_commandes(query):
     """Recherche dans les commandes"""
     commandes = []
     
-    # Recherche par ID
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id}',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': f'/commande/detail/{cmd.id}/',
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par client
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:5]
-    
-    for cmd in commandes_client:
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id}',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': f'/commande/detail/{cmd.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query)
-    )[:5]
-    
-    for cmd in commandes_geo:
+    # Une requête classée : numéro / ID, puis client, puis géographie (commande/recherche.py)
+    for cmd in rechercher_commandes(query, limite=10):
+        if cmd.rang == 3:
+            subtitle = f'{cmd.ville.nom if cmd.ville else "N/A"} - {cmd.total_cmd} DH'
+        else:
+            subtitle = f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH'
         commandes.append({
             'id': cmd.id,
             'type': 'commande',
             'title': f'Commande #{cmd.id}',
-            'subtitle': f'{cmd.ville.nom if cmd.ville else "N/A"} - {cmd.total_cmd} DH',
+            'subtitle': subtitle,
             'status': get_commande_status(cmd),
             'url': f'/commande/detail/{cmd.id}/',
             'icon': 'fas fa-shopping-cart',
-            'priority': 3
+            'priority': cmd.rang
         })
     
     # Recherche par montant
@@ -148,7 +113,7 @@ def search_commandes(query):
             montant_match = re.search(r'(\d+)', query)
             if montant_match:
                 montant = float(montant_match.group(1))
-                commandes_montant = Commande.objects.filter(total_cmd__gte=montant)[:3]
+                commandes_montant = Commande.objects.filter(total_cmd__gte=montant).select_related('etat_courant')[:3]
                 for cmd in commandes_montant:
                     commandes.append({
                         'id': cmd.id,
@@ -220,23 +185,12 @@ def search_regions(query):
     """Recherche dans les régions"""
     regions = []
     
-    regions_match = Region.objects.filter(
-        Q(nom_region__icontains=query)
-    )[:5]
-    
-    for region in regions_match:
-        # Compter les commandes de cette région
-        nb_commandes = Commande.objects.filter(
-            ville__region=region,
-            etats__enum_etat__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"],
-            etats__date_fin__isnull=True
-        ).count()
-        
+    for region in rechercher_regions(query, ETATS_ROLE['ADMIN']):
         regions.append({
             'id': region.id,
             'type': 'region',
             'title': region.nom_region,
-            'subtitle': f'{nb_commandes} commandes actives',
+            'subtitle': f'{region.nb_commandes} commandes actives',
             'status': 'Active',
             'url': f'/parametre/repartition/details-region/?region={region.nom_region}',
             'icon': 'fas fa-map',
@@ -250,24 +204,12 @@ def search_villes(query):
     """Recherche dans les villes"""
     villes = []
     
-    villes_match = Ville.objects.filter(
-        Q(nom__icontains=query) |
-        Q(region__nom_region__icontains=query)
-    )[:5]
-    
-    for ville in villes_match:
-        # Compter les commandes de cette ville
-        nb_commandes = Commande.objects.filter(
-            ville=ville,
-            etats__enum_etat__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"],
-            etats__date_fin__isnull=True
-        ).count()
-        
+    for ville in rechercher_villes(query, ETATS_ROLE['ADMIN']):
         villes.append({
             'id': ville.id,
             'type': 'ville',
             'title': ville.nom,
-            'subtitle': f'{ville.region.nom_region} - {nb_commandes} commandes',
+            'subtitle': f'{ville.region.nom_region} - {ville.nb_commandes} commandes',
             'status': 'Active',
             'url': f'/parametre/repartition/details-region/?ville={ville.nom}',
             'icon': 'fas fa-map-marker-alt',
@@ -281,19 +223,13 @@ def search_articles(query):
     """Recherche dans les articles"""
     articles = []
     
-    articles_match = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query) |
-        Q(description__icontains=query)
-    )[:5]
-    
-    for article in articles_match:
+    for article in rechercher_articles(query, limite=5):
         articles.append({
             'id': article.id,
             'type': 'article',
             'title': article.nom,
-            'subtitle': f'Réf: {article.reference} - Stock: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
+            'subtitle': f'Réf: {article.reference} - Stock: {article.stock}',
+            'status': 'En stock' if article.stock > 0 else 'Rupture',
             'url': f'/article/detail/{article.id}/',
             'icon': 'fas fa-box',
             'priority': 1
@@ -335,10 +271,7 @@ def search_statistiques(query):
 
 def get_commande_status(commande):
     """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
+    return statut(commande)
 
 
 @staff_member_required
@@ -380,8 +313,7 @@ def search_suggestions_api(request):
     # Suggestions de régions actives
     active_regions = Region.objects.annotate(
         nb_commandes=Count('villes__commandes', filter=Q(
-            villes__commandes__etats__enum_etat__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"],
-            villes__commandes__etats__date_fin__isnull=True
+            villes__commandes__etat_courant_id__in=ids_etats(*ETATS_ROLE['ADMIN'])
         ))
     ).filter(nb_commandes__gt=0)[:3]
     
@@ -2,11 +2,12 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import HttpResponse, JsonResponse
-from django.db.models import Count, Q
+from django.db.models import Count, Q, Prefetch
 from django.core.paginator import Paginator
 from parametre.models import Operateur
+from parametre.exports import couleur_pointure, prefetch_variantes_actives, servir_export
 from article.models import Article
-from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.models import Commande, EtatCommande, EnumEtatCmd, Panier
 from client.models import Client
 import csv
 import io
@@ -16,6 +17,8 @@ from openpyxl.utils import get_column_letter
 from django.utils.encoding import smart_str
 from django.utils import timezone
 import json
+from kpis.cache import cache_dashboard
+from config.activite import sans_activite
 from datetime import datetime, timedelta
 
 @staff_member_required
@@ -28,41 +31,11 @@ def page_360(request):
     total_commandes = Commande.objects.count()
     total_operateurs = Operateur.objects.count()
     
-    # Récupérer toutes les commandes avec filtres et pagination - optimisé avec only()
-    commandes_360 = Commande.objects.select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'etats__enum_etat',
-        'etats__operateur', # Pour récupérer l'opérateur qui a fait l'état
-        'paniers__article' # Accéder aux articles via les paniers
-    ).only(
-        'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'compteur',
-        'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
-        'ville__nom', 'ville__region__nom_region'
-    )
-    
-    # Filtres de recherche
+    # Récupérer toutes les commandes avec filtres et pagination
     search = request.GET.get('search')
-    if search:
-        commandes_360 = commandes_360.filter(
-            Q(num_cmd__icontains=search) |
-            Q(id_yz__icontains=search) |
-            Q(client__nom__icontains=search) |
-            Q(client__prenom__icontains=search) |
-            Q(client__numero_tel__icontains=search)
-        )
-    
     date_debut = request.GET.get('date_debut')
-    if date_debut:
-        commandes_360 = commandes_360.filter(date_cmd__gte=date_debut)
-        
     date_fin = request.GET.get('date_fin')
-    if date_fin:
-        commandes_360 = commandes_360.filter(date_cmd__lte=date_fin)
-    
-    commandes_360 = commandes_360.order_by('-date_cmd')
+    commandes_360 = get_commandes_360_queryset(search, date_debut, date_fin)
     
     # Pagination - 50 commandes par page
     paginator = Paginator(commandes_360, 50)
@@ -85,8 +58,10 @@ def page_360(request):
     }
     return render(request, 'parametre/360.html', context)
 
+@sans_activite
 @staff_member_required
 @login_required
+@cache_dashboard('dashboard_360.realtime')
 def vue_360_realtime_data(request):
     """API pour les données en temps réel de la vue 360"""
     try:
@@ -97,33 +72,7 @@ def vue_360_realtime_data(request):
         page = request.GET.get('page', 1)
         
         # Construire la requête avec les mêmes filtres
-        commandes_360 = Commande.objects.select_related(
-            'client', 'ville', 'ville__region'
-        ).prefetch_related(
-            'etats__enum_etat', 'etats__operateur', 'paniers__article'
-        ).only(
-            'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'compteur',
-            'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
-            'ville__nom', 'ville__region__nom_region'
-        )
-        
-        # Appliquer les filtres
-        if search:
-            commandes_360 = commandes_360.filter(
-                Q(num_cmd__icontains=search) |
-                Q(id_yz__icontains=search) |
-                Q(client__nom__icontains=search) |
-                Q(client__prenom__icontains=search) |
-                Q(client__numero_tel__icontains=search)
-            )
-        
-        if date_debut:
-            commandes_360 = commandes_360.filter(date_cmd__gte=date_debut)
-            
-        if date_fin:
-            commandes_360 = commandes_360.filter(date_cmd__lte=date_fin)
-        
-        commandes_360 = commandes_360.order_by('-date_cmd')
+        commandes_360 = get_commandes_360_queryset(search, date_debut, date_fin)
         
         # Pagination
         paginator = Paginator(commandes_360, 50)
@@ -171,8 +120,10 @@ def vue_360_realtime_data(request):
             'timestamp': timezone.now().isoformat(),
         }, status=500)
 
+@sans_activite
 @staff_member_required
 @login_required
+@cache_dashboard('dashboard_360.statistics')
 def vue_360_statistics_update(request):
     """API pour mettre à jour uniquement les statistiques"""
     try:
@@ -199,6 +150,7 @@ def vue_360_statistics_update(request):
             'timestamp': timezone.now().isoformat(),
         }, status=500)
 
+@sans_activite
 @staff_member_required
 @login_required
 def vue_360_etats_tracking(request):
@@ -292,6 +244,7 @@ def vue_360_etats_tracking(request):
             'timestamp': timezone.now().isoformat(),
         }, status=500)
 
+@sans_activite
 @staff_member_required
 @login_required
 def vue_360_panier_tracking(request):
@@ -392,135 +345,258 @@ def vue_360_panier_tracking(request):
             'timestamp': timezone.now().isoformat(),
         }, status=500)
 
+def get_commandes_360_queryset(search=None, date_debut=None, date_fin=None):
+    """
+    Requête des commandes de la vue 360 avec filtres.
+
+    Les états, paniers et variantes actives des articles sont préchargés : construire les
+    données d'une page (ou d'un lot d'export) coûte un nombre fixe de requêtes, quel que
+    soit le nombre de commandes.
+    """
+    commandes = Commande.objects.select_related(
+        'client', 'ville', 'ville__region'
+    ).prefetch_related(
+        Prefetch(
+            'etats',
+            queryset=EtatCommande.objects.select_related('enum_etat', 'operateur').order_by('date_debut', 'id')
+        ),
+        Prefetch(
+            'paniers',
+            queryset=Panier.objects.select_related('article').order_by('id')
+        ),
+        prefetch_variantes_actives(),
+    ).only(
+        'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'compteur',
+        'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
+        'ville__nom', 'ville__region__nom_region'
+    )
+
+    if search:
+        commandes = commandes.filter(
+            Q(num_cmd__icontains=search) |
+            Q(id_yz__icontains=search) |
+            Q(client__nom__icontains=search) |
+            Q(client__prenom__icontains=search) |
+            Q(client__numero_tel__icontains=search)
+        )
+
+    if date_debut:
+        commandes = commandes.filter(date_cmd__gte=date_debut)
+
+    if date_fin:
+        commandes = commandes.filter(date_cmd__lte=date_fin)
+
+    return commandes.order_by('-date_cmd', '-id')
+
+
+def _premier_etat(etats_commande, libelle):
+    """Premier état (chronologique) dont le libellé contient `libelle` (équivalent de icontains)"""
+    libelle = libelle.lower()
+    for etat in etats_commande:
+        if libelle in etat.enum_etat.libelle.lower():
+            return etat
+    return None
+
+
+def construire_donnees_commande(cmd, maintenant=None):
+    """Données d'une commande pour la vue 360 et les exports, calculées à partir des relations préchargées"""
+    maintenant = maintenant or timezone.now().isoformat()
+
+    # Tous les états de la commande ordonnés par date (préchargés)
+    etats_commande = list(cmd.etats.all())
+
+    # État actuel (le plus récent)
+    etat_actuel = etats_commande[-1] if etats_commande else None
+
+    confirmation_info = _premier_etat(etats_commande, 'Confirmée')
+    preparation_info = _premier_etat(etats_commande, 'Préparation en cours')
+    etat_livraison_obj = _premier_etat(etats_commande, 'Livrée')
+    etat_paiement_obj = _premier_etat(etats_commande, 'Payée')
+    piece_retournee_obj = _premier_etat(etats_commande, 'Retournée')
+    operateur_assigne_obj = _premier_etat(etats_commande, 'Affectée')
+
+    # Préparer l'historique des états
+    historique_etats = []
+    for etat in etats_commande:
+        historique_etats.append({
+            'etat': etat.enum_etat.libelle,
+            'date': etat.date_debut.strftime('%d/%m/%Y %H:%M') if etat.date_debut else "N/A",
+            'operateur': etat.operateur.mail if etat.operateur else "N/A",
+            'commentaire': etat.commentaire or "",
+            'duree': calculate_duration(etat.date_debut, etat.date_fin) if etat.date_debut else "N/A"
+        })
+
+    # Calculer les métriques de processus
+    duree_totale = calculate_total_duration(etats_commande)
+    etapes_completes = len(etats_commande)
+    etape_actuelle = get_current_step(etat_actuel.enum_etat.libelle if etat_actuel else "Non définie")
+
+    # Déterminer le statut du processus
+    statut_processus = determine_process_status(etats_commande)
+
+    # Données du panier (préchargées)
+    paniers = list(cmd.paniers.all())
+    articles_panier = []
+    total_panier = 0
+    nombre_articles = 0
+
+    for panier in paniers:
+        couleur, pointure = couleur_pointure(panier.article)
+        articles_panier.append({
+            'nom': panier.article.nom,
+            'reference': panier.article.reference,
+            'couleur': couleur,
+            'pointure': pointure,
+            'quantite': panier.quantite,
+            'prix_unitaire': panier.article.prix_unitaire,
+            'sous_total': panier.sous_total
+        })
+        total_panier += panier.sous_total
+        nombre_articles += panier.quantite
+
+    # Pour le panier: Joindre les noms des articles du panier
+    articles_noms = ", ".join([panier.article.nom for panier in paniers]) or "N/A"
+
+    # Opérateur Assigné
+    operateur_assigne_nom = operateur_assigne_obj.operateur.mail if operateur_assigne_obj and operateur_assigne_obj.operateur else "N/A"
+
+    # Agent Confirmation
+    agent_confirmation_nom = confirmation_info.operateur.mail if confirmation_info and confirmation_info.operateur else "N/A"
+
+    # Valeurs par défaut
+    etat_paiement = etat_paiement_obj.enum_etat.libelle if etat_paiement_obj else "Non Payé"
+    etat_livraison = etat_livraison_obj.enum_etat.libelle if etat_livraison_obj else "En attente"
+    piece_retournee = "Oui" if piece_retournee_obj else "Non"
+    tarif_livraison = 0.0
+    reste_a_payer = cmd.total_cmd
+    date_paiement = "N/A"
+    observation_livraison = piece_retournee_obj.commentaire if piece_retournee_obj else ""
+
+    return {
+        'id': cmd.id,
+        'num_cmd': cmd.num_cmd,
+        'id_yz': cmd.id_yz,
+        'client_nom_prenom': f"{cmd.client.prenom} {cmd.client.nom}" if cmd.client else "N/A",
+        'client_telephone': cmd.client.numero_tel if cmd.client else "N/A",
+        'client_adresse': cmd.client.adresse if cmd.client else "N/A",
+        'ville': cmd.ville.nom if cmd.ville else "N/A",
+        'region': cmd.ville.region.nom_region if cmd.ville and cmd.ville.region else "N/A",
+        'panier': articles_noms,
+        'prix_total_dh': cmd.total_cmd,
+        'date_commande': cmd.date_cmd.strftime('%d/%m/%Y') if cmd.date_cmd else "N/A",
+        'confirmation_status': confirmation_info.enum_etat.libelle if confirmation_info else "Non Confirmée",
+        'date_confirmation': confirmation_info.date_debut.strftime('%d/%m/%Y %H:%M') if confirmation_info and confirmation_info.date_debut else "N/A",
+        'observations_confirmation': confirmation_info.commentaire if confirmation_info else "",
+        'operateur_assigne': operateur_assigne_nom,
+        'agent_confirmation': agent_confirmation_nom,
+        'client_fidele': "future qui seras des les tables models plustard dans le projet",
+        'upsell_display': "Oui" if (getattr(cmd, 'compteur', 0) or 0) > 0 else "Non",
+        'preparation_status': preparation_info.enum_etat.libelle if preparation_info else "Non Préparée",
+        'etat_livraison': etat_livraison,
+        'etat_paiement': etat_paiement,
+        'tarif_livraison': tarif_livraison,
+        'reste_a_payer': reste_a_payer,
+        'date_paiement': date_paiement,
+        'piece_retournee': piece_retournee,
+        'observation_livraison': observation_livraison,
+        'last_updated': maintenant,
+        # Nouvelles données pour le suivi des états
+        'etat_actuel': etat_actuel.enum_etat.libelle if etat_actuel else "Non définie",
+        'etape_actuelle': etape_actuelle,
+        'etapes_completes': etapes_completes,
+        'duree_totale': duree_totale,
+        'statut_processus': statut_processus,
+        'historique_etats': historique_etats,
+        'derniere_modification': etat_actuel.date_debut.strftime('%d/%m/%Y %H:%M') if etat_actuel and etat_actuel.date_debut else "N/A",
+        'operateur_derniere_modification': etat_actuel.operateur.mail if etat_actuel and etat_actuel.operateur else "N/A",
+        # Nouvelles données pour le suivi du panier
+        'articles_panier': articles_panier,
+        'total_panier': total_panier,
+        'nombre_articles': nombre_articles,
+        'derniere_modification_panier': maintenant
+    }
+
+
 def prepare_commandes_data(commandes_queryset):
     """Prépare les données des commandes pour l'affichage avec suivi des états et panier"""
-    data_for_template = []
-    for cmd in commandes_queryset:
-        # Récupérer tous les états de la commande ordonnés par date
-        etats_commande = cmd.etats.all().order_by('date_debut')
-        
-        # État actuel (le plus récent)
-        etat_actuel = etats_commande.last()
-        
-        # État de confirmation
-        confirmation_info = etats_commande.filter(enum_etat__libelle__icontains='Confirmée').first()
-        
-        # État de préparation
-        preparation_info = etats_commande.filter(enum_etat__libelle__icontains='Préparation en cours').first()
-        
-        # État de livraison
-        etat_livraison_obj = etats_commande.filter(enum_etat__libelle__icontains='Livrée').first()
-        
-        # État de paiement
-        etat_paiement_obj = etats_commande.filter(enum_etat__libelle__icontains='Payée').first()
-        
-        # État de retour
-        piece_retournee_obj = etats_commande.filter(enum_etat__libelle__icontains='Retournée').first()
-        
-        # État d'affectation
-        operateur_assigne_obj = etats_commande.filter(enum_etat__libelle__icontains='Affectée').first()
-
-        # Préparer l'historique des états
-        historique_etats = []
-        for etat in etats_commande:
-            historique_etats.append({
-                'etat': etat.enum_etat.libelle,
-                'date': etat.date_debut.strftime('%d/%m/%Y %H:%M') if etat.date_debut else "N/A",
-                'operateur': etat.operateur.mail if etat.operateur else "N/A",
-                'commentaire': etat.commentaire or "",
-                'duree': calculate_duration(etat.date_debut, etat.date_fin) if etat.date_debut else "N/A"
-            })
+    maintenant = timezone.now().isoformat()
+    return [construire_donnees_commande(cmd, maintenant) for cmd in commandes_queryset]
+
+
+# En-têtes des exports CSV/Excel : une ligne par article du panier
+EXPORT_360_HEADERS = [
+    'N°', 'Identifiant Yoozak', 'CLIENT', 'TELEPHONE', 'ADRESSE', 'VILLE', 'REGION',
+    'ARTICLE NOM', 'ARTICLE REFERENCE', 'ARTICLE COULEUR', 'ARTICLE POINTURE',
+    'QUANTITE', 'PRIX UNITAIRE', 'SOUS TOTAL ARTICLE',
+    'PRIX TOTAL COMMANDE (DH)', 'DATE COMMANDE', 'CONFIRMATION', 'DATE CONFIRMATION',
+    'OBSERVATIONS CONFIRMATION', 'OPERATEUR', 'AGENT CONFIRMATION',
+    'CLIENT FIDELE', 'UPSELL', 'PREPARATION', 'ETAT LIVRAISON',
+    'ETAT PAIEMENT', 'TARIF', 'RESTE A PAYER', 'DATE PAIEMENT', 'PIECE RETOURNEE',
+    'OBSERVATION LIVRAISON'
+]
+
+
+def lignes_export_commande(donnees):
+    """Lignes d'export (une par article, ou une seule sans article) à partir de construire_donnees_commande()"""
+    # Informations communes à la commande
+    commande_info = [
+        donnees['num_cmd'],
+        donnees['id_yz'],
+        donnees['client_nom_prenom'],
+        donnees['client_telephone'],
+        donnees['client_adresse'],
+        donnees['ville'],
+        donnees['region'],
+    ]
 
-        # Calculer les métriques de processus
-        duree_totale = calculate_total_duration(etats_commande)
-        etapes_completes = len(etats_commande)
-        etape_actuelle = get_current_step(etat_actuel.enum_etat.libelle if etat_actuel else "Non définie")
-        
-        # Déterminer le statut du processus
-        statut_processus = determine_process_status(etats_commande)
-        
-        # Récupérer les données du panier en temps réel
-        paniers = cmd.paniers.all().select_related('article')
-        articles_panier = []
-        total_panier = 0
-        nombre_articles = 0
-        
-        for panier in paniers:
-            articles_panier.append({
-                'nom': panier.article.nom,
-                'reference': panier.article.reference,
-                'couleur': panier.article.couleur,
-                'pointure': panier.article.pointure,
-                'quantite': panier.quantite,
-                'prix_unitaire': panier.article.prix_unitaire,
-                'sous_total': panier.sous_total
-            })
-            total_panier += panier.sous_total
-            nombre_articles += panier.quantite
-        
-        # Pour le panier: Joindre les noms des articles du panier
-        articles_noms = ", ".join([panier.article.nom for panier in paniers]) or "N/A"
+    # Données communes de fin
+    commande_fin_info = [
+        donnees['prix_total_dh'],
+        donnees['date_commande'],
+        donnees['confirmation_status'],
+        donnees['date_confirmation'],
+        donnees['observations_confirmation'],
+        donnees['operateur_assigne'],
+        donnees['agent_confirmation'],
+        donnees['client_fidele'],
+        donnees['upsell_display'],
+        donnees['preparation_status'],
+        donnees['etat_livraison'],
+        donnees['etat_paiement'],
+        donnees['tarif_livraison'],
+        donnees['reste_a_payer'],
+        donnees['date_paiement'],
+        donnees['piece_retournee'],
+        donnees['observation_livraison'],
+    ]
 
-        # Opérateur Assigné
-        operateur_assigne_nom = operateur_assigne_obj.operateur.mail if operateur_assigne_obj and operateur_assigne_obj.operateur else "N/A"
-        
-        # Agent Confirmation
-        agent_confirmation_nom = confirmation_info.operateur.mail if confirmation_info and confirmation_info.operateur else "N/A"
-
-        # Valeurs par défaut
-        etat_paiement = etat_paiement_obj.enum_etat.libelle if etat_paiement_obj else "Non Payé"
-        etat_livraison = etat_livraison_obj.enum_etat.libelle if etat_livraison_obj else "En attente"
-        piece_retournee = "Oui" if piece_retournee_obj else "Non"
-        tarif_livraison = 0.0
-        reste_a_payer = cmd.total_cmd
-        date_paiement = "N/A"
-        observation_livraison = piece_retournee_obj.commentaire if piece_retournee_obj else ""
-
-        data_for_template.append({
-            'id': cmd.id,
-            'num_cmd': cmd.num_cmd,
-            'id_yz': cmd.id_yz,
-            'client_nom_prenom': f"{cmd.client.prenom} {cmd.client.nom}" if cmd.client else "N/A",
-            'client_telephone': cmd.client.numero_tel if cmd.client else "N/A",
-            'client_adresse': cmd.client.adresse if cmd.client else "N/A",
-            'ville': cmd.ville.nom if cmd.ville else "N/A",
-            'region': cmd.ville.region.nom_region if cmd.ville and cmd.ville.region else "N/A",
-            'panier': articles_noms,
-            'prix_total_dh': cmd.total_cmd,
-            'date_commande': cmd.date_cmd.strftime('%d/%m/%Y') if cmd.date_cmd else "N/A",
-            'confirmation_status': confirmation_info.enum_etat.libelle if confirmation_info else "Non Confirmée",
-            'date_confirmation': confirmation_info.date_debut.strftime('%d/%m/%Y %H:%M') if confirmation_info and confirmation_info.date_debut else "N/A",
-            'observations_confirmation': confirmation_info.commentaire if confirmation_info else "",
-            'operateur_assigne': operateur_assigne_nom,
-            'agent_confirmation': agent_confirmation_nom,
-            'client_fidele': "future qui seras des les tables models plustard dans le projet",
-            'upsell_display': "Oui" if (getattr(cmd, 'compteur', 0) or 0) > 0 else "Non",
-            'preparation_status': preparation_info.enum_etat.libelle if preparation_info else "Non Préparée",
-            'etat_livraison': etat_livraison,
-            'etat_paiement': etat_paiement,
-            'tarif_livraison': tarif_livraison,
-            'reste_a_payer': reste_a_payer,
-            'date_paiement': date_paiement,
-            'piece_retournee': piece_retournee,
-            'observation_livraison': observation_livraison,
-            'last_updated': timezone.now().isoformat(),
-            # Nouvelles données pour le suivi des états
-            'etat_actuel': etat_actuel.enum_etat.libelle if etat_actuel else "Non définie",
-            'etape_actuelle': etape_actuelle,
-            'etapes_completes': etapes_completes,
-            'duree_totale': duree_totale,
-            'statut_processus': statut_processus,
-            'historique_etats': historique_etats,
-            'derniere_modification': etat_actuel.date_debut.strftime('%d/%m/%Y %H:%M') if etat_actuel and etat_actuel.date_debut else "N/A",
-            'operateur_derniere_modification': etat_actuel.operateur.mail if etat_actuel and etat_actuel.operateur else "N/A",
-            # Nouvelles données pour le suivi du panier
-            'articles_panier': articles_panier,
-            'total_panier': total_panier,
-            'nombre_articles': nombre_articles,
-            'derniere_modification_panier': timezone.now().isoformat()
-        })
-    
-    return data_for_template
+    if not donnees['articles_panier']:
+        # Si pas d'articles, créer une ligne avec des valeurs N/A
+        return [commande_info + ["N/A", "N/A", "N/A", "N/A", 0, 0, 0] + commande_fin_info]
+
+    return [
+        commande_info + [
+            article['nom'] or "N/A",
+            article['reference'] or "N/A",
+            article['couleur'] or "N/A",
+            article['pointure'] or "N/A",
+            article['quantite'],
+            article['prix_unitaire'],
+            article['sous_total'],
+        ] + commande_fin_info
+        for article in donnees['articles_panier']
+    ]
+
+
+def iterer_lignes_export_360(search=None, date_debut=None, date_fin=None, batch_size=1000):
+    """
+    Parcourt les commandes filtrées avec un curseur serveur (préchargements faits par
+    paquets de `batch_size`) et produit les lignes d'export au fil de l'eau
+    """
+    commandes_query = get_commandes_360_queryset(search, date_debut, date_fin)
+    maintenant = timezone.now().isoformat()
+    for cmd in commandes_query.iterator(chunk_size=batch_size):
+        yield from lignes_export_commande(construire_donnees_commande(cmd, maintenant))
 
 def calculate_duration(start_date, end_date):
     """Calcule la durée entre deux dates"""
@@ -543,8 +619,8 @@ def calculate_total_duration(etats_commande):
     if not etats_commande:
         return "N/A"
     
-    premier_etat = etats_commande.first()
-    dernier_etat = etats_commande.last()
+    premier_etat = etats_commande[0]
+    dernier_etat = etats_commande[-1]
     
     if premier_etat and dernier_etat and premier_etat.date_debut and dernier_etat.date_debut:
         duration = dernier_etat.date_debut - premier_etat.date_debut
@@ -585,7 +661,7 @@ def determine_process_status(etats_commande):
     if not etats_commande:
         return "Non démarré"
     
-    dernier_etat = etats_commande.last()
+    dernier_etat = etats_commande[-1]
     if not dernier_etat:
         return "Non démarré"
     
@@ -610,330 +686,25 @@ def determine_process_status(etats_commande):
     else:
         return "En cours"
 
+def _parametres_export_360(request):
+    """Filtres de la vue 360 transmis à l'export (POST prioritaire sur GET)"""
+    return {
+        cle: request.POST.get(cle) or request.GET.get(cle)
+        for cle in ('search', 'date_debut', 'date_fin')
+    }
+
 @staff_member_required
 @login_required
 def export_all_data_csv(request):
     # Assurez-vous que la méthode de requête est POST
     if request.method == 'POST':
-        # Récupérer les filtres pour appliquer les mêmes que dans la vue
-        search = request.POST.get('search') or request.GET.get('search')
-        date_debut = request.POST.get('date_debut') or request.GET.get('date_debut')
-        date_fin = request.POST.get('date_fin') or request.GET.get('date_fin')
-        
-        # Utiliser une réponse streaming pour de gros volumes
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="export_commandes_avec_paniers_360.csv"'
-        
-        # Utiliser un writer CSV directement sur la réponse
-        writer = csv.writer(response)
-
-        # En-têtes du CSV consolidé avec détails des paniers
-        headers = [
-            'N°', 'Identifiant Yoozak', 'CLIENT', 'TELEPHONE', 'ADRESSE', 'VILLE', 'REGION',
-            'ARTICLE NOM', 'ARTICLE REFERENCE', 'ARTICLE COULEUR', 'ARTICLE POINTURE', 
-            'QUANTITE', 'PRIX UNITAIRE', 'SOUS TOTAL ARTICLE',
-            'PRIX TOTAL COMMANDE (DH)', 'DATE COMMANDE', 'CONFIRMATION', 'DATE CONFIRMATION',
-            'OBSERVATIONS CONFIRMATION', 'OPERATEUR', 'AGENT CONFIRMATION',
-            'CLIENT FIDELE', 'UPSELL', 'PREPARATION', 'ETAT LIVRAISON',
-            'ETAT PAIEMENT', 'TARIF', 'RESTE A PAYER', 'DATE PAIEMENT', 'PIECE RETOURNEE',
-            'OBSERVATION LIVRAISON'
-        ]
-        writer.writerow(headers)
-            
-        # Traitement par batch de 1000 commandes pour éviter de surcharger la mémoire
-        batch_size = 1000
-        offset = 0
-        
-        while True:
-            # Construire la requête avec les mêmes filtres que la vue
-            commandes_query = Commande.objects.select_related(
-                'client', 
-                'ville', 
-                'ville__region'
-            ).prefetch_related(
-                'etats__enum_etat',
-                'etats__operateur',
-                'paniers__article'
-            ).only(
-                'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'compteur',
-                'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
-                'ville__nom', 'ville__region__nom_region'
-            )
-            
-            # Appliquer les filtres
-            if search:
-                commandes_query = commandes_query.filter(
-                    Q(num_cmd__icontains=search) |
-                    Q(id_yz__icontains=search) |
-                    Q(client__nom__icontains=search) |
-                    Q(client__prenom__icontains=search) |
-                    Q(client__numero_tel__icontains=search)
-                )
-            
-            if date_debut:
-                commandes_query = commandes_query.filter(date_cmd__gte=date_debut)
-            
-            if date_fin:
-                commandes_query = commandes_query.filter(date_cmd__lte=date_fin)
-            
-            commandes_batch = commandes_query.order_by('-date_cmd')[offset:offset + batch_size]
-            
-            if not commandes_batch:
-                break
-                
-            for cmd in commandes_batch:
-                confirmation_info = cmd.etats.filter(enum_etat__libelle__icontains='Confirmée').first()
-                preparation_info = cmd.etats.filter(enum_etat__libelle__icontains='Préparation en cours').first()
-                
-                etat_livraison_obj = cmd.etats.filter(enum_etat__libelle__icontains='Livrée').first()
-                etat_paiement_obj = cmd.etats.filter(enum_etat__libelle__icontains='Payée').first()
-                piece_retournee_obj = cmd.etats.filter(enum_etat__libelle__icontains='Retournée').first()
-
-                etat_paiement = etat_paiement_obj.enum_etat.libelle if etat_paiement_obj else "Non Payé"
-                etat_livraison = etat_livraison_obj.enum_etat.libelle if etat_livraison_obj else "En attente"
-                piece_retournee = "Oui" if piece_retournee_obj else "Non"
-
-                operateur_assigne_obj = cmd.etats.filter(enum_etat__libelle__icontains='Affectée').first()
-                operateur_assigne_nom = operateur_assigne_obj.operateur.mail if operateur_assigne_obj and operateur_assigne_obj.operateur else "N/A"
-                
-                agent_confirmation_nom = confirmation_info.operateur.mail if confirmation_info and confirmation_info.operateur else "N/A"
-
-                tarif_livraison = 0.0
-                reste_a_payer = cmd.total_cmd
-                date_paiement = "N/A"
-                observation_livraison = piece_retournee_obj.commentaire if piece_retournee_obj else ""
-
-                # Informations communes à la commande
-                commande_info = [
-                    cmd.num_cmd,
-                    cmd.id_yz,
-                    f"{cmd.client.prenom} {cmd.client.nom}" if cmd.client else "N/A",
-                    cmd.client.numero_tel if cmd.client else "N/A",
-                    cmd.client.adresse if cmd.client else "N/A",
-                    cmd.ville.nom if cmd.ville else "N/A",
-                    cmd.ville.region.nom_region if cmd.ville and cmd.ville.region else "N/A",
-                ]
-                
-                # Données communes de fin
-                commande_fin_info = [
-                    cmd.total_cmd,
-                    cmd.date_cmd.strftime('%d/%m/%Y') if cmd.date_cmd else "N/A",
-                    confirmation_info.enum_etat.libelle if confirmation_info else "Non Confirmée",
-                    confirmation_info.date_debut.strftime('%d/%m/%Y %H:%M') if confirmation_info and confirmation_info.date_debut else "N/A",
-                    confirmation_info.commentaire if confirmation_info else "",
-                    operateur_assigne_nom,
-                    agent_confirmation_nom,
-                    "future qui seras des les tables models plustard dans le projet", # Client Fidèle
-                    "Oui" if (getattr(cmd, 'compteur', 0) or 0) > 0 else "Non", # UPSELL
-                    preparation_info.enum_etat.libelle if preparation_info else "Non Préparée",
-                    etat_livraison,
-                    etat_paiement,
-                    tarif_livraison,
-                    reste_a_payer,
-                    date_paiement,
-                    piece_retournee,
-                    observation_livraison,
-                ]
-                
-                # Si la commande a des articles, créer une ligne par article
-                paniers = cmd.paniers.all()
-                if paniers:
-                    for panier in paniers:
-                        # Détails de l'article
-                        article_info = [
-                            panier.article.nom or "N/A",
-                            panier.article.reference or "N/A",
-                            panier.article.couleur or "N/A",
-                            panier.article.pointure or "N/A",
-                            panier.quantite,
-                            panier.article.prix_unitaire,
-                            panier.sous_total,
-                        ]
-                        
-                        # Combiner toutes les informations
-                        row_data = commande_info + article_info + commande_fin_info
-                        writer.writerow(row_data)
-                else:
-                    # Si pas d'articles, créer une ligne avec des valeurs N/A
-                    article_info = ["N/A", "N/A", "N/A", "N/A", 0, 0, 0]
-                    row_data = commande_info + article_info + commande_fin_info
-                    writer.writerow(row_data)
-
-            offset += batch_size
-
-        return response
+        # Réponse streaming : les lignes sont produites au fil du parcours des commandes
+        # (?async=1 : export en arrière-plan, fichier téléchargeable une fois terminé)
+        return servir_export(request, 'commandes_360', _parametres_export_360(request), 'csv')
     return redirect('app_admin:page_360')
 
 @staff_member_required
 @login_required
 def export_all_data_excel(request):
-    # Récupérer les filtres
-    search = request.GET.get('search')
-    date_debut = request.GET.get('date_debut')
-    date_fin = request.GET.get('date_fin')
-    
-    # Créer un fichier Excel temporaire avec streaming
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="export_commandes_avec_paniers_360.xlsx"'
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Commandes avec Paniers"
-
-    # En-têtes Excel avec style - Inclure les détails des paniers
-    headers = [
-        "N°", "Identifiant Yoozak", "CLIENT", "TELEPHONE", "ADRESSE", "VILLE", "REGION",
-        "ARTICLE NOM", "ARTICLE REFERENCE", "ARTICLE COULEUR", "ARTICLE POINTURE", 
-        "QUANTITE", "PRIX UNITAIRE", "SOUS TOTAL ARTICLE",
-        "PRIX TOTAL COMMANDE (DH)", "DATE COMMANDE", "CONFIRMATION", "DATE CONFIRMATION",
-        "OBSERVATIONS CONFIRMATION", "OPERATEUR", "AGENT CONFIRMATION",
-        "CLIENT FIDELE", "UPSELL", "PREPARATION", "ETAT LIVRAISON",
-        "ETAT PAIEMENT", "TARIF", "RESTE A PAYER", "DATE PAIEMENT", "PIECE RETOURNEE",
-        "OBSERVATION LIVRAISON"
-    ]
-    ws.append(headers)
-
-    # Style des en-têtes
-    from openpyxl.styles import Font, PatternFill
-    header_font = Font(bold=True, color='FFFFFF')
-    header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-    
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.fill = header_fill
-
-    # Traitement par batch pour Excel aussi
-    batch_size = 500  # Plus petit pour Excel car plus lourd
-    offset = 0
-    
-    while True:
-        # Construire la requête avec les mêmes filtres que la vue
-        commandes_query = Commande.objects.select_related(
-            'client', 
-            'ville', 
-            'ville__region'
-        ).prefetch_related(
-            'etats__enum_etat', 
-            'etats__operateur', 
-            'paniers__article'
-        ).only(
-            'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'compteur',
-            'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
-            'ville__nom', 'ville__region__nom_region'
-        )
-        
-        # Appliquer les filtres
-        if search:
-            commandes_query = commandes_query.filter(
-                Q(num_cmd__icontains=search) |
-                Q(id_yz__icontains=search) |
-                Q(client__nom__icontains=search) |
-                Q(client__prenom__icontains=search) |
-                Q(client__numero_tel__icontains=search)
-            )
-        
-        if date_debut:
-            commandes_query = commandes_query.filter(date_cmd__gte=date_debut)
-            
-        if date_fin:
-            commandes_query = commandes_query.filter(date_cmd__lte=date_fin)
-        
-        commandes_batch = commandes_query.order_by('-date_cmd')[offset:offset + batch_size]
-        
-        if not commandes_batch:
-            break
-            
-        for cmd in commandes_batch:
-            confirmation_info = cmd.etats.filter(enum_etat__libelle__icontains='Confirmée').first()
-            preparation_info = cmd.etats.filter(enum_etat__libelle__icontains='Préparation en cours').first()
-            
-            # Récupérer les informations de livraison et paiement depuis les EtatsCommande
-            etat_livraison_obj = cmd.etats.filter(enum_etat__libelle__icontains='Livrée').first()
-            etat_paiement_obj = cmd.etats.filter(enum_etat__libelle__icontains='Payée').first()
-            piece_retournee_obj = cmd.etats.filter(enum_etat__libelle__icontains='Retournée').first()
-
-            etat_paiement = etat_paiement_obj.enum_etat.libelle if etat_paiement_obj else "Non Payé"
-            etat_livraison = etat_livraison_obj.enum_etat.libelle if etat_livraison_obj else "En attente"
-            piece_retournee = "Oui" if piece_retournee_obj else "Non"
-
-            # Opérateur Assigné: Chercher l'opérateur lié à l'état 'Affectée' ou un autre état pertinent
-            operateur_assigne_obj = cmd.etats.filter(enum_etat__libelle__icontains='Affectée').first()
-            operateur_assigne_nom = operateur_assigne_obj.operateur.mail if operateur_assigne_obj and operateur_assigne_obj.operateur else "N/A"
-            
-            # Agent Confirmation: Opérateur lié à l'état 'Confirmée'
-            agent_confirmation_nom = confirmation_info.operateur.mail if confirmation_info and confirmation_info.operateur else "N/A"
-
-            tarif_livraison = 0.0
-            reste_a_payer = cmd.total_cmd
-            date_paiement = "N/A"
-            observation_livraison = piece_retournee_obj.commentaire if piece_retournee_obj else ""
-
-            # Informations communes à la commande
-            commande_info = [
-                cmd.num_cmd,
-                cmd.id_yz,
-                f"{cmd.client.prenom} {cmd.client.nom}" if cmd.client else "N/A",
-                cmd.client.numero_tel if cmd.client else "N/A",
-                cmd.client.adresse if cmd.client else "N/A",
-                cmd.ville.nom if cmd.ville else "N/A",
-                cmd.ville.region.nom_region if cmd.ville and cmd.ville.region else "N/A",
-            ]
-            
-            # Données communes de fin
-            commande_fin_info = [
-                cmd.total_cmd,
-                cmd.date_cmd.strftime('%d/%m/%Y') if cmd.date_cmd else "N/A",
-                confirmation_info.enum_etat.libelle if confirmation_info else "Non Confirmée",
-                confirmation_info.date_debut.strftime('%d/%m/%Y %H:%M') if confirmation_info and confirmation_info.date_debut else "N/A",
-                confirmation_info.commentaire if confirmation_info else "",
-                operateur_assigne_nom,
-                agent_confirmation_nom,
-                "future qui seras des les tables models plustard dans le projet", # Client Fidèle
-                "Oui" if (getattr(cmd, 'compteur', 0) or 0) > 0 else "Non", # UPSELL
-                preparation_info.enum_etat.libelle if preparation_info else "Non Préparée",
-                etat_livraison,
-                etat_paiement,
-                tarif_livraison,
-                reste_a_payer,
-                date_paiement,
-                piece_retournee,
-                observation_livraison,
-            ]
-            
-            # Si la commande a des articles, créer une ligne par article
-            paniers = cmd.paniers.all()
-            if paniers:
-                for panier in paniers:
-                    # Détails de l'article
-                    article_info = [
-                        panier.article.nom or "N/A",
-                        panier.article.reference or "N/A",
-                        panier.article.couleur or "N/A",
-                        panier.article.pointure or "N/A",
-                        panier.quantite,
-                        panier.article.prix_unitaire,
-                        panier.sous_total,
-                    ]
-                    
-                    # Combiner toutes les informations
-                    row_data = commande_info + article_info + commande_fin_info
-                    ws.append(row_data)
-            else:
-                # Si pas d'articles, créer une ligne avec des valeurs N/A
-                article_info = ["N/A", "N/A", "N/A", "N/A", 0, 0, 0]
-                row_data = commande_info + article_info + commande_fin_info
-                ws.append(row_data)
-            
-        offset += batch_size
-
-    # Ajuster la largeur des colonnes
-    for i, col in enumerate(headers, 1):
-        if i <= 7:  # Colonnes de base commande
-            ws.column_dimensions[get_column_letter(i)].width = 20
-        elif i <= 14:  # Colonnes articles
-            ws.column_dimensions[get_column_letter(i)].width = 15
-        else:  # Autres colonnes
-            ws.column_dimensions[get_column_letter(i)].width = 18
-
-    wb.save(response)
-    return response 
\ No newline at end of file
+    # Classeur en mode write_only écrit dans un fichier temporaire (ou en arrière-plan avec ?async=1)
+    return servir_export(request, 'commandes_360', _parametres_export_360(request), 'xlsx')
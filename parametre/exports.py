@@ -0,0 +1,413 @@
+"""
+Moteur d'export CSV/XLSX à mémoire bornée.
+
+- CSV : StreamingHttpResponse alimentée par un générateur de lignes ; les querysets
+  sont parcourus avec iterator(chunk_size=...) (préchargements faits lot par lot).
+- XLSX : classeur openpyxl en mode write_only écrit dans un fichier temporaire, puis
+  renvoyé en FileResponse (le classeur n'est jamais entièrement en mémoire).
+- Arrière-plan : les exports enregistrés dans EXPORTS peuvent être exécutés hors
+  requête (ExportJob) ; le fichier produit est ensuite téléchargeable.
+
+Un export est une fabrique `fabrique(parametres, format)` enregistrée avec
+@enregistrer_export, qui renvoie une DefinitionExport (en-têtes + générateur de lignes).
+"""
+import csv
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Prefetch
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Nombre de commandes chargées (avec leurs préchargements) par aller-retour en base
+CHUNK_SIZE = 500
+
+# Fréquence de mise à jour de la progression d'un ExportJob
+INTERVALLE_PROGRESSION = 1000
+
+
+@dataclass
+class DefinitionExport:
+    nom_fichier: str  # sans extension
+    titre: str  # titre de la feuille Excel
+    entetes: List[str]
+    lignes: Iterable[list]
+    largeurs: Optional[List[int]] = None
+    delimiter: str = ';'
+    bom: bool = True
+
+
+EXPORTS = {}
+
+
+def enregistrer_export(nom):
+    """Enregistre une fabrique d'export utilisable en direct et en arrière-plan"""
+    def decorator(fabrique):
+        EXPORTS[nom] = fabrique
+        return fabrique
+    return decorator
+
+
+def get_definition(nom, parametres, format):
+    return EXPORTS[nom](parametres or {}, format)
+
+
+# --- Écriture -----------------------------------------------------------------
+
+class _Echo:
+    """Pseudo-fichier pour csv.writer : renvoie la ligne au lieu de la stocker"""
+    def write(self, value):
+        return value
+
+
+def iterer_csv(definition):
+    writer = csv.writer(_Echo(), delimiter=definition.delimiter)
+    if definition.bom:
+        yield '﻿'
+    yield writer.writerow(definition.entetes)
+    for ligne in definition.lignes:
+        yield writer.writerow(ligne)
+
+
+def ecrire_xlsx(definition, fichier):
+    """Écrit la définition dans `fichier` (chemin ou objet fichier) en mode write_only"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=definition.titre[:31])
+
+    # Les largeurs doivent être fixées avant la première ligne en mode write_only
+    largeurs = definition.largeurs or [20] * len(definition.entetes)
+    for i, largeur in enumerate(largeurs, 1):
+        ws.column_dimensions[get_column_letter(i)].width = largeur
+
+    header_font = Font(bold=True, color='FFFFFF')
+    header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+    header_alignment = Alignment(horizontal='center', vertical='center')
+    entetes = []
+    for entete in definition.entetes:
+        cell = WriteOnlyCell(ws, value=entete)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+        entetes.append(cell)
+    ws.append(entetes)
+
+    for ligne in definition.lignes:
+        ws.append(ligne)
+
+    wb.save(fichier)
+
+
+def reponse_csv(definition):
+    response = StreamingHttpResponse(iterer_csv(definition), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{definition.nom_fichier}.csv"'
+    return response
+
+
+def reponse_xlsx(definition):
+    # Fichier temporaire anonyme : supprimé dès que FileResponse le ferme
+    fichier = tempfile.TemporaryFile(suffix='.xlsx')
+    ecrire_xlsx(definition, fichier)
+    fichier.seek(0)
+    return FileResponse(
+        fichier,
+        as_attachment=True,
+        filename=f"{definition.nom_fichier}.xlsx",
+        content_type=CONTENT_TYPE_XLSX,
+    )
+
+
+def reponse_export(definition, format):
+    return reponse_xlsx(definition) if format == 'xlsx' else reponse_csv(definition)
+
+
+# --- Exports en arrière-plan -------------------------------------------------------
+
+def demande_arriere_plan(request):
+    """L'appelant demande un export en arrière-plan (?async=1)"""
+    valeur = request.POST.get('async') or request.GET.get('async')
+    return valeur in ('1', 'true', 'oui')
+
+
+def servir_export(request, nom, parametres, format):
+    """Point d'entrée des vues : export direct en streaming, ou ExportJob si ?async=1"""
+    if demande_arriere_plan(request):
+        job = lancer_export(nom, format, parametres, request.user)
+        return reponse_job(job, status=202)
+    return reponse_export(get_definition(nom, parametres, format), format)
+
+
+def lancer_export(nom, format, parametres, utilisateur=None):
+    from parametre.models import ExportJob
+
+    if nom not in EXPORTS:
+        raise ValueError(f"Export inconnu : {nom}")
+
+    job = ExportJob.objects.create(
+        type_export=nom,
+        format=format,
+        parametres=parametres or {},
+        cree_par=utilisateur if utilisateur and utilisateur.is_authenticated else None,
+    )
+
+    # En mode 'commande', les jobs sont pris en charge par `python manage.py executer_exports`
+    if getattr(settings, 'EXPORTS_MODE_EXECUTION', 'thread') == 'thread':
+        transaction.on_commit(lambda: threading.Thread(
+            target=_executer_export_thread, args=(job.pk,), daemon=True
+        ).start())
+    return job
+
+
+def _executer_export_thread(job_id):
+    from parametre.models import ExportJob
+
+    close_old_connections()
+    try:
+        executer_export(ExportJob.objects.get(pk=job_id))
+    finally:
+        connection.close()
+
+
+def _suivre_progression(job, lignes):
+    from parametre.models import ExportJob
+
+    nb_lignes = 0
+    for ligne in lignes:
+        yield ligne
+        nb_lignes += 1
+        if nb_lignes % INTERVALLE_PROGRESSION == 0:
+            ExportJob.objects.filter(pk=job.pk).update(nb_lignes=nb_lignes)
+    job.nb_lignes = nb_lignes
+
+
+def executer_export(job):
+    """Produit le fichier d'un ExportJob. Ne lève pas : l'erreur est enregistrée sur le job"""
+    from parametre.models import ExportJob
+
+    # Prise en charge atomique (un seul exécutant par job)
+    if not ExportJob.objects.filter(pk=job.pk, statut='en_attente').update(
+        statut='en_cours', date_debut=timezone.now()
+    ):
+        return job
+
+    chemin_tmp = None
+    try:
+        definition = get_definition(job.type_export, job.parametres, job.format)
+        definition.lignes = _suivre_progression(job, definition.lignes)
+
+        fd, chemin_tmp = tempfile.mkstemp(suffix=f'.{job.format}')
+        if job.format == 'xlsx':
+            os.close(fd)
+            ecrire_xlsx(definition, chemin_tmp)
+        else:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as sortie:
+                for morceau in iterer_csv(definition):
+                    sortie.write(morceau)
+
+        with open(chemin_tmp, 'rb') as contenu:
+            job.fichier.save(f"{definition.nom_fichier}_{job.pk}.{job.format}", File(contenu), save=False)
+        job.statut = 'termine'
+        job.date_fin = timezone.now()
+        job.save(update_fields=['fichier', 'statut', 'nb_lignes', 'date_fin'])
+        logger.info(f"Export {job.type_export} #{job.pk} terminé ({job.nb_lignes} lignes)")
+    except Exception as e:
+        logger.error(f"Erreur lors de l'export {job.type_export} #{job.pk}: {e}", exc_info=True)
+        job.statut = 'erreur'
+        job.erreur = str(e)
+        job.date_fin = timezone.now()
+        job.save(update_fields=['statut', 'erreur', 'date_fin'])
+    finally:
+        if chemin_tmp and os.path.exists(chemin_tmp):
+            os.remove(chemin_tmp)
+    return job
+
+
+def serialiser_job(job):
+    return {
+        'job_id': job.pk,
+        'type_export': job.type_export,
+        'format': job.format,
+        'statut': job.statut,
+        'statut_libelle': job.get_statut_display(),
+        'nb_lignes': job.nb_lignes,
+        'erreur': job.erreur,
+        'date_creation': job.date_creation.isoformat(),
+        'date_fin': job.date_fin.isoformat() if job.date_fin else None,
+        'statut_url': reverse('app_admin:export_job_statut', args=[job.pk]),
+        'telechargement_url': reverse('app_admin:export_job_telecharger', args=[job.pk]) if job.statut == 'termine' else None,
+    }
+
+
+def reponse_job(job, status=200):
+    return JsonResponse(dict(success=True, **serialiser_job(job)), status=status)
+
+
+# --- Préchargements communs --------------------------------------------------------
+
+def prefetch_variantes_actives(chemin='paniers__article__variantes'):
+    """Précharge les variantes actives des articles dans `variantes_actives` (cf. couleur_pointure)"""
+    from article.models import VarianteArticle
+
+    return Prefetch(
+        chemin,
+        queryset=VarianteArticle.objects.filter(actif=True).select_related('couleur', 'pointure'),
+        to_attr='variantes_actives'
+    )
+
+
+def couleur_pointure(article):
+    """Couleur et pointure de la première variante active (cf. Article.couleur / Article.pointure), sans requête"""
+    variantes = getattr(article, 'variantes_actives', None)
+    if variantes is None:
+        return article.couleur, article.pointure
+    variante = variantes[0] if variantes else None
+    couleur = variante.couleur.nom if variante and variante.couleur else ''
+    pointure = variante.pointure.pointure if variante and variante.pointure else ''
+    return couleur, pointure
+
+
+# --- Exports enregistrés -----------------------------------------------------------
+
+@enregistrer_export('commandes_360')
+def export_commandes_360(parametres, format):
+    """Export complet de la vue 360 (une ligne par article de panier)"""
+    from parametre.dashboard_360.views import EXPORT_360_HEADERS, iterer_lignes_export_360
+
+    return DefinitionExport(
+        nom_fichier='export_commandes_avec_paniers_360',
+        titre='Commandes avec Paniers',
+        entetes=EXPORT_360_HEADERS,
+        lignes=iterer_lignes_export_360(
+            parametres.get('search'), parametres.get('date_debut'), parametres.get('date_fin'),
+            batch_size=CHUNK_SIZE
+        ),
+        largeurs=[20] * 7 + [15] * 7 + [18] * (len(EXPORT_360_HEADERS) - 14),
+        delimiter=',',
+        bom=False,
+    )
+
+
+COMMANDES_PREPAREES_HEADERS = [
+    'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région',
+    'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
+    'Heure Préparation', 'Heure Exportation'
+]
+
+
+@enregistrer_export('commandes_preparees')
+def export_commandes_preparees(parametres, format):
+    """
+    Commandes passées par l'état "Préparée" (exports de la répartition / détails région).
+    Paramètres optionnels : region (nom), operateur_id, tri ('region' pour grouper par région).
+    """
+    from commande.etats import ids_etats
+    from commande.models import Commande, EtatCommande, Panier
+    from parametre.models import Operateur
+
+    # Un seul filter() : l'état Préparée et l'opérateur portent sur la même ligne d'EtatCommande
+    filtre_etat = {'etats__enum_etat_id__in': ids_etats('Préparée')}
+    nom_fichier = 'villes_consolidees'
+    titre = 'Villes Consolidées'
+    entetes = list(COMMANDES_PREPAREES_HEADERS)
+    operateur = None
+
+    region = parametres.get('region')
+    if region:
+        nom_fichier = f"region_{region.lower().replace(' ', '_')}_detail"
+        titre = f"Région {region}"
+
+    if parametres.get('operateur_id'):
+        operateur = Operateur.objects.get(id=parametres['operateur_id'])
+        filtre_etat['etats__operateur'] = operateur
+        nom_fichier = f"operateur_{operateur.prenom}_{operateur.nom}_commandes"
+        titre = f"Opérateur {operateur.prenom} {operateur.nom}"
+        entetes.append('Opérateur Assigné')
+
+    commandes = Commande.objects.filter(**filtre_etat)
+    if region:
+        commandes = commandes.filter(ville__region__nom_region=region)
+
+    if parametres.get('tri') == 'region':
+        commandes = commandes.order_by('ville__region__nom_region', '-date_cmd', '-id')
+        nom_fichier = 'regions_consolidees'
+        titre = 'Régions Consolidées'
+    else:
+        commandes = commandes.order_by('-date_cmd', '-id')
+
+    commandes = commandes.select_related(
+        'client', 'ville', 'ville__region', 'etat_courant'
+    ).prefetch_related(
+        Prefetch('paniers', queryset=Panier.objects.select_related('article').order_by('id')),
+        prefetch_variantes_actives(),
+        Prefetch('etats', queryset=EtatCommande.objects.select_related('enum_etat').order_by('-date_debut')),
+    ).distinct()
+
+    def lignes():
+        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
+        for commande in commandes.iterator(chunk_size=CHUNK_SIZE):
+            # Construire la liste des articles avec quantités
+            articles_list = []
+            for panier in commande.paniers.all():
+                couleur, pointure = couleur_pointure(panier.article)
+                article_info = f"{panier.article.nom}"
+                if couleur:
+                    article_info += f" {couleur}"
+                if pointure:
+                    article_info += f" {pointure}"
+                if panier.quantite > 1:
+                    article_info += f" x{panier.quantite}"
+                articles_list.append(article_info)
+
+            # Heure de préparation : dernier état "Préparée" (états préchargés du plus récent au plus ancien)
+            heure_preparation = next(
+                (etat.date_debut.strftime('%d/%m/%Y %H:%M') for etat in commande.etats.all()
+                 if etat.enum_etat.libelle == 'Préparée' and etat.date_debut),
+                None
+            )
+
+            if format == 'csv':
+                total = f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00"
+            else:
+                total = commande.total_cmd or 0
+
+            ligne = [
+                commande.id_yz or commande.num_cmd,
+                f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
+                commande.client.numero_tel if commande.client else "N/A",
+                commande.ville.nom if commande.ville else "N/A",
+                commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
+                ", ".join(articles_list) if articles_list else "Aucun article",
+                total,
+                commande.adresse or "N/A",
+                commande.libelle_etat_actuel or "Non défini",
+                commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
+                heure_preparation or "N/A",
+                heure_exportation,
+            ]
+            if operateur:
+                ligne.append(f"{operateur.prenom} {operateur.nom}")
+            yield ligne
+
+    return DefinitionExport(
+        nom_fichier=f"{nom_fichier}_{timezone.now().strftime('%Y%m%d_%H%M%S')}",
+        titre=titre,
+        entetes=entetes,
+        lignes=lignes(),
+        largeurs=[16, 25, 15, 15, 15, 50, 15, 40, 15, 17, 17, 19, 25][:len(entetes)],
+    )
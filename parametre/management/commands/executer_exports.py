@@ -0,0 +1,61 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from parametre.exports import executer_export
+from parametre.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Exécute les exports en attente (ExportJob). À utiliser avec EXPORTS_MODE_EXECUTION='commande', "
+        "en tâche planifiée ou en continu avec --boucle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help='Reste actif et traite les nouveaux exports au fil de l\'eau',
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=5,
+            help='Secondes entre deux recherches d\'exports en mode boucle (défaut: 5)',
+        )
+        parser.add_argument(
+            '--purger-jours',
+            type=int,
+            default=7,
+            help='Supprime les exports (et leurs fichiers) plus anciens que ce nombre de jours (défaut: 7, 0 pour désactiver)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.purger(options['purger_jours'])
+            traites = 0
+            for job in ExportJob.objects.filter(statut='en_attente').order_by('date_creation'):
+                job = executer_export(job)
+                traites += 1
+                if job.statut == 'termine':
+                    self.stdout.write(self.style.SUCCESS(f'✅ Export #{job.pk} ({job.type_export}) : {job.nb_lignes} ligne(s)'))
+                elif job.statut == 'erreur':
+                    self.stdout.write(self.style.ERROR(f'❌ Export #{job.pk} ({job.type_export}) : {job.erreur}'))
+
+            if not options['boucle']:
+                if not traites:
+                    self.stdout.write('Aucun export en attente')
+                return
+            time.sleep(max(1, options['intervalle']))
+
+    def purger(self, jours):
+        if not jours:
+            return
+        limite = timezone.now() - timedelta(days=jours)
+        for job in ExportJob.objects.filter(date_creation__lt=limite).exclude(statut='en_cours'):
+            if job.fichier:
+                job.fichier.delete(save=False)
+            job.delete()
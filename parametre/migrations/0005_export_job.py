@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parametre', '0004_livreur'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_export', models.CharField(help_text="Nom de l'export dans le registre (parametre/exports.py)", max_length=100)),
+                ('format', models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'Excel')], max_length=10)),
+                ('parametres', models.JSONField(blank=True, default=dict)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('erreur', 'Erreur')], default='en_attente', max_length=20)),
+                ('nb_lignes', models.PositiveIntegerField(default=0, help_text='Lignes déjà écrites')),
+                ('fichier', models.FileField(blank=True, null=True, upload_to='exports/')),
+                ('erreur', models.TextField(blank=True, null=True)),
+                ('date_creation', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_debut', models.DateTimeField(blank=True, null=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+                ('cree_par', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='exports', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Export en arrière-plan',
+                'verbose_name_plural': 'Exports en arrière-plan',
+                'ordering': ['-date_creation'],
+                'indexes': [models.Index(fields=['statut', 'date_creation'], name='export_job_statut_idx')],
+            },
+        ),
+    ]
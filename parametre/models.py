@@ -121,10 +121,11 @@ class Operateur(models.Model):
     @property
     def commandes_count(self):
         """Retourne le nombre de commandes actuellement affectées à cet opérateur"""
+        from commande.etats import ids_etats
         from commande.models import EtatCommande
         return EtatCommande.objects.filter(
             operateur=self,
-            enum_etat__libelle__in=['Affectée','En cours de confirmation','Report de confirmation'],
+            enum_etat_id__in=ids_etats('Affectée','En cours de confirmation','Report de confirmation'),
             date_fin__isnull=True
         ).count()
     
@@ -280,3 +281,43 @@ class HistoriqueMotDePasse(models.Model):
     def __str__(self):
         admin_name = self.administrateur.get_full_name() if self.administrateur else "Système"
         return f"Modification MDP de {self.operateur.nom_complet} par {admin_name} le {self.date_modification.strftime('%d/%m/%Y %H:%M')}"
+
+
+class ExportJob(models.Model):
+    """
+    Export volumineux (CSV/XLSX) exécuté en arrière-plan, voir parametre/exports.py.
+    Le fichier produit est conservé dans MEDIA_ROOT/exports/ jusqu'à sa purge.
+    """
+    STATUT_CHOICES = [
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminé'),
+        ('erreur', 'Erreur'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('xlsx', 'Excel'),
+    ]
+
+    type_export = models.CharField(max_length=100, help_text="Nom de l'export dans le registre (parametre/exports.py)")
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    parametres = models.JSONField(default=dict, blank=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    nb_lignes = models.PositiveIntegerField(default=0, help_text="Lignes déjà écrites")
+    fichier = models.FileField(upload_to='exports/', null=True, blank=True)
+    erreur = models.TextField(blank=True, null=True)
+    cree_par = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='exports')
+    date_creation = models.DateTimeField(default=timezone.now)
+    date_debut = models.DateTimeField(null=True, blank=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Export en arrière-plan"
+        verbose_name_plural = "Exports en arrière-plan"
+        ordering = ['-date_creation']
+        indexes = [
+            models.Index(fields=['statut', 'date_creation'], name='export_job_statut_idx'),
+        ]
+
+    def __str__(self):
+        return f"Export {self.type_export} ({self.format}) - {self.get_statut_display()}"
@@ -0,0 +1,97 @@
+"""
+Profil opérateur de l'utilisateur connecté, résolu une fois par requête.
+
+OperateurMiddleware (config/middleware.py) place sur chaque requête authentifiée :
+  - request.operateur : l'Operateur de request.user, None s'il n'en a pas ;
+  - request.role_operateur : son type_operateur (CONFIRMATION, LOGISTIQUE...), None sinon.
+request.user.profil_operateur est renseigné avec la même instance (sans requête, y compris
+l'absence de profil, qui lève toujours RelatedObjectDoesNotExist).
+
+Le profil est lu dans le cache Django (valeurs des champs, par id d'utilisateur) pendant
+OPERATEUR_CACHE_TTL secondes ; toute écriture sur Operateur (signaux post_save / post_delete,
+parametre/signals.py) efface l'entrée après le commit. Les vues remplacent
+
+    Operateur.objects.get(user=request.user, type_operateur='CONFIRMATION')
+
+par operateur_courant(request, 'CONFIRMATION'), qui lève Operateur.DoesNotExist de la même façon.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+CACHE_KEY = 'parametre:operateur:{user_id}'
+
+# Utilisateur sans profil opérateur (mis en cache comme un profil)
+SANS_PROFIL = 0
+
+
+def get_ttl():
+    return getattr(settings, 'OPERATEUR_CACHE_TTL', 300)
+
+
+def _champs():
+    from .models import Operateur
+
+    return [champ.attname for champ in Operateur._meta.concrete_fields]
+
+
+def operateur_de(user):
+    """Operateur de `user` (instance neuve, user déjà rattaché), None s'il n'en a pas"""
+    from .models import Operateur
+
+    if user is None or not user.is_authenticated:
+        return None
+    cle = CACHE_KEY.format(user_id=user.pk)
+    champs = _champs()
+    valeurs = cache.get(cle)
+    if valeurs is None or (valeurs != SANS_PROFIL and len(valeurs) != len(champs)):
+        valeurs = Operateur.objects.filter(user_id=user.pk).values_list(*champs).first() or SANS_PROFIL
+        cache.set(cle, valeurs, timeout=get_ttl())
+    if valeurs == SANS_PROFIL:
+        return None
+    operateur = Operateur.from_db(DEFAULT_DB_ALIAS, champs, valeurs)
+    # Rattache aussi l'instance à user.profil_operateur
+    operateur.user = user
+    return operateur
+
+
+def attacher(request):
+    """Renseigne request.operateur, request.role_operateur et request.user.profil_operateur"""
+    from .models import Operateur
+
+    operateur = operateur_de(request.user)
+    if operateur is None and request.user.is_authenticated:
+        Operateur._meta.get_field('user').remote_field.set_cached_value(request.user, None)
+    request.operateur = operateur
+    request.role_operateur = operateur.type_operateur if operateur is not None else None
+    return operateur
+
+
+def operateur_courant(request, *types, actif=None):
+    """
+    Opérateur de la requête, comme Operateur.objects.get(user=request.user, type_operateur__in=types,
+    actif=actif) : lève Operateur.DoesNotExist s'il n'existe pas ou ne correspond pas.
+    """
+    from .models import Operateur
+
+    if not hasattr(request, 'operateur'):
+        # Requête construite hors de la chaîne des middlewares (tests, appels internes)
+        attacher(request)
+    operateur = request.operateur
+    if operateur is None:
+        raise Operateur.DoesNotExist("Aucun profil opérateur pour cet utilisateur")
+    if types and operateur.type_operateur not in types:
+        raise Operateur.DoesNotExist(f"Profil opérateur de type {operateur.type_operateur}, attendu : {', '.join(types)}")
+    if actif is not None and operateur.actif != actif:
+        raise Operateur.DoesNotExist("Profil opérateur désactivé" if actif else "Profil opérateur actif")
+    return operateur
+
+
+def invalider(*user_ids):
+    """Oublie le profil en cache des utilisateurs `user_ids`"""
+    cache.delete_many([CACHE_KEY.format(user_id=user_id) for user_id in user_ids if user_id is not None])
+
+
+def planifier_invalidation(user_id):
+    """Invalide le profil après le commit de la transaction en cours (immédiatement hors transaction)"""
+    transaction.on_commit(lambda: invalider(user_id))
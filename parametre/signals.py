@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from .models import Operateur
+from . import operateurs
 
 @receiver(post_save, sender=User)
 def create_operateur_profile(sender, instance, created, **kwargs):
@@ -45,4 +46,11 @@ def save_operateur_profile(sender, instance, **kwargs):
         operateur.nom = instance.last_name or operateur.nom
         operateur.prenom = instance.first_name or operateur.prenom
         operateur.mail = instance.email or operateur.mail
-        operateur.save() 
\ No newline at end of file
+        operateur.save() 
+
+
+@receiver(post_save, sender=Operateur)
+@receiver(post_delete, sender=Operateur)
+def invalider_profil_operateur(sender, instance, **kwargs):
+    """Le profil en cache (parametre/operateurs.py) est relu après toute modification"""
+    operateurs.planifier_invalidation(instance.user_id)
@@ -1,3 +1,230 @@
-from django.test import TestCase
+import csv
+import io
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from article.models import Article, Categorie, Couleur, Pointure, VarianteArticle
+from client.models import Client
+from commande.models import Commande, EnumEtatCmd, EtatCommande, Panier
+from parametre import exports, operateurs
+from parametre.dashboard_360 import views as vue_360
+from parametre.models import ExportJob, Operateur, Region, Ville
+
+
+class ExportsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom_region='Centre')
+        cls.ville = Ville.objects.create(nom='Casablanca', frais_livraison=30, region=region)
+        cls.client_test = Client.objects.create(nom='Alami', prenom='Sara', numero_tel='0612345678')
+        cls.confirmation, cls.preparation = (
+            Operateur.objects.create(
+                user=User.objects.create(username=type_operateur.lower()), nom='Op', prenom=type_operateur.title(),
+                mail=f'{type_operateur.lower()}@test.ma', type_operateur=type_operateur,
+            )
+            for type_operateur in ('CONFIRMATION', 'PREPARATION')
+        )
+        cls.affectee = EnumEtatCmd.objects.create(libelle='Affectée', ordre=1)
+        cls.preparee = EnumEtatCmd.objects.create(libelle='Préparée', ordre=2)
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+
+    def commande_preparee(self, total):
+        commande = Commande.objects.create(client=self.client_test, ville=self.ville, adresse='Rue 1', total_cmd=total)
+        EtatCommande.objects.create(commande=commande, enum_etat=self.affectee, operateur=self.confirmation)
+        EtatCommande.objects.create(commande=commande, enum_etat=self.preparee, operateur=self.preparation)
+        return commande
+
+    def lire_csv(self, morceaux):
+        return list(csv.reader(io.StringIO(''.join(morceaux).lstrip('﻿')), delimiter=';'))
+
+    def test_commandes_preparees_par_operateur(self):
+        commande = self.commande_preparee(150)
+
+        # L'opérateur doit porter l'état Préparée lui-même, pas un autre état de la commande
+        self.assertEqual(list(exports.get_definition('commandes_preparees', {'operateur_id': self.confirmation.pk}, 'csv').lignes), [])
+        definition = exports.get_definition('commandes_preparees', {'operateur_id': self.preparation.pk}, 'csv')
+        lignes = self.lire_csv(exports.iterer_csv(definition))
+
+        self.assertEqual(lignes[0][-1], 'Opérateur Assigné')
+        self.assertEqual(len(lignes), 2)
+        self.assertEqual((lignes[1][0], lignes[1][4], lignes[1][6]), (str(commande.id_yz), 'Centre', '150.00'))
+
+    def test_export_en_arriere_plan(self):
+        self.commande_preparee(80)
+        self.commande_preparee(120)
+
+        with override_settings(MEDIA_ROOT=self.media, EXPORTS_MODE_EXECUTION='commande'):
+            with self.captureOnCommitCallbacks() as rappels:
+                job = exports.lancer_export('commandes_preparees', 'csv', {'tri': 'region'})
+            self.assertEqual(rappels, [])
+            exports.executer_export(job)
+
+            job.refresh_from_db()
+            self.assertEqual((job.statut, job.nb_lignes), ('termine', 2))
+            with job.fichier.open('rb') as fichier:
+                self.assertEqual(len(self.lire_csv(fichier.read().decode('utf-8'))), 3)
+
+            # Un job déjà pris en charge n'est pas relancé
+            ExportJob.objects.filter(pk=job.pk).update(statut='en_cours')
+            self.assertEqual(exports.executer_export(ExportJob.objects.get(pk=job.pk)).statut, 'en_cours')
+
+    def test_erreur_enregistree_sur_le_job(self):
+        with self.assertRaises(ValueError):
+            exports.lancer_export('inconnu', 'csv', {})
+
+        job = ExportJob.objects.create(type_export='commandes_preparees', format='csv', parametres={'operateur_id': 999999})
+        with override_settings(MEDIA_ROOT=self.media):
+            exports.executer_export(job)
+        job.refresh_from_db()
+        self.assertEqual(job.statut, 'erreur')
+        self.assertFalse(job.fichier)
+
+
+class OperateurCourantTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='confirmation')
+        cls.operateur = Operateur.objects.create(
+            user=cls.user, nom='Op', prenom='Test', mail='op@test.ma', type_operateur='CONFIRMATION',
+        )
+        cls.sans_profil = User.objects.create(username='visiteur')
+
+    def setUp(self):
+        cache.clear()
+
+    def requete(self, user):
+        requete = RequestFactory().get('/')
+        requete.user = user
+        return requete
+
+    def test_profil_attache_a_la_requete(self):
+        requete = self.requete(self.user)
+
+        self.assertEqual(operateurs.operateur_courant(requete, 'CONFIRMATION', actif=True), self.operateur)
+        self.assertEqual(requete.role_operateur, 'CONFIRMATION')
+        self.assertIs(requete.user.profil_operateur, requete.operateur)
+        with self.assertRaises(Operateur.DoesNotExist):
+            operateurs.operateur_courant(requete, 'LOGISTIQUE', 'PREPARATION')
+        with self.assertRaises(Operateur.DoesNotExist):
+            operateurs.operateur_courant(requete, actif=False)
+
+    def test_sans_profil_ou_anonyme(self):
+        for user in (self.sans_profil, AnonymousUser()):
+            with self.subTest(user=user):
+                requete = self.requete(user)
+                with self.assertRaises(Operateur.DoesNotExist):
+                    operateurs.operateur_courant(requete)
+                self.assertIsNone(requete.role_operateur)
+
+        # L'absence de profil est aussi gardée en cache
+        with self.assertNumQueries(0):
+            self.assertIsNone(operateurs.operateur_de(self.sans_profil))
+
+    def test_profil_relu_apres_modification(self):
+        operateurs.operateur_de(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(operateurs.operateur_de(self.user).type_operateur, 'CONFIRMATION')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Operateur.objects.filter(pk=self.operateur.pk).update(actif=False)
+            self.operateur.refresh_from_db()
+            self.operateur.save()
+        self.assertFalse(operateurs.operateur_de(self.user).actif)
+
+
+class Dashboard360Tests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(nom_region='Centre')
+        cls.ville = Ville.objects.create(nom='Casablanca', frais_livraison=30, region=region)
+        cls.client_test = Client.objects.create(nom='Alami', prenom='Sara', numero_tel='0612345678')
+        cls.affectation, cls.confirmation = (
+            Operateur.objects.create(
+                user=User.objects.create(username=nom), nom='Op', prenom=nom.title(),
+                mail=f'{nom}@test.ma', type_operateur='CONFIRMATION',
+            )
+            for nom in ('affectation', 'confirmation')
+        )
+        cls.etats = {
+            libelle: EnumEtatCmd.objects.create(libelle=libelle, ordre=ordre)
+            for ordre, libelle in enumerate(('Affectée', 'Confirmée', 'Livrée'), start=1)
+        }
+        categorie = Categorie.objects.create(nom='SANDALES')
+        cls.sandale = Article.objects.create(nom='Sandale', reference='SAN-1', prix_unitaire=200, categorie=categorie)
+        cls.mule = Article.objects.create(nom='Mule', reference='MUL-1', prix_unitaire=150, categorie=categorie)
+        VarianteArticle.objects.create(
+            article=cls.sandale, couleur=Couleur.objects.create(nom='Rouge'), pointure=Pointure.objects.create(pointure='40'),
+            actif=False,
+        )
+        VarianteArticle.objects.create(
+            article=cls.sandale, couleur=Couleur.objects.create(nom='Noir'), pointure=Pointure.objects.create(pointure='38'),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def commande_livree(self):
+        commande = Commande.objects.create(client=self.client_test, ville=self.ville, adresse='Rue 1', total_cmd=550)
+        for libelle, operateur, commentaire in (
+            ('Affectée', self.affectation, ''), ('Confirmée', self.confirmation, 'Client joint'), ('Livrée', None, ''),
+        ):
+            EtatCommande.objects.filter(commande=commande, date_fin__isnull=True).update(date_fin=timezone.now())
+            EtatCommande.objects.create(
+                commande=commande, enum_etat=self.etats[libelle], operateur=operateur, commentaire=commentaire,
+            )
+        Panier.objects.create(commande=commande, article=self.sandale, quantite=2, sous_total=400)
+        Panier.objects.create(commande=commande, article=self.mule, quantite=1, sous_total=150)
+        return commande
+
+    def test_lignes_construites_depuis_les_prechargements(self):
+        livree = self.commande_livree()
+        sans_etat = Commande.objects.create(client=self.client_test, ville=self.ville, adresse='Rue 1', total_cmd=90)
+
+        donnees = {ligne['id']: ligne for ligne in vue_360.prepare_commandes_data(vue_360.get_commandes_360_queryset())}
+
+        ligne = donnees[livree.pk]
+        self.assertEqual([etat['etat'] for etat in ligne['historique_etats']], ['Affectée', 'Confirmée', 'Livrée'])
+        self.assertEqual(
+            (ligne['etat_actuel'], ligne['etapes_completes'], ligne['confirmation_status'], ligne['observations_confirmation']),
+            ('Livrée', 3, 'Confirmée', 'Client joint'),
+        )
+        self.assertEqual(
+            (ligne['operateur_assigne'], ligne['agent_confirmation'], ligne['etat_livraison'], ligne['piece_retournee']),
+            ('affectation@test.ma', 'confirmation@test.ma', 'Livrée', 'Non'),
+        )
+        self.assertEqual(ligne['panier'], 'Sandale, Mule')
+        self.assertEqual(
+            [(article['reference'], article['couleur'], article['pointure']) for article in ligne['articles_panier']],
+            [('SAN-1', 'Noir', '38'), ('MUL-1', '', '')],
+        )
+        self.assertEqual((ligne['total_panier'], ligne['nombre_articles']), (550, 3))
+        self.assertEqual([ligne_export[7] for ligne_export in vue_360.lignes_export_commande(ligne)], ['Sandale', 'Mule'])
+
+        ligne = donnees[sans_etat.pk]
+        self.assertEqual(
+            (ligne['etat_actuel'], ligne['confirmation_status'], ligne['operateur_assigne'], ligne['panier']),
+            ('Non définie', 'Non Confirmée', 'N/A', 'N/A'),
+        )
+        self.assertEqual([ligne_export[7:11] for ligne_export in vue_360.lignes_export_commande(ligne)], [['N/A'] * 4])
+
+    def test_nombre_de_requetes_independant_du_nombre_de_commandes(self):
+        # Commandes, états, paniers (avec article) et variantes actives
+        for nombre in (1, 5):
+            with self.subTest(nombre=nombre):
+                while Commande.objects.count() < nombre:
+                    self.commande_livree()
+                with self.assertNumQueries(4):
+                    donnees = vue_360.prepare_commandes_data(vue_360.get_commandes_360_queryset())
+                self.assertEqual(len(donnees), nombre)
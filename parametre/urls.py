@@ -48,6 +48,10 @@ urlpatterns = [
     path('vue360/', views_360.page_360, name='page_360'),
     path('export-csv/', views_360.export_all_data_csv, name='export_all_data_csv'),
     path('export-excel/', views_360.export_all_data_excel, name='export_all_data_excel'),
+
+    # URLs Exports en arrière-plan
+    path('exports/<int:job_id>/statut/', views.export_job_statut, name='export_job_statut'),
+    path('exports/<int:job_id>/telecharger/', views.export_job_telecharger, name='export_job_telecharger'),
     
     # URLs Répartition
     path('repartition/automatique/', views.repartition_automatique, name='repartition_automatique'),
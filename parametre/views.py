@@ -1,19 +1,23 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.db.models import Q, Count, Avg, Min, Max, Sum
 from django.contrib.auth.models import User, Group
 from django.contrib import messages
-from .models import Region, Ville, Operateur, HistoriqueMotDePasse
+from .models import Region, Ville, Operateur, HistoriqueMotDePasse, ExportJob
+from .operateurs import operateur_courant
+from .exports import reponse_job, servir_export
 from article.models import Article, Couleur, Pointure, VarianteArticle
 from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.etats import ids_etats, obtenir_etat
 from django.contrib.messages import success, error
 from django.views.decorators.http import require_POST
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash # Required for password change
 import csv
+import os
 import json
 from datetime import datetime, timedelta
 from django.utils import timezone
@@ -495,9 +499,8 @@ def detail_operateur(request, pk):
     
     # Commandes actuellement affectées à cet opérateur
     commandes_affectees = Commande.objects.filter(
-        etats__operateur=operateur,
-        etats__date_fin__isnull=True
-    ).distinct().order_by('-date_cmd')
+        operateur_etat_courant=operateur
+    ).order_by('-date_cmd')
     
     # Historique de toutes les commandes traitées par cet opérateur
     commandes_historique = Commande.objects.filter(
@@ -910,7 +913,7 @@ def detail_ville(request, pk):
 @login_required
 def admin_profile(request):
     try:
-        operateur = Operateur.objects.get(user=request.user)
+        operateur = operateur_courant(request)
     except Operateur.DoesNotExist:
         operateur = None
     context = {
@@ -923,7 +926,7 @@ def admin_profile(request):
 @login_required
 def modifier_admin_profile(request):
     try:
-        operateur = Operateur.objects.get(user=request.user)
+        operateur = operateur_courant(request)
     except Operateur.DoesNotExist:
         # If admin doesn't have an Operateur profile, create one.
         # This might happen if the admin was created directly via Django admin and not as an Operateur.
@@ -992,11 +995,10 @@ def sav_commandes_retournees(request):
     from django.template.loader import render_to_string
     
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Retournée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Retournée')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Pagination flexible pour les administrateurs
     items_per_page = request.GET.get('items_per_page', '20')
@@ -1093,11 +1095,10 @@ def sav_commandes_reportees(request):
     from django.template.loader import render_to_string
     
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Reportée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Reportée')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Pagination flexible pour les administrateurs
     items_per_page = request.GET.get('items_per_page', '20')
@@ -1194,11 +1195,10 @@ def sav_livrees_partiellement(request):
     from django.template.loader import render_to_string
     
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée Partiellement',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Livrée Partiellement')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Pagination flexible pour les administrateurs
     items_per_page = request.GET.get('items_per_page', '20')
@@ -1295,11 +1295,10 @@ def sav_annulees_sav(request):
     from django.template.loader import render_to_string
     
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Annulée (SAV)',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Annulée (SAV)')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Pagination flexible pour les administrateurs
     items_per_page = request.GET.get('items_per_page', '20')
@@ -1396,11 +1395,10 @@ def sav_livrees_avec_changement(request):
     from django.template.loader import render_to_string
     
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée avec changement',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Livrée avec changement')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Pagination flexible pour les administrateurs
     items_per_page = request.GET.get('items_per_page', '20')
@@ -1497,11 +1495,10 @@ def sav_livrees(request):
     from django.template.loader import render_to_string
     
     commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Livrée',
-        etats__date_fin__isnull=True
+        etat_courant_id__in=ids_etats('Livrée')
     ).select_related('client', 'ville', 'ville__region').prefetch_related(
         'etats__enum_etat', 'etats__operateur', 'paniers__article'
-    ).order_by('-etats__date_debut').distinct()
+    ).order_by('-date_etat_courant')
     
     # Pagination flexible pour les administrateurs
     items_per_page = request.GET.get('items_per_page', '20')
@@ -1644,7 +1641,7 @@ def sav_creer_nouvelle_commande(request, commande_id):
             nouvelle_commande.save()
             
             # Créer l'état initial "Non affectée"
-            enum_etat = EnumEtatCmd.objects.get(libelle='Non affectée')
+            enum_etat = obtenir_etat('Non affectée')
             EtatCommande.objects.create(
                 commande=nouvelle_commande,
                 enum_etat=enum_etat,
@@ -1683,7 +1680,7 @@ def sav_renvoyer_preparation(request, commande_id):
                 etat_actuel.save()
             
             # Créer un nouvel état "En préparation"
-            enum_etat = EnumEtatCmd.objects.get(libelle='Préparation en cours')
+            enum_etat = obtenir_etat('Préparation en cours')
             EtatCommande.objects.create(
                 commande=commande,
                 enum_etat=enum_etat,
@@ -1718,22 +1715,22 @@ def repartition_automatique(request):
     
     # Statistiques pour les KPI
     total_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).distinct().count()
     
     total_commandes_en_livraison = Commande.objects.filter(
-        etats__enum_etat__libelle='En livraison'
+        etats__enum_etat_id__in=ids_etats('En livraison')
     ).distinct().count()
     
     total_montant_confirmees = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).distinct().aggregate(total=Sum('total_cmd'))['total'] or 0
     
     operateurs_disponibles = Operateur.objects.filter(actif=True).exclude(type_operateur='ADMIN').count()
     
     # Statistiques par région
     stats_par_region = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).values('ville__region__nom_region').annotate(
         nb_commandes=Count('id'),
         total_montant=Sum('total_cmd')
@@ -1745,7 +1742,7 @@ def repartition_automatique(request):
     
     # Récupérer toutes les commandes préparées avec leurs états
     commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
+        etats__enum_etat_id__in=ids_etats('Préparée')
     ).select_related(
         'client', 'ville', 'ville__region'
     ).prefetch_related(
@@ -1756,7 +1753,7 @@ def repartition_automatique(request):
         # Compter les commandes assignées à cet opérateur
         commandes_operateur = commandes_preparees.filter(
             etats__operateur=operateur,
-            etats__enum_etat__libelle='Préparée'
+            etats__enum_etat_id__in=ids_etats('Préparée')
         ).distinct()
         
         nb_commandes = commandes_operateur.count()
@@ -1783,7 +1780,7 @@ def repartition_automatique(request):
     
     # Vérifier si des commandes préparées existent pour les exportations
     commandes_preparees_exist = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
+        etats__enum_etat_id__in=ids_etats('Préparée')
     ).exists()
     
     # Vérifier si openpyxl est disponible
@@ -1837,18 +1834,18 @@ def details_region_view(request):
     
     # Statistiques globales
     total_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).distinct().count()
     
     total_montant = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).distinct().aggregate(total=Sum('total_cmd'))['total'] or 0
     
     regions = Region.objects.count()
     
     # Statistiques par région
     stats_par_region = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).values('ville__region__nom_region').annotate(
         nb_commandes=Count('id'),
         total_montant=Sum('total_cmd')
@@ -1856,7 +1853,7 @@ def details_region_view(request):
     
     # Statistiques par ville
     stats_par_ville = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).values('ville__nom', 'ville__region__nom_region').annotate(
         nb_commandes=Count('id'),
         total_montant=Sum('total_cmd')
@@ -1864,7 +1861,7 @@ def details_region_view(request):
     
     # Vérifier si des commandes préparées existent pour les exportations
     commandes_preparees_exist = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
+        etats__enum_etat_id__in=ids_etats('Préparée')
     ).exists()
     
     # Vérifier si openpyxl est disponible
@@ -1890,387 +1887,30 @@ def details_region_view(request):
 @staff_member_required
 @login_required
 def export_region_detail_csv(request, region_name):
-    """Export CSV détaillé pour une région spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES de la région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        ville__region__nom_region=region_name
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    filename = f"region_{region_name.lower().replace(' ', '_')}_detail_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        writer.writerow(row)
-    
-    return response
+    """Export CSV détaillé pour une région spécifique (streaming, ?async=1 pour un export en arrière-plan)"""
+    return servir_export(request, 'commandes_preparees', {'region': region_name}, 'csv')
 
 
 @staff_member_required
 @login_required
 def export_region_detail_excel(request, region_name):
     """Export Excel détaillé pour une région spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES de la région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        ville__region__nom_region=region_name
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Région {region_name}"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    filename = f"region_{region_name.lower().replace(' ', '_')}_detail_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return servir_export(request, 'commandes_preparees', {'region': region_name}, 'xlsx')
 
 
 @staff_member_required
 @login_required
 def export_villes_csv(request):
     """Export CSV pour toutes les villes"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    filename = f"villes_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        writer.writerow(row)
-    
-    return response
+    return servir_export(request, 'commandes_preparees', {}, 'csv')
 
 
 @staff_member_required
 @login_required
 def export_villes_excel(request):
     """Export Excel pour toutes les villes"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Villes Consolidées"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    filename = f"villes_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return servir_export(request, 'commandes_preparees', {}, 'xlsx')
+
 
 @staff_member_required
 @login_required
@@ -2282,17 +1922,17 @@ def get_modal_data_ajax(request):
     try:
         # Statistiques globales
         total_commandes = Commande.objects.filter(
-            etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+            etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
         ).distinct().count()
         
         total_montant = Commande.objects.filter(
-            etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+            etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
         ).distinct().aggregate(total=Sum('total_cmd'))['total'] or 0
         
         # Statistiques par région avec pourcentages
         stats_region_avec_pourcentage = []
         stats_par_region = Commande.objects.filter(
-            etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+            etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
         ).values('ville__region__nom_region').annotate(
             nb_commandes=Count('id'),
             total_montant=Sum('total_cmd')
@@ -2309,7 +1949,7 @@ def get_modal_data_ajax(request):
         
         # Top 10 des villes
         top_10_villes = Commande.objects.filter(
-            etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+            etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
         ).values('ville__nom', 'ville__region__nom_region').annotate(
             nb_commandes=Count('id'),
             total_montant=Sum('total_cmd')
@@ -2318,7 +1958,7 @@ def get_modal_data_ajax(request):
         # Statistiques globales détaillées
         nb_regions_actives = len(stats_region_avec_pourcentage)
         nb_villes_actives = Commande.objects.filter(
-            etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+            etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
         ).values('ville').distinct().count()
         
         moyenne_commandes_par_region = round(total_commandes / nb_regions_actives, 1) if nb_regions_actives > 0 else 0
@@ -2359,7 +1999,7 @@ def export_combine_csv(request):
     
     # Récupérer les statistiques par région
     stats_par_region = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).values('ville__region__nom_region').annotate(
         nb_commandes=Count('id'),
         total_montant=Sum('total_cmd')
@@ -2367,7 +2007,7 @@ def export_combine_csv(request):
     
     # Récupérer les statistiques par ville (Top 10)
     stats_par_ville = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).values('ville__nom', 'ville__region__nom_region').annotate(
         nb_commandes=Count('id'),
         total_montant=Sum('total_cmd')
@@ -2438,7 +2078,7 @@ def export_combine_excel(request):
     
     # Récupérer les statistiques par région
     stats_par_region = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).values('ville__region__nom_region').annotate(
         nb_commandes=Count('id'),
         total_montant=Sum('total_cmd')
@@ -2446,7 +2086,7 @@ def export_combine_excel(request):
     
     # Récupérer les statistiques par ville (Top 10)
     stats_par_ville = Commande.objects.filter(
-        etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
+        etats__enum_etat_id__in=ids_etats('Confirmée', 'À imprimer', 'Préparée')
     ).values('ville__nom', 'ville__region__nom_region').annotate(
         nb_commandes=Count('id'),
         total_montant=Sum('total_cmd')
@@ -2608,398 +2248,55 @@ def export_combine_excel(request):
 @staff_member_required
 @login_required
 def export_regions_csv(request):
-    """Export CSV pour toutes les régions"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES groupées par région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('ville__region__nom_region', '-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    filename = f"regions_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        writer.writerow(row)
-    
-    return response
+    """Export CSV pour toutes les régions (commandes groupées par région)"""
+    return servir_export(request, 'commandes_preparees', {'tri': 'region'}, 'csv')
 
 
 @staff_member_required
 @login_required
 def export_regions_excel(request):
-    """Export Excel pour toutes les régions"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES groupées par région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('ville__region__nom_region', '-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Régions Consolidées"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    filename = f"regions_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    """Export Excel pour toutes les régions (commandes groupées par région)"""
+    return servir_export(request, 'commandes_preparees', {'tri': 'region'}, 'xlsx')
+
 
 @staff_member_required
 @login_required
 def export_operateur_csv(request, operateur_id):
     """Export CSV pour les commandes d'un opérateur spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer l'opérateur
-    try:
-        operateur = Operateur.objects.get(id=operateur_id)
-    except Operateur.DoesNotExist:
+    if not Operateur.objects.filter(id=operateur_id).exists():
         return HttpResponse("Opérateur non trouvé", status=404)
-    
-    # Récupérer les commandes PRÉPARÉES assignées à cet opérateur
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__operateur=operateur
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    filename = f"operateur_{operateur.prenom}_{operateur.nom}_commandes_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation', 'Opérateur Assigné'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation,
-            f"{operateur.prenom} {operateur.nom}"
-        ]
-        writer.writerow(row)
-    
-    return response
+    return servir_export(request, 'commandes_preparees', {'operateur_id': operateur_id}, 'csv')
 
 
 @staff_member_required
 @login_required
 def export_operateur_excel(request, operateur_id):
     """Export Excel pour les commandes d'un opérateur spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer l'opérateur
-    try:
-        operateur = Operateur.objects.get(id=operateur_id)
-    except Operateur.DoesNotExist:
+    if not Operateur.objects.filter(id=operateur_id).exists():
         return HttpResponse("Opérateur non trouvé", status=404)
-    
-    # Récupérer les commandes PRÉPARÉES assignées à cet opérateur
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__operateur=operateur
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Opérateur {operateur.prenom} {operateur.nom}"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation', 'Opérateur Assigné'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation,
-            f"{operateur.prenom} {operateur.nom}"
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    filename = f"operateur_{operateur.prenom}_{operateur.nom}_commandes_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return servir_export(request, 'commandes_preparees', {'operateur_id': operateur_id}, 'xlsx')
+
 
+def _get_export_job(request, job_id):
+    """ExportJob visible par l'utilisateur courant (son créateur ou un superutilisateur)"""
+    job = get_object_or_404(ExportJob, id=job_id)
+    if job.cree_par_id != request.user.id and not request.user.is_superuser:
+        raise Http404("Export introuvable")
+    return job
+
+
+@staff_member_required
+@login_required
+def export_job_statut(request, job_id):
+    """Avancement d'un export lancé en arrière-plan (?async=1)"""
+    return reponse_job(_get_export_job(request, job_id))
+
+
+@staff_member_required
+@login_required
+def export_job_telecharger(request, job_id):
+    """Téléchargement du fichier produit par un export en arrière-plan"""
+    job = _get_export_job(request, job_id)
+    if job.statut != 'termine' or not job.fichier:
+        return JsonResponse({'success': False, 'error': "L'export n'est pas encore disponible", 'statut': job.statut}, status=409)
+    return FileResponse(job.fichier.open('rb'), as_attachment=True, filename=os.path.basename(job.fichier.name))
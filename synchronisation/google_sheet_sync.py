@@ -3,8 +3,13 @@ import gspread
 from google.oauth2.service_account import Credentials
 from django.conf import settings
 from django.utils import timezone
+from client import telephone
 from client.models import Client
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Panier
+from commande.etats import ids_etats, obtenir_etat, obtenir_ou_creer_etat
+from commande.compteurs import ajuster, deplacer
+from commande.recherche import rafraichir_documents
+from kpis.cache import planifier_invalidation
 from parametre.models import Operateur, Ville, Region
 from synchronisation.models import SyncLog, GoogleSheetConfig
 import pandas as pd
@@ -16,10 +21,14 @@ import re
 class GoogleSheetSync:
     """Classe pour gérer la synchronisation avec Google Sheets"""
     
-    def __init__(self, sheet_config, triggered_by="admin", verbose=False):
+    def __init__(self, sheet_config, triggered_by="admin", verbose=False, batch_size=None):
         self.sheet_config = sheet_config
         self.triggered_by = triggered_by
         self.verbose = verbose  # Contrôle l'affichage des messages détaillés
+        # Taille des lots pour l'import en masse (0 = traitement ligne par ligne)
+        if batch_size is None:
+            batch_size = getattr(settings, 'GOOGLE_SHEET_SYNC_BATCH_SIZE', 0)
+        self.batch_size = batch_size or 0
         self.records_imported = 0
         self.errors = []
         self.warnings = []
@@ -39,6 +48,10 @@ class GoogleSheetSync:
         self.existing_orders_skipped = 0  # Commandes existantes inchangées
         self.duplicate_orders_found = 0   # Commandes en double détectées
         self.protected_orders_count = 0   # Commandes protégées contre la régression d'état
+        
+        # Caches de référence chargés une seule fois par synchronisation
+        self._operateurs_par_nom = None
+        self._statuts_mappes = {}
     
     def _log(self, message, level="info"):
         """Log conditionnel selon le mode verbose"""
@@ -152,6 +165,25 @@ class GoogleSheetSync:
         
         return phone
     
+    def _get_operateur(self, operator_name):
+        """Retourne l'opérateur correspondant au nom complet (insensible à la casse), chargé une seule fois"""
+        if self._operateurs_par_nom is None:
+            self._operateurs_par_nom = {
+                operateur.nom_complet.lower(): operateur
+                for operateur in Operateur.objects.all()
+            }
+        operateur_obj = self._operateurs_par_nom.get(operator_name.strip().lower())
+        if operateur_obj is None:
+            self.errors.append(f"Opérateur non trouvé: {operator_name}")
+        return operateur_obj
+    
+    def _map_status_cached(self, status):
+        """Version mémorisée de _map_status pour l'import en masse"""
+        cle = str(status).strip() if status is not None else ''
+        if cle not in self._statuts_mappes:
+            self._statuts_mappes[cle] = self._map_status(status)
+        return self._statuts_mappes[cle]
+    
     def process_row(self, row_data, headers):
         """Traite une ligne de données - nouvelles commandes uniquement, évite les doublons"""
         try:
@@ -191,10 +223,13 @@ class GoogleSheetSync:
             client_nom = client_nom_prenom[0] if client_nom_prenom else ''
             client_prenom = client_nom_prenom[1] if len(client_nom_prenom) > 1 else ''
             
-            client_obj, created = Client.objects.get_or_create(
-                numero_tel=client_phone,
-                defaults={'nom': client_nom, 'prenom': client_prenom, 'adresse': data.get('Adresse', '')}
-            )
+            # Doublons : même numéro quelle que soit la saisie (forme canonique indexée)
+            client_obj = telephone.trouver(client_phone).first()
+            created = client_obj is None
+            if created:
+                client_obj = Client.objects.create(
+                    numero_tel=client_phone, nom=client_nom, prenom=client_prenom, adresse=data.get('Adresse', '')
+                )
             # Mettre à jour les infos client si la fiche n'est pas nouvelle et des données sont dispo
             if not created:
                 if client_nom and client_obj.nom != client_nom:
@@ -257,10 +292,7 @@ class GoogleSheetSync:
             operator_name = data.get('Opérateur', '')
             operateur_obj = None
             if operator_name:
-                try:
-                    operateur_obj = Operateur.objects.get(nom_complet__iexact=operator_name)
-                except Operateur.DoesNotExist:
-                    self.errors.append(f"Opérateur non trouvé: {operator_name}")
+                operateur_obj = self._get_operateur(operator_name)
 
             # Créer l'état de commande selon le statut
             status_from_sheet = data.get('Statut', '')
@@ -395,8 +427,8 @@ class GoogleSheetSync:
         # Obtenir l'ordre des états depuis la base de données
         try:
             from commande.models import EnumEtatCmd
-            current_enum = EnumEtatCmd.objects.get(libelle=current_status)
-            new_enum = EnumEtatCmd.objects.get(libelle=new_status)
+            current_enum = obtenir_etat(current_status)
+            new_enum = obtenir_etat(new_status)
             
             # Si le nouvel état a un ordre inférieur, c'est une régression
             if new_enum.ordre < current_enum.ordre:
@@ -489,10 +521,8 @@ class GoogleSheetSync:
                 return True  # Aucun opérateur spécifié
             
             # Récupérer l'opérateur
-            try:
-                operateur_obj = Operateur.objects.get(nom_complet__iexact=operator_name)
-            except Operateur.DoesNotExist:
-                self.errors.append(f"Opérateur non trouvé: {operator_name}")
+            operateur_obj = self._get_operateur(operator_name)
+            if operateur_obj is None:
                 return True  # Continuer même si l'opérateur n'est pas trouvé
             
             # Vérifier si l'opérateur a changé
@@ -546,10 +576,7 @@ class GoogleSheetSync:
                     operateur_obj = None
                     operator_name = data.get('Opérateur', '')
                     if operator_name:
-                        try:
-                            operateur_obj = Operateur.objects.get(nom_complet__iexact=operator_name)
-                        except Operateur.DoesNotExist:
-                            self.errors.append(f"Opérateur non trouvé: {operator_name}")
+                        operateur_obj = self._get_operateur(operator_name)
                     
                     # Créer l'état de commande
                     success = self._create_etat_commande(existing_commande, new_status_raw, operateur_obj)
@@ -583,10 +610,7 @@ class GoogleSheetSync:
                     operateur_obj = None
                     operator_name = data.get('Opérateur', '')
                     if operator_name:
-                        try:
-                            operateur_obj = Operateur.objects.get(nom_complet__iexact=operator_name)
-                        except Operateur.DoesNotExist:
-                            self.errors.append(f"Opérateur non trouvé: {operator_name}")
+                        operateur_obj = self._get_operateur(operator_name)
                     
                     success = self._create_etat_commande(existing_commande, default_status, operateur_obj)
                     if success:
@@ -778,8 +802,8 @@ class GoogleSheetSync:
                 print(f"🔍 [{i}/{len(etats_base)}] Vérification de l'état: '{etat_data['libelle']}'")
                 
                 try:
-                    etat, created = EnumEtatCmd.objects.get_or_create(
-                        libelle=etat_data['libelle'],
+                    etat, created = obtenir_ou_creer_etat(
+                        etat_data['libelle'],
                         defaults={
                             'ordre': etat_data['ordre'],
                             'couleur': etat_data['couleur']
@@ -839,7 +863,7 @@ class GoogleSheetSync:
             
             recent_etat = EtatCommande.objects.filter(
                 commande=commande,
-                enum_etat__libelle=status_libelle,
+                enum_etat_id__in=ids_etats(status_libelle),
                 date_debut__gte=recent_threshold
             ).order_by('-date_debut').first()
             
@@ -875,7 +899,7 @@ class GoogleSheetSync:
             
             # Récupérer l'énumération d'état (elle doit maintenant exister)
             try:
-                enum_etat = EnumEtatCmd.objects.get(libelle=status_libelle)
+                enum_etat = obtenir_etat(status_libelle)
                 self._log(f"✅ EnumEtatCmd trouvé: {status_libelle} (ID: {enum_etat.id})")
             except EnumEtatCmd.DoesNotExist:
                 # Si l'état n'existe toujours pas, le créer avec des valeurs par défaut
@@ -1124,47 +1148,11 @@ class GoogleSheetSync:
             print(f"🚀 === DÉBUT TRAITEMENT LIGNES ===")
             print(f"📈 Total lignes à traiter: {len(rows_to_process)}")
             
-            # Traiter chaque ligne (i = numéro réel de la ligne de la feuille)
-            for i, row in enumerate(rows_to_process, max(start_row, 2)):
-                print(f"\n📝 === TRAITEMENT LIGNE {i} ===")
-
-                try:
-                    # Vérifier si la ligne est vide
-                    if not any(cell.strip() for cell in row if cell):
-                        print(f"⚠️ Ligne {i} ignorée: ligne complètement vide")
-                        self._log(f"Ligne {i} ignorée : ligne complètement vide")
-                        self.skipped_rows += 1
-                    elif len(row) == len(headers):  # Vérifier que la ligne a le bon nombre de colonnes
-                        print(f"✅ Ligne {i} valide: {len(row)} colonnes vs {len(headers)} en-têtes")
-                        print(f"🔍 Aperçu: {dict(zip(headers[:3], row[:3]))}...")
-
-                        # Isolation transactionnelle par ligne pour éviter de bloquer les suivantes
-                        from django.db import transaction as dj_transaction
-                        with dj_transaction.atomic():
-                            success = self.process_row(row, headers)
-
-                        if success:
-                            print(f"✅ Ligne {i} traitée avec succès")
-                            self._log(f"Ligne {i} traitée avec succès")
-                            self.processed_rows += 1
-                        else:
-                            print(f"❌ Échec traitement ligne {i}")
-                            self._log(f"Échec traitement ligne {i}")
-                            self.skipped_rows += 1
-                    else:
-                        error_msg = f"❌ Ligne {i} ignorée: nombre de colonnes incorrect ({len(row)} vs {len(headers)})"
-                        print(error_msg)
-                        self._log(error_msg, "error")
-                        self.skipped_rows += 1
-                except Exception as row_error:
-                    print(f"💥 Exception inattendue lors du traitement de la ligne {i}: {row_error}")
-                    self._log(f"Exception inattendue ligne {i}: {row_error}", "error")
-                    self.skipped_rows += 1
-                finally:
-                    # Toujours avancer le curseur d'incrémental pour ne pas bloquer les nouvelles commandes
-                    self.sheet_config.last_processed_row = i
-                    self.sheet_config.save(update_fields=['last_processed_row'])
-                    print(f"📍 Dernière ligne traitée mise à jour: {i}")
+            if self.batch_size > 0:
+                print(f"📦 Mode import en masse: lots de {self.batch_size} lignes")
+                self._process_rows_batched(rows_to_process, headers, max(start_row, 2))
+            else:
+                self._process_rows(rows_to_process, headers, max(start_row, 2))
             
             # Marquer la fin de la synchronisation
             self.end_time = timezone.now()
@@ -1237,6 +1225,296 @@ class GoogleSheetSync:
             self._log_sync('error')
             return False
     
+    def _process_rows(self, rows_to_process, headers, first_row):
+        """Traite les lignes une par une (une transaction et une mise à jour du curseur par ligne)"""
+        # Traiter chaque ligne (i = numéro réel de la ligne de la feuille)
+        for i, row in enumerate(rows_to_process, first_row):
+            print(f"\n📝 === TRAITEMENT LIGNE {i} ===")
+
+            try:
+                # Vérifier si la ligne est vide
+                if not any(cell.strip() for cell in row if cell):
+                    print(f"⚠️ Ligne {i} ignorée: ligne complètement vide")
+                    self._log(f"Ligne {i} ignorée : ligne complètement vide")
+                    self.skipped_rows += 1
+                elif len(row) == len(headers):  # Vérifier que la ligne a le bon nombre de colonnes
+                    print(f"✅ Ligne {i} valide: {len(row)} colonnes vs {len(headers)} en-têtes")
+                    print(f"🔍 Aperçu: {dict(zip(headers[:3], row[:3]))}...")
+
+                    # Isolation transactionnelle par ligne pour éviter de bloquer les suivantes
+                    from django.db import transaction as dj_transaction
+                    with dj_transaction.atomic():
+                        success = self.process_row(row, headers)
+
+                    if success:
+                        print(f"✅ Ligne {i} traitée avec succès")
+                        self._log(f"Ligne {i} traitée avec succès")
+                        self.processed_rows += 1
+                    else:
+                        print(f"❌ Échec traitement ligne {i}")
+                        self._log(f"Échec traitement ligne {i}")
+                        self.skipped_rows += 1
+                else:
+                    error_msg = f"❌ Ligne {i} ignorée: nombre de colonnes incorrect ({len(row)} vs {len(headers)})"
+                    print(error_msg)
+                    self._log(error_msg, "error")
+                    self.skipped_rows += 1
+            except Exception as row_error:
+                print(f"💥 Exception inattendue lors du traitement de la ligne {i}: {row_error}")
+                self._log(f"Exception inattendue ligne {i}: {row_error}", "error")
+                self.skipped_rows += 1
+            finally:
+                # Toujours avancer le curseur d'incrémental pour ne pas bloquer les nouvelles commandes
+                self.sheet_config.last_processed_row = i
+                self.sheet_config.save(update_fields=['last_processed_row'])
+                print(f"📍 Dernière ligne traitée mise à jour: {i}")
+
+    def _process_rows_batched(self, rows_to_process, headers, first_row):
+        """
+        Traite les lignes par lots de self.batch_size : les commandes et clients existants
+        sont préchargés en une requête par lot, les nouveaux clients, commandes et états
+        sont créés avec bulk_create, et le curseur incrémental avance une fois par lot validé.
+        """
+        for debut in range(0, len(rows_to_process), self.batch_size):
+            lot = [
+                (first_row + debut + position, row)
+                for position, row in enumerate(rows_to_process[debut:debut + self.batch_size])
+            ]
+            derniere_ligne = lot[-1][0]
+            print(f"\n📦 === LOT LIGNES {lot[0][0]} À {derniere_ligne} ===")
+            
+            # Sauvegarder les compteurs pour pouvoir rejouer le lot ligne par ligne en cas d'échec
+            compteurs = self._snapshot_counters()
+            nb_erreurs = len(self.errors)
+            try:
+                with transaction.atomic():
+                    self._process_batch(lot, headers)
+            except Exception as batch_error:
+                print(f"💥 Échec du lot {lot[0][0]}-{derniere_ligne}: {batch_error} - reprise ligne par ligne")
+                self._restore_counters(compteurs)
+                del self.errors[nb_erreurs:]
+                self._log(f"Échec de l'import en masse des lignes {lot[0][0]} à {derniere_ligne}: {batch_error} - reprise ligne par ligne")
+                self._process_rows([row for _, row in lot], headers, lot[0][0])
+                continue
+            
+            # Avancer le curseur une seule fois par lot validé
+            self.sheet_config.last_processed_row = derniere_ligne
+            self.sheet_config.save(update_fields=['last_processed_row'])
+            print(f"📍 Dernière ligne traitée mise à jour: {derniere_ligne}")
+    
+    def _snapshot_counters(self):
+        """Capture les compteurs de synchronisation"""
+        return {
+            champ: getattr(self, champ)
+            for champ in (
+                'records_imported', 'processed_rows', 'skipped_rows', 'new_orders_created',
+                'existing_orders_updated', 'existing_orders_skipped', 'duplicate_orders_found',
+                'protected_orders_count',
+            )
+        }
+    
+    def _restore_counters(self, compteurs):
+        """Restaure les compteurs capturés par _snapshot_counters"""
+        for champ, valeur in compteurs.items():
+            setattr(self, champ, valeur)
+    
+    def _process_batch(self, lot, headers):
+        """Traite un lot de lignes [(numéro de ligne, valeurs)] dans la transaction courante"""
+        lignes_valides = []
+        for i, row in lot:
+            if not any(cell.strip() for cell in row if cell):
+                self._log(f"Ligne {i} ignorée : ligne complètement vide")
+                self.skipped_rows += 1
+            elif len(row) != len(headers):
+                self._log(f"❌ Ligne {i} ignorée: nombre de colonnes incorrect ({len(row)} vs {len(headers)})", "error")
+                self.skipped_rows += 1
+            else:
+                data = dict(zip(headers, row))
+                order_number = data.get('N° Commande') or data.get('Numéro') or data.get('N°Commande') or data.get('Numero')
+                if not order_number or not order_number.strip():
+                    self._log(f"Ligne {i} rejetée : numéro de commande manquant ou vide. Données reçues: {data}", "error")
+                    self.skipped_rows += 1
+                else:
+                    lignes_valides.append((i, row, data, order_number))
+        
+        if not lignes_valides:
+            return
+        
+        # Précharger les commandes existantes du lot en une requête
+        numeros = {order_number for _, _, _, order_number in lignes_valides}
+        commandes_existantes = set(
+            Commande.objects.filter(num_cmd__in=numeros).values_list('num_cmd', flat=True)
+        )
+        
+        # Séparer les nouvelles commandes des lignes à mettre à jour (commandes existantes
+        # ou numéros répétés dans le lot, traités après la création en masse)
+        nouvelles = []
+        mises_a_jour = []
+        numeros_vus = set()
+        for i, row, data, order_number in lignes_valides:
+            if order_number in commandes_existantes or order_number in numeros_vus:
+                mises_a_jour.append((i, row))
+                continue
+            status_from_sheet = data.get('Statut', '')
+            if not status_from_sheet or not status_from_sheet.strip():
+                self._log(f"Statut manquant pour la commande {order_number} - la commande est rejetée", "error")
+                self._log(f"Échec traitement ligne {i}")
+                self.skipped_rows += 1
+                continue
+            numeros_vus.add(order_number)
+            nouvelles.append((i, data, order_number))
+        
+        if nouvelles:
+            self._bulk_create_commandes(nouvelles)
+        
+        # Les commandes existantes gardent la logique de mise à jour ligne par ligne
+        # (protection anti-régression, mise à jour de l'opérateur, etc.)
+        for i, row in mises_a_jour:
+            with transaction.atomic():
+                success = self.process_row(row, headers)
+            if success:
+                self._log(f"Ligne {i} traitée avec succès")
+                self.processed_rows += 1
+            else:
+                self._log(f"Échec traitement ligne {i}")
+                self.skipped_rows += 1
+    
+    def _bulk_create_commandes(self, nouvelles):
+        """Crée en masse les clients, commandes et états initiaux des nouvelles commandes du lot"""
+        now = timezone.now()
+        
+        # Clients : précharger les fiches existantes par téléphone, puis créer/mettre à jour en masse
+        infos_clients = {}
+        telephones = {}
+        for i, data, order_number in nouvelles:
+            client_phone = self._clean_phone_number(data.get('Téléphone', ''))
+            # Regrouper les saisies d'un même numéro (06..., 2126..., +2126...) sur un seul client
+            cle_client = telephone.cle(client_phone)
+            telephones[order_number] = cle_client
+            client_nom_prenom = data.get('Client', '').split(' ', 1)
+            infos_clients.setdefault(cle_client, []).append({
+                'numero_tel': client_phone,
+                'nom': client_nom_prenom[0] if client_nom_prenom else '',
+                'prenom': client_nom_prenom[1] if len(client_nom_prenom) > 1 else '',
+                'adresse': data.get('Adresse', ''),
+            })
+        
+        existants = telephone.clients_par_telephone(
+            {info['numero_tel'] for infos in infos_clients.values() for info in infos}
+        )
+        clients = {}
+        for cle_client, infos in infos_clients.items():
+            for info in infos:
+                if info['numero_tel'] in existants:
+                    clients[cle_client] = existants[info['numero_tel']]
+                    break
+        clients_a_creer = []
+        clients_modifies = {}
+        for cle_client, infos in infos_clients.items():
+            client_obj = clients.get(cle_client)
+            if client_obj is None:
+                premier = infos[0]
+                client_obj = Client(numero_tel=premier['numero_tel'], nom=premier['nom'], prenom=premier['prenom'], adresse=premier['adresse'])
+                clients[cle_client] = client_obj
+                clients_a_creer.append(client_obj)
+                infos = infos[1:]
+            for info in infos:
+                # Mêmes règles que get_or_create + mise à jour de process_row
+                if info['nom'] and client_obj.nom != info['nom']:
+                    client_obj.nom = info['nom']
+                if info['prenom'] and client_obj.prenom != info['prenom']:
+                    client_obj.prenom = info['prenom']
+                if info['adresse'] and client_obj.adresse != info['adresse']:
+                    client_obj.adresse = info['adresse']
+                if client_obj.pk:
+                    client_obj.date_modification = now
+                    clients_modifies[cle_client] = client_obj
+        
+        # bulk_create / bulk_update ne passent pas par Client.save() : téléphone canonique et document de recherche
+        for client_obj in clients_a_creer:
+            client_obj.normaliser_telephone()
+        for client_obj in clients_a_creer + list(clients_modifies.values()):
+            client_obj.document_recherche = client_obj.construire_document_recherche()
+        Client.objects.bulk_create(clients_a_creer)
+        if clients_modifies:
+            Client.objects.bulk_update(
+                list(clients_modifies.values()), ['nom', 'prenom', 'adresse', 'date_modification', 'document_recherche']
+            )
+            rafraichir_documents(Commande.objects.filter(client__in=list(clients_modifies.values())))
+        
+        # États : charger toutes les définitions une fois
+        enums = {enum.libelle: enum for enum in EnumEtatCmd.objects.all()}
+        
+        commandes = []
+        etats_initiaux = []
+        ids_yz = Commande.allouer_ids_yz(len(nouvelles))
+        for (i, data, order_number), id_yz in zip(nouvelles, ids_yz):
+            try:
+                total_cmd_price = float(data.get('Prix', 0)) or float(data.get('Total', 0))
+            except (ValueError, TypeError):
+                total_cmd_price = 0.0
+            
+            status_from_sheet = data.get('Statut', '')
+            status_libelle = self._map_status_cached(status_from_sheet)
+            if not status_libelle:
+                self._log(f"Statut non reconnu '{status_from_sheet}' pour la commande {order_number} - utilisation du statut par défaut 'Non affectée'", "warning")
+                status_libelle = 'Non affectée'
+            enum_etat = enums.get(status_libelle)
+            if enum_etat is None:
+                enum_etat = EnumEtatCmd.objects.create(libelle=status_libelle, ordre=999, couleur='#6B7280')
+                enums[status_libelle] = enum_etat
+            
+            operator_name = data.get('Opérateur', '')
+            operateur_obj = self._get_operateur(operator_name) if operator_name else None
+            
+            product_str = data.get('Produit', '').strip()
+            commande = Commande(
+                num_cmd=order_number,
+                id_yz=id_yz,
+                date_cmd=self._parse_date(data.get('Date Création', '') or data.get('Date', '')),
+                total_cmd=total_cmd_price,
+                adresse=data.get('Adresse', ''),
+                client=clients[telephones[order_number]],
+                ville=None,
+                ville_init=data.get('Ville', '').strip(),
+                produit_init=product_str or "Produit non spécifié",
+                origine='SYNC',
+                last_sync_date=now,
+                # L'état initial est connu : renseigner directement l'état courant dénormalisé
+                etat_courant=enum_etat,
+                date_etat_courant=now,
+                operateur_etat_courant=operateur_obj,
+            )
+            commande.detecter_source()
+            commandes.append(commande)
+            etats_initiaux.append((commande, enum_etat, operateur_obj))
+        
+        Commande.objects.bulk_create(commandes)
+        rafraichir_documents(Commande.objects.filter(pk__in=[commande.pk for commande in commandes]))
+        EtatCommande.objects.bulk_create([
+            EtatCommande(
+                commande=commande,
+                enum_etat=enum_etat,
+                date_debut=now,
+                operateur=operateur_obj,
+                commentaire="État défini lors de la synchronisation depuis Google Sheets"
+            )
+            for commande, enum_etat, operateur_obj in etats_initiaux
+        ])
+        deltas = {}
+        for commande, enum_etat, operateur_obj in etats_initiaux:
+            deplacer(deltas, (None, None), (getattr(operateur_obj, 'pk', None), enum_etat.pk))
+        ajuster(deltas)
+        # bulk_create ne déclenche pas les signaux : une seule invalidation des tableaux de bord par lot
+        planifier_invalidation()
+        
+        for i, data, order_number in nouvelles:
+            self._log(f"Ligne {i} traitée avec succès")
+        self.new_orders_created += len(commandes)
+        self.records_imported += len(commandes)
+        self.processed_rows += len(commandes)
+        print(f"✅ {len(commandes)} nouvelles commandes créées en masse ({len(clients_a_creer)} nouveaux clients)")
+    
     def _log_sync(self, status):
         """Enregistre un log de synchronisation avec statistiques détaillées"""
         SyncLog.objects.create(
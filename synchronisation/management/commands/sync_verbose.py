@@ -18,10 +18,17 @@ class Command(BaseCommand):
             default='admin',
             help='Nom de l\'utilisateur qui déclenche la synchronisation (défaut: admin)'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Taille des lots pour l\'import en masse (0 = ligne par ligne, défaut: GOOGLE_SHEET_SYNC_BATCH_SIZE)'
+        )
 
     def handle(self, *args, **options):
         config_id = options['config_id']
         triggered_by = options['user']
+        batch_size = options['batch_size']
 
         try:
             # Récupérer la configuration
@@ -32,7 +39,7 @@ class Command(BaseCommand):
             )
             
             # Créer une instance de synchronisation en mode verbose
-            syncer = GoogleSheetSync(config, triggered_by=triggered_by, verbose=True)
+            syncer = GoogleSheetSync(config, triggered_by=triggered_by, verbose=True, batch_size=batch_size)
             success = syncer.sync()
             
             if success:
@@ -1,3 +1,80 @@
+import io
+from contextlib import redirect_stdout
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from client.models import Client
+from commande import compteurs
+from commande.models import Commande, EnumEtatCmd, EtatCommande
+from parametre.models import Operateur
+from synchronisation.google_sheet_sync import GoogleSheetSync
+from synchronisation.models import GoogleSheetConfig
+
+ENTETES = ['N° Commande', 'Date Création', 'Client', 'Téléphone', 'Adresse', 'Ville', 'Produit', 'Prix', 'Statut', 'Opérateur']
+
+
+class ImportParLotsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.config = GoogleSheetConfig.objects.create(sheet_url='https://example.com/feuille', sheet_name='Commandes')
+        cls.operateur = Operateur.objects.create(
+            user=User.objects.create(username='confirmation'), nom='Alaoui', prenom='Nadia',
+            mail='op@test.ma', type_operateur='CONFIRMATION',
+        )
+        cls.non_affectee = EnumEtatCmd.objects.create(libelle='Non affectée', ordre=1)
+        cls.confirmee = EnumEtatCmd.objects.create(libelle='Confirmée', ordre=2)
+        cls.client_existant = Client.objects.create(nom='Alami', prenom='Sara', numero_tel='0612345678')
+        cls.existante = Commande.objects.create(
+            num_cmd='CMD-0', client=cls.client_existant, adresse='Rue 1', total_cmd=100, frais_livraison=False,
+        )
+        EtatCommande.objects.create(commande=cls.existante, enum_etat=cls.non_affectee)
+
+    def setUp(self):
+        cache.clear()
+
+    def ligne(self, numero, telephone, statut='Non affectée', operateur=''):
+        return [numero, '15/01/2025', 'Bennani Omar', telephone, 'Rue 2', 'Rabat', 'Sandale x1', '250', statut, operateur]
+
+    def test_lot_cree_clients_commandes_et_etats(self):
+        lignes = [
+            self.ligne('CMD-1', '0698765432'),
+            self.ligne('CMD-2', '+212698765432', 'Confirmée', 'Nadia Alaoui'),
+            self.ligne('CMD-3', '0612345678'),
+            self.ligne('CMD-1', '0698765432'),
+            self.ligne('CMD-0', '0612345678'),
+            [''] * len(ENTETES),
+        ]
+        synchro = GoogleSheetSync(self.config, batch_size=10)
+
+        with redirect_stdout(io.StringIO()), \
+                mock.patch('synchronisation.google_sheet_sync.planifier_invalidation') as planifier:
+            synchro._process_rows_batched(lignes, ENTETES, 2)
+
+        planifier.assert_called_once_with()
+        self.assertEqual((synchro.new_orders_created, synchro.skipped_rows), (3, 1))
+
+        # Les deux saisies du même numéro et le client existant ne créent qu'une fiche
+        self.assertEqual(Client.objects.count(), 2)
+        nouvelles = Commande.objects.filter(num_cmd__in=['CMD-1', 'CMD-2', 'CMD-3']).order_by('num_cmd')
+        self.assertEqual(nouvelles[2].client_id, self.client_existant.pk)
+        self.assertEqual(len({c.client_id for c in nouvelles[:2]}), 1)
+
+        # Les doublons, dans le lot ou déjà en base, ne sont pas recréés
+        self.assertEqual(Commande.objects.filter(num_cmd='CMD-1').count(), 1)
+        self.assertEqual(Commande.objects.filter(num_cmd='CMD-0').count(), 1)
+        self.assertEqual(EtatCommande.objects.filter(commande__in=nouvelles).count(), 3)
+
+        self.assertEqual(
+            [(c.etat_courant_id, c.operateur_etat_courant_id) for c in nouvelles],
+            [(self.non_affectee.pk, None), (self.confirmee.pk, self.operateur.pk), (self.non_affectee.pk, None)],
+        )
+        # CMD-0 déjà en base, plus les nouvelles commandes
+        self.assertEqual(compteurs.par_etat(['Non affectée', 'Confirmée']), {'Non affectée': 3, 'Confirmée': 1})
+        self.assertEqual(compteurs.par_etat(['Confirmée'], operateur=self.operateur), {'Confirmée': 1})
+
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.last_processed_row, 7)